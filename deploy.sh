@@ -13,6 +13,9 @@ On top of the parameters above, the following environment variables need to be s
 ACTUAL_COST_WEBHOOK_URL the URL for the actual cost alert channel
 FORECASTED_COST_WEBHOOK_URL the URL for the forecasted cost alert channel
 LAMBDA_PACKAGE_BUCKET the name of the S3 bucket to which the lambda function code has been uploaded
+
+TEMPLATE_FILE can optionally be set to deploy another template than packaged.yaml, e.g. a template
+generated with the lambda function code defined inline, which doesn't need to be packaged
 EOF
 }
 
@@ -36,10 +39,12 @@ if [[ -z "${FORECASTED_COST_WEBHOOK_URL+x}" ]]; then
     exit 3
 fi
 
+TEMPLATE_FILE=${TEMPLATE_FILE:-packaged.yaml}
+
 set -euo pipefail
 
 sam deploy \
-  --template-file packaged.yaml \
+  --template-file "${TEMPLATE_FILE}" \
   --stack-name budget-alerts \
   --capabilities CAPABILITY_IAM CAPABILITY_NAMED_IAM CAPABILITY_AUTO_EXPAND \
   --parameter-overrides "MonthlyBudget=${MONTHLY_BUDGET}" \
@@ -5,8 +5,8 @@ const os = require('os')
 
 const messageSuffix = os.EOL + os.EOL + 'Please set the alert thresholds to higher values if you want to be notified of overspend again this month'
 
-const sendMessage = (message) => request.post({
-  url: process.env.WEBHOOK_URL,
+const sendMessage = (url, message) => request.post({
+  url: url,
   body: message,
   json: true
 })
@@ -18,21 +18,87 @@ const sendMessage = (message) => request.post({
     }
   })
 
-const processRecord = (record) => {
+// When a single function is subscribed to several topics, the webhook URL and message prefix for
+// a topic are defined by the WEBHOOK_URL_<topic name> and MESSAGE_PREFIX_<topic name> environment
+// variables
+const getRouteVariable = (name, notification) => {
+  const topicName = (notification.TopicArn || '').split(':').pop()
+  const routeVariable = process.env[`${name}_${topicName}`]
+  return routeVariable !== undefined ? routeVariable : process.env[name]
+}
+
+// When the notifications of a topic are buffered in an SQS queue, each record is a queue message
+// whose body is the SNS notification
+const isQueueRecord = (record) => record.eventSource === 'aws:sqs'
+const getNotification = (record) => isQueueRecord(record) ? JSON.parse(record.body) : record.Sns
+
+const getMessage = (notification) => {
   // Get the message prefix if any (e.g. a human-friendly AWS account name)
-  const messagePrefix = process.env.MESSAGE_PREFIX
-    ? process.env.MESSAGE_PREFIX + os.EOL
+  const routeMessagePrefix = getRouteVariable('MESSAGE_PREFIX', notification)
+  const messagePrefix = routeMessagePrefix
+    ? routeMessagePrefix + os.EOL
     : ''
-  return sendMessage({
-    text: `<!here> ${messagePrefix}${record.Sns.Message}${messageSuffix}`
+  return `${messagePrefix}${notification.Message}`
+}
+
+const postMessages = (webhookUrl, messages) => sendMessage(webhookUrl, {
+  text: `<!here> ${messages.join(os.EOL + os.EOL)}${messageSuffix}`
+})
+
+const processRecord = (record) => {
+  const notification = getNotification(record)
+  const webhookUrl = getRouteVariable('WEBHOOK_URL', notification)
+  if (!webhookUrl) {
+    return Promise.reject(new Error(`no webhook URL defined for topic ${notification.TopicArn}`))
+  }
+  return postMessages(webhookUrl, [getMessage(notification)])
+}
+
+// The messages of a batch are merged into a single post per webhook URL, so that a burst of alerts
+// doesn't flood the channel nor hit its rate limit. The messages that could not be posted are
+// reported, so that only they are retried, and moved to the dead-letter queue once they have
+// failed too many times
+const processQueueRecords = (records) => {
+  const failures = []
+  const batches = new Map()
+  records.forEach((record) => {
+    try {
+      const notification = getNotification(record)
+      const webhookUrl = getRouteVariable('WEBHOOK_URL', notification)
+      if (!webhookUrl) {
+        throw new Error(`no webhook URL defined for topic ${notification.TopicArn}`)
+      }
+      const batch = batches.get(webhookUrl) || []
+      batches.set(webhookUrl, batch.concat([{ record: record, message: getMessage(notification) }]))
+    } catch (err) {
+      console.log(`failed to post message ${record.messageId}: ${err.message}`)
+      failures.push({ itemIdentifier: record.messageId })
+    }
   })
+  return Promise.all(Array.from(batches, ([webhookUrl, batch]) =>
+    postMessages(webhookUrl, batch.map((item) => item.message))
+      .then(() => [])
+      .catch((err) => batch.map((item) => {
+        console.log(`failed to post message ${item.record.messageId}: ${err.message}`)
+        return { itemIdentifier: item.record.messageId }
+      }))))
+    .then((batchFailures) => failures.concat(...batchFailures))
 }
 
 exports.handler = (event, context, cb) => {
-  if (!process.env.WEBHOOK_URL) {
+  if (!Object.keys(process.env).some((name) => name.startsWith('WEBHOOK_URL'))) {
     throw new Error('WEBHOOK_URL environment variable must be defined')
   }
   console.log(`event received: ${JSON.stringify(event)}`)
+  if (event.Records.some(isQueueRecord)) {
+    processQueueRecords(event.Records)
+      .then((failures) => {
+        if (cb) {
+          cb(null, { batchItemFailures: failures })
+        }
+      })
+    return
+  }
   Promise.all(event.Records.map(processRecord))
     .then(() => {
       if (cb) {
@@ -0,0 +1,108 @@
+'use strict'
+
+// Handler of index.js without any dependency, small enough to be defined inline in the template
+// (aws_budget_alerting.py --inline-code lambda-src/inline.js)
+const https = require('https')
+const os = require('os')
+const url = require('url')
+
+const messageSuffix = os.EOL + os.EOL + 'Please set the alert thresholds to higher values if you want to be notified of overspend again this month'
+
+const sendMessage = (webhookUrl, message) => new Promise((resolve, reject) => {
+  const body = JSON.stringify(message)
+  const request = https.request(Object.assign(url.parse(webhookUrl), {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json', 'Content-Length': Buffer.byteLength(body) }
+  }), (response) => {
+    let responseBody = ''
+    response.setEncoding('utf8')
+    response.on('data', (chunk) => { responseBody += chunk })
+    response.on('end', () => responseBody === 'ok' ? resolve({}) : reject(new Error(responseBody)))
+  })
+  request.on('error', reject)
+  request.end(body)
+})
+
+const getRouteVariable = (name, notification) => {
+  const topicName = (notification.TopicArn || '').split(':').pop()
+  const routeVariable = process.env[`${name}_${topicName}`]
+  return routeVariable !== undefined ? routeVariable : process.env[name]
+}
+
+const isQueueRecord = (record) => record.eventSource === 'aws:sqs'
+const getNotification = (record) => isQueueRecord(record) ? JSON.parse(record.body) : record.Sns
+
+const getMessage = (notification) => {
+  const routeMessagePrefix = getRouteVariable('MESSAGE_PREFIX', notification)
+  const messagePrefix = routeMessagePrefix
+    ? routeMessagePrefix + os.EOL
+    : ''
+  return `${messagePrefix}${notification.Message}`
+}
+
+const postMessages = (webhookUrl, messages) => sendMessage(webhookUrl, {
+  text: `<!here> ${messages.join(os.EOL + os.EOL)}${messageSuffix}`
+})
+
+const processRecord = (record) => {
+  const notification = getNotification(record)
+  const webhookUrl = getRouteVariable('WEBHOOK_URL', notification)
+  if (!webhookUrl) {
+    return Promise.reject(new Error(`no webhook URL defined for topic ${notification.TopicArn}`))
+  }
+  return postMessages(webhookUrl, [getMessage(notification)])
+}
+
+const processQueueRecords = (records) => {
+  const failures = []
+  const batches = new Map()
+  records.forEach((record) => {
+    try {
+      const notification = getNotification(record)
+      const webhookUrl = getRouteVariable('WEBHOOK_URL', notification)
+      if (!webhookUrl) {
+        throw new Error(`no webhook URL defined for topic ${notification.TopicArn}`)
+      }
+      const batch = batches.get(webhookUrl) || []
+      batches.set(webhookUrl, batch.concat([{ record: record, message: getMessage(notification) }]))
+    } catch (err) {
+      console.log(`failed to post message ${record.messageId}: ${err.message}`)
+      failures.push({ itemIdentifier: record.messageId })
+    }
+  })
+  return Promise.all(Array.from(batches, ([webhookUrl, batch]) =>
+    postMessages(webhookUrl, batch.map((item) => item.message))
+      .then(() => [])
+      .catch((err) => batch.map((item) => {
+        console.log(`failed to post message ${item.record.messageId}: ${err.message}`)
+        return { itemIdentifier: item.record.messageId }
+      }))))
+    .then((batchFailures) => failures.concat(...batchFailures))
+}
+
+exports.handler = (event, context, cb) => {
+  if (!Object.keys(process.env).some((name) => name.startsWith('WEBHOOK_URL'))) {
+    throw new Error('WEBHOOK_URL environment variable must be defined')
+  }
+  console.log(`event received: ${JSON.stringify(event)}`)
+  if (event.Records.some(isQueueRecord)) {
+    processQueueRecords(event.Records)
+      .then((failures) => {
+        if (cb) {
+          cb(null, { batchItemFailures: failures })
+        }
+      })
+    return
+  }
+  Promise.all(event.Records.map(processRecord))
+    .then(() => {
+      if (cb) {
+        cb(null)
+      }
+    })
+    .catch((err) => {
+      if (cb) {
+        cb(err)
+      }
+    })
+}
@@ -0,0 +1,307 @@
+"""Module batching the AWS Budgets notifications of many accounts into digest messages posted to
+Slack.
+Rather than one Slack message per notification, the notifications received through an SQS queue
+subscribed to the alert topics of every account are buffered for a time window, deduplicated per
+(account, budget, alert type) and posted as a single message at the end of the window.
+The SQS messages stay in the queue until the digest containing them has been posted, their
+visibility timeout being extended for as long as the window lasts.
+"""
+
+from os import path, environ
+from urllib.parse import urlsplit
+import http.client
+import json
+import sys
+import time
+import logging
+import boto3
+from aws_budget_notification_parser import parse_notification, InvalidNotificationException
+
+MESSAGE_SUFFIX = 'Please set the alert thresholds to higher values if you want to be notified of ' \
+                 'overspend again this month'
+SQS_MAX_MESSAGES = 10
+SQS_MAX_WAIT_SECONDS = 20
+# visibility timeout of the buffered SQS messages, extended once half of it has passed, which leaves
+# more than a long poll for the extension
+VISIBILITY_TIMEOUT_SECONDS = 60
+
+
+class WebhookException(Exception):
+    """Exception indicating that a message could not be posted to the webhook
+    """
+
+
+class WebhookClient:
+    """Class posting JSON messages to a webhook over a single keep-alive connection
+    """
+
+    def __init__(self, url, timeout=10):
+        """Constructor
+
+        :param url: (str) the webhook URL
+        :param timeout: (float) the timeout (in seconds) of the requests
+        """
+        url_parts = urlsplit(url)
+        connection_class = http.client.HTTPSConnection if url_parts.scheme == 'https' \
+            else http.client.HTTPConnection
+        self.connection = connection_class(url_parts.netloc, timeout=timeout)
+        self.path = url_parts.path + ('?' + url_parts.query if url_parts.query else '')
+
+    def post(self, message):
+        """Posts a message to the webhook, reconnecting once if the connection was closed
+
+        :param message: (dict) the message to post, serialised as JSON
+        :return: None
+        :raises WebhookException: if the webhook doesn't accept the message
+        """
+        body = json.dumps(message).encode('utf-8')
+        headers = {'Content-Type': 'application/json'}
+        try:
+            self.connection.request('POST', self.path, body=body, headers=headers)
+            response = self.connection.getresponse()
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            self.connection.close()
+            self.connection.request('POST', self.path, body=body, headers=headers)
+            response = self.connection.getresponse()
+        response_body = response.read().decode('utf-8')
+        if response.status != 200 or response_body != 'ok':
+            raise WebhookException(f"webhook returned {response.status}: {response_body}")
+
+    def close(self):
+        """Closes the connection to the webhook
+
+        :return: None
+        """
+        self.connection.close()
+
+
+class AlertDigest:
+    """Class buffering AWS Budgets notifications for a time window
+    """
+
+    def __init__(self, window_seconds, clock=time.monotonic):
+        """Constructor
+
+        :param window_seconds: (float) the length of the window notifications are buffered for
+        :param clock: a function returning the current time in seconds
+        """
+        self.window_seconds = window_seconds
+        self.clock = clock
+        self.window_start = None
+        self.alerts = {}  # (account_id, budget_name, alert_type) -> [notification, count]
+
+    def add(self, message):
+        """Adds a notification to the digest. Notifications for the same account, budget and alert
+        type are merged, keeping the latest one.
+
+        :param message: (str) the 'Message' of the SNS notification
+        :return: None
+        """
+        try:
+            notification = parse_notification(message)
+            key = (notification.account_id, notification.budget_name, notification.alert_type)
+        except InvalidNotificationException:
+            logging.warning("warning: could not parse notification: %s", message)
+            notification = message
+            key = (message,)
+        if self.window_start is None:
+            self.window_start = self.clock()
+        count = self.alerts[key][1] + 1 if key in self.alerts else 1
+        self.alerts[key] = [notification, count]
+
+    def remaining_seconds(self):
+        """Gets the time left before the end of the current window
+
+        :return: (float) the number of seconds left, None if no notification is buffered
+        """
+        if self.window_start is None:
+            return None
+        return max(0.0, self.window_start + self.window_seconds - self.clock())
+
+    def is_due(self):
+        """Checks if the window is over and the digest should be sent
+
+        :return: (bool) True if notifications are buffered and the window is over
+        """
+        return self.remaining_seconds() == 0.0
+
+    def postpone(self):
+        """Starts a new window, keeping the buffered notifications, e.g. after failing to post them
+
+        :return: None
+        """
+        self.window_start = self.clock()
+
+    def clear(self):
+        """Empties the digest, once its message has been posted
+
+        :return: None
+        """
+        self.alerts = {}
+        self.window_start = None
+
+    def get_message(self):
+        """Gets the Slack message for the buffered notifications
+
+        :return: (dict) the Slack message, None if no notification is buffered
+        """
+        if not self.alerts:
+            return None
+        lines = []
+        for key in sorted(self.alerts, key=str):
+            notification, count = self.alerts[key]
+            repeat = f" (x{count})" if count > 1 else ''
+            if isinstance(notification, str):
+                lines.append(f"{notification}{repeat}")
+            else:
+                lines.append(f"AWS Account {notification.account_id} - "
+                             f"{notification.budget_name} - {notification.alert_type}: "
+                             f"${notification.amount:,.2f} > ${notification.threshold:,.2f} "
+                             f"(budget ${notification.budgeted_amount:,.2f}){repeat}")
+        return {
+            'text': f"<!here> AWS Budgets alerts ({len(lines)})\n" + '\n'.join(lines) +
+                    f"\n\n{MESSAGE_SUFFIX}"
+        }
+
+
+def _extend_visibility(sqs_client, queue_url, buffered_messages, now):
+    """Extends the visibility timeout of the buffered messages that are halfway through it, so
+    that they are not delivered again while their digest is pending
+
+    :param sqs_client: (boto3.client) 'sqs' boto3 client
+    :param queue_url: (str) the URL of the SQS queue
+    :param buffered_messages: (dict) [receipt handle, time until which the message is invisible]
+        keyed by message ID, updated with the new visibility
+    :param now: (float) the current time, in seconds
+    :return: None
+    """
+    message_ids = [message_id for message_id, (_, invisible_until) in buffered_messages.items()
+                   if invisible_until - now <= VISIBILITY_TIMEOUT_SECONDS / 2]
+    for start in range(0, len(message_ids), SQS_MAX_MESSAGES):
+        batch_message_ids = message_ids[start:start + SQS_MAX_MESSAGES]
+        response = sqs_client.change_message_visibility_batch(QueueUrl=queue_url, Entries=[
+            {'Id': str(index), 'ReceiptHandle': buffered_messages[message_id][0],
+             'VisibilityTimeout': VISIBILITY_TIMEOUT_SECONDS}
+            for index, message_id in enumerate(batch_message_ids)
+        ])
+        for successful in response.get('Successful', []):
+            buffered_messages[batch_message_ids[int(successful['Id'])]][1] = \
+                now + VISIBILITY_TIMEOUT_SECONDS
+        for failed in response.get('Failed', []):
+            # the message will be delivered again, and recognised by its ID
+            logging.warning("warning: could not extend the visibility of message %s: %s",
+                            batch_message_ids[int(failed['Id'])], failed.get('Message'))
+
+
+def _delete_messages(sqs_client, queue_url, receipt_handles):
+    """Deletes messages from the queue, SQS_MAX_MESSAGES at a time
+
+    :param sqs_client: (boto3.client) 'sqs' boto3 client
+    :param queue_url: (str) the URL of the SQS queue
+    :param receipt_handles: (list) the receipt handles of the messages
+    :return: None
+    """
+    for start in range(0, len(receipt_handles), SQS_MAX_MESSAGES):
+        sqs_client.delete_message_batch(QueueUrl=queue_url, Entries=[
+            {'Id': str(index), 'ReceiptHandle': receipt_handle}
+            for index, receipt_handle in enumerate(receipt_handles[start:start + SQS_MAX_MESSAGES])
+        ])
+
+
+def run_digest(sqs_client, queue_url, digest, webhook_client, stop=lambda: False):
+    """Receives the notifications delivered to an SQS queue by the alert topics and posts a digest
+    at the end of every window. Messages are only deleted from the queue once the digest containing
+    them has been posted, so that no notification is lost if posting fails, and their visibility
+    is extended meanwhile. A message delivered again is only counted once, by its message ID. A
+    digest that can't be posted is kept, with the notifications received meanwhile, and posted at
+    the end of the next window.
+
+    :param sqs_client: (boto3.client) 'sqs' boto3 client
+    :param queue_url: (str) the URL of the SQS queue subscribed to the alert topics
+    :param digest: (AlertDigest) the digest buffering the notifications
+    :param webhook_client: (WebhookClient) the client posting the digests
+    :param stop: a function returning True when the loop should stop
+    :return: None
+    """
+    # message ID -> [receipt handle, time until which the message is invisible]
+    buffered_messages = {}
+    while not stop():
+        _extend_visibility(sqs_client, queue_url, buffered_messages, digest.clock())
+        remaining_seconds = digest.remaining_seconds()
+        wait_seconds = SQS_MAX_WAIT_SECONDS if remaining_seconds is None \
+            else min(SQS_MAX_WAIT_SECONDS, int(remaining_seconds))
+        response = sqs_client.receive_message(QueueUrl=queue_url,
+                                              MaxNumberOfMessages=SQS_MAX_MESSAGES,
+                                              WaitTimeSeconds=wait_seconds,
+                                              VisibilityTimeout=VISIBILITY_TIMEOUT_SECONDS)
+        for sqs_message in response.get('Messages', []):
+            message_id = sqs_message['MessageId']
+            is_buffered = message_id in buffered_messages
+            # only the receipt handle of the latest delivery can delete the message
+            buffered_messages[message_id] = [sqs_message['ReceiptHandle'],
+                                             digest.clock() + VISIBILITY_TIMEOUT_SECONDS]
+            if is_buffered:
+                continue
+            try:
+                message = json.loads(sqs_message['Body'])['Message']
+            except (ValueError, KeyError, TypeError):
+                # raw message delivery
+                message = sqs_message['Body']
+            digest.add(message)
+        if digest.is_due():
+            try:
+                webhook_client.post(digest.get_message())
+            except (WebhookException, OSError) as exception:
+                logging.warning("warning: could not post the digest, retrying in %s seconds: %s",
+                                digest.window_seconds, exception)
+                digest.postpone()
+                continue
+            digest.clear()
+            _delete_messages(sqs_client, queue_url, [
+                receipt_handle for receipt_handle, _ in buffered_messages.values()])
+            buffered_messages = {}
+
+
+def usage():
+    """prints the script's usage
+
+    :return: None
+    """
+
+    print(
+        f"usage: {path.basename(__file__)} QUEUE_URL WINDOW_SECONDS\n"
+        f"Posts digests of the AWS Budgets notifications delivered to an SQS queue to Slack.\n"
+        f"\n"
+        f"where:\n"
+        f"\n"
+        f"QUEUE_URL is the URL of the SQS queue subscribed to the alert topics of the accounts\n"
+        f"WINDOW_SECONDS is the number of seconds notifications are buffered for before being\n"
+        f"    posted\n"
+        f"\n"
+        f"The WEBHOOK_URL environment variable must contain the URL for the Slack channel.\n"
+    )
+
+
+def main():
+    """Main entry point
+    """
+    if len(sys.argv) != 3 or 'WEBHOOK_URL' not in environ:
+        usage()
+        sys.exit(-1)
+    queue_url = sys.argv[1]
+    window_seconds = float(sys.argv[2])
+
+    if logging.getLogger(__name__).level > logging.INFO:
+        logging.basicConfig(level=logging.INFO)
+
+    webhook_client = WebhookClient(environ['WEBHOOK_URL'])
+    try:
+        run_digest(boto3.client('sqs'), queue_url, AlertDigest(window_seconds), webhook_client)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        webhook_client.close()
+
+
+if __name__ == "__main__":
+    main()
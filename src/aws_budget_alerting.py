@@ -1,14 +1,196 @@
 """Script creating a CloudFormation template containing the resources required to set up budget
 alerting to a Slack channel
 """
+# pylint: disable=too-many-lines
 
-import sys
-import os
+import argparse
+import csv
+import json
+import logging
+import re
 from dataclasses import dataclass
-from troposphere import Template, Parameter, Ref
-from troposphere import sns, serverless, budgets, awslambda
+from functools import lru_cache
+from os import path
+import cfn_flip
+from troposphere import GetAtt, Template, Output, Parameter, Ref, Sub
+from troposphere import sns, sqs, serverless, budgets, awslambda
+from bulk_build import build_template
+from template_emitter import write_template
 
 LAMBDA_RUNTIME = 'nodejs8.10'
+LAMBDA_ARCHITECTURES = ('x86_64', 'arm64')
+# runtimes the function code can run on, and whether they support the arm64 architecture
+LAMBDA_RUNTIMES = {
+    'nodejs8.10': False,
+    'nodejs10.x': False,
+    'nodejs12.x': True,
+    'nodejs14.x': True,
+    'nodejs16.x': True,
+    'nodejs18.x': True,
+    'nodejs20.x': True,
+}
+LAMBDA_MAX_TIMEOUT = 900
+LAMBDA_ALIAS = 'live'
+LAMBDA_CODE_URI = 'lambda-src/'
+# maximum size of the code of a function defined inline in a CloudFormation template (in bytes)
+LAMBDA_INLINE_CODE_MAX_SIZE = 4096
+# maximum time notifications can be buffered before invoking a function (in seconds)
+SQS_MAX_BATCHING_WINDOW = 300
+SQS_MAX_RETENTION_PERIOD = 1209600  # 14 days, in seconds
+STANDALONE_TOPOLOGY = 'standalone'
+# an account alerting to its own topics, or the hub and the member accounts of a hub-and-spoke
+# deployment, where the budgets of the members publish to the topics of the hub
+TEMPLATE_TOPOLOGIES = (STANDALONE_TOPOLOGY, 'hub', 'spoke')
+
+
+class InvalidPerformanceProfileException(Exception):
+    """Exception indicating that a Lambda performance profile has invalid settings
+    """
+
+
+class InlineCodeTooLargeException(Exception):
+    """Exception indicating that a handler file is too large to be defined inline in a template
+    """
+
+
+class InvalidBatchingException(Exception):
+    """Exception indicating that the batching of the notifications has invalid settings
+    """
+
+
+@dataclass
+class LambdaPerformanceProfile:
+    """Class specifying the performance settings of a Lambda function
+    """
+    memory_size: int = 128  # in MB
+    timeout: int = 10  # in seconds
+    architecture: str = 'x86_64'  # 'x86_64' or 'arm64'
+    runtime: str = LAMBDA_RUNTIME
+    reserved_concurrency: int = None  # concurrent executions reserved for the function
+    provisioned_concurrency: int = None  # pre-initialised execution environments
+
+    def validate(self):
+        """Checks that the settings are valid and compatible with each other
+
+        :return: None
+        :raises InvalidPerformanceProfileException: if the settings are not valid
+        """
+        try:
+            awslambda.validate_memory_size(self.memory_size)
+        except ValueError as value_error:
+            raise InvalidPerformanceProfileException(str(value_error)) from value_error
+        if not 1 <= self.timeout <= LAMBDA_MAX_TIMEOUT:
+            raise InvalidPerformanceProfileException(
+                f"timeout should be between 1 and {LAMBDA_MAX_TIMEOUT} (got {self.timeout})")
+        if self.architecture not in LAMBDA_ARCHITECTURES:
+            raise InvalidPerformanceProfileException(
+                f"architecture should be one of {LAMBDA_ARCHITECTURES} (got {self.architecture})")
+        if self.runtime not in LAMBDA_RUNTIMES:
+            raise InvalidPerformanceProfileException(
+                f"runtime should be one of {sorted(LAMBDA_RUNTIMES)} (got {self.runtime})")
+        if self.architecture == 'arm64' and not LAMBDA_RUNTIMES[self.runtime]:
+            raise InvalidPerformanceProfileException(
+                f"runtime {self.runtime} doesn't support the arm64 architecture")
+        if self.reserved_concurrency is not None and self.reserved_concurrency < 1:
+            raise InvalidPerformanceProfileException(
+                f"reserved_concurrency should be >0 (got {self.reserved_concurrency})")
+        if self.provisioned_concurrency is not None:
+            if self.provisioned_concurrency < 1:
+                raise InvalidPerformanceProfileException(
+                    f"provisioned_concurrency should be >0 (got {self.provisioned_concurrency})")
+            if self.reserved_concurrency is not None and \
+                    self.provisioned_concurrency > self.reserved_concurrency:
+                raise InvalidPerformanceProfileException(
+                    f"provisioned_concurrency ({self.provisioned_concurrency}) should not exceed "
+                    f"reserved_concurrency ({self.reserved_concurrency})")
+
+
+DEFAULT_PERFORMANCE_PROFILE = 'default'
+LAMBDA_PERFORMANCE_PROFILES = {
+    # the settings used before profiles were introduced
+    DEFAULT_PERFORMANCE_PROFILE: LambdaPerformanceProfile(),
+    # smallest and cheapest function
+    'minimal': LambdaPerformanceProfile(architecture='arm64', runtime='nodejs18.x'),
+    # absorbs month-start alert storms without being throttled by the account concurrency
+    'burst': LambdaPerformanceProfile(memory_size=256, timeout=30, architecture='arm64',
+                                      runtime='nodejs18.x', reserved_concurrency=50),
+    # no cold starts
+    'low-latency': LambdaPerformanceProfile(memory_size=512, architecture='arm64',
+                                            runtime='nodejs18.x', reserved_concurrency=20,
+                                            provisioned_concurrency=2),
+}
+
+
+def get_performance_profile(name):
+    """Gets a validated Lambda performance profile
+
+    :param name: (str) the name of the profile, a key of LAMBDA_PERFORMANCE_PROFILES
+    :return: a LambdaPerformanceProfile object
+    :raises InvalidPerformanceProfileException: if the profile doesn't exist or is not valid
+    """
+    if name not in LAMBDA_PERFORMANCE_PROFILES:
+        raise InvalidPerformanceProfileException(
+            f"performance profile should be one of {sorted(LAMBDA_PERFORMANCE_PROFILES)} "
+            f"(got {name})")
+    profile = LAMBDA_PERFORMANCE_PROFILES[name]
+    profile.validate()
+    return profile
+
+
+class Function(serverless.Function):
+    """SAM Serverless function supporting the properties that the version of troposphere in use
+    doesn't know about
+    """
+    props = dict(serverless.Function.props,
+                 Architectures=([str], False),
+                 ProvisionedConcurrencyConfig=(dict, False))
+
+
+class SQSEvent(serverless.SQSEvent):
+    """SAM SQS event source supporting the properties that the version of troposphere in use
+    doesn't know about
+    """
+    props = dict(serverless.SQSEvent.props,
+                 MaximumBatchingWindowInSeconds=(int, False),
+                 FunctionResponseTypes=([str], False))
+
+    def validate(self):
+        """Checks the batch size, which can be larger than 10 with a batching window
+        """
+        max_batch_size = 10000 if self.properties.get('MaximumBatchingWindowInSeconds') else 10
+        if not 1 <= self.properties['BatchSize'] <= max_batch_size:
+            raise ValueError(f"BatchSize must be between 1 and {max_batch_size}")
+
+
+@dataclass
+class AlertBatching:
+    """Class specifying the SQS queue buffering the notifications of every topic, so that the
+    Lambda functions post them in batches, and retry them without losing any when they fail
+    """
+    batch_size: int = 10  # the maximum number of notifications per invocation
+    maximum_batching_window: int = 30  # the maximum time notifications are buffered (in seconds)
+    max_receive_count: int = 5  # attempts before a notification is moved to the dead-letter queue
+
+    def validate(self):
+        """Checks that the settings are valid
+
+        :return: None
+        :raises InvalidBatchingException: if the settings are not valid
+        """
+        if not 1 <= self.batch_size <= 10000:
+            raise InvalidBatchingException(
+                f"batch_size should be between 1 and 10000 (got {self.batch_size})")
+        if not 0 <= self.maximum_batching_window <= SQS_MAX_BATCHING_WINDOW:
+            raise InvalidBatchingException(
+                f"maximum_batching_window should be between 0 and {SQS_MAX_BATCHING_WINDOW} "
+                f"(got {self.maximum_batching_window})")
+        if self.batch_size > 10 and self.maximum_batching_window < 1:
+            raise InvalidBatchingException(
+                f"maximum_batching_window should be >0 when batch_size is >10 "
+                f"(got {self.batch_size})")
+        if not 1 <= self.max_receive_count <= 1000:
+            raise InvalidBatchingException(
+                f"max_receive_count should be between 1 and 1000 (got {self.max_receive_count})")
 
 
 @dataclass
@@ -20,6 +202,72 @@ class LambdaMetaData:
     webhook_url: Ref  # the webhook URL for the Slack channel the message should be posted to
     message_prefix: Ref  # text to prepend to the alert message (e.g. a human-friendly AWS
     # account name)
+    performance_profile: str = DEFAULT_PERFORMANCE_PROFILE  # the name of the performance profile
+
+
+@dataclass
+class AlertRoute:
+    """Class specifying where the notifications published to a topic should be posted, when a
+    single Lambda function is subscribed to several topics
+    """
+    topic_name: str  # the SNS topic name (alphanumeric)
+    webhook_url: Ref  # the webhook URL for the Slack channel the message should be posted to
+    message_prefix: Ref  # text to prepend to the alert message
+
+
+@dataclass
+class AlertingTemplateVariant:
+    """Class specifying the values that differ between the alerting templates of the accounts
+    """
+    budget_name: str = 'Monthly Budget'  # the name of the AWS Budgets budget
+    monthly_budget: float = None  # default value of the MonthlyBudget parameter
+    actual_threshold: float = None  # default value of the ActualThreshold parameter
+    forecasted_threshold: float = None  # default value of the ForecastedThreshold parameter
+    message_prefix: str = ''  # default value of the MessagePrefix parameter
+    # values of the ActualCostWebHookUrl and ForecastedCostWebHookUrl parameters, either the URLs
+    # or references to the SSM parameters holding them (ssm:NAME), see
+    # ssm_parameters.resolve_variant_references(). They are secrets, passed as parameter overrides
+    # at deploy time and never written to the templates.
+    actual_webhook_url: str = None
+    forecasted_webhook_url: str = None
+
+
+# location of every AlertingTemplateVariant field in the template
+VARIANT_FIELD_PATHS = {
+    'budget_name': ('Resources', 'Budget', 'Properties', 'Budget', 'BudgetName'),
+    'monthly_budget': ('Parameters', 'MonthlyBudget', 'Default'),
+    'actual_threshold': ('Parameters', 'ActualThreshold', 'Default'),
+    'forecasted_threshold': ('Parameters', 'ForecastedThreshold', 'Default'),
+    'message_prefix': ('Parameters', 'MessagePrefix', 'Default'),
+}
+# stack parameters of the webhook URLs by AlertingTemplateVariant field, the fields that can
+# reference SSM parameters
+WEBHOOK_PARAMETERS = {
+    'actual_webhook_url': 'ActualCostWebHookUrl',
+    'forecasted_webhook_url': 'ForecastedCostWebHookUrl',
+}
+WEBHOOK_VARIANT_FIELDS = tuple(WEBHOOK_PARAMETERS)
+
+
+def get_lambda_code_properties(inline_code_file=None):
+    """Gets the properties of the SAM Function specifying its code. The code can be defined inline
+    in the template, so that the template can be deployed without packaging and uploading the code
+    to S3, if it fits within the inline code size limit, e.g. lambda-src/inline.js.
+
+    :param inline_code_file: (str) the name of a self-contained handler file, with no
+        dependencies, to define inline, None to use the packaged code
+    :return: (dict) either the InlineCode or the CodeUri property
+    :raises InlineCodeTooLargeException: if the handler file is larger than the size limit
+    """
+    if inline_code_file is None:
+        return {'CodeUri': LAMBDA_CODE_URI}
+    with open(inline_code_file, encoding='utf-8') as code_file:
+        code = code_file.read()
+    if len(code.encode('utf-8')) > LAMBDA_INLINE_CODE_MAX_SIZE:
+        raise InlineCodeTooLargeException(
+            f"{inline_code_file} is larger than the {LAMBDA_INLINE_CODE_MAX_SIZE} bytes of inline "
+            f"code CloudFormation allows")
+    return {'InlineCode': code}
 
 
 class AlertingTemplate(Template):
@@ -28,6 +276,89 @@ class AlertingTemplate(Template):
     To generate the template, create a new object of this class and call to_yaml() on it.
     """
 
+    def __init__(self, inline_code_file=None, batching=None):
+        """Constructor for the AlertingTemplate class.
+
+        :param inline_code_file: (str) the name of a self-contained handler file to define inline
+            in the Lambda functions, see get_lambda_code_properties()
+        :param batching: (AlertBatching) the batching of the notifications of every topic, None to
+            subscribe the Lambda functions to the topics directly
+        :raises InvalidBatchingException: if the batching settings are not valid
+        :raises InlineCodeTooLargeException: if the handler file is too large to be inline
+        """
+        Template.__init__(self)
+        self.code_properties = get_lambda_code_properties(inline_code_file)
+        if batching is not None:
+            batching.validate()
+        self.batching = batching
+
+    def _add_topic_and_event(self, topic_name, performance_profile):
+        """Adds a SNS topic to the CloudFormation template, with the SQS queues buffering its
+        notifications in batching mode
+
+        :param topic_name: (str) the SNS topic name
+        :param performance_profile: (str) the name of the performance profile of the function
+            the notifications are sent to
+        :return: a tuple (the sns.Topic object, the event triggering the function)
+        """
+        topic = self.add_resource(sns.Topic(
+            "{}Topic".format(topic_name),
+            TopicName=topic_name,
+        ))
+        if self.batching is None:
+            return topic, serverless.SNSEvent('sns', Topic=Ref(topic))
+
+        dead_letter_queue = self.add_resource(sqs.Queue(
+            "{}DeadLetterQueue".format(topic_name),
+            MessageRetentionPeriod=SQS_MAX_RETENTION_PERIOD,
+        ))
+        # a message is invisible while a function processes it: long enough for the function to
+        # time out, and the batching window to elapse, several times
+        timeout = get_performance_profile(performance_profile).timeout
+        queue = self.add_resource(sqs.Queue(
+            "{}Queue".format(topic_name),
+            VisibilityTimeout=6 * timeout + self.batching.maximum_batching_window,
+            MessageRetentionPeriod=SQS_MAX_RETENTION_PERIOD,
+            RedrivePolicy=sqs.RedrivePolicy(
+                deadLetterTargetArn=GetAtt(dead_letter_queue, 'Arn'),
+                maxReceiveCount=self.batching.max_receive_count,
+            ),
+        ))
+        self.add_resource(sqs.QueuePolicy(
+            "{}QueuePolicy".format(topic_name),
+            PolicyDocument={
+                "Version": "2012-10-17",
+                "Statement": [{
+                    "Effect": "Allow",
+                    "Principal": {
+                        "Service": "sns.amazonaws.com"
+                    },
+                    "Action": "sqs:SendMessage",
+                    "Resource": GetAtt(queue, 'Arn'),
+                    "Condition": {
+                        "ArnEquals": {
+                            "aws:SourceArn": Ref(topic),
+                        },
+                    },
+                }],
+            },
+            Queues=[Ref(queue)],
+        ))
+        self.add_resource(sns.SubscriptionResource(
+            "{}Subscription".format(topic_name),
+            Protocol='sqs',
+            Endpoint=GetAtt(queue, 'Arn'),
+            TopicArn=Ref(topic),
+        ))
+        return topic, SQSEvent(
+            'sqs',
+            Queue=GetAtt(queue, 'Arn'),
+            BatchSize=self.batching.batch_size,
+            MaximumBatchingWindowInSeconds=self.batching.maximum_batching_window,
+            # only the notifications that failed are retried
+            FunctionResponseTypes=['ReportBatchItemFailures'],
+        )
+
     def add_topic_and_lambda(self, topic_name, lambda_meta_data):
         """Adds a SNS topic and SAM Function to the CloudFormation template
 
@@ -37,56 +368,122 @@ class AlertingTemplate(Template):
 
         :return: a sns.Topic object
         """
-        topic = sns.Topic(
-            "{}Topic".format(topic_name),
-            TopicName=topic_name,
+        topic, event = self._add_topic_and_event(topic_name, lambda_meta_data.performance_profile)
+
+        self._add_function(
+            name=lambda_meta_data.name,
+            description=lambda_meta_data.description,
+            variables={
+                'WEBHOOK_URL': lambda_meta_data.webhook_url,
+                'MESSAGE_PREFIX': lambda_meta_data.message_prefix,
+            },
+            events={
+                event.resource_type: event,
+            },
+            performance_profile=lambda_meta_data.performance_profile,
         )
-        self.add_resource(topic)
-
-        self.add_resource(serverless.Function(
-            "{}Lambda".format(lambda_meta_data.name),
-            Description=lambda_meta_data.description,
-            MemorySize=128,
-            FunctionName=lambda_meta_data.name,
-            Runtime=LAMBDA_RUNTIME,
+        return topic
+
+    def add_topics_and_router_lambda(self, routes, name, description,
+                                     performance_profile=DEFAULT_PERFORMANCE_PROFILE):
+        """Adds a SNS topic per route and a single SAM Function subscribed to all of them to the
+        CloudFormation template. The function posts the notifications of each topic to the webhook
+        of its route.
+
+        :param routes: (list) the AlertRoute objects
+        :param name: (str) the name for the SAM Serverless function
+        :param description: (str) the description for the SAM Serverless function
+        :param performance_profile: (str) the name of the performance profile of the function
+
+        :return: (dict) the sns.Topic objects keyed by topic name
+        """
+        topics = {}
+        variables = {}
+        events = {}
+        for route in routes:
+            topic, event = self._add_topic_and_event(route.topic_name, performance_profile)
+            topics[route.topic_name] = topic
+            # the function looks up the webhook URL and message prefix by topic name
+            variables['WEBHOOK_URL_' + route.topic_name] = route.webhook_url
+            variables['MESSAGE_PREFIX_' + route.topic_name] = route.message_prefix
+            events[event.resource_type + route.topic_name] = event
+
+        self._add_function(name=name, description=description, variables=variables,
+                           events=events, performance_profile=performance_profile)
+        return topics
+
+    def _add_function(self, name, description, variables,  # pylint: disable=too-many-arguments
+                      events, performance_profile):
+        """Adds the SAM Function posting messages to Slack to the CloudFormation template
+
+        :param name: (str) the name for the SAM Serverless function
+        :param description: (str) the description for the SAM Serverless function
+        :param variables: (dict) the environment variables of the function
+        :param events: (dict) the events triggering the function
+        :param performance_profile: (str) the name of the performance profile of the function
+
+        :return: the serverless.Function object
+        """
+        profile = get_performance_profile(performance_profile)
+        # either the inline or the packaged code, and only the settings that differ from the Lambda
+        # defaults
+        optional_properties = dict(self.code_properties)
+        if profile.architecture != LAMBDA_ARCHITECTURES[0]:
+            optional_properties['Architectures'] = [profile.architecture]
+        if profile.reserved_concurrency is not None:
+            optional_properties['ReservedConcurrentExecutions'] = profile.reserved_concurrency
+        if profile.provisioned_concurrency is not None:
+            # provisioned concurrency applies to a version, published under an alias
+            optional_properties['AutoPublishAlias'] = LAMBDA_ALIAS
+            optional_properties['ProvisionedConcurrencyConfig'] = {
+                'ProvisionedConcurrentExecutions': profile.provisioned_concurrency,
+            }
+        function = Function(
+            "{}Lambda".format(name),
+            Description=description,
+            MemorySize=profile.memory_size,
+            FunctionName=name,
+            Runtime=profile.runtime,
             Handler='index.handler',
-            CodeUri='lambda-src/',
-            Timeout=10,
+            Timeout=profile.timeout,
             Environment=awslambda.Environment(
-                Variables={
-                    'WEBHOOK_URL': lambda_meta_data.webhook_url,
-                    'MESSAGE_PREFIX': lambda_meta_data.message_prefix,
-                }),
-            Events={
-                'SNS': serverless.SNSEvent(
-                    'sns',
-                    Topic=Ref(topic)
-                ),
-            },
-        ))
-        return topic
+                Variables=variables),
+            Events=events,
+            **optional_properties
+        )
+        return self.add_resource(function)
 
-    def add_topic_policy(self, topic):
+    def add_topic_policy(self, topic, source_account_ids=None):
         """Adds a topic policy to a topic object that allows it to be notified by the AWS Budgets
         service.
 
         :param topic: a sns.Topic object
+        :param source_account_ids: the IDs of the accounts whose budgets are allowed to publish to
+            the topic, as a list or a Ref to a CommaDelimitedList parameter, None for no
+            restriction
         :return: the sns.TopicPolicy object
         """
+        statement = {
+            "Sid": "AWSBudgets-sns-notification",
+            "Effect": "Allow",
+            "Principal": {
+                "Service": "budgets.amazonaws.com"
+            },
+            "Action": "SNS:Publish",
+            "Resource": Ref(topic),
+        }
+        if source_account_ids is not None:
+            statement["Condition"] = {
+                "StringEquals": {
+                    "aws:SourceAccount": source_account_ids,
+                },
+            }
         return self.add_resource(sns.TopicPolicy(
             "{}Policy".format(topic.title),
             PolicyDocument={
                 "Id": "BudgetTopicPolicy",
                 "Version": "2012-10-17",
-                "Statement": [{
-                    "Sid": "AWSBudgets-sns-notification",
-                    "Effect": "Allow",
-                    "Principal": {
-                        "Service": "budgets.amazonaws.com"
-                    },
-                    "Action": "SNS:Publish",
-                    "Resource": Ref(topic),
-                }],
+                "Statement": [statement],
             },
             Topics=[Ref(topic)],
         ))
@@ -98,7 +495,8 @@ def get_notification_with_subscriber(notification_type, threshold_param, budget_
 
     :param notification_type: the notification type (shold be 'ACTUAL' or 'FORECASTED')
     :param threshold_param: the threshold parameter (a percentage)
-    :param budget_topic: the sns.Topic object that should be notified
+    :param budget_topic: the sns.Topic object that should be notified, or the ARN of a topic of
+        another account
     :return:
     """
     # notification_type should be 'ACTUAL' 'FORECASTED'
@@ -110,89 +508,171 @@ def get_notification_with_subscriber(notification_type, threshold_param, budget_
             ThresholdType='PERCENTAGE',
         ),
         Subscribers=[budgets.Subscriber(
-            Address=Ref(budget_topic),
+            Address=Ref(budget_topic) if isinstance(budget_topic, sns.Topic) else budget_topic,
             SubscriptionType='SNS',
         )],
     )
 
 
-def get_alerting_cf_template():
-    """Generates a CloudFormation template with budget alerting resources
+def _get_default(value):
+    """Gets the Default property of a parameter
 
-    :return: the CloudFormation template as a :obj:`str`
+    :param value: the default value of the parameter, None if it has no default value
+    :return: (dict) the keyword arguments to pass to the Parameter constructor
     """
-    template = AlertingTemplate()
-    template.set_description('Stack alerting forecasted and actual AWS budget overspend to Slack')
-    template.set_version('2010-09-09')
-    template.set_transform('AWS::Serverless-2016-10-31')
+    return {} if value is None else {'Default': value}
 
+
+def get_service_budget(service_budget, budget_name, notifications_with_subscribers):
+    """Gets a budgets.Budget object limiting the spend of a single AWS service
+
+    :param service_budget: (ServiceBudget) the service and its monthly limit, see
+        aws_budget_service_budgets.py
+    :param budget_name: (str) the name of the account-wide budget, the service budget being named
+        after it
+    :param notifications_with_subscribers: (list) the budgets.NotificationWithSubscribers objects
+    :return: the budgets.Budget object
+    """
+    return budgets.Budget(
+        "{}Budget".format(re.sub('[^0-9A-Za-z]', '', service_budget.service)),
+        Budget=budgets.BudgetData(
+            BudgetType='COST',
+            TimeUnit='MONTHLY',
+            BudgetName="{} - {}".format(budget_name, service_budget.service),
+            BudgetLimit=budgets.Spend(
+                Amount=float(service_budget.limit_amount),
+                Unit='USD',
+            ),
+            CostFilters={'Service': [service_budget.service]},
+        ),
+        NotificationsWithSubscribers=notifications_with_subscribers,
+    )
+
+
+def _add_budget_parameters(template, variant):
+    """Adds the parameters of the budget and of its thresholds to a template
+
+    :param template: the Template object
+    :param variant: (AlertingTemplateVariant) the parameter default values
+    :return: a tuple (monthly budget, actual threshold, forecasted threshold) of Parameter objects
+    """
     # budget parameter
     monthly_budget_param = template.add_parameter(Parameter(
         'MonthlyBudget',
         Description='Monthly budget for the account (in USD)',
         Type='Number',
+        **_get_default(variant.monthly_budget)
+    ))
+    actual_threshold_param = template.add_parameter(Parameter(
+        'ActualThreshold',
+        Description='Threshold (percentage) compared to the actual cost that should trigger an '
+                    'alert',
+        Type='Number',
+        **_get_default(variant.actual_threshold)
+    ))
+    forecasted_threshold_param = template.add_parameter(Parameter(
+        'ForecastedThreshold',
+        Description='Threshold (percentage) compared to the forecasted cost that should trigger '
+                    'an alert',
+        Type='Number',
+        **_get_default(variant.forecasted_threshold)
     ))
+    return monthly_budget_param, actual_threshold_param, forecasted_threshold_param
+
+
+def _add_alert_topics(template, single_router, performance_profile, variant):
+    """Adds the actual and forecasted alert topics, the Lambda functions posting their
+    notifications to Slack and the parameters of the functions to a template
 
+    :param template: the AlertingTemplate object
+    :param single_router: (bool) if True, a single Lambda function is subscribed to both topics
+    :param performance_profile: (str) the name of the performance profile of the Lambda functions
+    :param variant: (AlertingTemplateVariant) the parameter default values
+    :return: a tuple (actual, forecasted) of sns.Topic objects
+    """
     # message prefix parameter
     message_prefix_param = template.add_parameter(Parameter(
         'MessagePrefix',
         Description='A string that will be pre-pend to alert messages, e.g. to specify a friendly'
                     ' AWS account name',
         Type='String',
-        Default='',
+        **_get_default(variant.message_prefix)
     ))
 
-    # params and resources linked to actual costs alerts
+    # params linked to actual and forecasted costs alerts
     actual_webhook_url_param = template.add_parameter(Parameter(
         'ActualCostWebHookUrl',
         Description='webhook for posting messages to the actual AWS cost Slack channel',
         Type='String',
+        NoEcho=True,
     ))
+    forecasted_webhook_url_param = template.add_parameter(Parameter(
+        'ForecastedCostWebHookUrl',
+        Description='webhook for posting messages to the forecasted AWS cost Slack channel',
+        Type='String',
+        NoEcho=True,
+    ))
+
+    if single_router:
+        # a single Lambda function subscribed to both topics
+        topics = template.add_topics_and_router_lambda(
+            routes=[
+                AlertRoute(topic_name='ActualBudgetAlert',
+                           webhook_url=Ref(actual_webhook_url_param),
+                           message_prefix=Ref(message_prefix_param)),
+                AlertRoute(topic_name='ForecastedBudgetAlert',
+                           webhook_url=Ref(forecasted_webhook_url_param),
+                           message_prefix=Ref(message_prefix_param)),
+            ],
+            name='BudgetAlertSlackNotification',
+            description='Posts a message to the budget alert Slack channel of the topic',
+            performance_profile=performance_profile,
+        )
+        return topics['ActualBudgetAlert'], topics['ForecastedBudgetAlert']
 
+    # resources linked to actual costs alerts
     actual_lambda_meta_data = \
         LambdaMetaData(description='Posts a message to the actual budget alert Slack channel',
                        name='ActualCostSlackNotification',
                        webhook_url=Ref(actual_webhook_url_param),
                        message_prefix=Ref(message_prefix_param),
+                       performance_profile=performance_profile,
                        )
-
     actual_budget_topic = \
         template.add_topic_and_lambda(topic_name='ActualBudgetAlert',
                                       lambda_meta_data=actual_lambda_meta_data)
 
-    actual_threshold_param = template.add_parameter(Parameter(
-        'ActualThreshold',
-        Description='Threshold (percentage) compared to the actual cost that should trigger an '
-                    'alert',
-        Type='Number',
-    ))
-
-    actual_budget_subscriber = get_notification_with_subscriber('ACTUAL', actual_threshold_param,
-                                                                actual_budget_topic)
-
-    # params and resources linked to forecasted costs alerts
-    forecasted_webhook_url_param = template.add_parameter(Parameter(
-        'ForecastedCostWebHookUrl',
-        Description='webhook for posting messages to the forecasted AWS cost Slack channel',
-        Type='String',
-    ))
-
+    # resources linked to forecasted costs alerts
     forecasted_lambda_meta_data = \
-        LambdaMetaData(description='Posts a message to the forecasted budget alert Slack channel',
+        LambdaMetaData(description='Posts a message to the forecasted budget alert Slack '
+                                   'channel',
                        name='ForecastedCostSlackNotification',
                        webhook_url=Ref(forecasted_webhook_url_param),
                        message_prefix=Ref(message_prefix_param),
+                       performance_profile=performance_profile,
                        )
     forecasted_budget_topic = \
         template.add_topic_and_lambda(topic_name='ForecastedBudgetAlert',
                                       lambda_meta_data=forecasted_lambda_meta_data)
+    return actual_budget_topic, forecasted_budget_topic
 
-    forecasted_threshold_param = template.add_parameter(Parameter(
-        'ForecastedThreshold',
-        Description='Threshold (percentage) compared to the forecasted cost that should trigger '
-                    'an alert',
-        Type='Number',
-    ))
+
+def _add_budgets(template, variant, budget_params, topics, service_budgets):
+    """Adds the account-wide budget and the service budgets, notifying the alert topics, to a
+    template
+
+    :param template: the Template object
+    :param variant: (AlertingTemplateVariant) the budget name
+    :param budget_params: (tuple) the monthly budget, actual threshold and forecasted threshold
+        parameters, see _add_budget_parameters()
+    :param topics: (tuple) the actual and forecasted alert topics, as sns.Topic objects or ARNs
+    :param service_budgets: (list) the ServiceBudget objects of the account
+    :return: None
+    """
+    monthly_budget_param, actual_threshold_param, forecasted_threshold_param = budget_params
+    actual_budget_topic, forecasted_budget_topic = topics
+    actual_budget_subscriber = get_notification_with_subscriber('ACTUAL', actual_threshold_param,
+                                                                actual_budget_topic)
     forecasted_budget_subscriber = get_notification_with_subscriber('FORECASTED',
                                                                     forecasted_threshold_param,
                                                                     forecasted_budget_topic)
@@ -203,7 +683,7 @@ def get_alerting_cf_template():
         Budget=budgets.BudgetData(
             BudgetType='COST',
             TimeUnit='MONTHLY',
-            BudgetName='Monthly Budget',
+            BudgetName=variant.budget_name,
             BudgetLimit=budgets.Spend(
                 Amount=Ref(monthly_budget_param),
                 Unit='USD',
@@ -215,26 +695,387 @@ def get_alerting_cf_template():
         ],
     )
     template.add_resource(budget)
+    for service_budget in service_budgets:
+        template.add_resource(get_service_budget(service_budget, variant.budget_name, [
+            actual_budget_subscriber,
+            forecasted_budget_subscriber,
+        ]))
+
+
+def build_alerting_template(single_router=False,  # pylint: disable=too-many-arguments
+                            performance_profile=DEFAULT_PERFORMANCE_PROFILE,
+                            inline_code_file=None, variant=None, service_budgets=(),
+                            batching=None):
+    """Builds the CloudFormation template with budget alerting resources
+
+    :param single_router: (bool) if True, a single Lambda function is subscribed to both the actual
+        and forecasted alert topics, instead of one function per topic
+    :param performance_profile: (str) the name of the performance profile of the Lambda functions
+    :param inline_code_file: (str) the name of a self-contained handler file to define inline in
+        the Lambda functions, instead of the packaged code, see get_lambda_code_properties()
+    :param variant: (AlertingTemplateVariant) the budget name and parameter default values of the
+        account the template is for, None for the defaults
+    :param service_budgets: (list) the ServiceBudget objects of the account, each adding a budget
+        limited to a single service alerting to the same topics and at the same thresholds as the
+        account-wide budget, see aws_budget_service_budgets.py
+    :param batching: (AlertBatching) the SQS queue settings buffering the notifications of every
+        topic, None to subscribe the Lambda functions to the topics directly
+    :return: the AlertingTemplate object
+    """
+    if variant is None:
+        variant = AlertingTemplateVariant()
+    template = AlertingTemplate(inline_code_file=inline_code_file, batching=batching)
+    template.set_description('Stack alerting forecasted and actual AWS budget overspend to Slack')
+    template.set_version('2010-09-09')
+    template.set_transform('AWS::Serverless-2016-10-31')
+
+    budget_params = _add_budget_parameters(template, variant)
+    topics = _add_alert_topics(template, single_router, performance_profile, variant)
+    _add_budgets(template, variant, budget_params, topics, service_budgets)
 
     # Allow the AWS Budgets service to publish messages to our topics
+    for topic in topics:
+        template.add_topic_policy(topic)
+
+    return template
+
+
+def build_hub_template(single_router=False, performance_profile=DEFAULT_PERFORMANCE_PROFILE,
+                       inline_code_file=None, variant=None, batching=None):
+    """Builds the CloudFormation template of the hub account of a hub-and-spoke deployment: the
+    alert topics, which the budgets of the member (spoke) accounts publish to, and the only Lambda
+    functions posting the alerts to Slack. The hub has no budget of its own.
+
+    :param single_router: (bool) see build_alerting_template()
+    :param performance_profile: (str) see build_alerting_template()
+    :param inline_code_file: (str) see build_alerting_template()
+    :param variant: (AlertingTemplateVariant) the MessagePrefix default value, None for the
+        defaults
+    :param batching: (AlertBatching) see build_alerting_template()
+    :return: the AlertingTemplate object
+    """
+    if variant is None:
+        variant = AlertingTemplateVariant()
+    template = AlertingTemplate(inline_code_file=inline_code_file, batching=batching)
+    template.set_description('Stack alerting forecasted and actual AWS budget overspend of the '
+                             'member accounts to Slack')
+    template.set_version('2010-09-09')
+    template.set_transform('AWS::Serverless-2016-10-31')
+
+    member_account_ids_param = template.add_parameter(Parameter(
+        'MemberAccountIds',
+        Description='IDs of the accounts whose budgets are allowed to publish alerts',
+        Type='CommaDelimitedList',
+    ))
+    topics = _add_alert_topics(template, single_router, performance_profile, variant)
+    for topic in topics:
+        template.add_topic_policy(topic, source_account_ids=Ref(member_account_ids_param))
+        template.add_output(Output(
+            "{}Arn".format(topic.title),
+            Description='ARN of the topic the budgets of the member accounts publish to',
+            Value=Ref(topic),
+        ))
+    return template
+
+
+def build_spoke_template(variant=None, service_budgets=()):
+    """Builds the CloudFormation template of a member (spoke) account of a hub-and-spoke
+    deployment: only the budgets, publishing their alerts to the topics of the hub account, see
+    build_hub_template()
+
+    :param variant: (AlertingTemplateVariant) the budget name and parameter default values of the
+        account the template is for, None for the defaults. The message prefix is set in the hub.
+    :param service_budgets: (list) the ServiceBudget objects of the account, see
+        build_alerting_template()
+    :return: the Template object
+    """
+    if variant is None:
+        variant = AlertingTemplateVariant()
+    template = Template()
+    template.set_description('Stack of the AWS budgets of a member account, alerting to the topics '
+                             'of the hub account')
+    template.set_version('2010-09-09')
+
+    budget_params = _add_budget_parameters(template, variant)
+    template.add_parameter(Parameter(
+        'HubAccountId',
+        Description='ID of the account hosting the alert topics',
+        Type='String',
+        AllowedPattern='[0-9]{12}',
+    ))
+    topics = tuple(Sub('arn:${AWS::Partition}:sns:${AWS::Region}:${HubAccountId}:' + topic_name)
+                   for topic_name in ('ActualBudgetAlert', 'ForecastedBudgetAlert'))
+    _add_budgets(template, variant, budget_params, topics, service_budgets)
+    return template
+
+
+def build_topology_template(topology=STANDALONE_TOPOLOGY,  # pylint: disable=too-many-arguments
+                            single_router=False, performance_profile=DEFAULT_PERFORMANCE_PROFILE,
+                            inline_code_file=None, variant=None, service_budgets=(),
+                            batching=None):
+    """Builds the alerting template of an account in the given topology
+
+    :param topology: (str) one of TEMPLATE_TOPOLOGIES: 'standalone' for an account alerting to
+        its own topics, see build_alerting_template(), 'hub' or 'spoke' for the hub and the member
+        accounts of a hub-and-spoke deployment, see build_hub_template() and
+        build_spoke_template()
+    :param single_router: (bool) see build_alerting_template(), ignored by spokes
+    :param performance_profile: (str) see build_alerting_template(), ignored by spokes
+    :param inline_code_file: (str) see build_alerting_template(), ignored by spokes
+    :param variant: (AlertingTemplateVariant) see build_alerting_template()
+    :param service_budgets: (list) see build_alerting_template(), ignored by the hub
+    :param batching: (AlertBatching) see build_alerting_template(), ignored by spokes
+    :return: the Template object
+    """
+    if topology not in TEMPLATE_TOPOLOGIES:
+        raise ValueError(f"topology should be one of {TEMPLATE_TOPOLOGIES} (got {topology})")
+    if topology == 'hub':
+        return build_hub_template(single_router=single_router,
+                                  performance_profile=performance_profile,
+                                  inline_code_file=inline_code_file, variant=variant,
+                                  batching=batching)
+    if topology == 'spoke':
+        return build_spoke_template(variant=variant, service_budgets=service_budgets)
+    return build_alerting_template(single_router=single_router,
+                                   performance_profile=performance_profile,
+                                   inline_code_file=inline_code_file, variant=variant,
+                                   service_budgets=service_budgets, batching=batching)
+
 
-    # actual costs alert topic
-    template.add_topic_policy(actual_budget_topic)
+def get_alerting_cf_template(single_router=False,  # pylint: disable=too-many-arguments
+                             performance_profile=DEFAULT_PERFORMANCE_PROFILE,
+                             inline_code_file=None, variant=None, bulk=False, service_budgets=(),
+                             topology=STANDALONE_TOPOLOGY, batching=None):
+    """Generates a CloudFormation template with budget alerting resources
+
+    :param single_router: (bool) if True, a single Lambda function is subscribed to both the actual
+        and forecasted alert topics, instead of one function per topic
+    :param performance_profile: (str) the name of the performance profile of the Lambda functions
+    :param inline_code_file: (str) the name of a self-contained handler file to define inline in
+        the Lambda functions, see build_alerting_template()
+    :param variant: (AlertingTemplateVariant) the budget name and parameter default values of the
+        account the template is for, None for the defaults
+    :param bulk: (bool) if True, the template is built in bulk mode, see bulk_build
+    :param service_budgets: (list) the ServiceBudget objects of the account, see
+        build_alerting_template()
+    :param topology: (str) one of TEMPLATE_TOPOLOGIES, see build_topology_template()
+    :param batching: (AlertBatching) see build_alerting_template()
+    :return: the CloudFormation template as a :obj:`str`
+    """
+    return build_template(lambda: build_topology_template(topology=topology,
+                                                          single_router=single_router,
+                                                          performance_profile=performance_profile,
+                                                          inline_code_file=inline_code_file,
+                                                          variant=variant,
+                                                          service_budgets=service_budgets,
+                                                          batching=batching),
+                          bulk=bulk)[0]
+
+
+@lru_cache(maxsize=4096)
+def _render_field(field_path, value_json):
+    """Renders a template field as YAML, exactly as Template.to_yaml() would
+
+    :param field_path: (tuple) the keys leading to the field from the root of the template
+    :param value_json: (str) the value of the field, serialised as JSON
+    :return: (str) the YAML lines of the field, indented for its location in the template
+    """
+    data = json.loads(value_json)
+    for key in reversed(field_path):
+        data = {key: data}
+    # the keys leading to the field are rendered as one line each
+    lines = cfn_flip.to_yaml(json.dumps(data)).splitlines(keepends=True)
+    return ''.join(lines[len(field_path) - 1:])
 
-    # forecasted costs alert topic
-    template.add_topic_policy(forecasted_budget_topic)
 
-    return template.to_yaml()
+class _TemplateDict(Template):
+    """Template whose content is an already built dict, so that it is serialised the same way as
+    the Template it was built from
+    """
+
+    def __init__(self, template_dict):
+        Template.__init__(self)
+        self.template_dict = template_dict
+
+    def to_dict(self):
+        return self.template_dict
+
+
+class AlertingTemplateSkeleton:  # pylint: disable=too-few-public-methods
+    """Class rendering the alerting templates of many accounts.
+
+    The template is built and serialised once, with a placeholder line for every field of
+    AlertingTemplateVariant. Each variant is then rendered by replacing the placeholder lines with
+    the YAML of the variant values, which gives the same output as get_alerting_cf_template()
+    without rebuilding and serialising the whole template.
+    """
+    PLACEHOLDER = 'ALERTING_TEMPLATE_SKELETON_FIELD_'
+
+    def __init__(self, single_router=False, performance_profile=DEFAULT_PERFORMANCE_PROFILE,
+                 inline_code_file=None, batching=None):
+        """Constructor, see get_alerting_cf_template() for the parameters
+        """
+        template_dict = build_alerting_template(single_router=single_router,
+                                                performance_profile=performance_profile,
+                                                inline_code_file=inline_code_file,
+                                                batching=batching).to_dict()
+        placeholders = {}
+        for field, field_path in VARIANT_FIELD_PATHS.items():
+            parent = template_dict
+            for key in field_path[:-1]:
+                parent = parent[key]
+            placeholder = self.PLACEHOLDER + field
+            parent[field_path[-1]] = placeholder
+            placeholders[placeholder] = field
+
+        # static text between the placeholder lines, and the fields to render in between
+        self.chunks = []
+        static_lines = []
+        for line in _TemplateDict(template_dict).to_yaml().splitlines(keepends=True):
+            key, _, value = line.strip().partition(': ')
+            if value in placeholders:
+                field = placeholders[value]
+                if key != VARIANT_FIELD_PATHS[field][-1]:
+                    raise ValueError(f"unexpected line for field {field}: {line!r}")
+                self.chunks.append(''.join(static_lines))
+                self.chunks.append(field)
+                static_lines = []
+            else:
+                static_lines.append(line)
+        self.chunks.append(''.join(static_lines))
+
+    def render(self, variant):
+        """Renders the template of an account
+
+        :param variant: (AlertingTemplateVariant) the values specific to the account
+        :return: the CloudFormation template as a :obj:`str`
+        """
+        parts = []
+        # chunks alternate between static text and field names
+        for index, chunk in enumerate(self.chunks):
+            if index % 2 == 0:
+                parts.append(chunk)
+            else:
+                value = getattr(variant, chunk)
+                if value is not None:
+                    parts.append(_render_field(VARIANT_FIELD_PATHS[chunk], json.dumps(value)))
+        return ''.join(parts)
+
+
+def _parse_number(value):
+    """Parses a number of a CSV file, e.g. '100', '100.5' or '1e3'
+
+    :param value: (str) the number
+    :return: the number, an int if it is integral
+    :raises ValueError: if the value is not a number
+    """
+    try:
+        return int(value)
+    except ValueError:
+        number = float(value)
+        return int(number) if number.is_integer() else number
+
+
+def read_variants(csv_file_name, name_field='name'):
+    """Reads the template variants of the accounts from a CSV file
+
+    :param csv_file_name: (str) the name of a CSV file with a header row and the columns 'name'
+        (used as the output file name) and the AlertingTemplateVariant fields. Empty values are
+        left to their defaults.
+    :param name_field: (str) the column naming the variant instead of 'name' (e.g. 'account_id')
+    :return: a generator yielding (name, AlertingTemplateVariant object) tuples
+    """
+    with open(csv_file_name, newline='', encoding='utf-8') as csv_file:
+        for row in csv.DictReader(csv_file):
+            kwargs = {}
+            for field, value in row.items():
+                if field == name_field or value == '':
+                    continue
+                if field in ('monthly_budget', 'actual_threshold', 'forecasted_threshold'):
+                    value = _parse_number(value)
+                kwargs[field] = value
+            yield row[name_field], AlertingTemplateVariant(**kwargs)
 
 
 def main():
     """Main entry point
     """
-    if len(sys.argv) != 1:
-        print("usage: {}".format(os.path.basename(__file__)))
-        print('prints a CloudFormation template')
-        sys.exit(1)
-    print(get_alerting_cf_template())
+    parser = argparse.ArgumentParser(description='prints a CloudFormation template')
+    parser.add_argument('--single-router', action='store_true',
+                        help='use a single Lambda function for actual and forecasted alerts')
+    parser.add_argument('--performance-profile', default=DEFAULT_PERFORMANCE_PROFILE,
+                        choices=sorted(LAMBDA_PERFORMANCE_PROFILES),
+                        help='the performance profile of the Lambda functions')
+    parser.add_argument('--inline-code', metavar='FILE',
+                        help='self-contained handler file to define inline in the template, no '
+                             'larger than {} bytes, e.g. lambda-src/inline.js'.format(
+                                 LAMBDA_INLINE_CODE_MAX_SIZE))
+    parser.add_argument('--bulk', action='store_true',
+                        help='build the template in bulk mode, validating it in a single pass, and '
+                             'log the time taken by each phase')
+    parser.add_argument('--output', metavar='FILE',
+                        help='file the template is written to, one resource at a time, as JSON if '
+                             'its name ends with .json, as YAML otherwise')
+    parser.add_argument('--variants', metavar='CSV',
+                        help='CSV file with the budget name and parameter defaults of many '
+                             'accounts, to write one template per account to --output-dir. The '
+                             'webhook URL columns are ignored, they are deploy-time overrides')
+    parser.add_argument('--output-dir', default='.',
+                        help='directory the templates of the --variants accounts are written to')
+    parser.add_argument('--batch-size', type=int,
+                        help='buffer the notifications of every topic in an SQS queue, with a '
+                             'dead-letter queue, and send them to the Lambda functions in batches '
+                             'of up to this size')
+    parser.add_argument('--batching-window', type=int,
+                        default=AlertBatching.maximum_batching_window,
+                        help='maximum time the notifications are buffered (in seconds)')
+    parser.add_argument('--max-receive-count', type=int, default=AlertBatching.max_receive_count,
+                        help='number of attempts at posting a notification before it is moved to '
+                             'the dead-letter queue')
+    parser.add_argument('--topology', default=STANDALONE_TOPOLOGY, choices=TEMPLATE_TOPOLOGIES,
+                        help='hub for the template of the account hosting the alert topics and '
+                             'Lambda functions of a hub-and-spoke deployment, spoke for the '
+                             'budget-only templates of its member accounts')
+    args = parser.parse_args()
+    if args.output is not None and (args.variants is not None or args.bulk):
+        # the template is streamed to --output resource by resource, for a single template
+        parser.error('--output can not be combined with --variants or --bulk')
+    if args.bulk:
+        logging.basicConfig(level=logging.INFO)
+    batching = None if args.batch_size is None else AlertBatching(
+        batch_size=args.batch_size, maximum_batching_window=args.batching_window,
+        max_receive_count=args.max_receive_count)
+    if args.output is not None:
+        write_template(build_topology_template(topology=args.topology,
+                                               single_router=args.single_router,
+                                               performance_profile=args.performance_profile,
+                                               inline_code_file=args.inline_code,
+                                               batching=batching), args.output)
+        return
+    if args.variants is None:
+        print(get_alerting_cf_template(single_router=args.single_router,
+                                       performance_profile=args.performance_profile,
+                                       inline_code_file=args.inline_code, bulk=args.bulk,
+                                       topology=args.topology, batching=batching))
+        return
+    variants = list(read_variants(args.variants))
+    if args.topology != STANDALONE_TOPOLOGY:
+        for name, variant in variants:
+            with open(path.join(args.output_dir, name + '.yaml'), 'w',
+                      encoding='utf-8') as template_file:
+                template_file.write(build_topology_template(
+                    topology=args.topology, single_router=args.single_router,
+                    performance_profile=args.performance_profile,
+                    inline_code_file=args.inline_code, variant=variant,
+                    batching=batching).to_yaml())
+        return
+    skeleton = AlertingTemplateSkeleton(single_router=args.single_router,
+                                        performance_profile=args.performance_profile,
+                                        inline_code_file=args.inline_code, batching=batching)
+    for name, variant in variants:
+        with open(path.join(args.output_dir, name + '.yaml'), 'w',
+                  encoding='utf-8') as template_file:
+            template_file.write(skeleton.render(variant))
 
 
 if __name__ == "__main__":
@@ -5,6 +5,7 @@ import sys
 import os
 from troposphere import Template, Parameter, Ref, Join
 from troposphere import iam
+from bulk_build import build_template
 
 
 class AlertingCreationRoleTemplate(Template):
@@ -173,6 +174,17 @@ class AlertingCreationRoleTemplate(Template):
             ],
         ))
 
+
+def get_cf_template(bulk=False):
+    """Generates the CloudFormation template containing the role allowing to manage the resources
+    required for AWS Budget alerting
+
+    :param bulk: (bool) if True, the template is built in bulk mode, see bulk_build
+    :return: a string containing the CloudFormation template
+    """
+    return build_template(AlertingCreationRoleTemplate, bulk=bulk)[0]
+
+
 def main():
     """Main entry point
     """
@@ -183,7 +195,7 @@ def main():
             'resources'
         )
         sys.exit(1)
-    print(AlertingCreationRoleTemplate().to_yaml())
+    print(get_cf_template())
 
 
 if __name__ == "__main__":
@@ -0,0 +1,229 @@
+"""Module detecting anomalies in the daily spend of AWS accounts and services.
+Budget alerts only fire once a fixed percentage of the monthly limit has been reached, so a sudden
+spike early in the month can go unnoticed for days. This module keeps rolling statistics for every
+(account, service) daily spend series and flags days where the spend deviates sharply from what
+has been observed so far.
+"""
+
+from os import path, environ
+from dataclasses import dataclass
+from datetime import date, timedelta
+from itertools import groupby
+import math
+import sys
+import logging
+import boto3
+from aws_budget_notification_sinks import dispatch, load_sinks
+
+
+@dataclass
+class SpendAnomaly:
+    """Class specifying information about an anomalous daily spend
+    """
+    day: str  # the day the spend was incurred on (YYYY-MM-DD)
+    account_id: str  # the AWS account the spend is associated with
+    service: str  # the AWS service the spend is associated with
+    amount: float  # the spend for the day
+    expected_amount: float  # the rolling mean of the series before this day
+    severity: float  # number of rolling standard deviations the spend is above the mean
+
+    @property
+    def message(self):
+        """A human-readable description of the anomaly
+        """
+        return f"{self.service} spend for account {self.account_id} on {self.day} " \
+               f"({self.amount:.2f}) is {self.severity:.1f} standard deviations above the " \
+               f"expected spend ({self.expected_amount:.2f})"
+
+
+class _SeriesStatistics:  # pylint: disable=too-few-public-methods
+    """Rolling statistics for a single daily spend series, using constant memory.
+
+    The mean and variance are updated with an exponentially weighted moving average. The smoothing
+    factor is max(alpha, 1/count), so the first observations are weighted equally (which is
+    Welford's algorithm) until enough history has been gathered for the EWMA to take over.
+    """
+    __slots__ = ('count', 'mean', 'variance')
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.variance = 0.0
+
+    def update(self, amount, alpha):
+        """Adds an observation to the statistics
+
+        :param amount: (float) the observed daily spend
+        :param alpha: (float) the EWMA smoothing factor
+        :return: None
+        """
+        self.count += 1
+        weight = max(alpha, 1 / self.count)
+        diff = amount - self.mean
+        increment = weight * diff
+        self.mean += increment
+        self.variance = (1 - weight) * (self.variance + diff * increment)
+
+
+class SpendAnomalyDetector:
+    """Class detecting anomalies in daily spend series, one series per (account, service).
+    """
+
+    def __init__(self, alpha=0.1, severity_threshold=4.0,  # pylint: disable=too-many-arguments
+                 min_periods=7, min_amount=1.0, min_relative_deviation=0.1):
+        """Constructor
+
+        :param alpha: (float) the EWMA smoothing factor, higher values forget history faster
+        :param severity_threshold: (float) the number of standard deviations above the rolling mean
+            from which a spend is flagged as an anomaly
+        :param min_periods: (int) the number of observations required before a series is checked
+        :param min_amount: (float) daily spends below this amount (in USD) are never flagged
+        :param min_relative_deviation: (float) the standard deviation used to compute the severity
+            is at least this fraction of the mean, so that flat series don't flag small changes
+        """
+        self.alpha = alpha
+        self.severity_threshold = severity_threshold
+        self.min_periods = min_periods
+        self.min_amount = min_amount
+        self.min_relative_deviation = min_relative_deviation
+        self.series = {}
+
+    def process_day(self, day, amounts):
+        """Scores a day of spend against the statistics gathered so far, then updates them
+
+        :param day: (str) the day the spend was incurred on (YYYY-MM-DD)
+        :param amounts: (dict) the spend for the day, keyed by (account_id, service)
+        :return: (list) the SpendAnomaly objects flagged for the day, most severe first
+        """
+        anomalies = []
+        alpha = self.alpha
+        for key, amount in amounts.items():
+            stats = self.series.get(key)
+            if stats is None:
+                stats = self.series[key] = _SeriesStatistics()
+            elif stats.count >= self.min_periods and amount >= self.min_amount:
+                deviation = max(math.sqrt(stats.variance),
+                                self.min_relative_deviation * stats.mean, sys.float_info.epsilon)
+                severity = (amount - stats.mean) / deviation
+                if severity >= self.severity_threshold:
+                    anomalies.append(SpendAnomaly(day=day, account_id=key[0], service=key[1],
+                                                  amount=amount, expected_amount=stats.mean,
+                                                  severity=severity))
+            stats.update(amount, alpha)
+        anomalies.sort(key=lambda anomaly: anomaly.severity, reverse=True)
+        return anomalies
+
+    def process(self, daily_spend):
+        """Processes a stream of daily spend records
+
+        :param daily_spend: an iterable of (day, account_id, service, amount) tuples, ordered by day
+        :return: a generator yielding the SpendAnomaly objects flagged, day by day
+        """
+        for day, records in groupby(daily_spend, key=lambda record: record[0]):
+            amounts = {}
+            for _, account_id, service, amount in records:
+                key = (account_id, service)
+                amounts[key] = amounts.get(key, 0.0) + amount
+            yield from self.process_day(day, amounts)
+
+
+def get_daily_spend(ce_client, start, end):
+    """Gets the daily spend per linked account and service from AWS Cost Explorer
+
+    :param ce_client: (boto3.client) 'ce' boto3 client
+    :param start: (str) the first day to get the spend for (YYYY-MM-DD)
+    :param end: (str) the day after the last day to get the spend for (YYYY-MM-DD)
+    :return: a generator yielding (day, account_id, service, amount) tuples, ordered by day
+    """
+    kwargs = {
+        'TimePeriod': {'Start': start, 'End': end},
+        'Granularity': 'DAILY',
+        'Metrics': ['UnblendedCost'],
+        'GroupBy': [
+            {'Type': 'DIMENSION', 'Key': 'LINKED_ACCOUNT'},
+            {'Type': 'DIMENSION', 'Key': 'SERVICE'},
+        ],
+    }
+    while True:
+        response = ce_client.get_cost_and_usage(**kwargs)
+        for result in response['ResultsByTime']:
+            day = result['TimePeriod']['Start']
+            for group in result['Groups']:
+                account_id, service = group['Keys']
+                yield (day, account_id, service,
+                       float(group['Metrics']['UnblendedCost']['Amount']))
+        if not response.get('NextPageToken'):
+            return
+        kwargs['NextPageToken'] = response['NextPageToken']
+
+
+def check_spend_anomalies(ce_client, days, detector):
+    """Replays the daily spend of the last days and reports the anomalies of the most recent day
+
+    :param ce_client: (boto3.client) 'ce' boto3 client
+    :param days: (int) the number of days of history to replay
+    :param detector: (SpendAnomalyDetector) the detector to use
+    :return: (list) the SpendAnomaly objects flagged for the most recent day
+    """
+    today = date.today()
+    last_day = (today - timedelta(days=1)).isoformat()
+    anomalies = [anomaly for anomaly in detector.process(get_daily_spend(
+        ce_client,
+        start=(today - timedelta(days=days)).isoformat(),
+        end=today.isoformat(),
+    )) if anomaly.day == last_day]
+    for anomaly in anomalies:
+        logging.warning("warning: %s", anomaly.message)
+    return anomalies
+
+
+def usage():
+    """prints the script's usage
+
+    :return: None
+    """
+
+    print(
+        f"usage: {path.basename(__file__)} DAYS [SEVERITY_THRESHOLD]\n"
+        f"Replays the daily spend per account and service over the last DAYS days and checks the\n"
+        f"spend of the most recent day for anomalies.\n"
+        f"The check fails if any anomaly is found.\n"
+        f"\n"
+        f"where:\n"
+        f"\n"
+        f"DAYS is the number of days of spend history to replay\n"
+        f"SEVERITY_THRESHOLD is the number of standard deviations above the expected spend from\n"
+        f"    which a daily spend is reported (default: 4)\n"
+        f"\n"
+        f"If the SINKS_CONFIG environment variable is set to a JSON file describing notification\n"
+        f"sinks, the anomalies found are also sent to these sinks.\n"
+    )
+
+
+def main():
+    """Main entry point
+    """
+    if len(sys.argv) not in (2, 3):
+        usage()
+        sys.exit(-1)
+    days = int(sys.argv[1])
+    detector = SpendAnomalyDetector()
+    if len(sys.argv) == 3:
+        detector.severity_threshold = float(sys.argv[2])
+
+    if logging.getLogger(__name__).level > logging.INFO:
+        logging.basicConfig(level=logging.INFO)
+
+    anomalies = check_spend_anomalies(boto3.client('ce'), days, detector)
+    logging.info("spend anomaly check passed: %s", not anomalies)
+    if 'SINKS_CONFIG' in environ:
+        logging.info("anomalies sent to sinks (delivered, failed): %s",
+                     dispatch(anomalies, load_sinks(environ['SINKS_CONFIG'])))
+    if anomalies:
+        sys.exit(1)
+    else:
+        sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,25 @@
 """Module checking that budget and threshold parameters are valid.
 If the actual and forecasted trigger thresholds are below the actual budget, alerting will never
 occur.
+Budgets are evaluated over their current period (day, month, quarter, year or custom time period),
+in batches: the elapsed fraction of the period of every budget is computed at once, and budgets
+without a forecast from AWS are checked against their spend projected to the end of the period.
+Optionally, budgets whose actual spend is ahead of their limit prorated over the elapsed fraction of
+the period are reported too.
 """
 
-from os import path
+from os import path, environ
 from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
 import sys
 import logging
 import boto3
+import numpy
+from aws_budget_notification_sinks import dispatch, load_sinks
+
+TIME_UNITS = ('DAILY', 'MONTHLY', 'QUARTERLY', 'ANNUALLY', 'CUSTOM')
+# minimum elapsed fraction of a period, about a day of a month
+MIN_ELAPSED_FRACTION = 1 / 31
 
 
 class InvalidPercentageException(Exception):
@@ -21,7 +33,197 @@ class Budget:
     """
     limit_amount: float  # budget limit amount
     calculated_actual_spend: float
-    calculated_forecasted_spend: float
+    calculated_forecasted_spend: float  # None if AWS doesn't forecast the spend of the budget
+    time_unit: str = 'MONTHLY'  # one of TIME_UNITS
+    period_start: float = None  # start of the time period of the budget (POSIX timestamp)
+    period_end: float = None  # end of the time period of the budget (POSIX timestamp)
+
+
+@dataclass
+class BudgetEvaluation:
+    """Class specifying the evaluation of a batch of budgets over their current period, with an
+    array item per budget
+    """
+    elapsed_fraction: numpy.ndarray  # fraction of the current period elapsed
+    expected_spend: numpy.ndarray  # budget limit prorated by the elapsed fraction of the period
+    projected_spend: numpy.ndarray  # spend at the end of the period at the current spend rate
+    forecasted_spend: numpy.ndarray  # forecast of AWS, the projected spend if there is none
+
+
+@dataclass
+class ThresholdFinding:
+    """Class specifying a threshold that is too low to trigger an alert in the current period, or
+    a budget whose actual spend is ahead of its prorated pace ('PACE' notification type)
+    """
+    account_id: str  # the AWS account the budget belongs to
+    budget_name: str
+    notification_type: str  # 'ACTUAL', 'FORECASTED' or 'PACE'
+    threshold_trigger: float  # the amount above which the alert is triggered
+    calculated_spend: float  # the actual or forecasted spend calculated by AWS
+
+    @property
+    def message(self):
+        """A human-readable description of the finding
+        """
+        if self.notification_type == 'PACE':
+            return f"calculated actual spend ({self.calculated_spend}) > prorated budget pace " \
+                   f"({self.threshold_trigger}) for budget '{self.budget_name}' in account " \
+                   f"{self.account_id}"
+        return f"{self.notification_type.lower()} threshold trigger ({self.threshold_trigger}) < " \
+               f"calculated {self.notification_type.lower()} spend ({self.calculated_spend}) for " \
+               f"budget '{self.budget_name}' in account {self.account_id}"
+
+
+def _add_months(start, months):
+    """Adds months to the start of a month
+
+    :param start: (datetime) the first day of a month
+    :param months: (int) the number of months to add
+    :return: (datetime) the first day of the resulting month
+    """
+    month_index = start.month - 1 + months
+    return start.replace(year=start.year + month_index // 12, month=month_index % 12 + 1)
+
+
+def get_period_bounds(now):
+    """Gets the bounds of the current period of every time unit
+
+    :param now: (datetime) the current time, timezone-aware
+    :return: (numpy.ndarray) a (len(TIME_UNITS), 2) matrix of the start and end (POSIX timestamps)
+        of the current period of each time unit, the custom periods being unbounded
+    """
+    day = datetime(now.year, now.month, now.day, tzinfo=timezone.utc)
+    month = day.replace(day=1)
+    quarter = month.replace(month=(month.month - 1) // 3 * 3 + 1)
+    year = month.replace(month=1)
+    return numpy.array([
+        [day.timestamp(), (day + timedelta(days=1)).timestamp()],
+        [month.timestamp(), _add_months(month, 1).timestamp()],
+        [quarter.timestamp(), _add_months(quarter, 3).timestamp()],
+        [year.timestamp(), _add_months(year, 12).timestamp()],
+        [-numpy.inf, numpy.inf],
+    ])
+
+
+def evaluate_budgets(budgets, now=None):
+    """Evaluates a batch of budgets over their current period. The period of a budget is the
+    current day, month, quarter or year of its time unit, within the time period of the budget,
+    or its whole time period for custom budgets.
+
+    :param budgets: (list) the Budget objects
+    :param now: (datetime) the current time, timezone-aware, now if None
+    :return: a BudgetEvaluation object
+    """
+    now = now or datetime.now(timezone.utc)
+    unit_bounds = get_period_bounds(now)[
+        numpy.array([TIME_UNITS.index(budget.time_unit) for budget in budgets], dtype=int)]
+    values = numpy.array([(budget.limit_amount, budget.calculated_actual_spend,
+                           budget.calculated_forecasted_spend, budget.period_start,
+                           budget.period_end) for budget in budgets], dtype=float).reshape(-1, 5)
+    limit_amount, actual_spend, forecasted_spend, period_start, period_end = values.T
+    # fmax and fmin ignore the missing (NaN) time period bounds
+    start = numpy.fmax(unit_bounds[:, 0], period_start)
+    end = numpy.fmin(unit_bounds[:, 1], period_end)
+    length = end - start
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        # at least a fraction of the period elapsed, so that its first hours don't inflate the
+        # projection
+        elapsed_fraction = numpy.where(
+            numpy.isfinite(length) & (length > 0),
+            numpy.clip((now.timestamp() - start) / length, MIN_ELAPSED_FRACTION, 1.0), 1.0)
+    projected_spend = actual_spend / elapsed_fraction
+    return BudgetEvaluation(
+        elapsed_fraction=elapsed_fraction,
+        expected_spend=limit_amount * elapsed_fraction,
+        projected_spend=projected_spend,
+        forecasted_spend=numpy.where(numpy.isnan(forecasted_spend), projected_spend,
+                                     forecasted_spend),
+    )
+
+
+def get_threshold_findings(  # pylint: disable=too-many-arguments,too-many-locals
+        account_ids, budget_names, budgets, actual_threshold_percentages,
+        forecasted_threshold_percentages, now=None, pace_percentages=None):
+    """Gets the thresholds that are not higher than the spend they are going to be compared to in
+    the current period of their budget, for a batch of budgets, and optionally the budgets whose
+    actual spend is ahead of their prorated pace
+
+    :param account_ids: (list) the AWS account of each budget
+    :param budget_names: (list) the name of each budget
+    :param budgets: (list) the Budget objects
+    :param actual_threshold_percentages: (list) the actual threshold percentage of each budget
+    :param forecasted_threshold_percentages: (list) the forecasted threshold percentage of each
+        budget
+    :param now: (datetime) the current time, timezone-aware, now if None
+    :param pace_percentages: (list) the percentage of its prorated budget (limit times elapsed
+        fraction of the period) the actual spend of each budget may reach, None not to check the
+        pace of the budgets
+    :return: (list) a ThresholdFinding object per threshold too low to result in a trigger, then
+        per budget ahead of its pace
+    :raises InvalidPercentageException: if a percentage is not >0
+    """
+    actual_percentages = numpy.asarray(actual_threshold_percentages, dtype=float)
+    forecasted_percentages = numpy.asarray(forecasted_threshold_percentages, dtype=float)
+    if numpy.any(actual_percentages <= 0):
+        raise InvalidPercentageException(f"actual_threshold_percentage should be >0 (got "
+                                         f"{actual_percentages[actual_percentages <= 0][0]:g})")
+    if numpy.any(forecasted_percentages <= 0):
+        raise InvalidPercentageException(
+            f"forecasted should be >0 (got "
+            f"{forecasted_percentages[forecasted_percentages <= 0][0]:g})")
+    if pace_percentages is not None:
+        pace_percentages = numpy.asarray(pace_percentages, dtype=float)
+        if numpy.any(pace_percentages <= 0):
+            raise InvalidPercentageException(
+                f"pace_percentage should be >0 (got "
+                f"{pace_percentages[pace_percentages <= 0][0]:g})")
+    evaluation = evaluate_budgets(budgets, now)
+    limit_amount = numpy.array([budget.limit_amount for budget in budgets], dtype=float)
+    actual_spend = numpy.array([budget.calculated_actual_spend for budget in budgets],
+                               dtype=float)
+    checks = [('ACTUAL', actual_percentages / 100 * limit_amount, actual_spend),
+              ('FORECASTED', forecasted_percentages / 100 * limit_amount,
+               evaluation.forecasted_spend)]
+    if pace_percentages is not None:
+        checks.append(('PACE', pace_percentages / 100 * evaluation.expected_spend, actual_spend))
+    findings = []
+    for notification_type, triggers, spend in checks:
+        for index in numpy.flatnonzero(triggers < spend):
+            findings.append(ThresholdFinding(
+                account_id=account_ids[index], budget_name=budget_names[index],
+                notification_type=notification_type, threshold_trigger=float(triggers[index]),
+                calculated_spend=float(spend[index])))
+    return findings
+
+
+def _to_timestamp(value):
+    """Converts a timestamp of the Budgets API to a POSIX timestamp
+
+    :param value: the timestamp, a datetime or a number of seconds
+    :return: (float) the POSIX timestamp, None if value is None
+    """
+    if value is None:
+        return None
+    return value.timestamp() if isinstance(value, datetime) else float(value)
+
+
+def get_budget_from_response(budget):
+    """Gets a Budget object from the description of a budget
+
+    :param budget: (dict) the Budget structure returned by budgets.describe_budget()
+    :return: a Budget object
+    """
+    calculated_spend = budget['CalculatedSpend']
+    forecasted_spend = calculated_spend.get('ForecastedSpend')
+    time_period = budget.get('TimePeriod', {})
+    return Budget(limit_amount=float(budget['BudgetLimit']['Amount']),
+                  calculated_actual_spend=float(calculated_spend['ActualSpend']['Amount']),
+                  calculated_forecasted_spend=None if forecasted_spend is None
+                  else float(forecasted_spend['Amount']),
+                  time_unit=budget['TimeUnit'],
+                  period_start=_to_timestamp(time_period.get('Start')),
+                  period_end=_to_timestamp(time_period.get('End')),
+                  )
 
 
 class AwsBudgetThresholdchecker:
@@ -52,29 +254,36 @@ class AwsBudgetThresholdchecker:
         :return: (bool) true if the threshold is high enough to potentially result in a trigger
             if the conditions are met in the current period
         """
+        return not self.get_findings(actual_threshold_percentage, forecasted_threshold_percentage)
+
+    def get_findings(self, actual_threshold_percentage, forecasted_threshold_percentage,
+                     pace_percentage=None):
+        """Gets the thresholds that are not higher than the value they are going to be compared to,
+        as described in check_threshold_trigger(), and whether the budget is ahead of its pace
+
+        :param actual_threshold_percentage: () the actual threshold percentage that should trigger
+            an alert
+        :param forecasted_threshold_percentage: () the forecasted threshold percentage that should
+            trigger an alert
+        :param pace_percentage: () the percentage of the prorated budget the actual spend may
+            reach, None not to check the pace of the budget
+        :return: (list) a ThresholdFinding object per threshold too low to result in a trigger,
+            and if the budget is ahead of its pace
+        """
         budget = self.get_budget()
-        passed = True
-        if actual_threshold_percentage <= 0:
-            raise InvalidPercentageException(f"actual_threshold_percentage should be >0 (got "
-                                             f"{actual_threshold_percentage})")
-        if forecasted_threshold_percentage <= 0:
-            raise InvalidPercentageException(f"forecasted should be >0 (got "
-                                             f"{forecasted_threshold_percentage})")
-        actual_threshold_trigger = actual_threshold_percentage / 100 * budget.limit_amount
-        if actual_threshold_trigger < budget.calculated_actual_spend:
-            passed = False
-            logging.warning("warning: actual threshold trigger (%s) < "
-                            "calculated actual spend (%s)", actual_threshold_trigger,
-                            budget.calculated_actual_spend)
-        forecasted_threshold_trigger = \
-            forecasted_threshold_percentage / 100 * budget.limit_amount
-        if forecasted_threshold_trigger < budget.calculated_forecasted_spend:
-            passed = False
-            logging.warning(
-                "warning: forecasted threshold trigger (%s) < "
-                "calculated forecasted spend (%s)", forecasted_threshold_trigger,
-                budget.calculated_forecasted_spend)
-        return passed
+        findings = get_threshold_findings(
+            [self.account_id], [self.budget_name], [budget], [actual_threshold_percentage],
+            [forecasted_threshold_percentage],
+            pace_percentages=None if pace_percentage is None else [pace_percentage])
+        for finding in findings:
+            if finding.notification_type == 'PACE':
+                logging.warning("warning: calculated actual spend (%s) > prorated budget pace (%s)",
+                                finding.calculated_spend, finding.threshold_trigger)
+                continue
+            logging.warning("warning: %s threshold trigger (%s) < calculated %s spend (%s)",
+                            finding.notification_type.lower(), finding.threshold_trigger,
+                            finding.notification_type.lower(), finding.calculated_spend)
+        return findings
 
     def get_budget(self):
         """Gets info about the AWS Budget we're dealing with
@@ -86,20 +295,16 @@ class AwsBudgetThresholdchecker:
             BudgetName=self.budget_name,
         )
         logging.debug(budget_resp)
-        limit_amount = float(budget_resp['Budget']['BudgetLimit']['Amount'])
-        time_unit = budget_resp['Budget']['TimeUnit']
-        calculated_actual_spend = float(budget_resp['Budget']['CalculatedSpend']
-                                        ['ActualSpend']['Amount'])
-        calculated_forecasted_spend = float(budget_resp['Budget']['CalculatedSpend']
-                                            ['ForecastedSpend']['Amount'])
-        logging.info("budget amount: %s", limit_amount)
-        logging.info("time limit: %s", time_unit)
-        logging.info("calculated actual spend: %s", calculated_actual_spend)
-        logging.info("calculated forecasted spend: %s", calculated_forecasted_spend)
-        return Budget(limit_amount=limit_amount,
-                      calculated_actual_spend=calculated_actual_spend,
-                      calculated_forecasted_spend=calculated_forecasted_spend,
-                      )
+        budget = get_budget_from_response(budget_resp['Budget'])
+        evaluation = evaluate_budgets([budget])
+        logging.info("budget amount: %s", budget.limit_amount)
+        logging.info("time limit: %s", budget.time_unit)
+        logging.info("elapsed fraction of the period: %.3f", evaluation.elapsed_fraction[0])
+        logging.info("calculated actual spend: %s (prorated budget: %.2f)",
+                     budget.calculated_actual_spend, evaluation.expected_spend[0])
+        logging.info("calculated forecasted spend: %s (projected spend: %.2f)",
+                     budget.calculated_forecasted_spend, evaluation.projected_spend[0])
+        return budget
 
 
 def usage():
@@ -110,7 +315,7 @@ def usage():
 
     print(
         f"usage: {path.basename(__file__)} BUDGET_NAME ACTUAL_THRESHOLD_PERCENTAGE FORECASTED_"
-        f"THRESHOLD_PERCENTAGE\n"
+        f"THRESHOLD_PERCENTAGE [PACE_PERCENTAGE]\n"
         f"Checks the values of the budget thresholds against the current and forecasted values.\n"
         f"The checks fail if the thresholds are too low and would never cause an alert in the \n"
         f"current period.\n"
@@ -124,18 +329,24 @@ def usage():
         f"FORECASTED_THRESHOLD_PERCENTAGE is the percentage of the budget that should trigger "
         f"alerts\n"
         f"    for forecasted costs\n"
+        f"PACE_PERCENTAGE, if set, is the percentage of the budget prorated over the elapsed part\n"
+        f"    of the period the actual costs may reach, the check failing if they are ahead of it\n"
+        f"\n"
+        f"If the SINKS_CONFIG environment variable is set to a JSON file describing notification\n"
+        f"sinks, failed checks are also sent to these sinks.\n"
     )
 
 
 def main():
     """Main entry point
     """
-    if len(sys.argv) != 4:
+    if len(sys.argv) not in (4, 5):
         usage()
         sys.exit(-1)
     budget_name = sys.argv[1]
-    actual_threshold_percentage = int(sys.argv[2])
-    forecasted_threshold_percentage = int(sys.argv[3])
+    actual_threshold_percentage = float(sys.argv[2])
+    forecasted_threshold_percentage = float(sys.argv[3])
+    pace_percentage = float(sys.argv[4]) if len(sys.argv) == 5 else None
 
     if logging.getLogger(__name__).level > logging.INFO:
         logging.basicConfig(level=logging.INFO)
@@ -144,18 +355,23 @@ def main():
     budgets_client = boto3.client('budgets')
 
     try:
-        check_passed = AwsBudgetThresholdchecker(
+        findings = AwsBudgetThresholdchecker(
             sts_client=sts_client,
             budgets_client=budgets_client,
             budget_name=budget_name,
-        ).check_threshold_trigger(
+        ).get_findings(
             actual_threshold_percentage=actual_threshold_percentage,
             forecasted_threshold_percentage=forecasted_threshold_percentage,
+            pace_percentage=pace_percentage,
         )
+        check_passed = not findings
         logging.info("threshold check passed: %s", check_passed)
     except InvalidPercentageException as ipe:
         print(str(ipe))
         sys.exit(-2)
+    if 'SINKS_CONFIG' in environ:
+        logging.info("findings sent to sinks (delivered, failed): %s",
+                     dispatch(findings, load_sinks(environ['SINKS_CONFIG'])))
     if check_passed:
         sys.exit(0)
     else:
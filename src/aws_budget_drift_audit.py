@@ -0,0 +1,356 @@
+"""Script auditing the drift of the alerting stack of every account of an organisation, e.g. after
+budget amounts or notification thresholds were edited in the console.
+The drift detection of every stack is started at once with cloudformation.detect_stack_drift(),
+from a pool of threads, then the detections still in progress are polled together, less and less
+often, until they are all done. The drifted resources of a stack are fetched as soon as its
+detection completes, and every account is written to the report as soon as its drift is known,
+changes of budget amounts and thresholds being highlighted.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+import argparse
+import json
+import logging
+import sys
+import threading
+import time
+from botocore.exceptions import BotoCoreError, ClientError
+from aws_budget_fleet_scan import ALERTING_STACK_NAME, INCOMPLETE_EXIT_STATUS, FleetScanner, \
+    add_fleet_arguments
+
+BUDGET_RESOURCE_TYPE = 'AWS::Budgets::Budget'
+BUDGET_AMOUNT_PATH = '/Budget/BudgetLimit/Amount'
+# drift statuses of the resources reported, the others being in sync or not checked
+DRIFTED_RESOURCE_STATUSES = ['MODIFIED', 'DELETED']
+
+
+@dataclass
+class PropertyDrift:
+    """Class specifying a property of a stack resource that differs from the template
+    """
+    logical_resource_id: str
+    resource_type: str
+    property_path: str  # e.g. '/Budget/BudgetLimit/Amount'
+    expected_value: str  # the value in the template, None if the property was added
+    actual_value: str  # the value of the resource, None if the property was removed
+    difference_type: str  # 'ADD', 'REMOVE' or 'NOT_EQUAL'
+    budget_setting: str = None  # 'budget amount' or '<type> threshold', None for other properties
+
+    @property
+    def message(self):
+        """A human-readable description of the difference
+        """
+        setting = self.budget_setting or self.property_path
+        return f"{self.logical_resource_id}, {setting}: {self.expected_value} -> " \
+               f"{self.actual_value}"
+
+
+@dataclass
+class StackDrift:
+    """Class specifying the drift of the alerting stack of an account
+    """
+    account_id: str
+    drift_status: str = None  # 'DRIFTED', 'IN_SYNC', 'UNKNOWN' or 'NOT_CHECKED', None if unknown
+    resource_drifts: dict = field(default_factory=dict)  # logical ID -> drift status
+    property_drifts: list = field(default_factory=list)  # PropertyDrift objects
+    error: str = None  # the reason why the drift could not be detected, None if it was
+
+    @property
+    def budget_drifts(self):
+        """The changes of budget amounts and thresholds
+        """
+        return [drift for drift in self.property_drifts if drift.budget_setting]
+
+
+def get_budget_setting(property_path, expected_properties):
+    """Gets the budget setting a property of a budget resource holds
+
+    :param property_path: (str) the path of the property, e.g.
+        '/NotificationsWithSubscribers/0/Notification/Threshold'
+    :param expected_properties: (dict) the properties of the resource in the template
+    :return: (str) 'budget amount', '<notification type> threshold' (e.g. 'actual threshold'), or
+        None if the property is neither
+    """
+    if property_path == BUDGET_AMOUNT_PATH:
+        return 'budget amount'
+    parts = property_path.strip('/').split('/')
+    if len(parts) != 4 or parts[0] != 'NotificationsWithSubscribers' or \
+            parts[2:] != ['Notification', 'Threshold'] or not parts[1].isdigit():
+        return None
+    try:
+        notification_type = expected_properties['NotificationsWithSubscribers'][int(parts[1])][
+            'Notification']['NotificationType']
+    except (KeyError, IndexError, TypeError):
+        return 'threshold'
+    return f"{notification_type.lower()} threshold"
+
+
+def get_property_drifts(resource_drift):
+    """Gets the properties of a drifted resource that differ from the template
+
+    :param resource_drift: (dict) the drift of the resource, as returned by
+        cloudformation.describe_stack_resource_drifts()
+    :return: (list) the PropertyDrift objects
+    """
+    is_budget = resource_drift['ResourceType'] == BUDGET_RESOURCE_TYPE
+    expected_properties = json.loads(resource_drift.get('ExpectedProperties') or '{}') \
+        if is_budget else {}
+    return [PropertyDrift(
+        logical_resource_id=resource_drift['LogicalResourceId'],
+        resource_type=resource_drift['ResourceType'],
+        property_path=difference['PropertyPath'],
+        expected_value=None if difference['DifferenceType'] == 'ADD'
+        else difference['ExpectedValue'],
+        actual_value=None if difference['DifferenceType'] == 'REMOVE'
+        else difference['ActualValue'],
+        difference_type=difference['DifferenceType'],
+        budget_setting=get_budget_setting(difference['PropertyPath'], expected_properties)
+        if is_budget else None,
+    ) for difference in resource_drift.get('PropertyDifferences', [])]
+
+
+@dataclass
+class DriftAuditReport:
+    """Class specifying the results of a drift audit
+    """
+    accounts: int = 0  # the number of accounts whose drift is known
+    drifted_account_ids: list = field(default_factory=list)
+    budget_drifts: int = 0  # the number of changes of budget amounts and thresholds
+    # (account ID, PropertyDrift object) tuples of every property changed outside of the stacks
+    property_drifts: list = field(default_factory=list)
+    failed_account_ids: list = field(default_factory=list)  # accounts that could not be audited
+    seconds: float = 0.0  # the duration of the audit
+
+    def add(self, stack_drift):
+        """Adds the drift of an account to the report
+
+        :param stack_drift: the StackDrift object
+        :return: None
+        """
+        if stack_drift.error:
+            self.failed_account_ids.append(stack_drift.account_id)
+            return
+        self.accounts += 1
+        if stack_drift.drift_status == 'DRIFTED':
+            self.drifted_account_ids.append(stack_drift.account_id)
+            self.budget_drifts += len(stack_drift.budget_drifts)
+            self.property_drifts.extend((stack_drift.account_id, property_drift)
+                                        for property_drift in stack_drift.property_drifts)
+
+    @property
+    def exit_status(self):
+        """The exit status of the audit: 0 if no stack drifted, 1 if any did, 2 if some accounts
+        were not audited
+        """
+        if self.failed_account_ids:
+            return INCOMPLETE_EXIT_STATUS
+        return 1 if self.drifted_account_ids else 0
+
+    @property
+    def message(self):
+        """A human-readable description of the results
+        """
+        message = f"{self.accounts} stacks audited in {self.seconds:.1f}s, " \
+                  f"{len(self.drifted_account_ids)} drifted with {self.budget_drifts} budget " \
+                  f"amount and threshold changes"
+        if self.failed_account_ids:
+            message += f", {len(self.failed_account_ids)} accounts not audited: " \
+                       f"{', '.join(self.failed_account_ids)}"
+        return message
+
+
+class DriftAuditor:
+    """Class detecting the drift of the alerting stacks of the accounts of an organisation
+    """
+
+    def __init__(self, scanner, stack_name=ALERTING_STACK_NAME,  # pylint: disable=too-many-arguments
+                 concurrency=32, poll_interval=2.0, max_poll_interval=30.0):
+        """Constructor
+
+        :param scanner: the FleetScanner object giving access to the accounts
+        :param stack_name: (str) the name of the alerting stack in every account
+        :param concurrency: (int) the number of calls made at the same time
+        :param poll_interval: (float) the initial time (in seconds) between polls of the
+            detections, doubled after every poll
+        :param max_poll_interval: (float) the maximum time (in seconds) between polls
+        """
+        self.scanner = scanner
+        self.stack_name = stack_name
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        # the role is assumed once per account, the audit being shorter than its credentials
+        self.clients = {}  # account ID -> cloudformation client
+        self.clients_lock = threading.Lock()
+
+    def get_client(self, account_id):
+        """Gets the CloudFormation client of an account
+
+        :param account_id: (str) the account ID
+        :return: the botocore client
+        """
+        with self.clients_lock:
+            client = self.clients.get(account_id)
+        if client is None:
+            client = self.scanner.create_client(
+                'cloudformation', **self.scanner.get_account_credentials(account_id))
+            with self.clients_lock:
+                self.clients[account_id] = client
+        return client
+
+    def start_detection(self, account_id):
+        """Starts the drift detection of the stack of an account
+
+        :param account_id: (str) the account ID
+        :return: (str) the ID of the detection
+        """
+        return self.get_client(account_id).detect_stack_drift(
+            StackName=self.stack_name)['StackDriftDetectionId']
+
+    def get_detection_status(self, account_id, detection_id):
+        """Gets the status of a drift detection
+
+        :param account_id: (str) the account ID
+        :param detection_id: (str) the ID of the detection
+        :return: (dict) the status, as returned by
+            cloudformation.describe_stack_drift_detection_status()
+        """
+        return self.get_client(account_id).describe_stack_drift_detection_status(
+            StackDriftDetectionId=detection_id)
+
+    def get_stack_drift(self, account_id, detection_status):
+        """Gets the drift of the stack of an account once its detection is done
+
+        :param account_id: (str) the account ID
+        :param detection_status: (dict) the final status of the detection
+        :return: the StackDrift object
+        """
+        if detection_status['DetectionStatus'] == 'DETECTION_FAILED':
+            return StackDrift(account_id=account_id,
+                              drift_status=detection_status.get('StackDriftStatus'),
+                              error=detection_status.get('DetectionStatusReason',
+                                                         'drift detection failed'))
+        stack_drift = StackDrift(account_id=account_id,
+                                 drift_status=detection_status['StackDriftStatus'])
+        if stack_drift.drift_status != 'DRIFTED':
+            return stack_drift
+        client = self.get_client(account_id)
+        kwargs = {'StackName': self.stack_name,
+                  'StackResourceDriftStatusFilters': DRIFTED_RESOURCE_STATUSES}
+        while True:
+            response = client.describe_stack_resource_drifts(**kwargs)
+            for resource_drift in response['StackResourceDrifts']:
+                stack_drift.resource_drifts[resource_drift['LogicalResourceId']] = \
+                    resource_drift['StackResourceDriftStatus']
+                stack_drift.property_drifts.extend(get_property_drifts(resource_drift))
+            if not response.get('NextToken'):
+                return stack_drift
+            kwargs['NextToken'] = response['NextToken']
+
+    def _call(self, account_id, method, *args):
+        """Calls a method for an account, turning an error into a failed StackDrift object
+
+        :param account_id: (str) the account ID
+        :param method: the method, taking the account ID and args
+        :param args: the other arguments of the method
+        :return: the result of the method, a StackDrift object with the error if it failed
+        """
+        try:
+            return method(account_id, *args)
+        except (BotoCoreError, ClientError) as error:
+            logging.warning("warning: could not audit account %s: %s", account_id, error)
+            return StackDrift(account_id=account_id, error=str(error))
+
+    def audit(self, account_ids):
+        """Detects the drift of the stacks of many accounts
+
+        :param account_ids: (list) the IDs of the accounts
+        :return: (generator) the StackDrift object of every account, as soon as it is known
+        """
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            detections = {}  # account ID -> detection ID
+            for account_id, result in zip(account_ids, executor.map(
+                    lambda account_id: self._call(account_id, self.start_detection),
+                    account_ids)):
+                if isinstance(result, StackDrift):
+                    yield result
+                else:
+                    detections[account_id] = result
+            logging.info("%d drift detections started", len(detections))
+            interval = self.poll_interval
+            while detections:
+                time.sleep(interval)
+                interval = min(interval * 2, self.max_poll_interval)
+                pending = list(detections.items())
+                statuses = executor.map(lambda detection: self._call(
+                    detection[0], self.get_detection_status, detection[1]), pending)
+                done = []
+                for (account_id, _), status in zip(pending, statuses):
+                    if isinstance(status, StackDrift):
+                        del detections[account_id]
+                        yield status
+                    elif status['DetectionStatus'] != 'DETECTION_IN_PROGRESS':
+                        del detections[account_id]
+                        done.append((account_id, status))
+                logging.info("%d drift detections done, %d in progress", len(done),
+                             len(detections))
+                yield from executor.map(lambda detection: self._call(
+                    detection[0], self.get_stack_drift, detection[1]), done)
+
+
+def run_audit(auditor, account_ids, report_file=None):
+    """Audits the drift of the stacks of many accounts, writing every account to a report file as
+    soon as its drift is known
+
+    :param auditor: the DriftAuditor object
+    :param account_ids: (list) the IDs of the accounts
+    :param report_file: the JSON lines file the drift of every account is written to, open for
+        writing, None for no file
+    :return: a DriftAuditReport object
+    """
+    start = time.monotonic()
+    report = DriftAuditReport()
+    for stack_drift in auditor.audit(account_ids):
+        report.add(stack_drift)
+        if report_file is not None:
+            report_file.write(json.dumps(asdict(stack_drift), sort_keys=True) + '\n')
+            report_file.flush()
+    report.seconds = time.monotonic() - start
+    return report
+
+
+def main():
+    """Main entry point
+    """
+    parser = argparse.ArgumentParser(
+        description='detects the drift of the alerting stack of many accounts, highlighting the '
+                    'budget amounts and thresholds changed outside of the stack')
+    parser.add_argument('--accounts', nargs='+',
+                        help='the accounts to audit (default: every account of the organisation)')
+    parser.add_argument('--output', help='JSON lines file the drift of every account is written to')
+    parser.add_argument('--poll-interval', type=float, default=2.0,
+                        help='initial number of seconds between polls of the drift detections')
+    parser.add_argument('--max-poll-interval', type=float, default=30.0,
+                        help='maximum number of seconds between polls of the drift detections')
+    add_fleet_arguments(parser, 32, 'number of calls made at the same time', stack_name=True)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    scanner = FleetScanner(endpoint_url=args.endpoint_url, role_name=args.role_name)
+    auditor = DriftAuditor(scanner, args.stack_name, args.concurrency, args.poll_interval,
+                           args.max_poll_interval)
+    account_ids = args.accounts or scanner.list_account_ids()
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as report_file:
+            report = run_audit(auditor, account_ids, report_file)
+    else:
+        report = run_audit(auditor, account_ids)
+    for account_id, property_drift in report.property_drifts:
+        print(f"account {account_id}, {property_drift.message}")
+    print(report.message)
+    sys.exit(report.exit_status)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1028 @@
+"""Module providing a local HTTP stand-in for the AWS STS, Budgets, Organizations and
+CloudFormation APIs, seeded with a generated fleet of accounts, for load testing the budget checks
+and the fleet-wide tools without touching AWS.
+boto3 clients are pointed at the server with endpoint_url. The server identifies the account a
+request is made from by the access key signing it: the credentials returned by AssumeRole carry the
+account ID, any other credentials are those of the management account.
+Latency, server errors and throttling can be injected to reproduce the behaviour of the real APIs
+under load. Stack set operations deploy their instances over time, in batches of their maximum
+concurrency, and the instances of chosen accounts can be made to fail. Stack drift detections
+complete after a delay, and compare the parameters of the alerting stack with its budget. The
+accounts can be placed in a hierarchy of organizational units, see
+generate_organizational_units().
+"""
+# pylint: disable=too-many-lines
+
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+from xml.sax.saxutils import escape
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from aws_budget_fleet_scan import ALERTING_STACK_NAME, THRESHOLD_PARAMETERS
+
+MANAGEMENT_ACCOUNT_ID = '000000000000'
+ROOT_ID = 'r-fake'
+ACCESS_KEY_PREFIX = 'FAKE'
+CREDENTIAL_PATTERN = re.compile(r'Credential=([^/]+)/')
+ROLE_ARN_PATTERN = re.compile(r'^arn:aws:iam::(\d{12}):role/(.+)$')
+STS_NAMESPACE = 'https://sts.amazonaws.com/doc/2011-06-15/'
+
+
+class FakeAwsError(Exception):
+    """Exception returned to the client as an AWS error response
+    """
+
+    def __init__(self, status, code, message):
+        """Constructor
+
+        :param status: (int) the HTTP status
+        :param code: (str) the AWS error code (e.g. 'ThrottlingException')
+        :param message: (str) the error message
+        """
+        Exception.__init__(self, message)
+        self.status = status
+        self.code = code
+        self.message = message
+
+
+@dataclass
+class FakeBudget:
+    """Class specifying a budget of a fake account
+    """
+    name: str
+    limit_amount: float
+    actual_spend: float
+    forecasted_spend: float
+    time_unit: str = 'MONTHLY'
+    thresholds: dict = field(default_factory=dict)  # notification type -> threshold (percentage)
+
+
+@dataclass
+class FakeStack:
+    """Class specifying a CloudFormation stack of a fake account, managing a budget
+    """
+    name: str
+    budget_name: str  # the name of the budget created by the stack
+    parameters: dict = field(default_factory=dict)  # parameter key -> value
+    status: str = 'CREATE_COMPLETE'
+
+
+@dataclass
+class FakeStackInstance:
+    """Class specifying a stack instance of a fake stack set
+    """
+    account_id: str
+    region: str
+    operation_id: str  # the last operation on the instance
+    detailed_status: str = 'PENDING'  # PENDING, RUNNING, SUCCEEDED, FAILED or CANCELLED
+    parameter_overrides: dict = field(default_factory=dict)  # parameter key -> value
+
+
+@dataclass
+class FakeStackSetOperation:
+    """Class specifying an operation deploying the instances of a fake stack set
+    """
+    operation_id: str
+    action: str  # 'CREATE' or 'UPDATE'
+    start: float  # the time the operation started (time.monotonic())
+    instances: list  # the FakeStackInstance objects deployed, in order
+    max_concurrent_percentage: float = 100.0
+    failure_tolerance_percentage: float = 0.0
+    status: str = 'RUNNING'  # RUNNING, SUCCEEDED or FAILED
+
+
+@dataclass
+class FakeStackSet:
+    """Class specifying a stack set of the management account
+    """
+    name: str
+    template_body: str
+    parameters: dict = field(default_factory=dict)  # parameter key -> value
+    instances: dict = field(default_factory=dict)  # (account ID, region) -> FakeStackInstance
+    operations: dict = field(default_factory=dict)  # operation ID -> FakeStackSetOperation
+
+
+@dataclass
+class FakeDriftDetection:
+    """Class specifying a drift detection of a fake stack
+    """
+    detection_id: str
+    account_id: str
+    stack_name: str
+    start: float  # the time the detection started (time.monotonic())
+
+
+@dataclass
+class FakeAccount:
+    """Class specifying a fake AWS account
+    """
+    account_id: str
+    name: str
+    budgets: dict = field(default_factory=dict)  # budget name -> FakeBudget
+    stacks: dict = field(default_factory=dict)  # stack name -> FakeStack
+    parent_id: str = ROOT_ID  # the ID of the root or organizational unit of the account
+
+
+@dataclass
+class FakeOrganizationalUnit:
+    """Class specifying an organizational unit of the fake organisation
+    """
+    ou_id: str
+    name: str
+    parent_id: str  # the ID of the root or organizational unit the unit belongs to
+
+
+def generate_fleet(account_count, budgets_per_account=1, seed=0, drift_rate=0.0):
+    """Generates a fleet of fake accounts, each with a 'Monthly Budget' created by a
+    'budget-alerts' stack and more budgets if requested. Some accounts have spent, or are
+    forecasted to spend, more than their thresholds.
+
+    :param account_count: (int) the number of accounts
+    :param budgets_per_account: (int) the number of budgets of every account
+    :param seed: (int) the seed of the random generator, the same seed generates the same fleet
+    :param drift_rate: (float) the fraction of accounts whose budget amount or actual threshold
+        was edited outside of their stack
+    :return: (dict) the FakeAccount objects keyed by account ID
+    """
+    generator = random.Random(seed)
+    # a generator of its own, so that the budgets don't depend on the drift rate
+    drift_generator = random.Random(seed + 1)
+    fleet = {}
+    for index in range(account_count):
+        account_id = f"{100000000000 + index:012d}"
+        account = FakeAccount(account_id=account_id, name=f"account-{index}")
+        for budget_index in range(budgets_per_account):
+            name = 'Monthly Budget' if budget_index == 0 else f"Budget {budget_index}"
+            limit_amount = float(generator.randrange(100, 10000, 50))
+            actual_spend = round(limit_amount * generator.uniform(0.0, 1.2), 2)
+            account.budgets[name] = FakeBudget(
+                name=name, limit_amount=limit_amount, actual_spend=actual_spend,
+                forecasted_spend=round(actual_spend * generator.uniform(1.0, 1.5), 2),
+                thresholds={'ACTUAL': 80.0, 'FORECASTED': 100.0})
+        budget = account.budgets['Monthly Budget']
+        account.stacks[ALERTING_STACK_NAME] = FakeStack(
+            name=ALERTING_STACK_NAME, budget_name=budget.name, parameters={
+                'MonthlyBudget': f"{budget.limit_amount:g}",
+                'MessagePrefix': '',
+                'ActualCostWebHookUrl': 'https://hooks.example.com/actual',
+                'ActualThreshold': f"{budget.thresholds['ACTUAL']:g}",
+                'ForecastedCostWebHookUrl': 'https://hooks.example.com/forecasted',
+                'ForecastedThreshold': f"{budget.thresholds['FORECASTED']:g}",
+            })
+        if drift_generator.random() < drift_rate:
+            if drift_generator.random() < 0.5:
+                budget.limit_amount += 500.0
+            else:
+                budget.thresholds['ACTUAL'] = 90.0
+        fleet[account_id] = account
+    return fleet
+
+
+def generate_organizational_units(fleet, depth=2, fanout=3, seed=0):
+    """Generates a hierarchy of organizational units under the root of the organisation, and moves
+    every account of a fleet to one of them, or leaves it in the root
+
+    :param fleet: (dict) the FakeAccount objects keyed by account ID, see generate_fleet()
+    :param depth: (int) the number of levels of organizational units
+    :param fanout: (int) the number of children of the root and of every unit but the deepest
+    :param seed: (int) the seed of the random generator placing the accounts
+    :return: (dict) the FakeOrganizationalUnit objects keyed by ID, to set as the
+        organizational_units of the FakeAwsServer
+    """
+    generator = random.Random(seed)
+    units = {}
+    parents = [(ROOT_ID, '')]
+    for _ in range(depth):
+        children = []
+        for parent_id, parent_suffix in parents:
+            for index in range(1, fanout + 1):
+                suffix = f"{parent_suffix}-{index}"
+                unit = FakeOrganizationalUnit(ou_id=f"ou-fake-{len(units):08d}",
+                                              name=f"unit{suffix}", parent_id=parent_id)
+                units[unit.ou_id] = unit
+                children.append((unit.ou_id, suffix))
+        parents = children
+    parent_ids = [ROOT_ID] + list(units)
+    for account in fleet.values():
+        account.parent_id = generator.choice(parent_ids)
+    return units
+
+
+class _FakeAwsRequestHandler(BaseHTTPRequestHandler):
+    """Request handler of the fake AWS APIs, for the JSON (Budgets, Organizations) and query (STS,
+    CloudFormation) protocols
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """Handles an API call
+        """
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8')
+        target = self.headers.get('X-Amz-Target')
+        if target:
+            action = target.rpartition('.')[2]
+            params = json.loads(body or '{}')
+        else:
+            params = {key: values[0] for key, values in parse_qs(body).items()}
+            action = params.get('Action', '')
+        try:
+            result = self.server.call(action, params, self.headers.get('Authorization', ''))
+            status = 200
+            if target:
+                response = json.dumps(result)
+            else:
+                response = f'<{action}Response xmlns="{STS_NAMESPACE}"><{action}Result>' \
+                           f'{result}</{action}Result><ResponseMetadata><RequestId>' \
+                           f'{uuid.uuid4()}</RequestId></ResponseMetadata></{action}Response>'
+        except FakeAwsError as error:
+            status = error.status
+            if target:
+                response = json.dumps({'__type': error.code, 'message': error.message})
+            else:
+                response = f'<ErrorResponse xmlns="{STS_NAMESPACE}"><Error><Type>Sender</Type>' \
+                           f'<Code>{error.code}</Code><Message>{escape(error.message)}</Message>' \
+                           f'</Error><RequestId>{uuid.uuid4()}</RequestId></ErrorResponse>'
+        response_body = response.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/x-amz-json-1.1' if target else 'text/xml')
+        self.send_header('Content-Length', str(len(response_body)))
+        self.send_header('x-amzn-RequestId', str(uuid.uuid4()))
+        self.end_headers()
+        self.wfile.write(response_body)
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        """Silences the request logging
+        """
+
+
+class FakeAwsServer(ThreadingHTTPServer):  # pylint: disable=too-many-instance-attributes,too-many-public-methods
+    """Local HTTP server standing in for the AWS STS, Budgets, Organizations and CloudFormation
+    APIs.
+    Use it as a context manager to start and stop it, and pass its url as the endpoint_url of the
+    boto3 clients.
+    """
+    daemon_threads = True
+    # actions of the query protocol APIs, whose throttling error code is 'Throttling'
+    QUERY_ACTIONS = {'GetCallerIdentity', 'AssumeRole', 'DescribeStacks', 'DescribeStackResource',
+                     'UpdateStack', 'CreateStackSet', 'DescribeStackSet', 'UpdateStackSet',
+                     'CreateStackInstances', 'UpdateStackInstances', 'DescribeStackSetOperation',
+                     'ListStackInstances', 'DetectStackDrift',
+                     'DescribeStackDriftDetectionStatus', 'DescribeStackResourceDrifts'}
+
+    def __init__(self, fleet, latency=0.0, error_rate=0.0,  # pylint: disable=too-many-arguments
+                 throttle_rate=0.0, rate_limit=None, seed=0):
+        """Constructor
+
+        :param fleet: (dict) the FakeAccount objects keyed by account ID, see generate_fleet()
+        :param latency: (float) the mean time (in seconds) taken by every call, the actual time
+            being uniformly distributed between 0.5x and 1.5x the mean
+        :param error_rate: (float) the fraction of calls failing with an internal error
+        :param throttle_rate: (float) the fraction of calls throttled at random
+        :param rate_limit: (float) the number of calls per second per action above which calls are
+            throttled, None for no limit
+        :param seed: (int) the seed of the random generator used to inject latency and errors
+        """
+        ThreadingHTTPServer.__init__(self, ('127.0.0.1', 0), _FakeAwsRequestHandler)
+        self.fleet = fleet
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.rate_limit = rate_limit
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.buckets = {}  # action -> [tokens, last refill time]
+        self.stats = {}  # action -> {'calls': n, 'throttled': n, 'errors': n}
+        self.thread = None
+        self.stack_sets = {}  # stack set name -> FakeStackSet
+        self.stack_instance_seconds = 0.05  # time taken to deploy a batch of stack instances
+        self.failing_stack_instances = set()  # accounts whose stack instances fail to deploy
+        self.drift_detections = {}  # detection ID -> FakeDriftDetection
+        self.drift_detection_seconds = 0.05  # time taken to detect the drift of a stack
+        self.organizational_units = {}  # ID -> FakeOrganizationalUnit
+        self.actions = {
+            'GetCallerIdentity': self.get_caller_identity,
+            'AssumeRole': self.assume_role,
+            'ListAccounts': self.list_accounts,
+            'ListRoots': self.list_roots,
+            'ListOrganizationalUnitsForParent': self.list_organizational_units_for_parent,
+            'ListAccountsForParent': self.list_accounts_for_parent,
+            'DescribeBudget': self.describe_budget,
+            'DescribeBudgets': self.describe_budgets,
+            'DescribeNotificationsForBudget': self.describe_notifications_for_budget,
+            'UpdateNotification': self.update_notification,
+            'DescribeStacks': self.describe_stacks,
+            'DescribeStackResource': self.describe_stack_resource,
+            'UpdateStack': self.update_stack,
+            'CreateStackSet': self.create_stack_set,
+            'DescribeStackSet': self.describe_stack_set,
+            'UpdateStackSet': self.update_stack_set,
+            'CreateStackInstances': self.create_stack_instances,
+            'UpdateStackInstances': self.update_stack_instances,
+            'DescribeStackSetOperation': self.describe_stack_set_operation,
+            'ListStackInstances': self.list_stack_instances,
+            'DetectStackDrift': self.detect_stack_drift,
+            'DescribeStackDriftDetectionStatus': self.describe_stack_drift_detection_status,
+            'DescribeStackResourceDrifts': self.describe_stack_resource_drifts,
+        }
+
+    @property
+    def url(self):
+        """The endpoint URL of the server
+        """
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+
+    def _count(self, action, outcome):
+        """Counts a call in the statistics, the lock being held
+
+        :param action: (str) the API action
+        :param outcome: (str) 'calls', 'throttled' or 'errors'
+        :return: None
+        """
+        action_stats = self.stats.setdefault(action, {'calls': 0, 'throttled': 0, 'errors': 0})
+        action_stats[outcome] += 1
+
+    def _take_token(self, action, now):
+        """Takes a token from the token bucket of an action, the lock being held
+
+        :param action: (str) the API action
+        :param now: (float) the current time
+        :return: (bool) False if the bucket is empty and the call should be throttled
+        """
+        tokens, last_refill = self.buckets.get(action, (self.rate_limit, now))
+        tokens = min(self.rate_limit, tokens + (now - last_refill) * self.rate_limit)
+        if tokens < 1:
+            self.buckets[action] = (tokens, now)
+            return False
+        self.buckets[action] = (tokens - 1, now)
+        return True
+
+    def call(self, action, params, authorization):
+        """Handles an API call, injecting latency, errors and throttling
+
+        :param action: (str) the API action (e.g. 'DescribeBudget')
+        :param params: (dict) the parameters of the call
+        :param authorization: (str) the Authorization header of the request
+        :return: the result of the call, a dict for the JSON APIs and an XML string for the query
+            APIs
+        :raises FakeAwsError: if the call fails
+        """
+        if action not in self.actions:
+            raise FakeAwsError(400, 'InvalidAction', f"action {action} is not supported")
+        with self.lock:
+            self._count(action, 'calls')
+            delay = self.latency * self.random.uniform(0.5, 1.5)
+            if self.random.random() < self.throttle_rate or \
+                    (self.rate_limit and not self._take_token(action, time.monotonic())):
+                self._count(action, 'throttled')
+                raise FakeAwsError(400, 'Throttling' if action in self.QUERY_ACTIONS
+                                   else 'ThrottlingException', 'Rate exceeded')
+            if self.random.random() < self.error_rate:
+                self._count(action, 'errors')
+                raise FakeAwsError(500, 'InternalFailure', 'injected internal error')
+        if delay:
+            time.sleep(delay)
+        credential = CREDENTIAL_PATTERN.search(authorization)
+        access_key = credential.group(1) if credential else ''
+        account_id = access_key[len(ACCESS_KEY_PREFIX):] \
+            if access_key.startswith(ACCESS_KEY_PREFIX) else MANAGEMENT_ACCOUNT_ID
+        return self.actions[action](account_id, params)
+
+    def _get_budget(self, account_id, params):
+        """Gets the budget a call is about
+
+        :param account_id: (str) the account making the call
+        :param params: (dict) the parameters of the call, with the AccountId and BudgetName
+        :return: the FakeBudget object
+        :raises FakeAwsError: if the account or budget doesn't exist
+        """
+        if params.get('AccountId') != account_id:
+            raise FakeAwsError(400, 'AccessDeniedException',
+                               f"account {account_id} can't access the budgets of account "
+                               f"{params.get('AccountId')}")
+        budget = self.fleet[account_id].budgets.get(params.get('BudgetName')) \
+            if account_id in self.fleet else None
+        if budget is None:
+            raise FakeAwsError(400, 'NotFoundException',
+                               f"Unable to get budget: {params.get('BudgetName')} - the budget "
+                               f"doesn't exist.")
+        return budget
+
+    @staticmethod
+    def _paginate(items, params, key):
+        """Gets a page of results
+
+        :param items: (list) all the results
+        :param params: (dict) the parameters of the call, with the optional NextToken and
+            MaxResults
+        :param key: (str) the key of the results in the response
+        :return: (dict) the response
+        """
+        start = int(params.get('NextToken') or 0)
+        end = start + int(params.get('MaxResults') or 20)
+        response = {key: items[start:end]}
+        if end < len(items):
+            response['NextToken'] = str(end)
+        return response
+
+    # STS
+
+    def get_caller_identity(self, account_id, _):
+        """Handles sts.get_caller_identity()
+        """
+        return f"<Arn>arn:aws:sts::{account_id}:assumed-role/fake/session</Arn>" \
+               f"<UserId>AROAFAKE:session</UserId><Account>{account_id}</Account>"
+
+    def assume_role(self, _, params):
+        """Handles sts.assume_role(), returning credentials identifying the account of the role
+        """
+        match = ROLE_ARN_PATTERN.match(params.get('RoleArn', ''))
+        if not match or match.group(1) not in self.fleet:
+            raise FakeAwsError(403, 'AccessDenied',
+                               f"not authorized to perform sts:AssumeRole on resource "
+                               f"{params.get('RoleArn')}")
+        account_id, role_name = match.groups()
+        expiration = (datetime.now(timezone.utc) + timedelta(hours=1)).strftime(
+            '%Y-%m-%dT%H:%M:%SZ')
+        session_name = escape(params.get('RoleSessionName', 'session'))
+        return f"<Credentials><AccessKeyId>{ACCESS_KEY_PREFIX}{account_id}</AccessKeyId>" \
+               f"<SecretAccessKey>fake</SecretAccessKey><SessionToken>fake</SessionToken>" \
+               f"<Expiration>{expiration}</Expiration></Credentials><AssumedRoleUser>" \
+               f"<AssumedRoleId>AROAFAKE:{session_name}</AssumedRoleId>" \
+               f"<Arn>arn:aws:sts::{account_id}:assumed-role/{escape(role_name)}/" \
+               f"{session_name}</Arn></AssumedRoleUser>"
+
+    # Organizations
+
+    @staticmethod
+    def _account_response(account):
+        """Gets the description of an account
+
+        :param account: the FakeAccount object
+        :return: (dict) the Account structure of the Organizations API
+        """
+        return {
+            'Id': account.account_id,
+            'Arn': f"arn:aws:organizations::{MANAGEMENT_ACCOUNT_ID}:account/o-fake/"
+                   f"{account.account_id}",
+            'Email': f"{account.name}@example.com",
+            'Name': account.name,
+            'Status': 'ACTIVE',
+            'JoinedMethod': 'CREATED',
+            'JoinedTimestamp': 1556668800.0,
+        }
+
+    def _check_parent(self, params):
+        """Checks that the parent a call is about exists
+
+        :param params: (dict) the parameters of the call, with the ParentId
+        :return: (str) the ID of the parent
+        :raises FakeAwsError: if the parent doesn't exist
+        """
+        parent_id = params.get('ParentId')
+        if parent_id != ROOT_ID and parent_id not in self.organizational_units:
+            raise FakeAwsError(400, 'ParentNotFoundException',
+                               f"parent {parent_id} doesn't exist")
+        return parent_id
+
+    def list_accounts(self, _, params):
+        """Handles organizations.list_accounts()
+        """
+        return self._paginate([self._account_response(account) for account in self.fleet.values()],
+                              params, 'Accounts')
+
+    def list_roots(self, _, params):
+        """Handles organizations.list_roots()
+        """
+        return self._paginate([{
+            'Id': ROOT_ID,
+            'Arn': f"arn:aws:organizations::{MANAGEMENT_ACCOUNT_ID}:root/o-fake/{ROOT_ID}",
+            'Name': 'Root',
+            'PolicyTypes': [],
+        }], params, 'Roots')
+
+    def list_organizational_units_for_parent(self, _, params):
+        """Handles organizations.list_organizational_units_for_parent()
+        """
+        parent_id = self._check_parent(params)
+        return self._paginate([{
+            'Id': unit.ou_id,
+            'Arn': f"arn:aws:organizations::{MANAGEMENT_ACCOUNT_ID}:ou/o-fake/{unit.ou_id}",
+            'Name': unit.name,
+        } for unit in self.organizational_units.values() if unit.parent_id == parent_id],
+                              params, 'OrganizationalUnits')
+
+    def list_accounts_for_parent(self, _, params):
+        """Handles organizations.list_accounts_for_parent()
+        """
+        parent_id = self._check_parent(params)
+        return self._paginate([self._account_response(account) for account in self.fleet.values()
+                               if account.parent_id == parent_id], params, 'Accounts')
+
+    # Budgets
+
+    @staticmethod
+    def _budget_response(budget):
+        """Gets the description of a budget
+
+        :param budget: the FakeBudget object
+        :return: (dict) the Budget structure of the Budgets API
+        """
+        return {
+            'BudgetName': budget.name,
+            'BudgetLimit': {'Amount': str(budget.limit_amount), 'Unit': 'USD'},
+            'TimeUnit': budget.time_unit,
+            'TimePeriod': {'Start': 1556668800.0, 'End': 3706473600.0},
+            'CalculatedSpend': {
+                'ActualSpend': {'Amount': str(budget.actual_spend), 'Unit': 'USD'},
+                'ForecastedSpend': {'Amount': str(budget.forecasted_spend), 'Unit': 'USD'},
+            },
+            'BudgetType': 'COST',
+        }
+
+    def describe_budget(self, account_id, params):
+        """Handles budgets.describe_budget()
+        """
+        return {'Budget': self._budget_response(self._get_budget(account_id, params))}
+
+    def describe_budgets(self, account_id, params):
+        """Handles budgets.describe_budgets()
+        """
+        if params.get('AccountId') != account_id or account_id not in self.fleet:
+            raise FakeAwsError(400, 'AccessDeniedException',
+                               f"account {account_id} can't access the budgets of account "
+                               f"{params.get('AccountId')}")
+        return self._paginate([self._budget_response(budget)
+                               for budget in self.fleet[account_id].budgets.values()],
+                              params, 'Budgets')
+
+    def describe_notifications_for_budget(self, account_id, params):
+        """Handles budgets.describe_notifications_for_budget()
+        """
+        budget = self._get_budget(account_id, params)
+        return self._paginate([{
+            'NotificationType': notification_type,
+            'ComparisonOperator': 'GREATER_THAN',
+            'Threshold': threshold,
+            'ThresholdType': 'PERCENTAGE',
+            'NotificationState': 'OK',
+        } for notification_type, threshold in sorted(budget.thresholds.items())],
+                              params, 'Notifications')
+
+    def update_notification(self, account_id, params):
+        """Handles budgets.update_notification()
+        """
+        budget = self._get_budget(account_id, params)
+        old_notification = params.get('OldNotification', {})
+        new_notification = params.get('NewNotification', {})
+        with self.lock:
+            if budget.thresholds.get(old_notification.get('NotificationType')) != \
+                    old_notification.get('Threshold'):
+                raise FakeAwsError(400, 'NotFoundException',
+                                   f"Unable to update notification: the notification of budget "
+                                   f"{budget.name} doesn't exist.")
+            del budget.thresholds[old_notification['NotificationType']]
+            budget.thresholds[new_notification['NotificationType']] = \
+                float(new_notification['Threshold'])
+        return {}
+
+    # CloudFormation
+
+    def _get_stack(self, account_id, params):
+        """Gets the stack a call is about
+
+        :param account_id: (str) the account making the call
+        :param params: (dict) the parameters of the call, with the StackName
+        :return: the FakeStack object
+        :raises FakeAwsError: if the stack doesn't exist
+        """
+        account = self.fleet.get(account_id)
+        stack = account.stacks.get(params.get('StackName')) if account else None
+        if stack is None:
+            raise FakeAwsError(400, 'ValidationError',
+                               f"Stack with id {params.get('StackName')} does not exist")
+        return stack
+
+    @staticmethod
+    def _get_members(params, name):
+        """Gets a list of structures from the parameters of a query protocol call
+
+        :param params: (dict) the parameters of the call (e.g. 'Parameters.member.1.ParameterKey')
+        :param name: (str) the name of the list (e.g. 'Parameters')
+        :return: (list) the structures, as dicts
+        """
+        members = {}
+        for key, value in params.items():
+            parts = key.split('.')
+            if len(parts) == 4 and parts[:2] == [name, 'member']:
+                members.setdefault(int(parts[2]), {})[parts[3]] = value
+        return [members[index] for index in sorted(members)]
+
+    @staticmethod
+    def _stack_id(account_id, stack):
+        """Gets the ID of a stack
+
+        :param account_id: (str) the account of the stack
+        :param stack: the FakeStack object
+        :return: (str) the stack ID
+        """
+        return f"arn:aws:cloudformation:us-east-1:{account_id}:stack/{stack.name}/" \
+               f"{uuid.uuid5(uuid.NAMESPACE_URL, account_id + stack.name)}"
+
+    def describe_stacks(self, account_id, params):
+        """Handles cloudformation.describe_stacks() for a given stack
+        """
+        stack = self._get_stack(account_id, params)
+        parameters = ''.join(f"<member><ParameterKey>{escape(key)}</ParameterKey><ParameterValue>"
+                             f"{escape(value)}</ParameterValue></member>"
+                             for key, value in sorted(stack.parameters.items()))
+        return f"<Stacks><member><StackName>{escape(stack.name)}</StackName><StackId>" \
+               f"{self._stack_id(account_id, stack)}</StackId><CreationTime>" \
+               f"2019-05-01T00:00:00Z</CreationTime><StackStatus>{stack.status}</StackStatus>" \
+               f"<Parameters>{parameters}</Parameters></member></Stacks>"
+
+    def describe_stack_resource(self, account_id, params):
+        """Handles cloudformation.describe_stack_resource() for the budget of a stack
+        """
+        stack = self._get_stack(account_id, params)
+        if params.get('LogicalResourceId') != 'Budget':
+            raise FakeAwsError(400, 'ValidationError',
+                               f"Resource {params.get('LogicalResourceId')} does not exist for "
+                               f"stack {stack.name}")
+        return f"<StackResourceDetail><StackName>{escape(stack.name)}</StackName><StackId>" \
+               f"{self._stack_id(account_id, stack)}</StackId><LogicalResourceId>Budget" \
+               f"</LogicalResourceId><PhysicalResourceId>{escape(stack.budget_name)}" \
+               f"</PhysicalResourceId><ResourceType>AWS::Budgets::Budget</ResourceType>" \
+               f"<LastUpdatedTimestamp>2019-05-01T00:00:00Z</LastUpdatedTimestamp>" \
+               f"<ResourceStatus>CREATE_COMPLETE</ResourceStatus></StackResourceDetail>"
+
+    def update_stack(self, account_id, params):
+        """Handles cloudformation.update_stack() with the previous template, applying the new
+        parameters to the budget of the stack at once
+        """
+        stack = self._get_stack(account_id, params)
+        parameters = {}
+        for parameter in self._get_members(params, 'Parameters'):
+            key = parameter['ParameterKey']
+            parameters[key] = stack.parameters.get(key) \
+                if parameter.get('UsePreviousValue') == 'true' else parameter['ParameterValue']
+        missing = sorted(set(stack.parameters) - set(parameters))
+        if missing:
+            raise FakeAwsError(400, 'ValidationError', f"Parameters: {missing} must have values")
+        if parameters == stack.parameters:
+            raise FakeAwsError(400, 'ValidationError', 'No updates are to be performed.')
+        with self.lock:
+            stack.parameters = parameters
+            stack.status = 'UPDATE_COMPLETE'
+            budget = self.fleet[account_id].budgets[stack.budget_name]
+            budget.limit_amount = float(parameters['MonthlyBudget'])
+            for notification_type, key in THRESHOLD_PARAMETERS.items():
+                budget.thresholds[notification_type] = float(parameters[key])
+        return f"<StackId>{self._stack_id(account_id, stack)}</StackId>"
+
+    @staticmethod
+    def _budget_properties(budget, limit_amount, thresholds):
+        """Gets the properties of the resource of a budget
+
+        :param budget: the FakeBudget object
+        :param limit_amount: (float) the amount of the budget
+        :param thresholds: (dict) the thresholds (percentages) keyed by notification type
+        :return: (dict) the properties of the AWS::Budgets::Budget resource
+        """
+        return {
+            'Budget': {'BudgetName': budget.name, 'BudgetType': 'COST',
+                       'TimeUnit': budget.time_unit,
+                       'BudgetLimit': {'Amount': limit_amount, 'Unit': 'USD'}},
+            'NotificationsWithSubscribers': [{'Notification': {
+                'NotificationType': notification_type, 'ComparisonOperator': 'GREATER_THAN',
+                'Threshold': threshold, 'ThresholdType': 'PERCENTAGE',
+            }} for notification_type, threshold in thresholds.items()],
+        }
+
+    def _get_budget_drift(self, account_id, stack):
+        """Compares the budget of a stack with the budget its parameters specify, as CloudFormation
+        drift detection does
+
+        :param account_id: (str) the account of the stack
+        :param stack: the FakeStack object
+        :return: a tuple (the expected properties of the budget resource, its actual properties,
+            the property differences)
+        """
+        budget = self.fleet[account_id].budgets[stack.budget_name]
+        thresholds = {notification_type: float(stack.parameters[key])
+                      for notification_type, key in THRESHOLD_PARAMETERS.items()}
+        expected = self._budget_properties(budget, float(stack.parameters['MonthlyBudget']),
+                                           thresholds)
+        actual = self._budget_properties(budget, budget.limit_amount, budget.thresholds)
+        differences = []
+        if expected['Budget']['BudgetLimit'] != actual['Budget']['BudgetLimit']:
+            differences.append(('/Budget/BudgetLimit/Amount',
+                                f"{expected['Budget']['BudgetLimit']['Amount']:g}",
+                                f"{budget.limit_amount:g}", 'NOT_EQUAL'))
+        for index, (notification_type, threshold) in enumerate(thresholds.items()):
+            if notification_type not in budget.thresholds:
+                differences.append((f"/NotificationsWithSubscribers/{index}",
+                                    json.dumps(expected['NotificationsWithSubscribers'][index]),
+                                    'null', 'REMOVE'))
+            elif budget.thresholds[notification_type] != threshold:
+                differences.append((f"/NotificationsWithSubscribers/{index}/Notification/"
+                                    f"Threshold", f"{threshold:g}",
+                                    f"{budget.thresholds[notification_type]:g}", 'NOT_EQUAL'))
+        return expected, actual, differences
+
+    def detect_stack_drift(self, account_id, params):
+        """Handles cloudformation.detect_stack_drift(), the detection completing after
+        drift_detection_seconds
+        """
+        stack = self._get_stack(account_id, params)
+        detection = FakeDriftDetection(detection_id=str(uuid.uuid4()), account_id=account_id,
+                                       stack_name=stack.name, start=time.monotonic())
+        with self.lock:
+            self.drift_detections[detection.detection_id] = detection
+        return f"<StackDriftDetectionId>{detection.detection_id}</StackDriftDetectionId>"
+
+    def describe_stack_drift_detection_status(self, account_id, params):
+        """Handles cloudformation.describe_stack_drift_detection_status()
+        """
+        detection = self.drift_detections.get(params.get('StackDriftDetectionId'))
+        if detection is None or detection.account_id != account_id:
+            raise FakeAwsError(400, 'ValidationError',
+                               f"Drift detection {params.get('StackDriftDetectionId')} does not "
+                               f"exist")
+        stack = self._get_stack(account_id, {'StackName': detection.stack_name})
+        result = f"<StackId>{self._stack_id(account_id, stack)}</StackId><StackDriftDetectionId>" \
+                 f"{detection.detection_id}</StackDriftDetectionId><Timestamp>" \
+                 f"2019-05-01T00:00:00Z</Timestamp>"
+        if time.monotonic() - detection.start < self.drift_detection_seconds:
+            return result + '<DetectionStatus>DETECTION_IN_PROGRESS</DetectionStatus>'
+        drifted = bool(self._get_budget_drift(account_id, stack)[2])
+        return result + f"<DetectionStatus>DETECTION_COMPLETE</DetectionStatus><StackDriftStatus>" \
+                        f"{'DRIFTED' if drifted else 'IN_SYNC'}</StackDriftStatus>" \
+                        f"<DriftedStackResourceCount>{int(drifted)}</DriftedStackResourceCount>"
+
+    def describe_stack_resource_drifts(self, account_id, params):
+        """Handles cloudformation.describe_stack_resource_drifts() for the budget of a stack
+        """
+        stack = self._get_stack(account_id, params)
+        expected, actual, differences = self._get_budget_drift(account_id, stack)
+        status = 'MODIFIED' if differences else 'IN_SYNC'
+        status_filters = self._get_list(params, 'StackResourceDriftStatusFilters')
+        if status_filters and status not in status_filters:
+            return '<StackResourceDrifts></StackResourceDrifts>'
+        property_differences = ''.join(
+            f"<member><PropertyPath>{escape(property_path)}</PropertyPath><ExpectedValue>"
+            f"{escape(expected_value)}</ExpectedValue><ActualValue>{escape(actual_value)}"
+            f"</ActualValue><DifferenceType>{difference_type}</DifferenceType></member>"
+            for property_path, expected_value, actual_value, difference_type in differences)
+        return f"<StackResourceDrifts><member><StackId>{self._stack_id(account_id, stack)}" \
+               f"</StackId><LogicalResourceId>Budget</LogicalResourceId><PhysicalResourceId>" \
+               f"{escape(stack.budget_name)}</PhysicalResourceId><ResourceType>" \
+               f"AWS::Budgets::Budget</ResourceType><ExpectedProperties>" \
+               f"{escape(json.dumps(expected))}</ExpectedProperties><ActualProperties>" \
+               f"{escape(json.dumps(actual))}</ActualProperties><PropertyDifferences>" \
+               f"{property_differences}</PropertyDifferences><StackResourceDriftStatus>{status}" \
+               f"</StackResourceDriftStatus><Timestamp>2019-05-01T00:00:00Z</Timestamp></member>" \
+               f"</StackResourceDrifts>"
+
+    # CloudFormation StackSets
+
+    def _get_stack_set(self, params):
+        """Gets the stack set a call is about
+
+        :param params: (dict) the parameters of the call, with the StackSetName
+        :return: the FakeStackSet object
+        :raises FakeAwsError: if the stack set doesn't exist
+        """
+        stack_set = self.stack_sets.get(params.get('StackSetName'))
+        if stack_set is None:
+            raise FakeAwsError(404, 'StackSetNotFoundException',
+                               f"StackSet {params.get('StackSetName')} not found")
+        return stack_set
+
+    @staticmethod
+    def _get_list(params, name):
+        """Gets a list of strings from the parameters of a query protocol call
+
+        :param params: (dict) the parameters of the call (e.g. 'Accounts.member.1')
+        :param name: (str) the name of the list (e.g. 'Accounts')
+        :return: (list) the strings
+        """
+        items = {}
+        for key, value in params.items():
+            parts = key.split('.')
+            if len(parts) == 3 and parts[:2] == [name, 'member']:
+                items[int(parts[2])] = value
+        return [items[index] for index in sorted(items)]
+
+    def _get_parameters(self, params, name):
+        """Gets the CloudFormation parameters of a query protocol call
+
+        :param params: (dict) the parameters of the call
+        :param name: (str) the name of the list of parameters (e.g. 'Parameters')
+        :return: (dict) the parameter values keyed by parameter key
+        """
+        return {parameter['ParameterKey']: parameter.get('ParameterValue', '')
+                for parameter in self._get_members(params, name)}
+
+    def _advance(self, operation):
+        """Updates the status of an operation and of its instances, the lock being held. The
+        instances are deployed in batches of the maximum concurrency, each batch taking
+        stack_instance_seconds, until the number of failures exceeds the failure tolerance.
+
+        :param operation: the FakeStackSetOperation object
+        :return: None
+        """
+        if operation.status != 'RUNNING':
+            return
+        count = len(operation.instances)
+        concurrency = max(1, math.floor(count * operation.max_concurrent_percentage / 100))
+        tolerance = math.floor(count * operation.failure_tolerance_percentage / 100)
+        completed_batches = int((time.monotonic() - operation.start) / self.stack_instance_seconds)
+        failures = 0
+        for start in range(0, count, concurrency):
+            batch = start // concurrency
+            for instance in operation.instances[start:start + concurrency]:
+                if instance.operation_id != operation.operation_id:
+                    continue  # superseded by a later operation
+                if failures > tolerance:
+                    instance.detailed_status = 'CANCELLED'
+                elif batch < completed_batches:
+                    instance.detailed_status = 'FAILED' \
+                        if instance.account_id in self.failing_stack_instances else 'SUCCEEDED'
+                else:
+                    instance.detailed_status = 'RUNNING' if batch == completed_batches \
+                        else 'PENDING'
+            # the operation stops once a batch takes the failures above the tolerance
+            failures += sum(instance.detailed_status == 'FAILED'
+                            for instance in operation.instances[start:start + concurrency])
+        if failures > tolerance:
+            operation.status = 'FAILED'
+        elif all(instance.detailed_status == 'SUCCEEDED' for instance in operation.instances):
+            operation.status = 'SUCCEEDED'
+
+    def _check_idle(self, stack_set):
+        """Checks that no operation of a stack set is running, the lock being held, as a stack set
+        runs a single operation at a time
+
+        :param stack_set: the FakeStackSet object
+        :return: None
+        :raises FakeAwsError: if an operation of the stack set is running
+        """
+        for operation in stack_set.operations.values():
+            self._advance(operation)
+            if operation.status == 'RUNNING':
+                raise FakeAwsError(409, 'OperationInProgressException',
+                                   f"Another Operation on StackSet {stack_set.name} is in "
+                                   f"progress: {operation.operation_id}")
+
+    def _start_operation(self, stack_set, action, params, instances):
+        """Starts an operation deploying stack instances
+
+        :param stack_set: the FakeStackSet object
+        :param action: (str) 'CREATE' or 'UPDATE'
+        :param params: (dict) the parameters of the call, with the OperationPreferences
+        :param instances: (list) the FakeStackInstance objects to deploy
+        :return: (str) the XML result, with the operation ID
+        """
+        operation_id = params.get('OperationId') or str(uuid.uuid4())
+        operation = FakeStackSetOperation(
+            operation_id=operation_id, action=action, start=time.monotonic(),
+            instances=instances,
+            max_concurrent_percentage=float(params.get(
+                'OperationPreferences.MaxConcurrentPercentage', 100)),
+            failure_tolerance_percentage=float(params.get(
+                'OperationPreferences.FailureTolerancePercentage', 0)))
+        for instance in instances:
+            instance.operation_id = operation_id
+            instance.detailed_status = 'PENDING'
+        stack_set.operations[operation_id] = operation
+        return f"<OperationId>{operation_id}</OperationId>"
+
+    def create_stack_set(self, _, params):
+        """Handles cloudformation.create_stack_set()
+        """
+        name = params.get('StackSetName')
+        with self.lock:
+            if name in self.stack_sets:
+                raise FakeAwsError(400, 'NameAlreadyExistsException',
+                                   f"StackSet {name} already exists")
+            self.stack_sets[name] = FakeStackSet(
+                name=name, template_body=params.get('TemplateBody', ''),
+                parameters=self._get_parameters(params, 'Parameters'))
+        return f"<StackSetId>{escape(name)}:{uuid.uuid5(uuid.NAMESPACE_URL, name)}</StackSetId>"
+
+    def describe_stack_set(self, _, params):
+        """Handles cloudformation.describe_stack_set()
+        """
+        stack_set = self._get_stack_set(params)
+        parameters = ''.join(f"<member><ParameterKey>{escape(key)}</ParameterKey><ParameterValue>"
+                             f"{escape(value)}</ParameterValue></member>"
+                             for key, value in sorted(stack_set.parameters.items()))
+        return f"<StackSet><StackSetName>{escape(stack_set.name)}</StackSetName><Status>ACTIVE" \
+               f"</Status><TemplateBody>{escape(stack_set.template_body)}</TemplateBody>" \
+               f"<Parameters>{parameters}</Parameters></StackSet>"
+
+    def update_stack_set(self, _, params):
+        """Handles cloudformation.update_stack_set(), updating every instance of the stack set
+        """
+        stack_set = self._get_stack_set(params)
+        with self.lock:
+            self._check_idle(stack_set)
+            stack_set.template_body = params.get('TemplateBody', stack_set.template_body)
+            stack_set.parameters = self._get_parameters(params, 'Parameters')
+            return self._start_operation(stack_set, 'UPDATE', params,
+                                         list(stack_set.instances.values()))
+
+    def create_stack_instances(self, _, params):
+        """Handles cloudformation.create_stack_instances()
+        """
+        stack_set = self._get_stack_set(params)
+        overrides = self._get_parameters(params, 'ParameterOverrides')
+        with self.lock:
+            self._check_idle(stack_set)
+            instances = []
+            for account_id in self._get_list(params, 'Accounts'):
+                for region in self._get_list(params, 'Regions'):
+                    if (account_id, region) in stack_set.instances:
+                        raise FakeAwsError(400, 'ValidationError',
+                                           f"stack instance of account {account_id} in region "
+                                           f"{region} already exists")
+                    instances.append(FakeStackInstance(
+                        account_id=account_id, region=region, operation_id='',
+                        parameter_overrides=dict(overrides)))
+            stack_set.instances.update(((instance.account_id, instance.region), instance)
+                                       for instance in instances)
+            return self._start_operation(stack_set, 'CREATE', params, instances)
+
+    def update_stack_instances(self, _, params):
+        """Handles cloudformation.update_stack_instances()
+        """
+        stack_set = self._get_stack_set(params)
+        overrides = self._get_parameters(params, 'ParameterOverrides')
+        with self.lock:
+            self._check_idle(stack_set)
+            instances = []
+            for account_id in self._get_list(params, 'Accounts'):
+                for region in self._get_list(params, 'Regions'):
+                    instance = stack_set.instances.get((account_id, region))
+                    if instance is None:
+                        raise FakeAwsError(400, 'StackInstanceNotFoundException',
+                                           f"no stack instance of account {account_id} in "
+                                           f"region {region}")
+                    instance.parameter_overrides = dict(overrides)
+                    instances.append(instance)
+            return self._start_operation(stack_set, 'UPDATE', params, instances)
+
+    def describe_stack_set_operation(self, _, params):
+        """Handles cloudformation.describe_stack_set_operation()
+        """
+        stack_set = self._get_stack_set(params)
+        operation = stack_set.operations.get(params.get('OperationId'))
+        if operation is None:
+            raise FakeAwsError(404, 'OperationNotFoundException',
+                               f"operation {params.get('OperationId')} not found")
+        with self.lock:
+            self._advance(operation)
+        return f"<StackSetOperation><OperationId>{operation.operation_id}</OperationId>" \
+               f"<Action>{operation.action}</Action><Status>{operation.status}</Status>" \
+               f"<OperationPreferences><MaxConcurrentPercentage>" \
+               f"{operation.max_concurrent_percentage:g}</MaxConcurrentPercentage>" \
+               f"<FailureTolerancePercentage>{operation.failure_tolerance_percentage:g}" \
+               f"</FailureTolerancePercentage></OperationPreferences><CreationTimestamp>" \
+               f"2019-05-01T00:00:00Z</CreationTimestamp></StackSetOperation>"
+
+    def list_stack_instances(self, _, params):
+        """Handles cloudformation.list_stack_instances()
+        """
+        stack_set = self._get_stack_set(params)
+        with self.lock:
+            for operation in stack_set.operations.values():
+                self._advance(operation)
+            instances = sorted(stack_set.instances.values(),
+                               key=lambda instance: (instance.account_id, instance.region))
+        page = self._paginate(instances, params, 'Summaries')
+        summaries = ''.join(
+            f"<member><StackSetId>{escape(stack_set.name)}</StackSetId><Region>{instance.region}"
+            f"</Region><Account>{instance.account_id}</Account><Status>"
+            f"{'CURRENT' if instance.detailed_status == 'SUCCEEDED' else 'OUTDATED'}</Status>"
+            f"<StatusReason>{instance.detailed_status}</StatusReason><StackInstanceStatus>"
+            f"<DetailedStatus>{instance.detailed_status}</DetailedStatus></StackInstanceStatus>"
+            f"<LastOperationId>{instance.operation_id}</LastOperationId></member>"
+            for instance in page['Summaries'])
+        next_token = f"<NextToken>{page['NextToken']}</NextToken>" if 'NextToken' in page else ''
+        return f"<Summaries>{summaries}</Summaries>{next_token}"
@@ -0,0 +1,457 @@
+"""Script checking the thresholds of every budget of every account of an organisation.
+The scan can be split between several runners with --shard i/N: every account is assigned to a
+shard by a stable hash of its ID, so that the runners split the fleet without coordinating. Each
+runner appends the result of every account it checks to a checkpoint file as soon as it is known,
+so that a shard restarted after a crash only checks the accounts it didn't finish. The merge
+command then combines the checkpoint files of all the shards into one report and exit status.
+"""
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import asdict, dataclass, field
+from os import environ, path
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+import threading
+from botocore import session
+from botocore.exceptions import BotoCoreError, ClientError
+from aws_budget_check_params import ThresholdFinding, evaluate_budgets, get_budget_from_response
+from aws_budget_notification_sinks import dispatch, load_sinks
+
+DEFAULT_ROLE_NAME = 'budget-alerting-management'
+# name of the stack deployed by deploy.sh in every account, and its threshold parameters
+ALERTING_STACK_NAME = 'budget-alerts'
+THRESHOLD_PARAMETERS = {'ACTUAL': 'ActualThreshold', 'FORECASTED': 'ForecastedThreshold'}
+# exit status of the merge command when some accounts were not checked
+INCOMPLETE_EXIT_STATUS = 2
+
+
+class CheckpointException(Exception):
+    """Exception indicating that a checkpoint file can't be used for a shard
+    """
+
+
+def parse_shard(value):
+    """Parses a shard specification
+
+    :param value: (str) the shard specification 'i/N', i being the index of the shard between 1
+        and the number of shards N
+    :return: a tuple (the index of the shard, the number of shards)
+    :raises argparse.ArgumentTypeError: if the specification is not valid
+    """
+    try:
+        shard_index, shard_count = (int(part) for part in value.split('/'))
+    except ValueError as error:
+        raise argparse.ArgumentTypeError(f"shard should be i/N (got {value})") from error
+    if not 1 <= shard_index <= shard_count:
+        raise argparse.ArgumentTypeError(f"shard index should be between 1 and {shard_count} "
+                                         f"(got {shard_index})")
+    return shard_index, shard_count
+
+
+def get_shard_index(account_id, shard_count):
+    """Gets the shard an account belongs to. The hash doesn't depend on the process (as hash()
+    does) nor on the other accounts of the organisation, so every runner computes the same shards.
+
+    :param account_id: (str) the account ID
+    :param shard_count: (int) the number of shards
+    :return: (int) the index of the shard, between 1 and shard_count
+    """
+    digest = hashlib.sha256(account_id.encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % shard_count + 1
+
+
+class FleetScanner:
+    """Class checking the thresholds of the budgets of the accounts of an organisation, assuming a
+    role in every account from the management account
+    """
+
+    def __init__(self, endpoint_url=None, role_name=DEFAULT_ROLE_NAME, **credentials):
+        """Constructor
+
+        :param endpoint_url: (str) the URL of the AWS APIs, None for the real APIs
+        :param role_name: (str) the name of the role to assume in every account
+        :param credentials: the credentials of the management account (aws_access_key_id...), the
+            default credentials if not set
+        """
+        self.endpoint_url = endpoint_url
+        self.role_name = role_name
+        self.credentials = credentials
+        # botocore sessions are not thread-safe, but creating a session per thread would load the
+        # service models again in every thread
+        self.session = session.get_session()
+        self.session_lock = threading.Lock()
+        self.local = threading.local()
+
+    def create_client(self, service_name, **credentials):
+        """Creates a client of the AWS APIs
+
+        :param service_name: (str) the name of the service (e.g. 'budgets')
+        :param credentials: the credentials of the client, those of the management account if
+            not set
+        :return: the botocore client
+        """
+        with self.session_lock:
+            return self.session.create_client(
+                service_name, region_name='us-east-1', endpoint_url=self.endpoint_url,
+                **(credentials or self.credentials))
+
+    def list_account_ids(self):
+        """Lists the accounts of the organisation
+
+        :return: (list) the account IDs
+        """
+        paginator = self.create_client('organizations').get_paginator('list_accounts')
+        return [account['Id'] for page in paginator.paginate() for account in page['Accounts']
+                if account['Status'] == 'ACTIVE']
+
+    def get_account_credentials(self, account_id):
+        """Assumes the role in an account
+
+        :param account_id: (str) the account ID
+        :return: (dict) the credentials of the role, to pass to create_client()
+        """
+        if not hasattr(self.local, 'sts_client'):
+            self.local.sts_client = self.create_client('sts')
+        credentials = self.local.sts_client.assume_role(
+            RoleArn=f"arn:aws:iam::{account_id}:role/{self.role_name}",
+            RoleSessionName='budget-check',
+        )['Credentials']
+        return {
+            'aws_access_key_id': credentials['AccessKeyId'],
+            'aws_secret_access_key': credentials['SecretAccessKey'],
+            'aws_session_token': credentials['SessionToken'],
+        }
+
+    def scan_account(self, account_id):
+        """Checks the thresholds of every budget of an account
+
+        :param account_id: (str) the account ID
+        :return: (list) a ThresholdFinding object per threshold too low to result in a trigger
+        """
+        budgets_client = self.create_client('budgets', **self.get_account_credentials(account_id))
+        budgets = []
+        for page in budgets_client.get_paginator('describe_budgets').paginate(
+                AccountId=account_id):
+            for budget in page.get('Budgets', []):
+                if 'BudgetLimit' in budget and 'CalculatedSpend' in budget:
+                    budgets.append(budget)
+                else:
+                    logging.info("budget '%s' in account %s has no fixed limit, not checked",
+                                 budget['BudgetName'], account_id)
+        if not budgets:
+            return []
+        # the budgets without a forecast are checked against their projected spend
+        evaluation = evaluate_budgets([get_budget_from_response(budget) for budget in budgets])
+        findings = []
+        for budget, forecasted_spend in zip(budgets, evaluation.forecasted_spend):
+            findings.extend(check_budget(budgets_client, account_id, budget,
+                                         float(forecasted_spend)))
+        return findings
+
+
+def check_budget(budgets_client, account_id, budget, forecasted_spend):
+    """Checks the thresholds of the notifications of a budget, as
+    AwsBudgetThresholdchecker.get_findings() does with the thresholds of the alerting template
+
+    :param budgets_client: the 'budgets' client of the account
+    :param account_id: (str) the account ID
+    :param budget: (dict) the budget, as returned by budgets.describe_budgets()
+    :param forecasted_spend: (float) the forecasted spend of the budget, see evaluate_budgets()
+    :return: (list) a ThresholdFinding object per threshold too low to result in a trigger
+    """
+    limit_amount = float(budget['BudgetLimit']['Amount'])
+    spends = {
+        'ACTUAL': float(budget['CalculatedSpend']['ActualSpend']['Amount']),
+        'FORECASTED': forecasted_spend,
+    }
+    findings = []
+    paginator = budgets_client.get_paginator('describe_notifications_for_budget')
+    for page in paginator.paginate(AccountId=account_id, BudgetName=budget['BudgetName']):
+        for notification in page.get('Notifications', []):
+            notification_type = notification['NotificationType']
+            if notification['ComparisonOperator'] != 'GREATER_THAN' or \
+                    notification_type not in spends:
+                continue
+            threshold_trigger = notification['Threshold']
+            if notification.get('ThresholdType', 'PERCENTAGE') == 'PERCENTAGE':
+                threshold_trigger = threshold_trigger / 100 * limit_amount
+            if threshold_trigger < spends[notification_type]:
+                findings.append(ThresholdFinding(
+                    account_id=account_id, budget_name=budget['BudgetName'],
+                    notification_type=notification_type, threshold_trigger=threshold_trigger,
+                    calculated_spend=spends[notification_type]))
+    return findings
+
+
+def read_checkpoint(file_name):
+    """Reads a checkpoint file. A line cut short by a crash is ignored.
+
+    :param file_name: (str) the name of the checkpoint file
+    :return: a tuple (the header of the file, None if there is none, the last record of every
+        account keyed by account ID, the last summary of the shard, None if the shard never
+        completed)
+    """
+    header = None
+    records = {}
+    summary = None
+    if not path.exists(file_name):
+        return header, records, summary
+    with open(file_name, encoding='utf-8') as checkpoint_file:
+        for line_number, line in enumerate(checkpoint_file, 1):
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                logging.warning("warning: ignoring line %s of %s: %s", line_number, file_name,
+                                line.strip())
+                continue
+            if 'shard_count' in entry:
+                header = entry
+            elif 'account_id' in entry:
+                records[entry['account_id']] = entry
+            else:
+                summary = entry
+    return header, records, summary
+
+
+def _get_findings(record):
+    """Gets the findings of an account from its checkpoint record
+
+    :param record: (dict) the checkpoint record
+    :return: (list) the ThresholdFinding objects
+    """
+    return [ThresholdFinding(**finding) for finding in record.get('findings', [])]
+
+
+def _append_entry(checkpoint_file, entry):
+    """Appends an entry to a checkpoint file, the entry being on disk once this returns
+
+    :param checkpoint_file: the checkpoint file, open for appending
+    :param entry: (dict) the entry
+    :return: None
+    """
+    checkpoint_file.write(json.dumps(entry, sort_keys=True) + '\n')
+    checkpoint_file.flush()
+    os.fsync(checkpoint_file.fileno())
+
+
+def scan_shard(scanner, shard, checkpoint_file_name, concurrency=16):  # pylint: disable=too-many-locals
+    """Checks the accounts of a shard that are not already checked in the checkpoint file,
+    appending the result of every account to the file
+
+    :param scanner: the FleetScanner object
+    :param shard: a tuple (the index of the shard, the number of shards), see parse_shard()
+    :param checkpoint_file_name: (str) the name of the checkpoint file of the shard
+    :param concurrency: (int) the number of accounts checked at the same time
+    :return: a tuple (the number of accounts in the shard, the number of accounts checked by this
+        run, the IDs of the accounts that could not be checked)
+    :raises CheckpointException: if the checkpoint file belongs to another shard
+    """
+    shard_index, shard_count = shard
+    header, records, _ = read_checkpoint(checkpoint_file_name)
+    if header is not None and (header['shard'], header['shard_count']) != shard:
+        raise CheckpointException(f"{checkpoint_file_name} is the checkpoint of shard "
+                                  f"{header['shard']}/{header['shard_count']}, not "
+                                  f"{shard_index}/{shard_count}")
+    account_ids = [account_id for account_id in scanner.list_account_ids()
+                   if get_shard_index(account_id, shard_count) == shard_index]
+    pending_account_ids = [account_id for account_id in account_ids
+                           if account_id not in records or 'error' in records[account_id]]
+    logging.info("shard %s/%s: %s accounts, %s already checked", shard_index, shard_count,
+                 len(account_ids), len(account_ids) - len(pending_account_ids))
+    failed_account_ids = []
+    with open(checkpoint_file_name, 'a+', encoding='utf-8') as checkpoint_file:
+        # complete a line cut short by a crash, so that the next entry starts on its own line
+        if checkpoint_file.tell():
+            checkpoint_file.seek(checkpoint_file.tell() - 1)
+            if checkpoint_file.read(1) != '\n':
+                checkpoint_file.write('\n')
+        if header is None:
+            _append_entry(checkpoint_file, {'shard': shard_index, 'shard_count': shard_count})
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = {executor.submit(scanner.scan_account, account_id): account_id
+                       for account_id in pending_account_ids}
+            for future in as_completed(futures):
+                account_id = futures[future]
+                try:
+                    record = {'account_id': account_id,
+                              'findings': [asdict(finding) for finding in future.result()]}
+                except (BotoCoreError, ClientError) as error:
+                    logging.warning("warning: could not check account %s: %s", account_id,
+                                    error)
+                    record = {'account_id': account_id, 'error': str(error)}
+                    failed_account_ids.append(account_id)
+                _append_entry(checkpoint_file, record)
+        _append_entry(checkpoint_file, {'accounts': account_ids})
+    return len(account_ids), len(pending_account_ids), failed_account_ids
+
+
+@dataclass
+class FleetScanReport:
+    """Class specifying the results of a fleet scan, merged from the checkpoints of its shards
+    """
+    shard_count: int  # the number of shards the fleet was split into
+    accounts: int = 0  # the number of accounts checked
+    findings: list = field(default_factory=list)  # the ThresholdFinding objects
+    failed_account_ids: list = field(default_factory=list)  # accounts that could not be checked
+    missing_shards: list = field(default_factory=list)  # shards without a completed checkpoint
+
+    @property
+    def complete(self):
+        """True if every account of every shard was checked
+        """
+        return not self.failed_account_ids and not self.missing_shards
+
+    @property
+    def exit_status(self):
+        """The exit status of the scan: 0 if the checks passed, 1 if any check failed, 2 if
+        some accounts were not checked
+        """
+        if not self.complete:
+            return INCOMPLETE_EXIT_STATUS
+        return 1 if self.findings else 0
+
+    @property
+    def message(self):
+        """A human-readable description of the results
+        """
+        message = f"{self.accounts} accounts checked in {self.shard_count} shards, " \
+                  f"{len(self.findings)} findings"
+        if self.failed_account_ids:
+            message += f", {len(self.failed_account_ids)} accounts not checked: " \
+                       f"{', '.join(self.failed_account_ids)}"
+        if self.missing_shards:
+            message += f", shards not completed: {', '.join(map(str, self.missing_shards))}"
+        return message
+
+
+def merge_checkpoints(checkpoint_file_names):
+    """Merges the checkpoint files of the shards of a scan
+
+    :param checkpoint_file_names: (list) the names of the checkpoint files, one per shard
+    :return: a FleetScanReport object
+    :raises CheckpointException: if the checkpoint files don't belong to the same scan
+    """
+    report = None
+    completed_shards = set()
+    for file_name in checkpoint_file_names:
+        header, records, summary = read_checkpoint(file_name)
+        if header is None:
+            raise CheckpointException(f"{file_name} is not a checkpoint file")
+        if report is None:
+            report = FleetScanReport(shard_count=header['shard_count'])
+        elif header['shard_count'] != report.shard_count:
+            raise CheckpointException(f"{file_name} is the checkpoint of a scan in "
+                                      f"{header['shard_count']} shards, not "
+                                      f"{report.shard_count}")
+        if summary is None:
+            logging.warning("warning: shard %s/%s was not completed", header['shard'],
+                            header['shard_count'])
+            continue
+        completed_shards.add(header['shard'])
+        for account_id in summary['accounts']:
+            record = records.get(account_id, {'error': 'not checked'})
+            if 'error' in record:
+                report.failed_account_ids.append(account_id)
+            else:
+                report.accounts += 1
+                report.findings.extend(_get_findings(record))
+    if report is None:
+        raise CheckpointException('no checkpoint file to merge')
+    report.missing_shards = sorted(set(range(1, report.shard_count + 1)) - completed_shards)
+    return report
+
+
+def scan(args):
+    """Runs the scan command
+
+    :param args: the parsed arguments
+    :return: (int) the exit status
+    """
+    scanner = FleetScanner(endpoint_url=args.endpoint_url, role_name=args.role_name)
+    try:
+        accounts, checked, failed_account_ids = scan_shard(scanner, args.shard, args.checkpoint,
+                                                           args.concurrency)
+    except CheckpointException as exception:
+        print(str(exception))
+        return -2
+    print(f"shard {args.shard[0]}/{args.shard[1]}: {accounts} accounts, {checked} checked by "
+          f"this run, {len(failed_account_ids)} not checked")
+    return INCOMPLETE_EXIT_STATUS if failed_account_ids else 0
+
+
+def merge(args):
+    """Runs the merge command
+
+    :param args: the parsed arguments
+    :return: (int) the exit status
+    """
+    try:
+        report = merge_checkpoints(args.checkpoints)
+    except CheckpointException as exception:
+        print(str(exception))
+        return -2
+    for finding in report.findings:
+        print(finding.message)
+    print(report.message)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output_file:
+            json.dump(dict(asdict(report), complete=report.complete,
+                           exit_status=report.exit_status), output_file, indent=4)
+    if 'SINKS_CONFIG' in environ:
+        logging.info("findings sent to sinks (delivered, failed): %s",
+                     dispatch(report.findings, load_sinks(environ['SINKS_CONFIG'])))
+    return report.exit_status
+
+
+def add_fleet_arguments(parser, concurrency, concurrency_help, stack_name=False):
+    """Adds the arguments of the scripts running on every account of the organisation: the number
+    of accounts or calls processed at the same time, the role assumed in every account, the URL of
+    the AWS APIs and optionally the name of the alerting stack
+
+    :param parser: (argparse.ArgumentParser) the parser of the script
+    :param concurrency: (int) the default number of accounts or calls processed at the same time
+    :param concurrency_help: (str) the help of the --concurrency argument
+    :param stack_name: (bool) True to add the --stack-name argument
+    :return: None
+    """
+    parser.add_argument('--concurrency', type=int, default=concurrency, help=concurrency_help)
+    if stack_name:
+        parser.add_argument('--stack-name', default=ALERTING_STACK_NAME,
+                            help='the name of the alerting stack in every account')
+    parser.add_argument('--role-name', default=DEFAULT_ROLE_NAME,
+                        help='the role assumed in every account')
+    parser.add_argument('--endpoint-url', help='the URL of the AWS APIs')
+
+
+def main():
+    """Main entry point
+    """
+    parser = argparse.ArgumentParser(
+        description='checks the thresholds of every budget of every account of the organisation, '
+                    'possibly split in shards run separately and merged afterwards')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    scan_parser = subparsers.add_parser(
+        'scan', help='checks the accounts of a shard, resuming from its checkpoint file')
+    scan_parser.add_argument('--shard', type=parse_shard, default=(1, 1),
+                             help='the shard to check, i/N for the i-th of N shards (default: 1/1)')
+    scan_parser.add_argument('--checkpoint', required=True,
+                             help='the checkpoint file of the shard, created if it does not exist')
+    add_fleet_arguments(scan_parser, 16, 'number of accounts checked at the same time')
+    scan_parser.set_defaults(run=scan)
+    merge_parser = subparsers.add_parser(
+        'merge', help='merges the checkpoint files of the shards into one report')
+    merge_parser.add_argument('checkpoints', nargs='+', help='the checkpoint files')
+    merge_parser.add_argument('--output', help='JSON file the report is written to')
+    merge_parser.set_defaults(run=merge)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(args.run(args))
+
+
+if __name__ == "__main__":
+    main()
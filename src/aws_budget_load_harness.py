@@ -0,0 +1,156 @@
+"""Script load testing the budget threshold checks of a fleet of accounts against a local stand-in
+for the AWS APIs, reporting the throughput and the latency percentiles of the checks.
+Every account of the organisation is checked concurrently the way a fleet-wide scan would: assume
+a role in the account, then check its budget with AwsBudgetThresholdchecker.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from time import perf_counter
+import argparse
+import logging
+import numpy
+from botocore.exceptions import BotoCoreError, ClientError
+from aws_budget_check_params import AwsBudgetThresholdchecker
+from aws_budget_fake_services import FakeAwsServer, generate_fleet
+from aws_budget_fleet_scan import DEFAULT_ROLE_NAME, FleetScanner
+
+# credentials of the management account, the stand-in doesn't check signatures
+MANAGEMENT_CREDENTIALS = {
+    'aws_access_key_id': 'MANAGEMENT',
+    'aws_secret_access_key': 'fake',
+}
+
+
+@dataclass
+class LoadTestReport:
+    """Class specifying the results of a load test
+    """
+    accounts: int  # the number of accounts checked
+    findings: int  # the number of thresholds too low to trigger an alert
+    failures: int  # the number of accounts that could not be checked
+    seconds: float  # the time taken by the whole test
+    latency_p50: float  # median time taken to check an account (in seconds)
+    latency_p90: float
+    latency_p99: float
+
+    @property
+    def throughput(self):
+        """The number of accounts checked per second
+        """
+        return self.accounts / self.seconds if self.seconds else 0.0
+
+    @property
+    def message(self):
+        """A human-readable description of the results
+        """
+        return f"{self.accounts} accounts checked in {self.seconds:.2f}s " \
+               f"({self.throughput:.1f} accounts/s), {self.findings} findings, " \
+               f"{self.failures} failures, latency p50 {self.latency_p50 * 1000:.1f} ms, " \
+               f"p90 {self.latency_p90 * 1000:.1f} ms, p99 {self.latency_p99 * 1000:.1f} ms"
+
+
+class FleetChecker(FleetScanner):  # pylint: disable=too-many-instance-attributes
+    """Class checking the budgets of the accounts of an organisation concurrently
+    """
+
+    def __init__(self, endpoint_url, budget_name,  # pylint: disable=too-many-arguments
+                 actual_threshold_percentage, forecasted_threshold_percentage,
+                 role_name=DEFAULT_ROLE_NAME):
+        """Constructor
+
+        :param endpoint_url: (str) the URL of the AWS APIs (e.g. FakeAwsServer.url)
+        :param budget_name: (str) the name of the budget to check in every account
+        :param actual_threshold_percentage: (float) the actual threshold percentage
+        :param forecasted_threshold_percentage: (float) the forecasted threshold percentage
+        :param role_name: (str) the name of the role to assume in every account
+        """
+        FleetScanner.__init__(self, endpoint_url, role_name, **MANAGEMENT_CREDENTIALS)
+        self.budget_name = budget_name
+        self.actual_threshold_percentage = actual_threshold_percentage
+        self.forecasted_threshold_percentage = forecasted_threshold_percentage
+
+    def check_account(self, account_id):
+        """Checks the budget of an account
+
+        :param account_id: (str) the account ID
+        :return: a tuple (the ThresholdFinding objects, None if the check failed, the time taken)
+        """
+        start = perf_counter()
+        try:
+            account_credentials = self.get_account_credentials(account_id)
+            findings = AwsBudgetThresholdchecker(
+                sts_client=self.create_client('sts', **account_credentials),
+                budgets_client=self.create_client('budgets', **account_credentials),
+                budget_name=self.budget_name,
+            ).get_findings(self.actual_threshold_percentage, self.forecasted_threshold_percentage)
+        except (BotoCoreError, ClientError) as error:
+            logging.warning("warning: could not check account %s: %s", account_id, error)
+            findings = None
+        return findings, perf_counter() - start
+
+
+def run_load_test(fleet_checker, concurrency):
+    """Checks every account of the organisation concurrently
+
+    :param fleet_checker: the FleetChecker object
+    :param concurrency: (int) the number of accounts checked at the same time
+    :return: a LoadTestReport object
+    """
+    start = perf_counter()
+    account_ids = fleet_checker.list_account_ids()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(fleet_checker.check_account, account_ids))
+    seconds = perf_counter() - start
+    latencies = numpy.array([latency for _, latency in results]) if results else numpy.zeros(1)
+    p50, p90, p99 = numpy.percentile(latencies, [50, 90, 99])
+    return LoadTestReport(
+        accounts=len(results),
+        findings=sum(len(findings) for findings, _ in results if findings is not None),
+        failures=sum(1 for findings, _ in results if findings is None),
+        seconds=seconds,
+        latency_p50=float(p50),
+        latency_p90=float(p90),
+        latency_p99=float(p99),
+    )
+
+
+def main():
+    """Main entry point
+    """
+    parser = argparse.ArgumentParser(
+        description='load tests the budget checks of a generated fleet of accounts against a '
+                    'local stand-in for the AWS STS, Budgets and Organizations APIs')
+    parser.add_argument('--accounts', type=int, default=1000, help='number of accounts')
+    parser.add_argument('--concurrency', type=int, default=32,
+                        help='number of accounts checked at the same time')
+    parser.add_argument('--latency', type=float, default=0.02,
+                        help='mean time taken by every API call (in seconds)')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='fraction of the API calls failing with an internal error')
+    parser.add_argument('--throttle-rate', type=float, default=0.0,
+                        help='fraction of the API calls throttled at random')
+    parser.add_argument('--rate-limit', type=float,
+                        help='number of calls per second per API action above which calls are '
+                             'throttled')
+    parser.add_argument('--actual-threshold', type=float, default=80,
+                        help='actual threshold percentage checked')
+    parser.add_argument('--forecasted-threshold', type=float, default=100,
+                        help='forecasted threshold percentage checked')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the generated fleet')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    with FakeAwsServer(generate_fleet(args.accounts, seed=args.seed), latency=args.latency,
+                       error_rate=args.error_rate, throttle_rate=args.throttle_rate,
+                       rate_limit=args.rate_limit, seed=args.seed) as server:
+        report = run_load_test(FleetChecker(server.url, 'Monthly Budget', args.actual_threshold,
+                                            args.forecasted_threshold), args.concurrency)
+        print(report.message)
+        for action, action_stats in sorted(server.stats.items()):
+            print(f"{action}: {action_stats['calls']} calls, {action_stats['throttled']} "
+                  f"throttled, {action_stats['errors']} errors")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+"""Module parsing the notifications sent by AWS Budgets to SNS topics.
+The message of these notifications is free text. This module extracts the information it contains
+into structured records, and aggregates archives of notifications into alert statistics per
+account.
+"""
+
+from os import path
+from dataclasses import dataclass, field
+from datetime import datetime
+from functools import lru_cache
+import csv
+import gzip
+import json
+import logging
+import re
+import sys
+
+HEADER_PATTERN = re.compile(
+    r'AWS Budget Notification (?P<date>\w+ \d{1,2}, \d{4})\s+AWS Account (?P<account_id>\d+)')
+DETAILS_PATTERN = re.compile(
+    r'Budget Name: (?P<budget_name>[^\n]*)\n'
+    r'(?:[^\n]*\n)*?'
+    r'Budgeted Amount: \$?(?P<budgeted_amount>[\d,.]+)\n'
+    r'(?:[^\n]*\n)*?'
+    r'Alert Type: (?P<alert_type>\w+)\n'
+    r'Alert Threshold: [^\d\n]*(?P<threshold>[\d,.]+)\n'
+    r'(?P=alert_type) Amount: \$?(?P<amount>[\d,.]+)'
+)
+DETAILS_MARKER = '\nBudget Name: '
+NOTIFICATION_MARKER = 'AWS Budget Notification'
+
+
+class InvalidNotificationException(Exception):
+    """Exception indicating that a message is not an AWS Budgets notification
+    """
+
+
+@dataclass
+class BudgetNotification:
+    """Class specifying the information contained in an AWS Budgets notification
+    """
+    date: str  # the day the notification was sent (YYYY-MM-DD)
+    account_id: str  # the AWS account the budget belongs to
+    budget_name: str
+    alert_type: str  # 'ACTUAL' or 'FORECASTED'
+    budgeted_amount: float  # the budget limit amount
+    threshold: float  # the amount above which the alert is triggered
+    amount: float  # the actual or forecasted amount that triggered the alert
+
+
+@dataclass
+class AccountAlertStatistics:
+    """Class specifying statistics about the alerts received for an account
+    """
+    account_id: str
+    alert_counts: dict = field(default_factory=dict)  # alert count per alert type
+    months: set = field(default_factory=set)  # the months (YYYY-MM) alerts were received in
+    first_date: str = None  # the day of the first alert (YYYY-MM-DD)
+    last_date: str = None  # the day of the last alert (YYYY-MM-DD)
+
+    @property
+    def total_alerts(self):
+        """The number of alerts received for the account
+        """
+        return sum(self.alert_counts.values())
+
+    @property
+    def alerts_per_month(self):
+        """The mean number of alerts received per month, over the months with alerts
+        """
+        return self.total_alerts / len(self.months) if self.months else 0.0
+
+
+@lru_cache(maxsize=4096)
+def _parse_date(text):
+    """Converts a date such as 'May 15, 2019' to the ISO format
+
+    :param text: (str) the date as written in AWS Budgets notifications
+    :return: (str) the date in the YYYY-MM-DD format
+    """
+    return datetime.strptime(text, '%B %d, %Y').date().isoformat()
+
+
+def _parse_amount(text):
+    """Converts an amount such as '1,981.00' to a float
+
+    :param text: (str) the amount as written in AWS Budgets notifications
+    :return: (float) the amount
+    """
+    return float(text.replace(',', ''))
+
+
+def parse_notification(message):
+    """Parses the message of an AWS Budgets notification
+
+    :param message: (str) the 'Message' of the SNS notification
+    :return: a BudgetNotification object
+    :raises InvalidNotificationException: if the message is not an AWS Budgets notification
+    """
+    # the details are matched from the start of the summary at the end of the message, rather
+    # than searched for across the free text above it
+    header = HEADER_PATTERN.match(message)
+    details = header and DETAILS_PATTERN.match(message, message.rfind(DETAILS_MARKER) + 1)
+    if not details:
+        raise InvalidNotificationException(f"not an AWS Budgets notification: {message[:80]!r}")
+    return BudgetNotification(
+        date=_parse_date(header.group('date')),
+        account_id=header.group('account_id'),
+        budget_name=details.group('budget_name'),
+        alert_type=details.group('alert_type'),
+        budgeted_amount=_parse_amount(details.group('budgeted_amount')),
+        threshold=_parse_amount(details.group('threshold')),
+        amount=_parse_amount(details.group('amount')),
+    )
+
+
+def _get_messages(event):
+    """Gets the SNS messages contained in an archived event
+
+    :param event: (dict) a Lambda event with 'Records', an SNS record or an SNS notification
+    :return: a generator yielding the messages
+    """
+    if 'Records' in event:
+        for record in event['Records']:
+            yield record['Sns']['Message']
+    elif 'Sns' in event:
+        yield event['Sns']['Message']
+    elif 'Message' in event:
+        yield event['Message']
+
+
+def read_archive(file_name):
+    """Reads an archive of SNS events, one JSON object per line, optionally compressed with gzip.
+    Lines are read one at a time so that archives of any size can be processed in constant memory,
+    and lines that are not AWS Budgets notifications or not valid JSON are skipped.
+
+    :param file_name: (str) the name of the archive file, compressed if it ends with '.gz'
+    :return: a generator yielding BudgetNotification objects
+    """
+    opener = gzip.open if file_name.endswith('.gz') else open
+    with opener(file_name, 'rt', encoding='utf-8') as archive:
+        for line_number, line in enumerate(archive, 1):
+            if NOTIFICATION_MARKER not in line:
+                continue
+            try:
+                event = json.loads(line)
+            except ValueError:
+                logging.warning("warning: ignoring line %s of %s: %s", line_number, file_name,
+                                line.strip())
+                continue
+            for message in _get_messages(event):
+                try:
+                    yield parse_notification(message)
+                except InvalidNotificationException:
+                    continue
+
+
+def aggregate_notifications(notifications):
+    """Aggregates notifications into alert statistics per account
+
+    :param notifications: an iterable of BudgetNotification objects
+    :return: (dict) AccountAlertStatistics objects keyed by account ID
+    """
+    statistics = {}
+    for notification in notifications:
+        account_statistics = statistics.get(notification.account_id)
+        if account_statistics is None:
+            account_statistics = statistics[notification.account_id] = \
+                AccountAlertStatistics(account_id=notification.account_id)
+        counts = account_statistics.alert_counts
+        counts[notification.alert_type] = counts.get(notification.alert_type, 0) + 1
+        account_statistics.months.add(notification.date[:7])
+        if account_statistics.first_date is None or \
+                notification.date < account_statistics.first_date:
+            account_statistics.first_date = notification.date
+        if account_statistics.last_date is None or \
+                notification.date > account_statistics.last_date:
+            account_statistics.last_date = notification.date
+    return statistics
+
+
+def usage():
+    """prints the script's usage
+
+    :return: None
+    """
+
+    print(
+        f"usage: {path.basename(__file__)} ARCHIVE [ARCHIVE...]\n"
+        f"Parses archives of AWS Budgets SNS notifications and prints the alert statistics for\n"
+        f"each account as CSV.\n"
+        f"\n"
+        f"where:\n"
+        f"\n"
+        f"ARCHIVE is a file containing one SNS event per line in the JSON format, compressed with\n"
+        f"    gzip if its name ends with '.gz'\n"
+    )
+
+
+def main():
+    """Main entry point
+    """
+    if len(sys.argv) < 2:
+        usage()
+        sys.exit(-1)
+
+    statistics = aggregate_notifications(
+        notification for file_name in sys.argv[1:] for notification in read_archive(file_name))
+
+    writer = csv.writer(sys.stdout)
+    writer.writerow(['account_id', 'actual_alerts', 'forecasted_alerts', 'total_alerts',
+                     'months_with_alerts', 'alerts_per_month', 'first_alert', 'last_alert'])
+    for account_id in sorted(statistics):
+        account_statistics = statistics[account_id]
+        writer.writerow([account_id,
+                         account_statistics.alert_counts.get('ACTUAL', 0),
+                         account_statistics.alert_counts.get('FORECASTED', 0),
+                         account_statistics.total_alerts,
+                         len(account_statistics.months),
+                         f"{account_statistics.alerts_per_month:.2f}",
+                         account_statistics.first_date,
+                         account_statistics.last_date])
+
+
+if __name__ == "__main__":
+    main()
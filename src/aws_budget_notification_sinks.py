@@ -0,0 +1,420 @@
+"""Module sending the findings of the budget checks to notification sinks (Slack, Microsoft Teams,
+email, ticket queues...).
+Each sink runs as its own asyncio task with a bounded queue, its own connections, batching, a
+timeout per delivery and a bounded number of retries, so that a slow or failing sink never delays
+the others.
+"""
+
+from dataclasses import asdict, is_dataclass
+from email.message import EmailMessage
+from functools import partial
+from urllib.parse import urlsplit
+import abc
+import asyncio
+import json
+import logging
+import smtplib
+import ssl
+import threading
+
+SINK_TYPES = {}
+
+
+class SinkException(Exception):
+    """Exception indicating that findings could not be delivered to a sink
+    """
+
+
+def get_finding_text(finding):
+    """Gets a human-readable description of a finding
+
+    :param finding: a finding (e.g. a ThresholdFinding or SpendAnomaly object)
+    :return: (str) the description
+    """
+    return getattr(finding, 'message', str(finding))
+
+
+class Sink(abc.ABC):  # pylint: disable=too-many-instance-attributes
+    """Base class for notification sinks. Subclasses implement deliver().
+    """
+
+    def __init__(self, name, batch_size=20,  # pylint: disable=too-many-arguments
+                 timeout=10.0, max_retries=3, retry_delay=1.0, queue_size=1000):
+        """Constructor
+
+        :param name: (str) the name of the sink, used in logs and reports
+        :param batch_size: (int) the maximum number of findings delivered at once
+        :param timeout: (float) the number of seconds a delivery may take before it is abandoned
+        :param max_retries: (int) the number of times a failed delivery is retried
+        :param retry_delay: (float) the number of seconds before the first retry, doubled for every
+            subsequent retry
+        :param queue_size: (int) the maximum number of findings waiting to be delivered,
+            dispatch() waiting for room in the queue
+        """
+        self.name = name
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.queue_size = queue_size
+        self.queue = None
+        self.delivered = 0
+        self.failed = 0
+
+    @abc.abstractmethod
+    async def deliver(self, findings):
+        """Delivers a batch of findings
+
+        :param findings: (list) the findings to deliver
+        :return: None
+        """
+
+    async def close(self):
+        """Releases the connections held by the sink
+
+        :return: None
+        """
+
+    async def _deliver_with_retries(self, findings):
+        """Delivers a batch of findings, retrying with an exponential backoff
+
+        :param findings: (list) the findings to deliver
+        :return: None
+        """
+        delay = self.retry_delay
+        for attempt in range(self.max_retries + 1):
+            try:
+                await asyncio.wait_for(self.deliver(findings), self.timeout)
+                self.delivered += len(findings)
+                return
+            except Exception as exception:  # pylint: disable=broad-except
+                logging.warning("warning: sink %s delivery attempt %s failed: %r", self.name,
+                                attempt + 1, exception)
+                if attempt < self.max_retries:
+                    await asyncio.sleep(delay)
+                    delay *= 2
+        self.failed += len(findings)
+
+    async def run(self):
+        """Delivers the queued findings in batches until None is queued
+
+        :return: None
+        """
+        done = False
+        try:
+            while not done:
+                batch = [await self.queue.get()]
+                while len(batch) < self.batch_size and not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+                if batch[-1] is None:
+                    done = True
+                    batch.pop()
+                if batch:
+                    await self._deliver_with_retries(batch)
+        finally:
+            await self.close()
+
+
+class _HttpConnectionPool:
+    """Pool of keep-alive HTTP/1.1 connections to a single host
+    """
+
+    def __init__(self, url, max_connections):
+        """Constructor
+
+        :param url: (str) the URL requests are sent to
+        :param max_connections: (int) the maximum number of concurrent connections
+        """
+        url_parts = urlsplit(url)
+        self.ssl = ssl.create_default_context() if url_parts.scheme == 'https' else None
+        self.host = url_parts.hostname
+        self.port = url_parts.port or (443 if self.ssl else 80)
+        self.path = (url_parts.path or '/') + ('?' + url_parts.query if url_parts.query else '')
+        self.max_connections = max_connections
+        self.semaphore = None
+        self.idle_connections = []
+
+    async def post(self, body, content_type='application/json'):
+        """Posts a request body
+
+        :param body: (bytes) the request body
+        :param content_type: (str) the content type of the body
+        :return: a tuple (status, response body)
+        """
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.max_connections)
+        async with self.semaphore:
+            if self.idle_connections:
+                reader, writer = self.idle_connections.pop()
+            else:
+                reader, writer = await asyncio.open_connection(self.host, self.port, ssl=self.ssl)
+            try:
+                writer.write(
+                    f"POST {self.path} HTTP/1.1\r\nHost: {self.host}\r\n"
+                    f"Content-Type: {content_type}\r\nContent-Length: {len(body)}\r\n\r\n"
+                    .encode('latin-1') + body)
+                await writer.drain()
+                status, response_body, keep_alive = await self._read_response(reader)
+            except BaseException:
+                writer.close()
+                raise
+            if keep_alive:
+                self.idle_connections.append((reader, writer))
+            else:
+                writer.close()
+            return status, response_body
+
+    @staticmethod
+    async def _read_response(reader):
+        """Reads an HTTP response
+
+        :param reader: (asyncio.StreamReader) the connection reader
+        :return: a tuple (status, response body, whether the connection can be reused)
+        """
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionError('connection closed by the server')
+        version, status = status_line.decode('latin-1').split(None, 2)[:2]
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode('latin-1').strip()
+            if not line:
+                break
+            key, _, value = line.partition(':')
+            headers[key.strip().lower()] = value.strip()
+        keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                chunk = await reader.readexactly(size + 2)
+                if not size:
+                    break
+                chunks.append(chunk[:-2])
+            body = b''.join(chunks)
+        elif 'content-length' in headers:
+            body = await reader.readexactly(int(headers['content-length']))
+        else:
+            body = await reader.read()
+            keep_alive = False
+        return int(status), body.decode('utf-8', 'replace'), keep_alive
+
+    def close(self):
+        """Closes the idle connections
+
+        :return: None
+        """
+        for _, writer in self.idle_connections:
+            writer.close()
+        self.idle_connections = []
+
+
+def slack_payload(findings):
+    """Formats findings as a Slack message
+
+    :param findings: (list) the findings
+    :return: (dict) the message
+    """
+    return {'text': '<!here> ' + '\n'.join(get_finding_text(finding) for finding in findings)}
+
+
+def teams_payload(findings):
+    """Formats findings as a Microsoft Teams message card
+
+    :param findings: (list) the findings
+    :return: (dict) the message
+    """
+    return {
+        '@type': 'MessageCard',
+        '@context': 'https://schema.org/extensions',
+        'summary': 'AWS Budgets findings',
+        'text': '\n\n'.join(get_finding_text(finding) for finding in findings),
+    }
+
+
+def json_payload(findings):
+    """Formats findings as JSON records, e.g. for a ticket queue
+
+    :param findings: (list) the findings
+    :return: (dict) the message
+    """
+    return {'findings': [dict(asdict(finding), message=get_finding_text(finding))
+                         if is_dataclass(finding) else {'message': get_finding_text(finding)}
+                         for finding in findings]}
+
+
+class WebhookSink(Sink):
+    """Sink posting findings as JSON to a webhook
+    """
+    PAYLOAD_FORMATS = {
+        'slack': slack_payload,
+        'teams': teams_payload,
+        'json': json_payload,
+    }
+
+    def __init__(self, name, url, payload_format='slack',  # pylint: disable=too-many-arguments
+                 max_connections=2, expected_body=None, **kwargs):
+        """Constructor
+
+        :param name: (str) the name of the sink
+        :param url: (str) the webhook URL
+        :param payload_format: (str) 'slack', 'teams' or 'json'
+        :param max_connections: (int) the maximum number of connections to the webhook
+        :param expected_body: (str) if set, the response body expected from the webhook (e.g. 'ok'
+            for Slack)
+        :param kwargs: the Sink constructor arguments
+        """
+        Sink.__init__(self, name, **kwargs)
+        self.pool = _HttpConnectionPool(url, max_connections)
+        self.format_payload = self.PAYLOAD_FORMATS[payload_format]
+        self.expected_body = expected_body
+
+    async def deliver(self, findings):
+        status, body = await self.pool.post(
+            json.dumps(self.format_payload(findings)).encode('utf-8'))
+        if status >= 300 or (self.expected_body is not None and body != self.expected_body):
+            raise SinkException(f"webhook returned {status}: {body}")
+
+    async def close(self):
+        self.pool.close()
+
+
+class EmailSink(Sink):
+    """Sink sending findings by email. The SMTP connection is kept open between batches and used
+    from a worker thread, smtplib being blocking. A worker thread takes the connection for as long
+    as it sends, so that a retry after a timed out delivery, whose thread may still be sending,
+    never writes to the same SMTP session, and opens a connection of its own instead.
+    """
+
+    def __init__(self, name, host, sender, recipients,  # pylint: disable=too-many-arguments
+                 port=25, use_tls=False, **kwargs):
+        """Constructor
+
+        :param name: (str) the name of the sink
+        :param host: (str) the SMTP server host
+        :param sender: (str) the sender address
+        :param recipients: (list) the recipient addresses
+        :param port: (int) the SMTP server port
+        :param use_tls: (bool) whether to use STARTTLS
+        :param kwargs: the Sink constructor arguments
+        """
+        Sink.__init__(self, name, **kwargs)
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self.recipients = recipients
+        self.use_tls = use_tls
+        self.smtp = None  # the idle connection, None while a worker thread uses it
+        self.smtp_lock = threading.Lock()
+
+    def _send(self, findings):
+        """Sends an email with a batch of findings, reusing the idle SMTP connection if it is
+        still open
+
+        :param findings: (list) the findings
+        :return: None
+        """
+        with self.smtp_lock:
+            smtp, self.smtp = self.smtp, None
+        if smtp is not None:
+            try:
+                smtp.noop()
+            except (smtplib.SMTPException, OSError):
+                smtp.close()
+                smtp = None
+        if smtp is None:
+            smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            if self.use_tls:
+                smtp.starttls()
+        message = EmailMessage()
+        message['Subject'] = f"AWS Budgets: {len(findings)} finding(s)"
+        message['From'] = self.sender
+        message['To'] = ', '.join(self.recipients)
+        message.set_content('\n'.join(get_finding_text(finding) for finding in findings))
+        try:
+            smtp.send_message(message)
+        except (smtplib.SMTPException, OSError):
+            smtp.close()
+            raise
+        with self.smtp_lock:
+            # a retry may have opened another connection meanwhile, which is kept instead
+            if self.smtp is None:
+                self.smtp, smtp = smtp, None
+        if smtp is not None:
+            smtp.close()
+
+    async def deliver(self, findings):
+        await asyncio.get_event_loop().run_in_executor(None, partial(self._send, findings))
+
+    async def close(self):
+        with self.smtp_lock:
+            smtp, self.smtp = self.smtp, None
+        if smtp is not None:
+            await asyncio.get_event_loop().run_in_executor(None, smtp.quit)
+
+
+SINK_TYPES.update({
+    'webhook': WebhookSink,
+    'email': EmailSink,
+})
+
+
+def load_sinks(file_name):
+    """Creates sinks from a JSON configuration file, see get_sinks()
+
+    :param file_name: (str) the name of the configuration file
+    :return: (list) the Sink objects
+    """
+    with open(file_name, encoding='utf-8') as config_file:
+        return get_sinks(json.load(config_file))
+
+
+def get_sinks(config):
+    """Creates sinks from their configuration
+
+    :param config: (list) a dict per sink, with a 'type' ('webhook' or 'email'), a 'name' and the
+        constructor arguments of the sink
+    :return: (list) the Sink objects
+    """
+    return [SINK_TYPES[sink_config['type']](
+        **{key: value for key, value in sink_config.items() if key != 'type'})
+            for sink_config in config]
+
+
+async def _feed(findings, sink):
+    """Queues findings to a sink, waiting for room in its queue, then the None marking their end
+
+    :param findings: (list) the findings
+    :param sink: the Sink object
+    :return: None
+    """
+    for finding in findings:
+        await sink.queue.put(finding)
+    await sink.queue.put(None)
+
+
+async def _dispatch(findings, sinks):
+    """Queues findings to every sink and waits for the sinks to deliver them. Every sink is fed
+    on its own, so that a slow sink doesn't hold back the others.
+
+    :param findings: (list) the findings
+    :param sinks: (list) the Sink objects
+    :return: None
+    """
+    for sink in sinks:
+        sink.queue = asyncio.Queue(maxsize=sink.queue_size)
+    tasks = [asyncio.ensure_future(sink.run()) for sink in sinks]
+    await asyncio.gather(*(_feed(findings, sink) for sink in sinks))
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def dispatch(findings, sinks):
+    """Sends findings to all the sinks concurrently
+
+    :param findings: (list) the findings
+    :param sinks: (list) the Sink objects
+    :return: (dict) a tuple (delivered, failed) with the number of findings per sink name
+    """
+    if findings and sinks:
+        asyncio.run(_dispatch(findings, sinks))
+    return {sink.name: (sink.delivered, sink.failed) for sink in sinks}
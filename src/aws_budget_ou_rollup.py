@@ -0,0 +1,327 @@
+"""Script rolling up the budgets of the accounts of an organisation to its organizational units, and
+checking the thresholds of the units as well as those of the accounts.
+The hierarchy of the organisation is walked once with the Organizations API into an
+OrganizationTree index, cached in a file between runs, in which the path of every account to the
+root is precomputed as (account, unit) pairs. The budget amount and the actual and forecasted spend
+of every account are then added to every unit above it in a single aggregation over these pairs,
+and the thresholds of the accounts and of the units are checked in a single batch.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from os import environ, path
+import argparse
+import json
+import logging
+import sys
+import time
+from botocore.exceptions import BotoCoreError, ClientError
+import numpy
+from aws_budget_check_params import Budget, InvalidPercentageException, evaluate_budgets, \
+    get_budget_from_response, get_threshold_findings
+from aws_budget_fleet_scan import INCOMPLETE_EXIT_STATUS, FleetScanner, add_fleet_arguments
+from aws_budget_notification_sinks import dispatch, load_sinks
+
+# default maximum age of the cached organisation tree, in seconds
+DEFAULT_TREE_MAX_AGE = 24 * 3600
+
+
+class OrganizationTree:
+    """Class indexing the hierarchy of the organizational units of an organisation, and the
+    ancestors of its accounts
+    """
+
+    def __init__(self, units, accounts):
+        """Constructor
+
+        :param units: (list) the roots and organizational units, as (ID, name, parent ID) tuples,
+            every unit after its parent, the parent ID of a root being None
+        :param accounts: (dict) the ID of the root or unit every account belongs to, keyed by
+            account ID
+        """
+        self.units = [tuple(unit) for unit in units]
+        self.accounts = dict(accounts)
+        self.unit_ids = [unit_id for unit_id, _, _ in self.units]
+        unit_indexes = {unit_id: index for index, unit_id in enumerate(self.unit_ids)}
+        # the units from the root down to every unit, and their names
+        ancestors = []
+        self.unit_paths = []
+        for unit_id, name, parent_id in self.units:
+            parent_index = unit_indexes.get(parent_id)
+            if parent_index is None:
+                ancestors.append((unit_indexes[unit_id],))
+                self.unit_paths.append(name)
+            else:
+                ancestors.append(ancestors[parent_index] + (unit_indexes[unit_id],))
+                self.unit_paths.append(f"{self.unit_paths[parent_index]}/{name}")
+        self.account_ids = sorted(self.accounts)
+        self.account_indexes = {account_id: index
+                                for index, account_id in enumerate(self.account_ids)}
+        # an (account index, unit index) row per account and unit above it, so that a rollup is a
+        # single aggregation
+        pairs = [(account_index, unit_index)
+                 for account_index, account_id in enumerate(self.account_ids)
+                 for unit_index in ancestors[unit_indexes[self.accounts[account_id]]]]
+        self.pairs = numpy.array(pairs, dtype=int).reshape(-1, 2)
+
+    @classmethod
+    def from_organizations(cls, organizations_client):
+        """Builds the tree by walking the organisation from its roots
+
+        :param organizations_client: the 'organizations' client of the management account
+        :return: an OrganizationTree object
+        """
+        units = []
+        accounts = {}
+        parents = [(root['Id'], root['Name'], None)
+                   for page in organizations_client.get_paginator('list_roots').paginate()
+                   for root in page['Roots']]
+        while parents:
+            units.extend(parents)
+            children = []
+            for parent_id, _, _ in parents:
+                for page in organizations_client.get_paginator(
+                        'list_organizational_units_for_parent').paginate(ParentId=parent_id):
+                    children.extend((unit['Id'], unit['Name'], parent_id)
+                                    for unit in page['OrganizationalUnits'])
+                for page in organizations_client.get_paginator(
+                        'list_accounts_for_parent').paginate(ParentId=parent_id):
+                    accounts.update((account['Id'], parent_id) for account in page['Accounts']
+                                    if account['Status'] == 'ACTIVE')
+            parents = children
+        return cls(units, accounts)
+
+    def to_dict(self):
+        """Gets the tree as a dict that can be serialised to JSON
+
+        :return: (dict) the units and the accounts of the tree
+        """
+        return {'units': self.units, 'accounts': self.accounts}
+
+    def rollup(self, account_ids, values):
+        """Adds the values of accounts up to every unit above them
+
+        :param account_ids: (list) the IDs of the accounts, the accounts not in the tree being
+            ignored
+        :param values: (numpy.ndarray) a (len(account_ids), n) matrix of the values of the
+            accounts
+        :return: a tuple (a (number of units, n) matrix of the totals of the units, the number of
+            accounts added to every unit)
+        """
+        values = numpy.asarray(values, dtype=float).reshape(len(account_ids), -1)
+        rows = numpy.full(len(self.account_ids), -1, dtype=int)
+        for row, account_id in enumerate(account_ids):
+            if account_id in self.account_indexes:
+                rows[self.account_indexes[account_id]] = row
+            else:
+                logging.warning("warning: account %s is not in the organisation tree", account_id)
+        pair_rows = rows[self.pairs[:, 0]]
+        present = pair_rows >= 0
+        pair_units = self.pairs[present, 1]
+        totals = numpy.zeros((len(self.unit_ids), values.shape[1]))
+        numpy.add.at(totals, pair_units, values[pair_rows[present]])
+        return totals, numpy.bincount(pair_units, minlength=len(self.unit_ids))
+
+
+def load_tree(organizations_client, cache_file_name=None, max_age=DEFAULT_TREE_MAX_AGE):
+    """Gets the tree of the organisation from its cache file, or from Organizations if the cache
+    is missing or too old, updating the cache
+
+    :param organizations_client: the 'organizations' client of the management account
+    :param cache_file_name: (str) the name of the cache file, None to not cache the tree
+    :param max_age: (float) the age (in seconds) above which the cache is built again
+    :return: an OrganizationTree object
+    """
+    if cache_file_name and path.exists(cache_file_name) and \
+            time.time() - path.getmtime(cache_file_name) < max_age:
+        with open(cache_file_name, encoding='utf-8') as cache_file:
+            cache = json.load(cache_file)
+        logging.info("organisation tree read from %s", cache_file_name)
+        return OrganizationTree(cache['units'], cache['accounts'])
+    tree = OrganizationTree.from_organizations(organizations_client)
+    logging.info("organisation tree built: %d units, %d accounts", len(tree.unit_ids),
+                 len(tree.account_ids))
+    if cache_file_name:
+        with open(cache_file_name, 'w', encoding='utf-8') as cache_file:
+            json.dump(tree.to_dict(), cache_file)
+    return tree
+
+
+@dataclass
+class UnitBudget:
+    """Class specifying the budgets of the accounts of an organizational unit, rolled up
+    """
+    unit_id: str
+    path: str  # the names of the units from the root down to the unit
+    accounts: int  # the number of accounts below the unit with a budget
+    limit_amount: float
+    actual_spend: float
+    forecasted_spend: float  # the forecasts of AWS, or the projected spends if there are none
+
+
+def rollup_budgets(tree, account_ids, budgets):
+    """Rolls the budgets of accounts up to every unit of the organisation
+
+    :param tree: the OrganizationTree object
+    :param account_ids: (list) the AWS account of each budget
+    :param budgets: (list) the Budget objects, sharing the same time unit
+    :return: (list) a UnitBudget object per unit with at least one account
+    """
+    time_units = {budget.time_unit for budget in budgets}
+    if len(time_units) > 1:
+        logging.warning("warning: rolling up budgets of different time units: %s",
+                        ', '.join(sorted(time_units)))
+    evaluation = evaluate_budgets(budgets)
+    values = numpy.column_stack((
+        [budget.limit_amount for budget in budgets],
+        [budget.calculated_actual_spend for budget in budgets],
+        evaluation.forecasted_spend,
+    )) if budgets else numpy.zeros((0, 3))
+    totals, counts = tree.rollup(account_ids, values)
+    return [UnitBudget(unit_id=tree.unit_ids[index], path=tree.unit_paths[index],
+                       accounts=int(counts[index]), limit_amount=float(totals[index, 0]),
+                       actual_spend=float(totals[index, 1]),
+                       forecasted_spend=float(totals[index, 2]))
+            for index in numpy.flatnonzero(counts)]
+
+
+def get_rollup_findings(account_ids, budgets,  # pylint: disable=too-many-arguments
+                        unit_budgets, actual_threshold_percentage,
+                        forecasted_threshold_percentage, budget_name='Monthly Budget'):
+    """Checks the thresholds of the budgets of the accounts and of the units in a single batch.
+    The findings of a unit have the unit ID as account ID, and its path as budget name.
+
+    :param account_ids: (list) the AWS account of each budget
+    :param budgets: (list) the Budget objects of the accounts
+    :param unit_budgets: (list) the UnitBudget objects, see rollup_budgets()
+    :param actual_threshold_percentage: (float) the actual threshold percentage
+    :param forecasted_threshold_percentage: (float) the forecasted threshold percentage
+    :param budget_name: (str) the name of the budget of the accounts
+    :return: (list) a ThresholdFinding object per threshold too low to result in a trigger
+    :raises InvalidPercentageException: if a percentage is not >0
+    """
+    unit_time_unit = budgets[0].time_unit if budgets else 'MONTHLY'
+    # the forecasts of the units are complete, so they are not projected again
+    all_budgets = list(budgets) + [Budget(
+        limit_amount=unit_budget.limit_amount, calculated_actual_spend=unit_budget.actual_spend,
+        calculated_forecasted_spend=unit_budget.forecasted_spend, time_unit=unit_time_unit)
+        for unit_budget in unit_budgets]
+    count = len(all_budgets)
+    return get_threshold_findings(
+        list(account_ids) + [unit_budget.unit_id for unit_budget in unit_budgets],
+        [budget_name] * len(budgets) + [unit_budget.path for unit_budget in unit_budgets],
+        all_budgets, [actual_threshold_percentage] * count,
+        [forecasted_threshold_percentage] * count)
+
+
+def get_account_budgets(scanner, account_ids, budget_name, concurrency=16):
+    """Gets the budget of many accounts concurrently
+
+    :param scanner: the FleetScanner object giving access to the accounts
+    :param account_ids: (list) the IDs of the accounts
+    :param budget_name: (str) the name of the budget of every account
+    :param concurrency: (int) the number of accounts read at the same time
+    :return: a tuple (the Budget objects keyed by account ID, the IDs of the accounts that could
+        not be read)
+    """
+    def get_budget(account_id):
+        """Gets the budget of an account, None if it has none
+        """
+        budgets_client = scanner.create_client('budgets',
+                                               **scanner.get_account_credentials(account_id))
+        try:
+            return get_budget_from_response(budgets_client.describe_budget(
+                AccountId=account_id, BudgetName=budget_name)['Budget'])
+        except budgets_client.exceptions.NotFoundException:
+            logging.info("account %s has no budget '%s'", account_id, budget_name)
+            return None
+
+    budgets = {}
+    failed_account_ids = []
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(get_budget, account_id) for account_id in account_ids]
+        for account_id, future in zip(account_ids, futures):
+            try:
+                budget = future.result()
+            except (BotoCoreError, ClientError) as error:
+                logging.warning("warning: could not read account %s: %s", account_id, error)
+                failed_account_ids.append(account_id)
+                continue
+            if budget is not None:
+                budgets[account_id] = budget
+    return budgets, failed_account_ids
+
+
+@dataclass
+class RollupReport:
+    """Class specifying the results of a rollup
+    """
+    unit_budgets: list = field(default_factory=list)  # UnitBudget objects
+    findings: list = field(default_factory=list)  # ThresholdFinding objects
+    failed_account_ids: list = field(default_factory=list)  # accounts that could not be read
+
+    @property
+    def exit_status(self):
+        """The exit status of the rollup: 0 if the checks passed, 1 if any check failed, 2 if
+        some accounts were not read
+        """
+        if self.failed_account_ids:
+            return INCOMPLETE_EXIT_STATUS
+        return 1 if self.findings else 0
+
+
+def main():
+    """Main entry point
+    """
+    parser = argparse.ArgumentParser(
+        description='rolls the budgets of the accounts of the organisation up to its '
+                    'organizational units, and checks the thresholds of the units and accounts')
+    parser.add_argument('--budget-name', default='Monthly Budget',
+                        help='the name of the budget of every account')
+    parser.add_argument('--actual-threshold', type=float, default=80.0,
+                        help='threshold percentage of the actual cost notifications')
+    parser.add_argument('--forecasted-threshold', type=float, default=100.0,
+                        help='threshold percentage of the forecasted cost notifications')
+    parser.add_argument('--tree-cache', help='file the organisation tree is cached in')
+    parser.add_argument('--tree-max-age', type=float, default=DEFAULT_TREE_MAX_AGE,
+                        help='number of seconds after which the cached tree is built again')
+    parser.add_argument('--output', help='JSON file the report is written to')
+    add_fleet_arguments(parser, 16, 'number of accounts read at the same time')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    scanner = FleetScanner(endpoint_url=args.endpoint_url, role_name=args.role_name)
+    tree = load_tree(scanner.create_client('organizations'), args.tree_cache, args.tree_max_age)
+    budgets, failed_account_ids = get_account_budgets(scanner, tree.account_ids,
+                                                      args.budget_name, args.concurrency)
+    account_ids = sorted(budgets)
+    account_budgets = [budgets[account_id] for account_id in account_ids]
+    report = RollupReport(unit_budgets=rollup_budgets(tree, account_ids, account_budgets),
+                          failed_account_ids=failed_account_ids)
+    try:
+        report.findings = get_rollup_findings(account_ids, account_budgets, report.unit_budgets,
+                                              args.actual_threshold, args.forecasted_threshold,
+                                              args.budget_name)
+    except InvalidPercentageException as ipe:
+        print(str(ipe))
+        sys.exit(-2)
+    for unit_budget in report.unit_budgets:
+        print(f"{unit_budget.path}: {unit_budget.accounts} accounts, budget "
+              f"{unit_budget.limit_amount:.2f}, actual {unit_budget.actual_spend:.2f}, "
+              f"forecasted {unit_budget.forecasted_spend:.2f}")
+    for finding in report.findings:
+        print(finding.message)
+    print(f"{len(account_ids)} accounts in {len(report.unit_budgets)} units, "
+          f"{len(report.findings)} findings, {len(failed_account_ids)} accounts not read")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output_file:
+            json.dump(dict(asdict(report), exit_status=report.exit_status), output_file,
+                      indent=4)
+    if 'SINKS_CONFIG' in environ:
+        logging.info("findings sent to sinks (delivered, failed): %s",
+                     dispatch(report.findings, load_sinks(environ['SINKS_CONFIG'])))
+    sys.exit(report.exit_status)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,443 @@
+"""Script running the release pipeline (template generation, sam build, sam package, then the
+threshold pre-check and deploy.sh for every account) while profiling each of its phases.
+Every phase runs as a child process, in order, the pipeline stopping at the first failure. The
+wall time, the CPU time of the child processes, the bytes sent over the network and the AWS API
+calls of every phase are recorded. The API calls are counted from the client-side monitoring
+events botocore (and thus the AWS and SAM CLIs) sends over UDP when AWS_CSM_ENABLED is set, each
+phase having a client ID of its own. The bytes sent are read from the counters of the network
+interfaces of the host (Linux only), so they include whatever else the host sends meanwhile.
+The phases are written to a trace file in the Chrome trace event format, which chrome://tracing
+and https://ui.perfetto.dev open, and are summarised by phase name, compared to the summary of a
+baseline trace file.
+"""
+
+from collections import Counter
+from dataclasses import asdict, dataclass, field
+from os import environ, path
+import argparse
+import json
+import logging
+import resource
+import socket
+import subprocess
+import sys
+import threading
+import time
+import boto3
+from aws_budget_alerting import WEBHOOK_VARIANT_FIELDS
+from aws_budget_fleet_scan import INCOMPLETE_EXIT_STATUS
+from aws_budget_stack_sets import read_manifest
+from ssm_parameters import SsmParameterResolver, resolve_variant_references
+
+NETWORK_COUNTERS_FILE = '/proc/net/dev'
+# time to wait for the last monitoring events of a phase, sent over UDP
+CSM_SETTLE_SECONDS = 0.2
+# metrics of the phases, summed per phase name in the summaries
+SUMMARY_METRICS = ('wall_seconds', 'cpu_seconds', 'bytes_sent', 'api_calls')
+# minimum growth of the wall time of a phase to be a regression, so that short phases don't
+# flap with noise
+MIN_REGRESSION_SECONDS = 1.0
+
+
+class InvalidManifestException(Exception):
+    """Exception indicating that the account manifest lacks values the deployment needs
+    """
+
+
+@dataclass
+class Phase:
+    """Class specifying a phase of the pipeline
+    """
+    name: str  # e.g. 'sam package', the phases of the same name are summarised together
+    command: list  # the command run, as a list of arguments
+    account_id: str = None  # the account the phase is about, None for the build phases
+    env: dict = field(default_factory=dict)  # environment variables set for the command
+    output_file: str = None  # the file the standard output of the command is written to
+
+
+@dataclass
+class PhaseProfile:  # pylint: disable=too-many-instance-attributes
+    """Class specifying the measurements of a phase that ran
+    """
+    name: str
+    account_id: str  # None for the build phases
+    start: float  # the start of the phase, in seconds since the start of the pipeline
+    wall_seconds: float
+    cpu_seconds: float  # the user and system CPU time of the child processes
+    bytes_sent: int  # sent over the network interfaces of the host, None if unknown
+    api_calls: int = 0  # the number of AWS API calls
+    api_attempts: int = 0  # the number of attempts of the calls, retries included
+    api_call_counts: dict = field(default_factory=dict)  # 'Service.Api' -> number of calls
+    returncode: int = 0
+
+
+def get_pipeline_phases(manifest, bucket, template_file='template.yaml',  # pylint: disable=too-many-arguments,too-many-locals
+                        packaged_template_file='packaged.yaml', profile_format=None,
+                        python=sys.executable):
+    """Gets the phases of the release pipeline, as the Makefile and deploy.sh run them
+
+    :param manifest: (dict) the AlertingTemplateVariant objects keyed by account ID, see
+        aws_budget_stack_sets.read_manifest()
+    :param bucket: (str) the S3 bucket sam package uploads the code of the lambda functions to
+    :param template_file: (str) the file the template is generated to
+    :param packaged_template_file: (str) the file sam package writes the packaged template to
+    :param profile_format: (str) the AWS profile of the phases of every account, e.g.
+        'budgets-{account_id}', None to use the current credentials
+    :param python: (str) the Python interpreter running the scripts
+    :return: (list) the Phase objects
+    :raises InvalidManifestException: if an account lacks a budget or a threshold
+    """
+    phases = [
+        Phase(name='template', command=[python, path.join('src', 'aws_budget_alerting.py')],
+              output_file=template_file),
+        Phase(name='sam build', command=['sam', 'build', '--template-file', template_file]),
+        Phase(name='sam package', command=['sam', 'package', '--output-template-file',
+                                           packaged_template_file, '--s3-bucket', bucket]),
+    ]
+    for account_id, variant in sorted(manifest.items()):
+        values = (variant.monthly_budget, variant.actual_threshold, variant.forecasted_threshold)
+        if None in values:
+            raise InvalidManifestException(
+                f"account {account_id} should have a monthly_budget, an actual_threshold and a "
+                f"forecasted_threshold")
+        # str() keeps every digit, where the general format would round them
+        monthly_budget, actual_threshold, forecasted_threshold = map(str, values)
+        env = {'TEMPLATE_FILE': packaged_template_file}
+        if profile_format:
+            env['AWS_PROFILE'] = profile_format.format(account_id=account_id)
+        for key, url in (('ACTUAL_COST_WEBHOOK_URL', variant.actual_webhook_url),
+                         ('FORECASTED_COST_WEBHOOK_URL', variant.forecasted_webhook_url)):
+            if url:
+                env[key] = url
+        phases.append(Phase(
+            name='threshold check', account_id=account_id, env=env,
+            command=[python, path.join('src', 'aws_budget_check_params.py'), variant.budget_name,
+                     actual_threshold, forecasted_threshold]))
+        phases.append(Phase(
+            name='deploy', account_id=account_id, env=env,
+            command=['./deploy.sh', monthly_budget, actual_threshold, forecasted_threshold,
+                     variant.message_prefix]))
+    return phases
+
+
+def read_bytes_sent(counters_file_name=NETWORK_COUNTERS_FILE):
+    """Reads the number of bytes sent over the network interfaces of the host, but the loopback
+
+    :param counters_file_name: (str) the file of the counters of the interfaces
+    :return: (int) the number of bytes, None if the counters can't be read
+    """
+    try:
+        with open(counters_file_name, encoding='utf-8') as counters_file:
+            lines = counters_file.readlines()[2:]
+    except OSError:
+        return None
+    bytes_sent = 0
+    for line in lines:
+        interface, _, counters = line.partition(':')
+        if interface.strip() != 'lo':
+            # the receive counters come first, then the transmit ones
+            bytes_sent += int(counters.split()[8])
+    return bytes_sent
+
+
+class CsmListener:
+    """Class receiving the client-side monitoring events of the AWS SDKs, and counting the API
+    calls of every client ID
+    """
+
+    def __init__(self):
+        """Constructor
+        """
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind(('127.0.0.1', 0))
+        self.socket.settimeout(CSM_SETTLE_SECONDS)
+        self.calls = {}  # client ID -> Counter of 'Service.Api'
+        self.attempts = Counter()  # client ID -> number of attempts
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._receive, daemon=True)
+
+    @property
+    def port(self):
+        """The port the events are received on
+        """
+        return self.socket.getsockname()[1]
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stopped.set()
+        self.thread.join()
+        self.socket.close()
+
+    def _receive(self):
+        """Receives the events until the listener is stopped
+
+        :return: None
+        """
+        while not self.stopped.is_set():
+            try:
+                event = json.loads(self.socket.recv(65536))
+            except (socket.timeout, ValueError):
+                continue
+            if event.get('Type') != 'ApiCall':
+                continue
+            with self.lock:
+                self.calls.setdefault(event['ClientId'], Counter())[
+                    f"{event['Service']}.{event['Api']}"] += 1
+                self.attempts[event['ClientId']] += event.get('AttemptCount', 1)
+
+    def get_calls(self, client_id):
+        """Gets the API calls of a client ID, waiting for its last events
+
+        :param client_id: (str) the client ID
+        :return: a tuple (the number of calls keyed by 'Service.Api', the number of attempts)
+        """
+        time.sleep(CSM_SETTLE_SECONDS)
+        with self.lock:
+            return dict(self.calls.get(client_id, {})), self.attempts[client_id]
+
+
+class PipelineProfiler:
+    """Class running the phases of a pipeline one after the other, and measuring them
+    """
+
+    def __init__(self, csm_listener, working_directory='.'):
+        """Constructor
+
+        :param csm_listener: the CsmListener object counting the API calls of the phases
+        :param working_directory: (str) the directory the phases run in
+        """
+        self.csm_listener = csm_listener
+        self.working_directory = working_directory
+        self.start = time.monotonic()
+
+    def run_phase(self, index, phase):  # pylint: disable=too-many-locals
+        """Runs a phase
+
+        :param index: (int) the index of the phase in the pipeline
+        :param phase: the Phase object
+        :return: a PhaseProfile object
+        """
+        client_id = f"pipeline-phase-{index}"
+        env = dict(environ, AWS_CSM_ENABLED='true', AWS_CSM_HOST='127.0.0.1',
+                   AWS_CSM_PORT=str(self.csm_listener.port), AWS_CSM_CLIENT_ID=client_id,
+                   **phase.env)
+        logging.info("running %s%s: %s", phase.name,
+                     f" ({phase.account_id})" if phase.account_id else '',
+                     ' '.join(phase.command))
+        usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        bytes_sent = read_bytes_sent()
+        start = time.monotonic()
+        try:
+            if phase.output_file:
+                with open(path.join(self.working_directory, phase.output_file), 'w',
+                          encoding='utf-8') as output_file:
+                    returncode = subprocess.call(phase.command, cwd=self.working_directory,
+                                                 env=env, stdout=output_file)
+            else:
+                returncode = subprocess.call(phase.command, cwd=self.working_directory, env=env)
+        except OSError as error:
+            logging.warning("warning: could not run %s: %s", phase.name, error)
+            # the exit status of a shell for a command not found
+            returncode = 127
+        end = time.monotonic()
+        end_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        end_bytes_sent = read_bytes_sent()
+        api_call_counts, api_attempts = self.csm_listener.get_calls(client_id)
+        return PhaseProfile(
+            name=phase.name, account_id=phase.account_id, start=start - self.start,
+            wall_seconds=end - start,
+            cpu_seconds=(end_usage.ru_utime - usage.ru_utime) +
+            (end_usage.ru_stime - usage.ru_stime),
+            bytes_sent=None if bytes_sent is None or end_bytes_sent is None
+            else end_bytes_sent - bytes_sent,
+            api_calls=sum(api_call_counts.values()), api_attempts=api_attempts,
+            api_call_counts=api_call_counts, returncode=returncode)
+
+    def run(self, phases):
+        """Runs the phases in order, until one fails
+
+        :param phases: (list) the Phase objects
+        :return: (list) the PhaseProfile objects of the phases that ran
+        """
+        profiles = []
+        for index, phase in enumerate(phases):
+            profiles.append(self.run_phase(index, phase))
+            if profiles[-1].returncode:
+                logging.warning("warning: %s failed with exit status %d, pipeline stopped",
+                                phase.name, profiles[-1].returncode)
+                break
+        return profiles
+
+
+def to_chrome_trace(profiles):
+    """Gets the trace of the phases in the Chrome trace event format, the build phases on a track
+    of their own and the phases of every account on the track of the account
+
+    :param profiles: (list) the PhaseProfile objects
+    :return: (dict) the trace, to write as JSON
+    """
+    tracks = {None: 0}
+    for profile in profiles:
+        tracks.setdefault(profile.account_id, len(tracks))
+    events = [{'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': track,
+               'args': {'name': 'build' if account_id is None else f"account {account_id}"}}
+              for account_id, track in tracks.items()]
+    events.extend({
+        'name': profile.name,
+        'cat': 'phase',
+        'ph': 'X',
+        'pid': 1,
+        'tid': tracks[profile.account_id],
+        'ts': round(profile.start * 1e6),
+        'dur': round(profile.wall_seconds * 1e6),
+        'args': asdict(profile),
+    } for profile in profiles)
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+def read_trace_profiles(trace_file_name):
+    """Reads the phases of a trace file written by this script
+
+    :param trace_file_name: (str) the name of the trace file
+    :return: (list) the PhaseProfile objects
+    """
+    with open(trace_file_name, encoding='utf-8') as trace_file:
+        trace = json.load(trace_file)
+    return [PhaseProfile(**event['args']) for event in trace['traceEvents']
+            if event.get('cat') == 'phase']
+
+
+def summarize(profiles):
+    """Sums the metrics of the phases of the same name
+
+    :param profiles: (list) the PhaseProfile objects
+    :return: (dict) the sum of every metric of SUMMARY_METRICS (None if unknown in a phase) and
+        the number of 'runs', keyed by phase name in the order of the pipeline
+    """
+    summary = {}
+    for profile in profiles:
+        totals = summary.setdefault(profile.name, dict(dict.fromkeys(SUMMARY_METRICS, 0), runs=0))
+        totals['runs'] += 1
+        for metric in SUMMARY_METRICS:
+            value = getattr(profile, metric)
+            totals[metric] = None if value is None or totals[metric] is None \
+                else totals[metric] + value
+    return summary
+
+
+@dataclass
+class PhaseComparison:
+    """Class specifying the metrics of a phase compared to those of the baseline
+    """
+    name: str
+    totals: dict  # the sum of every metric of SUMMARY_METRICS, and the number of runs
+    baseline_totals: dict = None  # the same in the baseline, None if the phase is new
+    regression: bool = False  # True if the phase is slower than the baseline beyond tolerance
+
+    @property
+    def wall_change(self):
+        """The change of the wall time, as a percentage of the baseline, None if not comparable
+        """
+        if not self.baseline_totals or not self.baseline_totals['wall_seconds']:
+            return None
+        return (self.totals['wall_seconds'] / self.baseline_totals['wall_seconds'] - 1) * 100
+
+    @property
+    def message(self):
+        """A human-readable line of the comparison table
+        """
+        wall_change = '' if self.wall_change is None else f"{self.wall_change:+.1f}%"
+        baseline = '' if not self.baseline_totals \
+            else f"{self.baseline_totals['wall_seconds']:.2f}"
+        bytes_sent = '' if self.totals['bytes_sent'] is None else self.totals['bytes_sent']
+        return f"{self.name:<16}{self.totals['runs']:>5}{self.totals['wall_seconds']:>10.2f}" \
+               f"{baseline:>10}{wall_change:>9}{self.totals['cpu_seconds']:>9.2f}" \
+               f"{bytes_sent:>13}{self.totals['api_calls']:>10}" \
+               f"{' REGRESSION' if self.regression else ''}"
+
+
+SUMMARY_HEADER = f"{'phase':<16}{'runs':>5}{'wall (s)':>10}{'baseline':>10}{'change':>9}" \
+                 f"{'cpu (s)':>9}{'bytes sent':>13}{'API calls':>10}"
+
+
+def compare_to_baseline(summary, baseline_summary=None, tolerance=20.0):
+    """Compares the summary of a run to the summary of a baseline run
+
+    :param summary: (dict) the summary of the run, see summarize()
+    :param baseline_summary: (dict) the summary of the baseline, None if there is no baseline
+    :param tolerance: (float) the percentage the wall time of a phase may grow by without being
+        a regression, if it grows by more than MIN_REGRESSION_SECONDS
+    :return: (list) the PhaseComparison objects, in the order of the pipeline
+    """
+    comparisons = []
+    for name, totals in summary.items():
+        comparison = PhaseComparison(name=name, totals=totals,
+                                     baseline_totals=(baseline_summary or {}).get(name))
+        comparison.regression = comparison.wall_change is not None and \
+            comparison.wall_change > tolerance and \
+            totals['wall_seconds'] - comparison.baseline_totals['wall_seconds'] > \
+            MIN_REGRESSION_SECONDS
+        comparisons.append(comparison)
+    return comparisons
+
+
+def main():
+    """Main entry point
+    """
+    parser = argparse.ArgumentParser(
+        description='runs the release pipeline, recording the wall time, CPU time, bytes sent and '
+                    'AWS API calls of every phase in a Chrome trace file')
+    parser.add_argument('manifest',
+                        help='CSV file with a header row and the columns account_id, '
+                             'monthly_budget, actual_threshold, forecasted_threshold and '
+                             'optionally the other template variant fields')
+    parser.add_argument('--bucket', default=environ.get('LAMBDA_PACKAGE_BUCKET'),
+                        help='the S3 bucket the lambda code is packaged to (default: '
+                             '$LAMBDA_PACKAGE_BUCKET)')
+    parser.add_argument('--profile-format',
+                        help='the AWS profile of the phases of every account, e.g. '
+                             'budgets-{account_id} (default: the current credentials)')
+    parser.add_argument('--trace', default='pipeline-trace.json',
+                        help='the trace file written (default: pipeline-trace.json)')
+    parser.add_argument('--baseline', help='a trace file of a previous run to compare to')
+    parser.add_argument('--tolerance', type=float, default=20.0,
+                        help='percentage the wall time of a phase may grow by compared to the '
+                             'baseline before being reported as a regression')
+    args = parser.parse_args()
+    if not args.bucket:
+        parser.error('--bucket or LAMBDA_PACKAGE_BUCKET is required')
+
+    logging.basicConfig(level=logging.INFO)
+    try:
+        # the webhook URLs referencing SSM parameters are resolved in memory, and only passed to
+        # deploy.sh in its environment
+        manifest = dict(resolve_variant_references(
+            read_manifest(args.manifest).items(), SsmParameterResolver(boto3.client('ssm')),
+            WEBHOOK_VARIANT_FIELDS))
+        phases = get_pipeline_phases(manifest, args.bucket, profile_format=args.profile_format)
+    except InvalidManifestException as exception:
+        print(str(exception))
+        sys.exit(-2)
+    with CsmListener() as csm_listener:
+        profiles = PipelineProfiler(csm_listener).run(phases)
+    with open(args.trace, 'w', encoding='utf-8') as trace_file:
+        json.dump(to_chrome_trace(profiles), trace_file)
+    baseline_summary = summarize(read_trace_profiles(args.baseline)) if args.baseline else None
+    comparisons = compare_to_baseline(summarize(profiles), baseline_summary, args.tolerance)
+    print(SUMMARY_HEADER)
+    for comparison in comparisons:
+        print(comparison.message)
+    print(f"{len(profiles)} of {len(phases)} phases run in "
+          f"{sum(profile.wall_seconds for profile in profiles):.1f}s, trace written to "
+          f"{args.trace}")
+    if len(profiles) < len(phases) or profiles[-1].returncode:
+        sys.exit(INCOMPLETE_EXIT_STATUS)
+    sys.exit(1 if any(comparison.regression for comparison in comparisons) else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""Script deriving per-service budgets from the spend history of the accounts of an organisation.
+A single account-wide budget lets a runaway service hide inside the total until the whole account
+breaches, so the services driving most of the cost of each account get a budget of their own,
+sized from a percentile of their monthly spend. The spend of every (account, service, month) is
+held in a single cost matrix, and the cost drivers and budgets of every account are computed at
+once over the whole matrix.
+"""
+
+from dataclasses import dataclass
+from datetime import date
+from os import path
+import argparse
+import csv
+import logging
+import sys
+import boto3
+import numpy
+from aws_budget_alerting import AlertingTemplateVariant, build_alerting_template
+from aws_budget_anomaly_detector import get_daily_spend
+from template_emitter import write_template
+
+
+@dataclass
+class ServiceBudget:
+    """Class specifying a budget limiting the monthly spend of an AWS service in an account
+    """
+    account_id: str  # the AWS account the budget is for
+    service: str  # the AWS service, as named by Cost Explorer (e.g. 'AWS Lambda')
+    limit_amount: float  # the monthly budget (in USD)
+    share: float  # the fraction of the spend of the account the service accounted for
+
+
+class CostMatrix:
+    """Class holding the monthly spend of many accounts and services over many months as a matrix
+    with one row per account, one column per service and one layer per month.
+    """
+
+    def __init__(self):
+        """Constructor
+        """
+        self._indexes = ({}, {}, {})  # account ID, service and month -> index in the matrix
+        self._entries = ([], [], [], [])  # account, service and month indexes, amounts
+
+    def add(self, day, account_id, service, amount):
+        """Adds spend to the matrix
+
+        :param day: (str) the day the spend was incurred on (YYYY-MM-DD)
+        :param account_id: (str) the AWS account the spend is associated with
+        :param service: (str) the AWS service the spend is associated with
+        :param amount: (float) the spend
+        :return: None
+        """
+        for entries, indexes, key in zip(self._entries, self._indexes,
+                                         (account_id, service, day[:7])):
+            entries.append(indexes.setdefault(key, len(indexes)))
+        self._entries[3].append(amount)
+
+    def to_arrays(self):
+        """Gets the matrix as arrays
+
+        :return: a tuple (account_ids, services, months, spend) where account_ids, services and
+            months (YYYY-MM) list the rows, columns and layers of spend, an (accounts, services,
+            months) matrix
+        """
+        keys = tuple(sorted(indexes, key=indexes.get) for indexes in self._indexes)
+        spend = numpy.zeros(tuple(len(key_list) for key_list in keys))
+        numpy.add.at(spend, tuple(numpy.array(entries, dtype=int)
+                                  for entries in self._entries[:3]),
+                     numpy.array(self._entries[3], dtype=float))
+        return keys + (spend,)
+
+
+def derive_service_budgets(cost_matrix, top_n=3,  # pylint: disable=too-many-arguments,too-many-locals
+                           percentile=90.0, headroom=0.1, min_share=0.05, rounding=10.0):
+    """Picks the top cost drivers of every account and sizes a budget for each of them
+
+    :param cost_matrix: the CostMatrix object, with full months only
+    :param top_n: (int) the maximum number of services given a budget in every account
+    :param percentile: (float) the percentile of the monthly spend of a service its budget is
+        sized from
+    :param headroom: (float) the fraction of the percentile added to the budget, so that a normal
+        month doesn't reach it
+    :param min_share: (float) the minimum fraction of the spend of the account a service should
+        account for to get a budget
+    :param rounding: (float) the budgets are rounded up to a multiple of this amount (in USD)
+    :return: (list) the ServiceBudget objects, sorted by account then by decreasing spend
+    """
+    account_ids, services, _, spend = cost_matrix.to_arrays()
+    if not spend.size:
+        return []
+    totals = spend.sum(axis=2)
+    shares = totals / numpy.maximum(totals.sum(axis=1, keepdims=True), sys.float_info.epsilon)
+    # rounded to the cent before rounding up, so that float errors don't add a whole step
+    limits = numpy.ceil(numpy.round(numpy.percentile(spend, percentile, axis=2) * (1 + headroom),
+                                    2) / rounding) * rounding
+    # the services of every account by decreasing spend
+    drivers = numpy.argsort(-totals, axis=1, kind='stable')[:, :top_n]
+    driver_shares = numpy.take_along_axis(shares, drivers, axis=1)
+    driver_limits = numpy.take_along_axis(limits, drivers, axis=1)
+    accounts, ranks = numpy.nonzero((driver_shares >= min_share) & (driver_limits > 0))
+    return [ServiceBudget(account_id=account_ids[account], service=services[service],
+                          limit_amount=float(limit), share=float(share))
+            for account, service, limit, share in zip(
+                accounts, drivers[accounts, ranks], driver_limits[accounts, ranks],
+                driver_shares[accounts, ranks])]
+
+
+def main():
+    """Main entry point
+    """
+    parser = argparse.ArgumentParser(
+        description='derives per-service budgets from the monthly spend of the last full months '
+                    'and prints them as CSV')
+    parser.add_argument('--months', type=int, default=6,
+                        help='number of full months of spend history analysed')
+    parser.add_argument('--top', type=int, default=3,
+                        help='maximum number of services given a budget in every account')
+    parser.add_argument('--percentile', type=float, default=90.0,
+                        help='percentile of the monthly spend of a service its budget is sized '
+                             'from')
+    parser.add_argument('--headroom', type=float, default=0.1,
+                        help='fraction of the percentile added to the budget')
+    parser.add_argument('--min-share', type=float, default=0.05,
+                        help='minimum fraction of the spend of the account a service should '
+                             'account for to get a budget')
+    parser.add_argument('--output-dir',
+                        help='directory the alerting template of every account, with its service '
+                             'budgets, is written to')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    end = date.today().replace(day=1)
+    start_month = end.year * 12 + end.month - 1 - args.months
+    start = date(start_month // 12, start_month % 12 + 1, 1)
+    cost_matrix = CostMatrix()
+    for day, account_id, service, amount in get_daily_spend(
+            boto3.client('ce'), start=start.isoformat(), end=end.isoformat()):
+        cost_matrix.add(day, account_id, service, amount)
+    service_budgets = derive_service_budgets(cost_matrix, top_n=args.top,
+                                             percentile=args.percentile, headroom=args.headroom,
+                                             min_share=args.min_share)
+
+    writer = csv.writer(sys.stdout)
+    writer.writerow(['account_id', 'service', 'limit_amount', 'share'])
+    account_budgets = {}
+    for service_budget in service_budgets:
+        writer.writerow([service_budget.account_id, service_budget.service,
+                         f"{service_budget.limit_amount:g}", f"{service_budget.share:.3f}"])
+        account_budgets.setdefault(service_budget.account_id, []).append(service_budget)
+    if args.output_dir is not None:
+        for account_id, budgets in account_budgets.items():
+            write_template(build_alerting_template(variant=AlertingTemplateVariant(),
+                                                   service_budgets=budgets),
+                           path.join(args.output_dir, account_id + '.yaml'))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,412 @@
+"""Script rolling out the budget alerting stack to the accounts of an organisation as a
+CloudFormation stack set, from the management account, instead of running deploy.sh in every
+account.
+A single template is deployed to every account, the values that differ between the accounts (the
+AlertingTemplateVariant fields of aws_budget_alerting.py, read from an account manifest) being
+passed as parameter overrides, and the accounts sharing the same overrides being deployed by a
+single operation. The stack set uses self-managed permissions, as stack sets with service-managed
+permissions don't support the AWS::Serverless transform of the alerting template. A stack set runs
+a single operation at a time, so the operations of the groups of accounts run one after the other,
+each being polled, with backoff, until it is done, and the status of every stack instance is
+reported at the end.
+"""
+
+from collections import Counter
+from dataclasses import dataclass, field
+import argparse
+import logging
+import sys
+import time
+from botocore.exceptions import ClientError
+from aws_budget_alerting import AlertingTemplateVariant, WEBHOOK_PARAMETERS, \
+    WEBHOOK_VARIANT_FIELDS, get_alerting_cf_template, read_variants
+from aws_budget_alerting_management_role import get_cf_template
+from aws_budget_fleet_scan import ALERTING_STACK_NAME, FleetScanner
+from aws_budget_threshold_updater import STACK_CAPABILITIES
+from ssm_parameters import SsmParameterResolver, resolve_variant_references
+
+# stack parameters of the alerting template overridden per account, by AlertingTemplateVariant field
+OVERRIDE_PARAMETERS = {
+    'monthly_budget': 'MonthlyBudget',
+    'actual_threshold': 'ActualThreshold',
+    'forecasted_threshold': 'ForecastedThreshold',
+    'message_prefix': 'MessagePrefix',
+    **WEBHOOK_PARAMETERS,
+}
+# the member (spoke) accounts of a hub-and-spoke deployment have no message prefix nor webhook
+# URLs, see aws_budget_alerting.build_spoke_template()
+SPOKE_OVERRIDE_PARAMETERS = {variant_field: parameter_key for variant_field, parameter_key
+                             in OVERRIDE_PARAMETERS.items()
+                             if variant_field != 'message_prefix'
+                             and variant_field not in WEBHOOK_PARAMETERS}
+# NoEcho parameters, whose values are never logged
+SECRET_PARAMETERS = frozenset(WEBHOOK_PARAMETERS.values())
+DONE_OPERATION_STATUSES = ('SUCCEEDED', 'FAILED', 'STOPPED')
+# statuses of the stack instances by summary status, for the API versions whose summaries have no
+# detailed status: OUTDATED instances weren't deployed by the last operation, and keep their status
+SUMMARY_INSTANCE_STATUSES = {'CURRENT': 'SUCCEEDED', 'INOPERABLE': 'FAILED'}
+LIST_PAGE_SIZE = 100  # the maximum number of stack instances listed per call
+
+
+@dataclass
+class RolloutPreferences:
+    """Class specifying how the stack instances are deployed and polled
+    """
+    regions: tuple = ('us-east-1',)  # budgets are global, one region is enough
+    max_concurrent_percentage: int = 25  # percentage of the accounts deployed at the same time
+    failure_tolerance_percentage: int = 0  # percentage of the accounts that may fail per region
+    poll_interval: float = 5.0  # time between the first polls (in seconds)
+    max_poll_interval: float = 30.0  # the poll interval doubles up to this time (in seconds)
+
+    @property
+    def operation_preferences(self):
+        """The OperationPreferences of the stack set operations
+        """
+        return {
+            'MaxConcurrentPercentage': self.max_concurrent_percentage,
+            'FailureTolerancePercentage': self.failure_tolerance_percentage,
+        }
+
+
+@dataclass
+class StackInstanceStatus:
+    """Class specifying the status of the stack instance of an account
+    """
+    account_id: str
+    region: str
+    status: str  # the detailed status, e.g. 'SUCCEEDED', 'FAILED', 'CANCELLED' or 'OUTDATED'
+    reason: str = ''  # the reason of the status, e.g. why the deployment failed
+
+
+@dataclass
+class RolloutReport:
+    """Class specifying the results of a rollout
+    """
+    stack_set_name: str
+    instances: list = field(default_factory=list)  # the StackInstanceStatus objects
+    operations: dict = field(default_factory=dict)  # operation ID -> final status
+    seconds: float = 0.0  # the time taken by the rollout
+
+    @property
+    def failed_instances(self):
+        """The StackInstanceStatus objects of the instances that weren't deployed
+        """
+        return [instance for instance in self.instances if instance.status != 'SUCCEEDED']
+
+    @property
+    def exit_status(self):
+        """0 if every operation and stack instance succeeded, 1 otherwise
+        """
+        return 1 if self.failed_instances or any(
+            status != 'SUCCEEDED' for status in self.operations.values()) else 0
+
+    @property
+    def message(self):
+        """A human-readable summary of the rollout
+        """
+        counts = Counter(instance.status for instance in self.instances)
+        statuses = ', '.join(f"{count} {status.lower()}"
+                             for status, count in sorted(counts.items()))
+        return f"stack set {self.stack_set_name}: {len(self.instances)} stack instances " \
+               f"({statuses}), {len(self.operations)} operations in {self.seconds:.1f}s"
+
+
+def read_manifest(csv_file_name):
+    """Reads the account manifest
+
+    :param csv_file_name: (str) the name of a CSV file with a header row and the columns
+        'account_id' and the AlertingTemplateVariant fields, see read_variants()
+    :return: (dict) the AlertingTemplateVariant objects keyed by account ID
+    """
+    return dict(read_variants(csv_file_name, name_field='account_id'))
+
+
+def get_parameter_overrides(variant, override_parameters=None):
+    """Gets the parameter overrides of the stack instance of an account
+
+    :param variant: the AlertingTemplateVariant object of the account
+    :param override_parameters: (dict) the stack parameters overridden, by AlertingTemplateVariant
+        field, None for OVERRIDE_PARAMETERS
+    :return: (tuple) the (parameter key, parameter value) tuples, sorted by key
+    """
+    if variant.budget_name != AlertingTemplateVariant.budget_name:
+        logging.warning("warning: the budget name %s can't be overridden, the stack set template "
+                        "names the budget %s", variant.budget_name,
+                        AlertingTemplateVariant.budget_name)
+    return tuple(sorted((parameter_key, str(getattr(variant, variant_field)))
+                        for variant_field, parameter_key in
+                        (override_parameters or OVERRIDE_PARAMETERS).items()
+                        if getattr(variant, variant_field) not in (None, '')))
+
+
+def group_accounts(manifest, override_parameters=None):
+    """Groups the accounts sharing the same parameter overrides, so that each group is deployed by
+    a single operation
+
+    :param manifest: (dict) the AlertingTemplateVariant objects keyed by account ID
+    :param override_parameters: (dict) the stack parameters overridden, see
+        get_parameter_overrides()
+    :return: (dict) the sorted account IDs keyed by parameter overrides
+    """
+    groups = {}
+    for account_id, variant in sorted(manifest.items()):
+        groups.setdefault(get_parameter_overrides(variant, override_parameters),
+                          []).append(account_id)
+    return groups
+
+
+def _to_parameters(parameters):
+    """Converts parameter values to the CloudFormation API format
+
+    :param parameters: (iterable) the (parameter key, parameter value) tuples
+    :return: (list) the Parameter dicts
+    """
+    return [{'ParameterKey': key, 'ParameterValue': value} for key, value in parameters]
+
+
+class StackSetRollout:
+    """Class deploying a template to many accounts as a CloudFormation stack set
+    """
+
+    def __init__(self, cloudformation_client, stack_set_name, preferences=None):
+        """Constructor
+
+        :param cloudformation_client: the CloudFormation client of the management account
+        :param stack_set_name: (str) the name of the stack set
+        :param preferences: the RolloutPreferences object, None for the defaults
+        """
+        self.cloudformation_client = cloudformation_client
+        self.stack_set_name = stack_set_name
+        self.preferences = preferences or RolloutPreferences()
+
+    def ensure_stack_set(self, template_body, parameters):
+        """Creates the stack set, or updates it if its template or parameters changed
+
+        :param template_body: (str) the template
+        :param parameters: (dict) the parameter values common to every account
+        :return: (str) the ID of the operation updating the existing stack instances, None if
+            there is none
+        """
+        parameters = _to_parameters(sorted(parameters.items()))
+        try:
+            stack_set = self.cloudformation_client.describe_stack_set(
+                StackSetName=self.stack_set_name)['StackSet']
+        except ClientError as error:
+            if error.response['Error']['Code'] != 'StackSetNotFoundException':
+                raise
+            self.cloudformation_client.create_stack_set(
+                StackSetName=self.stack_set_name,
+                TemplateBody=template_body,
+                Parameters=parameters,
+                Capabilities=STACK_CAPABILITIES,
+            )
+            logging.info("created stack set %s", self.stack_set_name)
+            return None
+        current_parameters = sorted(stack_set.get('Parameters', []),
+                                    key=lambda parameter: parameter['ParameterKey'])
+        if stack_set.get('TemplateBody') == template_body and [
+                (parameter['ParameterKey'], parameter.get('ParameterValue'))
+                for parameter in current_parameters] == [
+                    (parameter['ParameterKey'], parameter['ParameterValue'])
+                    for parameter in parameters]:
+            return None
+        operation_id = self.cloudformation_client.update_stack_set(
+            StackSetName=self.stack_set_name,
+            TemplateBody=template_body,
+            Parameters=parameters,
+            Capabilities=STACK_CAPABILITIES,
+            OperationPreferences=self.preferences.operation_preferences,
+        )['OperationId']
+        logging.info("updating stack set %s (operation %s)", self.stack_set_name, operation_id)
+        return operation_id
+
+    def get_instances(self):
+        """Lists the stack instances of the stack set, a page of instances at a time
+
+        :return: (list) the StackInstanceStatus objects
+        """
+        paginator = self.cloudformation_client.get_paginator('list_stack_instances')
+        return [StackInstanceStatus(
+            account_id=summary['Account'],
+            region=summary['Region'],
+            status=summary.get('StackInstanceStatus', {}).get(
+                'DetailedStatus',
+                SUMMARY_INSTANCE_STATUSES.get(summary['Status'], summary['Status'])),
+            reason=summary.get('StatusReason', ''))
+                for page in paginator.paginate(StackSetName=self.stack_set_name,
+                                               PaginationConfig={'PageSize': LIST_PAGE_SIZE})
+                for summary in page['Summaries']]
+
+    def deploy_instances(self, groups):
+        """Deploys the stack instances of groups of accounts, one operation per group, creating
+        the instances of the new accounts and updating the overrides of the existing ones. Each
+        operation is waited for before the next one starts.
+
+        :param groups: (dict) the account IDs keyed by parameter overrides, see group_accounts()
+        :return: (dict) the final status of every operation keyed by ID
+        """
+        existing_account_ids = {instance.account_id for instance in self.get_instances()}
+        statuses = {}
+        for overrides, account_ids in groups.items():
+            for create, method in ((True, self.cloudformation_client.create_stack_instances),
+                                   (False, self.cloudformation_client.update_stack_instances)):
+                group_account_ids = [account_id for account_id in account_ids
+                                     if (account_id not in existing_account_ids) == create]
+                if not group_account_ids:
+                    continue
+                operation_id = method(
+                    StackSetName=self.stack_set_name,
+                    Accounts=group_account_ids,
+                    Regions=list(self.preferences.regions),
+                    ParameterOverrides=_to_parameters(overrides),
+                    OperationPreferences=self.preferences.operation_preferences,
+                )['OperationId']
+                logging.info("%s %d stack instances with overrides %s (operation %s)",
+                             'creating' if create else 'updating', len(group_account_ids),
+                             _mask_secrets(overrides), operation_id)
+                statuses[operation_id] = self.wait(operation_id)
+        return statuses
+
+    def wait(self, operation_id):
+        """Polls an operation until it is done
+
+        :param operation_id: (str) the ID of the operation
+        :return: (str) the final status of the operation
+        """
+        interval = self.preferences.poll_interval
+        while True:
+            status = self.cloudformation_client.describe_stack_set_operation(
+                StackSetName=self.stack_set_name,
+                OperationId=operation_id)['StackSetOperation']['Status']
+            if status in DONE_OPERATION_STATUSES:
+                logging.info("operation %s %s", operation_id, status.lower())
+                return status
+            time.sleep(interval)
+            interval = min(interval * 2, self.preferences.max_poll_interval)
+
+    def roll_out(self, template_body, parameters, groups):
+        """Creates or updates the stack set and deploys the stack instances of the accounts
+
+        :param template_body: (str) the template
+        :param parameters: (dict) the parameter values common to every account
+        :param groups: (dict) the account IDs keyed by parameter overrides, see group_accounts()
+        :return: a RolloutReport object
+        """
+        start = time.monotonic()
+        statuses = {}
+        operation_id = self.ensure_stack_set(template_body, parameters)
+        if operation_id is not None:
+            statuses[operation_id] = self.wait(operation_id)
+        statuses.update(self.deploy_instances(groups))
+        return RolloutReport(stack_set_name=self.stack_set_name, instances=self.get_instances(),
+                             operations=statuses, seconds=time.monotonic() - start)
+
+
+def _mask_secrets(parameters):
+    """Masks the values of the NoEcho parameters, so that they can be logged
+
+    :param parameters: (iterable) the (parameter key, parameter value) tuples
+    :return: (dict) the parameter values keyed by parameter key, the secrets being masked
+    """
+    return {key: '****' if key in SECRET_PARAMETERS else value for key, value in parameters}
+
+
+def _parse_parameter(value):
+    """Parses a KEY=VALUE stack parameter
+
+    :param value: (str) the command line value
+    :return: a tuple (parameter key, parameter value)
+    """
+    key, separator, parameter_value = value.partition('=')
+    if not separator or not key:
+        raise argparse.ArgumentTypeError(f"invalid parameter {value}, expected KEY=VALUE")
+    return key, parameter_value
+
+
+def main():
+    """Main entry point
+    """
+    parser = argparse.ArgumentParser(
+        description='deploys the budget alerting stack, or the role managing it, to many accounts '
+                    'as a CloudFormation stack set')
+    parser.add_argument('--template', choices=('alerting', 'alerting-spoke', 'management-role'),
+                        default='alerting',
+                        help='the template deployed, alerting-spoke for the budget-only template '
+                             'of the member accounts of a hub-and-spoke deployment, which needs '
+                             'the HubAccountId parameter')
+    parser.add_argument('--stack-set-name', default=ALERTING_STACK_NAME,
+                        help='the name of the stack set')
+    parser.add_argument('--manifest', metavar='CSV',
+                        help="CSV file with the columns 'account_id' and the template variant "
+                             "fields (e.g. monthly_budget) overriding the parameters of each "
+                             "account, every account of the organisation if not set")
+    parser.add_argument('--parameter', metavar='KEY=VALUE', type=_parse_parameter,
+                        action='append', default=[],
+                        help='parameter value common to every account, can be repeated')
+    parser.add_argument('--region', action='append', dest='regions',
+                        help='region the stacks are deployed to, can be repeated (default: '
+                             'us-east-1)')
+    parser.add_argument('--max-concurrent-percentage', type=int, default=25,
+                        help='percentage of the accounts deployed at the same time')
+    parser.add_argument('--failure-tolerance-percentage', type=int, default=0,
+                        help='percentage of the accounts whose deployment may fail before the '
+                             'operation stops')
+    parser.add_argument('--poll-interval', type=float, default=5.0,
+                        help='time between the first polls of the operations (in seconds)')
+    code = parser.add_mutually_exclusive_group()
+    code.add_argument('--inline-code', metavar='FILE',
+                      help='self-contained handler file to define inline in the alerting '
+                           'template, e.g. lambda-src/inline.js, so that no packaged code needs to '
+                           'be shared with the accounts')
+    code.add_argument('--packaged-template', metavar='FILE',
+                      help='alerting template whose code was uploaded by sam package (e.g. '
+                           'packaged.yaml), deployed as is, the package bucket being readable by '
+                           'the accounts')
+    parser.add_argument('--endpoint-url', help='the URL of the AWS APIs')
+    args = parser.parse_args()
+    if args.template == 'alerting' and args.inline_code is None \
+            and args.packaged_template is None:
+        # the code of the generated template is a local directory, which only sam package uploads
+        parser.error('--template alerting requires --inline-code or --packaged-template')
+    if args.template != 'alerting' and (args.inline_code or args.packaged_template):
+        parser.error('--inline-code and --packaged-template only apply to --template alerting')
+
+    logging.basicConfig(level=logging.INFO)
+    scanner = FleetScanner(endpoint_url=args.endpoint_url)
+    if args.manifest is not None:
+        # the webhook URLs referencing SSM parameters are only resolved in memory, and passed as
+        # overrides of NoEcho parameters
+        resolver = SsmParameterResolver(scanner.create_client('ssm'))
+        manifest = dict(resolve_variant_references(read_manifest(args.manifest).items(),
+                                                   resolver, WEBHOOK_VARIANT_FIELDS))
+    else:
+        manifest = {account_id: AlertingTemplateVariant()
+                    for account_id in scanner.list_account_ids()}
+    if args.packaged_template is not None:
+        with open(args.packaged_template, encoding='utf-8') as template_file:
+            template_body = template_file.read()
+        groups = group_accounts(manifest)
+    elif args.template == 'alerting':
+        template_body = get_alerting_cf_template(inline_code_file=args.inline_code)
+        groups = group_accounts(manifest)
+    elif args.template == 'alerting-spoke':
+        template_body = get_alerting_cf_template(topology='spoke')
+        groups = group_accounts(manifest, SPOKE_OVERRIDE_PARAMETERS)
+    else:
+        template_body = get_cf_template()
+        groups = {(): sorted(manifest)}
+    rollout = StackSetRollout(scanner.create_client('cloudformation'), args.stack_set_name,
+                              RolloutPreferences(
+                                  regions=tuple(args.regions or RolloutPreferences.regions),
+                                  max_concurrent_percentage=args.max_concurrent_percentage,
+                                  failure_tolerance_percentage=args.failure_tolerance_percentage,
+                                  poll_interval=args.poll_interval))
+    report = rollout.roll_out(template_body, dict(args.parameter), groups)
+    for instance in report.failed_instances:
+        print(f"{instance.account_id} {instance.region}: {instance.status} {instance.reason}")
+    print(report.message)
+    sys.exit(report.exit_status)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""Script comparing the time taken to generate the alerting templates of many accounts from scratch,
+with get_alerting_cf_template(), and from an AlertingTemplateSkeleton, built once and rendered per
+account. The timings depend on the machine, so they are only reported, never checked.
+"""
+
+from dataclasses import dataclass
+import argparse
+import time
+from aws_budget_alerting import AlertingTemplateSkeleton, AlertingTemplateVariant, \
+    get_alerting_cf_template, read_variants
+
+
+@dataclass
+class TemplateBenchmark:
+    """Class specifying the time taken to generate the templates of many accounts
+    """
+    variant_count: int  # the number of templates generated by each method
+    full_seconds: float  # time taken to generate every template from scratch
+    skeleton_seconds: float  # time taken to build the skeleton and render every template
+
+    @property
+    def message(self):
+        """A human-readable summary of the benchmark
+        """
+        return f"{self.variant_count} templates: {self.full_seconds:.3f}s from scratch, " \
+               f"{self.skeleton_seconds:.3f}s from the skeleton " \
+               f"({self.full_seconds / self.skeleton_seconds:.1f}x faster)"
+
+
+def get_variants(count):
+    """Gets distinct template variants
+
+    :param count: (int) the number of variants
+    :return: (list) the AlertingTemplateVariant objects
+    """
+    return [AlertingTemplateVariant(monthly_budget=100 + index, actual_threshold=80,
+                                    message_prefix=f'account-{index}')
+            for index in range(count)]
+
+
+def benchmark_templates(variants, single_router=False):
+    """Generates the template of every variant from scratch, then from a skeleton
+
+    :param variants: (list) the AlertingTemplateVariant objects
+    :param single_router: (bool) True to generate the templates with a single router function
+    :return: a TemplateBenchmark object
+    """
+    start = time.perf_counter()
+    for variant in variants:
+        get_alerting_cf_template(single_router=single_router, variant=variant)
+    full_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    skeleton = AlertingTemplateSkeleton(single_router=single_router)
+    for variant in variants:
+        skeleton.render(variant)
+    skeleton_seconds = time.perf_counter() - start
+    return TemplateBenchmark(variant_count=len(variants), full_seconds=full_seconds,
+                             skeleton_seconds=skeleton_seconds)
+
+
+def main():
+    """Main entry point
+    """
+    parser = argparse.ArgumentParser(
+        description='compares the time taken to generate the alerting templates of many accounts '
+                    'from scratch and from a skeleton')
+    variants = parser.add_mutually_exclusive_group()
+    variants.add_argument('--count', type=int, default=100,
+                          help='number of distinct generated variants')
+    variants.add_argument('--variants', metavar='CSV',
+                          help='the --variants file of aws_budget_alerting.py, to benchmark its '
+                               'accounts instead of generated variants')
+    parser.add_argument('--single-router', action='store_true',
+                        help='generate the templates with a single router function')
+    args = parser.parse_args()
+
+    if args.variants is None:
+        benchmarked_variants = get_variants(args.count)
+    else:
+        benchmarked_variants = [variant for _, variant in read_variants(args.variants)]
+    print(benchmark_templates(benchmarked_variants, single_router=args.single_router).message)
+
+
+if __name__ == "__main__":
+    main()
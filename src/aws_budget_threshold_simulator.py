@@ -0,0 +1,244 @@
+"""Module replaying historical daily spend against AWS Budgets notifications in order to recommend
+actual and forecasted threshold percentages.
+
+An ACTUAL notification fires the first time the spend of the month goes above the threshold
+percentage of the budget, and a FORECASTED notification fires the first time the forecasted spend
+for the month goes above its threshold percentage. Every combination of thresholds of a grid is
+evaluated for every account at once, trading the number of days of warning given before the budget
+is exceeded against the number of alerts raised in months where it was not.
+"""
+
+from os import path
+from dataclasses import dataclass
+from datetime import date
+import calendar
+import csv
+import sys
+import logging
+import boto3
+import numpy
+from aws_budget_anomaly_detector import get_daily_spend
+
+DEFAULT_ACTUAL_THRESHOLDS = range(50, 160, 10)
+DEFAULT_FORECASTED_THRESHOLDS = range(80, 210, 10)
+MAX_DAYS_IN_MONTH = 31
+
+
+@dataclass
+class ThresholdRecommendation:
+    """Class specifying the recommended thresholds for an account
+    """
+    account_id: str  # the AWS account the thresholds are recommended for
+    actual_threshold: int  # recommended percentage of the budget for ACTUAL notifications
+    forecasted_threshold: int  # recommended percentage of the budget for FORECASTED notifications
+    mean_lead_days: float  # mean number of days an alert fired before the budget was exceeded
+    missed_overspends: int  # number of months the budget was exceeded without an earlier alert
+    false_alarms: int  # number of alerts fired in months where the budget was not exceeded
+    months: int  # number of months replayed
+
+
+class SpendHistory:
+    """Class holding the daily spend of many accounts over many months as a matrix with one row per
+    (account, month), padded to 31 days.
+    """
+
+    def __init__(self, monthly_budgets):
+        """Constructor
+
+        :param monthly_budgets: (dict) the monthly budget (in USD) keyed by account ID. Spend of
+            accounts that are not in this dict is ignored.
+        """
+        self.monthly_budgets = monthly_budgets
+        self._rows = {}
+
+    def add(self, day, account_id, amount):
+        """Adds spend to the history
+
+        :param day: (str) the day the spend was incurred on (YYYY-MM-DD)
+        :param account_id: (str) the AWS account the spend is associated with
+        :param amount: (float) the spend
+        :return: None
+        """
+        if account_id not in self.monthly_budgets:
+            return
+        year, month, day_of_month = (int(part) for part in day.split('-'))
+        row = self._rows.get((account_id, year, month))
+        if row is None:
+            row = self._rows[(account_id, year, month)] = numpy.zeros(MAX_DAYS_IN_MONTH)
+        row[day_of_month - 1] += amount
+
+    def to_arrays(self):
+        """Gets the history as arrays, with rows sorted by account
+
+        :return: a tuple (account_ids, row_accounts, daily_spend, days_in_month, budget) where
+            account_ids lists the accounts, row_accounts is the index in account_ids of the account
+            of each row, daily_spend is a (rows, 31) matrix, and days_in_month and budget are the
+            length and the budget of the month of each row
+        """
+        keys = sorted(self._rows)
+        account_ids = sorted({key[0] for key in keys})
+        account_index = {account_id: index for index, account_id in enumerate(account_ids)}
+        row_accounts = numpy.array([account_index[key[0]] for key in keys], dtype=int)
+        daily_spend = numpy.array([self._rows[key] for key in keys]).reshape(
+            len(keys), MAX_DAYS_IN_MONTH)
+        days_in_month = numpy.array([calendar.monthrange(key[1], key[2])[1] for key in keys])
+        budget = numpy.array([float(self.monthly_budgets[key[0]]) for key in keys])
+        return account_ids, row_accounts, daily_spend, days_in_month, budget
+
+
+def _first_crossing_day(percentages, thresholds):
+    """Gets the first day each row goes above each threshold
+
+    :param percentages: (numpy.ndarray) (rows, days) matrix of percentages of the budget
+    :param thresholds: (numpy.ndarray) the threshold percentages
+    :return: a (rows, thresholds) matrix of day indexes, the number of days if never crossed
+    """
+    crossed = numpy.maximum.accumulate(percentages, axis=1)[:, :, None] > thresholds
+    return numpy.where(crossed.any(axis=1), crossed.argmax(axis=1), percentages.shape[1])
+
+
+def _replay_months(actual_percentages, forecasted_percentages, actual_thresholds,
+                   forecasted_thresholds):
+    """Replays every month against every combination of thresholds
+
+    :param actual_percentages: (numpy.ndarray) (rows, days) matrix of the spend of the month so
+        far, as percentages of the budget
+    :param forecasted_percentages: (numpy.ndarray) (rows, days) matrix of the forecasted spend for
+        the month, as percentages of the budget
+    :param actual_thresholds: (numpy.ndarray) the ACTUAL notification threshold percentages
+    :param forecasted_thresholds: (numpy.ndarray) the FORECASTED notification threshold percentages
+    :return: a tuple (overspent, lead_days, missed, false_alarms) where overspent flags the rows
+        where the budget was exceeded and the others are (rows, actual thresholds, forecasted
+        thresholds) matrices
+    """
+    never = actual_percentages.shape[1]
+    breach_day = _first_crossing_day(actual_percentages, numpy.array([100.0]))[:, None]
+    overspent = breach_day < never
+    actual_day = _first_crossing_day(actual_percentages, actual_thresholds)
+    forecasted_day = _first_crossing_day(forecasted_percentages, forecasted_thresholds)
+
+    first_alert_day = numpy.minimum(actual_day[:, :, None], forecasted_day[:, None, :])
+    lead_days = numpy.where(overspent, numpy.clip(breach_day - first_alert_day, 0, None), 0)
+    missed = overspent & (first_alert_day > breach_day)
+    alerts = (actual_day < never).astype(int)[:, :, None] + \
+        (forecasted_day < never).astype(int)[:, None, :]
+    false_alarms = numpy.where(overspent, 0, alerts)
+    return overspent[:, 0, 0], lead_days, missed, false_alarms
+
+
+def simulate_thresholds(history, actual_thresholds, forecasted_thresholds,  # pylint: disable=too-many-locals
+                        noise_penalty=5.0):
+    """Replays the spend history against every combination of thresholds and recommends, for each
+    account, the combination giving the most warning before overspend for the least noise.
+
+    The forecasted spend is approximated by the run rate of the month so far.
+
+    :param history: (SpendHistory) the spend history to replay
+    :param actual_thresholds: the ACTUAL notification threshold percentages to evaluate
+    :param forecasted_thresholds: the FORECASTED notification threshold percentages to evaluate
+    :param noise_penalty: (float) the number of days of warning one false alarm is worth
+    :return: (list) a ThresholdRecommendation object per account
+    """
+    account_ids, row_accounts, daily_spend, days_in_month, budget = history.to_arrays()
+    if not account_ids:
+        return []
+    # evaluate the highest thresholds first so that ties are resolved with the least noise
+    actual_thresholds = numpy.sort(numpy.asarray(actual_thresholds, dtype=float))[::-1]
+    forecasted_thresholds = numpy.sort(numpy.asarray(forecasted_thresholds, dtype=float))[::-1]
+
+    actual_percentages = numpy.cumsum(daily_spend, axis=1) / budget[:, None] * 100
+    forecasted_percentages = \
+        actual_percentages * days_in_month[:, None] / numpy.arange(1, MAX_DAYS_IN_MONTH + 1)
+    overspent, lead_days, missed, false_alarms = _replay_months(
+        actual_percentages, forecasted_percentages, actual_thresholds, forecasted_thresholds)
+
+    # aggregate the rows of each account, rows being sorted by account
+    starts = numpy.flatnonzero(numpy.r_[True, row_accounts[1:] != row_accounts[:-1]])
+    months = numpy.diff(numpy.r_[starts, len(row_accounts)])
+    mean_lead_days = numpy.add.reduceat(lead_days, starts, axis=0) / \
+        numpy.maximum(numpy.add.reduceat(overspent.astype(int), starts), 1)[:, None, None]
+    total_missed = numpy.add.reduceat(missed.astype(int), starts, axis=0)
+    total_false_alarms = numpy.add.reduceat(false_alarms, starts, axis=0)
+
+    score = mean_lead_days - noise_penalty * total_false_alarms / months[:, None, None]
+    best = (numpy.arange(len(account_ids)),) + numpy.unravel_index(
+        score.reshape(len(account_ids), -1).argmax(axis=1), score.shape[1:])
+
+    return [ThresholdRecommendation(
+        account_id=account_id,
+        actual_threshold=int(actual_threshold),
+        forecasted_threshold=int(forecasted_threshold),
+        mean_lead_days=float(lead),
+        missed_overspends=int(missed_count),
+        false_alarms=int(false_alarm_count),
+        months=int(month_count),
+    ) for account_id, actual_threshold, forecasted_threshold, lead, missed_count,
+          false_alarm_count, month_count in zip(
+              account_ids, actual_thresholds[best[1]], forecasted_thresholds[best[2]],
+              mean_lead_days[best], total_missed[best], total_false_alarms[best], months)]
+
+
+def read_monthly_budgets(file_name):
+    """Reads the monthly budget of each account from a CSV file with 'account_id' and
+    'monthly_budget' columns
+
+    :param file_name: (str) the name of the CSV file
+    :return: (dict) the monthly budget (in USD) keyed by account ID
+    """
+    with open(file_name, newline='', encoding='utf-8') as budgets_file:
+        return {row['account_id']: float(row['monthly_budget'])
+                for row in csv.DictReader(budgets_file)}
+
+
+def usage():
+    """prints the script's usage
+
+    :return: None
+    """
+
+    print(
+        f"usage: {path.basename(__file__)} BUDGETS_CSV MONTHS\n"
+        f"Replays the daily spend of the last MONTHS full months against a grid of actual and\n"
+        f"forecasted threshold percentages and prints the recommended thresholds for each "
+        f"account.\n"
+        f"\n"
+        f"where:\n"
+        f"\n"
+        f"BUDGETS_CSV is a CSV file with 'account_id' and 'monthly_budget' columns\n"
+        f"MONTHS is the number of months of spend history to replay\n"
+    )
+
+
+def main():
+    """Main entry point
+    """
+    if len(sys.argv) != 3:
+        usage()
+        sys.exit(-1)
+    history = SpendHistory(read_monthly_budgets(sys.argv[1]))
+    months = int(sys.argv[2])
+
+    if logging.getLogger(__name__).level > logging.INFO:
+        logging.basicConfig(level=logging.INFO)
+
+    end = date.today().replace(day=1)
+    start_month = end.year * 12 + end.month - 1 - months
+    start = date(start_month // 12, start_month % 12 + 1, 1)
+    for day, account_id, _, amount in get_daily_spend(boto3.client('ce'), start=start.isoformat(),
+                                                      end=end.isoformat()):
+        history.add(day, account_id, amount)
+
+    writer = csv.writer(sys.stdout)
+    writer.writerow(['account_id', 'actual_threshold', 'forecasted_threshold', 'mean_lead_days',
+                     'missed_overspends', 'false_alarms', 'months'])
+    for recommendation in simulate_thresholds(history, DEFAULT_ACTUAL_THRESHOLDS,
+                                              DEFAULT_FORECASTED_THRESHOLDS):
+        writer.writerow([recommendation.account_id, recommendation.actual_threshold,
+                         recommendation.forecasted_threshold,
+                         f"{recommendation.mean_lead_days:.1f}",
+                         recommendation.missed_overspends, recommendation.false_alarms,
+                         recommendation.months])
+
+
+if __name__ == "__main__":
+    main()
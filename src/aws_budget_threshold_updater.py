@@ -0,0 +1,365 @@
+"""Script updating the thresholds of the budget notifications of many accounts at once, instead of
+redeploying the alerting stack of every account with deploy.sh.
+The new thresholds are set by a policy: fixed percentages, and/or the minimum viable threshold of
+the notifications whose threshold is too low to trigger an alert in the current period (see
+aws_budget_check_params.py), i.e. the current spend plus a margin. The notifications are updated
+concurrently with budgets.update_notification(), under a rate limit, and the threshold parameters
+of the alerting stack managing the budget are updated too, so that the stack doesn't drift from
+its budget. Thresholds that are already correct are left alone, so that the script can be run
+again safely.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+import argparse
+import json
+import logging
+import math
+import sys
+import threading
+import time
+from botocore.exceptions import BotoCoreError, ClientError
+from aws_budget_fleet_scan import ALERTING_STACK_NAME, THRESHOLD_PARAMETERS, FleetScanner, \
+    add_fleet_arguments
+
+STACK_CAPABILITIES = ['CAPABILITY_IAM', 'CAPABILITY_NAMED_IAM', 'CAPABILITY_AUTO_EXPAND']
+
+
+@dataclass
+class ThresholdPolicy:
+    """Class specifying how the new thresholds are computed
+    """
+    thresholds: dict = field(default_factory=dict)  # notification type -> threshold (percentage)
+    minimum_viable: bool = False  # raise the thresholds too low to trigger an alert above the spend
+    margin: float = 5.0  # percentage points added to the spend for the minimum viable thresholds
+
+    def get_threshold(self, notification_type, threshold, spend_percentage):
+        """Gets the new threshold of a notification
+
+        :param notification_type: (str) 'ACTUAL' or 'FORECASTED'
+        :param threshold: (float) the current threshold (percentage of the budget)
+        :param spend_percentage: (float) the actual or forecasted spend, as a percentage of the
+            budget, None if unknown
+        :return: (float) the new threshold, the current one if it should not change
+        """
+        new_threshold = float(self.thresholds.get(notification_type, threshold))
+        if self.minimum_viable and spend_percentage is not None and \
+                new_threshold < spend_percentage:
+            new_threshold = float(math.ceil(spend_percentage + self.margin))
+        return new_threshold
+
+
+@dataclass
+class ThresholdUpdate:
+    """Class specifying a change of the threshold of a budget notification
+    """
+    account_id: str
+    budget_name: str
+    notification_type: str  # 'ACTUAL' or 'FORECASTED'
+    old_threshold: float
+    new_threshold: float
+    notification: dict = field(default=None, repr=False)  # the notification, as described by AWS
+
+    @property
+    def message(self):
+        """A human-readable description of the change
+        """
+        return f"account {self.account_id}, budget '{self.budget_name}', " \
+               f"{self.notification_type.lower()} threshold: {self.old_threshold:g} -> " \
+               f"{self.new_threshold:g}"
+
+
+@dataclass
+class StackParameterUpdate:
+    """Class specifying a change of a parameter of a stack
+    """
+    account_id: str
+    stack_name: str
+    parameter_key: str
+    old_value: str
+    new_value: str
+
+    @property
+    def message(self):
+        """A human-readable description of the change
+        """
+        return f"account {self.account_id}, stack {self.stack_name}, {self.parameter_key}: " \
+               f"{self.old_value} -> {self.new_value}"
+
+
+@dataclass
+class AccountUpdate:
+    """Class specifying the changes made (or to make, in dry-run mode) to an account
+    """
+    account_id: str
+    threshold_updates: list = field(default_factory=list)  # ThresholdUpdate objects
+    stack_updates: list = field(default_factory=list)  # StackParameterUpdate objects
+    unchanged: int = 0  # the number of notifications whose threshold is already correct
+    error: str = None  # the reason why the account could not be updated, None if it was
+
+
+class RateLimiter:  # pylint: disable=too-few-public-methods
+    """Class spacing out calls shared by several threads
+    """
+
+    def __init__(self, calls_per_second):
+        """Constructor
+
+        :param calls_per_second: (float) the maximum number of calls per second
+        """
+        self.interval = 1 / calls_per_second
+        self.next_call = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Waits until the next call is allowed
+
+        :return: None
+        """
+        with self.lock:
+            now = time.monotonic()
+            wait = self.next_call - now
+            self.next_call = max(now, self.next_call) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+
+class ThresholdUpdater:
+    """Class updating the thresholds of the budget notifications of the accounts of an organisation
+    """
+
+    def __init__(self, scanner, policy, rate_limiter, stack_name=ALERTING_STACK_NAME):
+        """Constructor
+
+        :param scanner: the FleetScanner object giving access to the accounts
+        :param policy: the ThresholdPolicy object
+        :param rate_limiter: the RateLimiter object limiting the update calls
+        :param stack_name: (str) the name of the alerting stack in every account
+        """
+        self.scanner = scanner
+        self.policy = policy
+        self.rate_limiter = rate_limiter
+        self.stack_name = stack_name
+
+    def get_threshold_updates(self, budgets_client, account_id, budget_names=None):
+        """Computes the new thresholds of the notifications of the budgets of an account
+
+        :param budgets_client: the 'budgets' client of the account
+        :param account_id: (str) the account ID
+        :param budget_names: (set) the names of the budgets to update, None for every budget
+        :return: (list) a ThresholdUpdate object per notification, including the notifications
+            whose threshold doesn't change
+        """
+        updates = []
+        for page in budgets_client.get_paginator('describe_budgets').paginate(
+                AccountId=account_id):
+            for budget in page.get('Budgets', []):
+                if 'BudgetLimit' not in budget or \
+                        (budget_names is not None and budget['BudgetName'] not in budget_names):
+                    continue
+                limit_amount = float(budget['BudgetLimit']['Amount'])
+                calculated_spend = budget.get('CalculatedSpend', {})
+                spend_percentages = {
+                    notification_type: float(calculated_spend[key]['Amount']) / limit_amount * 100
+                    for notification_type, key in (('ACTUAL', 'ActualSpend'),
+                                                   ('FORECASTED', 'ForecastedSpend'))
+                    if key in calculated_spend and limit_amount
+                }
+                paginator = budgets_client.get_paginator('describe_notifications_for_budget')
+                for notification_page in paginator.paginate(AccountId=account_id,
+                                                            BudgetName=budget['BudgetName']):
+                    for notification in notification_page.get('Notifications', []):
+                        notification_type = notification['NotificationType']
+                        if notification.get('ThresholdType', 'PERCENTAGE') != 'PERCENTAGE' or \
+                                notification['ComparisonOperator'] != 'GREATER_THAN':
+                            continue
+                        updates.append(ThresholdUpdate(
+                            account_id=account_id, budget_name=budget['BudgetName'],
+                            notification_type=notification_type,
+                            old_threshold=float(notification['Threshold']),
+                            new_threshold=self.policy.get_threshold(
+                                notification_type, float(notification['Threshold']),
+                                spend_percentages.get(notification_type)),
+                            notification=notification))
+        return updates
+
+    def get_stack_updates(self, cloudformation_client, account_id, threshold_updates):
+        """Computes the new threshold parameters of the alerting stack of an account
+
+        :param cloudformation_client: the 'cloudformation' client of the account
+        :param account_id: (str) the account ID
+        :param threshold_updates: (list) the ThresholdUpdate objects of the account
+        :return: a tuple (the StackParameterUpdate objects, the parameters of the stack keyed by
+            parameter key), ([], {}) if the account has no alerting stack managing the updated
+            budgets
+        """
+        try:
+            budget_name = cloudformation_client.describe_stack_resource(
+                StackName=self.stack_name, LogicalResourceId='Budget',
+            )['StackResourceDetail']['PhysicalResourceId']
+        except ClientError as error:
+            if error.response['Error']['Code'] != 'ValidationError':
+                raise
+            logging.info("no stack %s in account %s", self.stack_name, account_id)
+            return [], {}
+        new_thresholds = {update.notification_type: update.new_threshold
+                          for update in threshold_updates if update.budget_name == budget_name}
+        if not new_thresholds:
+            return [], {}
+        stack = cloudformation_client.describe_stacks(StackName=self.stack_name)['Stacks'][0]
+        parameters = {parameter['ParameterKey']: parameter.get('ParameterValue')
+                      for parameter in stack.get('Parameters', [])}
+        stack_updates = []
+        for notification_type, threshold in sorted(new_thresholds.items()):
+            parameter_key = THRESHOLD_PARAMETERS.get(notification_type)
+            if parameter_key not in parameters or \
+                    float(parameters[parameter_key]) == threshold:
+                continue
+            stack_updates.append(StackParameterUpdate(
+                account_id=account_id, stack_name=self.stack_name, parameter_key=parameter_key,
+                old_value=parameters[parameter_key], new_value=f"{threshold:g}"))
+        if stack_updates and not stack['StackStatus'].endswith('_COMPLETE'):
+            raise ValueError(f"stack {self.stack_name} can't be updated in status "
+                             f"{stack['StackStatus']}")
+        return stack_updates, parameters
+
+    def update_account(self, account_id, budget_names=None, dry_run=False):
+        """Updates the thresholds of the notifications of the budgets of an account, and the
+        parameters of its alerting stack
+
+        :param account_id: (str) the account ID
+        :param budget_names: (set) the names of the budgets to update, None for every budget
+        :param dry_run: (bool) if True, the changes are computed but not made
+        :return: an AccountUpdate object
+        """
+        account_update = AccountUpdate(account_id=account_id)
+        try:
+            credentials = self.scanner.get_account_credentials(account_id)
+            budgets_client = self.scanner.create_client('budgets', **credentials)
+            cloudformation_client = self.scanner.create_client('cloudformation', **credentials)
+            updates = self.get_threshold_updates(budgets_client, account_id, budget_names)
+            account_update.threshold_updates = [update for update in updates
+                                                if update.new_threshold != update.old_threshold]
+            account_update.unchanged = len(updates) - len(account_update.threshold_updates)
+            account_update.stack_updates, parameters = self.get_stack_updates(
+                cloudformation_client, account_id, updates)
+            if dry_run:
+                return account_update
+            for update in account_update.threshold_updates:
+                new_notification = {key: value for key, value in update.notification.items()
+                                    if key != 'NotificationState'}
+                new_notification['Threshold'] = update.new_threshold
+                self.rate_limiter.acquire()
+                budgets_client.update_notification(
+                    AccountId=account_id, BudgetName=update.budget_name,
+                    OldNotification=update.notification, NewNotification=new_notification)
+            if account_update.stack_updates:
+                new_values = {update.parameter_key: update.new_value
+                              for update in account_update.stack_updates}
+                self.rate_limiter.acquire()
+                cloudformation_client.update_stack(
+                    StackName=self.stack_name, UsePreviousTemplate=True,
+                    Capabilities=STACK_CAPABILITIES,
+                    Parameters=[{'ParameterKey': key, 'ParameterValue': new_values[key]}
+                                if key in new_values else
+                                {'ParameterKey': key, 'UsePreviousValue': True}
+                                for key in sorted(parameters)])
+        except (BotoCoreError, ClientError, ValueError) as error:
+            logging.warning("warning: could not update account %s: %s", account_id, error)
+            account_update.error = str(error)
+        return account_update
+
+
+def update_fleet(updater, account_ids, budget_names=None, dry_run=False, concurrency=8):
+    """Updates the thresholds of many accounts concurrently
+
+    :param updater: the ThresholdUpdater object
+    :param account_ids: (list) the IDs of the accounts to update
+    :param budget_names: (dict) the names of the budgets to update (set) keyed by account ID,
+        None to update every budget of every account
+    :param dry_run: (bool) if True, the changes are computed but not made
+    :param concurrency: (int) the number of accounts updated at the same time
+    :return: (list) the AccountUpdate objects, in the order of the accounts
+    """
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(
+            lambda account_id: updater.update_account(
+                account_id, None if budget_names is None else budget_names.get(account_id, set()),
+                dry_run),
+            account_ids))
+
+
+def read_scan_report(file_name):
+    """Reads the budgets with findings from the report of a fleet scan (see
+    aws_budget_fleet_scan.py merge --output)
+
+    :param file_name: (str) the name of the JSON report
+    :return: (dict) the names of the budgets with findings (set) keyed by account ID
+    """
+    with open(file_name, encoding='utf-8') as report_file:
+        report = json.load(report_file)
+    budget_names = {}
+    for finding in report['findings']:
+        budget_names.setdefault(finding['account_id'], set()).add(finding['budget_name'])
+    return budget_names
+
+
+def main():
+    """Main entry point
+    """
+    parser = argparse.ArgumentParser(
+        description='updates the thresholds of the budget notifications of many accounts, and '
+                    'the threshold parameters of their alerting stack')
+    parser.add_argument('--actual-threshold', type=float,
+                        help='new threshold percentage of the actual cost notifications')
+    parser.add_argument('--forecasted-threshold', type=float,
+                        help='new threshold percentage of the forecasted cost notifications')
+    parser.add_argument('--minimum-viable', action='store_true',
+                        help='raise the thresholds too low to trigger an alert in the current '
+                             'period just above the current spend')
+    parser.add_argument('--margin', type=float, default=5.0,
+                        help='percentage points added to the spend for the minimum viable '
+                             'thresholds')
+    parser.add_argument('--accounts', nargs='+',
+                        help='the accounts to update (default: every account of the organisation)')
+    parser.add_argument('--scan-report',
+                        help='only update the budgets with findings in this fleet scan report')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='print the changes without making them')
+    parser.add_argument('--rate-limit', type=float, default=5.0,
+                        help='maximum number of update calls per second')
+    add_fleet_arguments(parser, 8, 'number of accounts updated at the same time',
+                        stack_name=True)
+    args = parser.parse_args()
+
+    thresholds = {notification_type: threshold for notification_type, threshold in
+                  (('ACTUAL', args.actual_threshold), ('FORECASTED', args.forecasted_threshold))
+                  if threshold is not None}
+    if not thresholds and not args.minimum_viable:
+        parser.error('at least one of --actual-threshold, --forecasted-threshold and '
+                     '--minimum-viable is required')
+    logging.basicConfig(level=logging.INFO)
+    scanner = FleetScanner(endpoint_url=args.endpoint_url, role_name=args.role_name)
+    budget_names = read_scan_report(args.scan_report) if args.scan_report else None
+    account_ids = args.accounts or (sorted(budget_names) if budget_names is not None
+                                    else scanner.list_account_ids())
+    updater = ThresholdUpdater(scanner, ThresholdPolicy(thresholds, args.minimum_viable,
+                                                        args.margin),
+                               RateLimiter(args.rate_limit), args.stack_name)
+    account_updates = update_fleet(updater, account_ids, budget_names, args.dry_run,
+                                   args.concurrency)
+    for account_update in account_updates:
+        for update in account_update.threshold_updates + account_update.stack_updates:
+            print(('would update ' if args.dry_run else 'updated ') + update.message)
+    failures = [account_update for account_update in account_updates if account_update.error]
+    print(f"{len(account_updates)} accounts: "
+          f"{sum(len(update.threshold_updates) for update in account_updates)} notifications "
+          f"and {sum(len(update.stack_updates) for update in account_updates)} stack "
+          f"parameters {'to update' if args.dry_run else 'updated'}, "
+          f"{sum(update.unchanged for update in account_updates)} notifications unchanged, "
+          f"{len(failures)} accounts failed")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+"""Module building CloudFormation templates in bulk mode.
+Troposphere checks the type of every property when it is assigned, then validates every object
+again each time the template is serialised. In bulk mode, the objects are created without any
+check, then a single validation pass over the finished template replays the property checks and
+validates every object once, reporting all the errors at once, before the template is serialised
+without validating it again.
+"""
+
+from contextlib import contextmanager
+from time import perf_counter
+import logging
+import threading
+import types
+from troposphere import AWSHelperFn, BaseAWSObject
+
+_CHECKED_SETATTR = BaseAWSObject.__setattr__
+_DEFERRED_VALIDATION_LOCK = threading.Lock()
+
+
+class TemplateValidationException(Exception):
+    """Exception indicating that a template built in bulk mode is not valid
+    """
+
+    def __init__(self, errors):
+        """Constructor
+
+        :param errors: (list) the description of every error found in the template
+        """
+        Exception.__init__(self, f"{len(errors)} error(s) in template:\n" + '\n'.join(errors))
+        self.errors = errors
+
+
+def _unchecked_setattr(self, name, value):
+    """Replacement for BaseAWSObject.__setattr__ storing properties without checking them
+
+    :param self: the troposphere object
+    :param name: (str) the name of the attribute
+    :param value: the value of the attribute
+    :return: None
+    """
+    attributes = self.__dict__
+    if '_BaseAWSObject__initialized' not in attributes or name in attributes:
+        object.__setattr__(self, name, value)
+    elif name in attributes['propnames']:
+        self.properties[name] = value
+    else:
+        # resource attributes (DependsOn...) and unknown properties
+        _CHECKED_SETATTR(self, name, value)
+
+
+def _check_property(troposphere_object, name, value):
+    """Checks the value of a property, as BaseAWSObject.__setattr__ does
+
+    :param troposphere_object: the troposphere object
+    :param name: (str) the name of the property
+    :param value: the value of the property
+    :return: the value to store, as converted by the validator function of the property if any
+    :raises TypeError: if the value doesn't have the expected type
+    """
+    if name not in troposphere_object.props:
+        raise AttributeError(f"{type(troposphere_object).__name__} object does not support "
+                             f"attribute {name}")
+    expected_type = troposphere_object.props[name][0]
+    if isinstance(value, AWSHelperFn):
+        return value
+    if isinstance(expected_type, types.FunctionType):
+        try:
+            return expected_type(value)
+        except (TypeError, ValueError) as exception:
+            raise ValueError(f"{name}: {exception}") from exception
+    if isinstance(expected_type, list):
+        expected_types = tuple(expected_type) + (AWSHelperFn,)
+        if isinstance(value, list) and all(isinstance(item, expected_types) for item in value):
+            return value
+    elif isinstance(value, expected_type):
+        return value
+    raise TypeError(f"{name} is {type(value)}, expected {expected_type}")
+
+
+@contextmanager
+def deferred_validation():
+    """Context in which the properties of the troposphere objects created are not checked. The
+    check is replaced for the whole process, so only one thread should create troposphere objects
+    while in this context.
+
+    :return: None
+    """
+    with _DEFERRED_VALIDATION_LOCK:
+        BaseAWSObject.__setattr__ = _unchecked_setattr
+        try:
+            yield
+        finally:
+            BaseAWSObject.__setattr__ = _CHECKED_SETATTR
+
+
+def _iter_objects(value):
+    """Walks the troposphere objects nested in a value
+
+    :param value: a troposphere object, list or dict
+    :return: a generator yielding the troposphere objects
+    """
+    if isinstance(value, BaseAWSObject):
+        yield value
+        for item in value.properties.values():
+            if isinstance(item, (BaseAWSObject, list, dict)):
+                yield from _iter_objects(item)
+    elif isinstance(value, list):
+        for item in value:
+            yield from _iter_objects(item)
+    elif isinstance(value, dict):
+        for item in value.values():
+            yield from _iter_objects(item)
+
+
+def _validate_object(troposphere_object):
+    """Validates a troposphere object built in bulk mode
+
+    :param troposphere_object: the troposphere object
+    :return: None
+    :raises AttributeError, TypeError, ValueError: if the object is not valid
+    """
+    properties = troposphere_object.properties
+    for name, value in properties.items():
+        checked_value = _check_property(troposphere_object, name, value)
+        if checked_value is not value:
+            properties[name] = checked_value
+    if troposphere_object.do_validation:
+        troposphere_object._validate_props()  # pylint: disable=protected-access
+        troposphere_object.validate()
+
+
+def validate_template(template):
+    """Validates every object of a template built in bulk mode, then disables the validation of the
+    objects when the template is serialised
+
+    :param template: the troposphere Template object
+    :return: None
+    :raises TemplateValidationException: if any object is not valid
+    """
+    errors = []
+    objects = []
+    for section, values in (('Parameters', template.parameters),
+                            ('Resources', template.resources),
+                            ('Outputs', template.outputs)):
+        for title, value in values.items():
+            for troposphere_object in _iter_objects(value):
+                objects.append(troposphere_object)
+                try:
+                    _validate_object(troposphere_object)
+                except (AttributeError, TypeError, ValueError) as exception:
+                    errors.append(f"{section}.{title} ({type(troposphere_object).__name__}): "
+                                  f"{exception}")
+    if errors:
+        raise TemplateValidationException(errors)
+    for troposphere_object in objects:
+        troposphere_object.do_validation = False
+
+
+class PhaseTimer:  # pylint: disable=too-few-public-methods
+    """Class measuring the time taken by the phases of a template build
+    """
+
+    def __init__(self):
+        """Constructor
+        """
+        self.timings = {}  # phase name -> seconds
+
+    @contextmanager
+    def phase(self, name):
+        """Context measuring the time taken by a phase
+
+        :param name: (str) the name of the phase
+        :return: None
+        """
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = perf_counter() - start
+            logging.info("%s phase: %.2f ms", name, self.timings[name] * 1000)
+
+
+def build_template(build, bulk=False):
+    """Builds and serialises a template
+
+    :param build: a function returning the troposphere Template object to serialise
+    :param bulk: (bool) if True, the template is built in bulk mode
+    :return: a tuple (the template as YAML, the PhaseTimer object with the time taken by the
+        build, validate and serialize phases)
+    """
+    timer = PhaseTimer()
+    if bulk:
+        with timer.phase('build'), deferred_validation():
+            template = build()
+        with timer.phase('validate'):
+            validate_template(template)
+    else:
+        with timer.phase('build'):
+            template = build()
+    with timer.phase('serialize'):
+        template_yaml = template.to_yaml()
+    return template_yaml, timer
@@ -4,13 +4,14 @@ Lambda service
 
 from troposphere import Template, Parameter, Ref, Join
 from troposphere import s3
+from bulk_build import build_template
 
 
-def get_cf_template():
-    """Generates CloudFormation code for creating an S3 bucket accessible from the Lambda service,
-    therefore allowing the service to download lambda function packages
+def build_cf_template():
+    """Builds the CloudFormation template for creating an S3 bucket accessible from the Lambda
+    service, therefore allowing the service to download lambda function packages
 
-    :return: a string containing the CloudFormation template
+    :return: the troposphere Template object
     """
     template = Template()
     template.set_description('Creates an S3 bucket that can be used when uploading lambda packages')
@@ -65,7 +66,17 @@ def get_cf_template():
 
     ))
 
-    return template.to_yaml()
+    return template
+
+
+def get_cf_template(bulk=False):
+    """Generates CloudFormation code for creating an S3 bucket accessible from the Lambda service,
+    therefore allowing the service to download lambda function packages
+
+    :param bulk: (bool) if True, the template is built in bulk mode, see bulk_build
+    :return: a string containing the CloudFormation template
+    """
+    return build_template(build_cf_template, bulk=bulk)[0]
 
 
 def main():
@@ -0,0 +1,107 @@
+"""Module resolving the values of SSM Parameter Store parameters, such as the webhook URLs of the
+alerting templates of many accounts.
+A value referencing a parameter is written 'ssm:' followed by the parameter name (e.g.
+'ssm:/budgets/actual-webhook-url'). The parameters are fetched GET_PARAMETERS_MAX_NAMES at a time
+with ssm.get_parameters(), SecureString parameters being decrypted, and cached for the run, so that
+every parameter is fetched once however many templates use it.
+"""
+
+from dataclasses import replace
+import threading
+
+SSM_REFERENCE_PREFIX = 'ssm:'
+# maximum number of parameters ssm.get_parameters() accepts in a single call
+GET_PARAMETERS_MAX_NAMES = 10
+
+
+class SsmParameterNotFoundException(Exception):
+    """Exception indicating that SSM parameters don't exist, or can't be read
+    """
+
+
+def get_reference_name(value):
+    """Gets the name of the SSM parameter a value references
+
+    :param value: the value, e.g. 'ssm:/budgets/actual-webhook-url'
+    :return: (str) the parameter name, None if the value doesn't reference a parameter
+    """
+    if isinstance(value, str) and value.startswith(SSM_REFERENCE_PREFIX):
+        return value[len(SSM_REFERENCE_PREFIX):]
+    return None
+
+
+class SsmParameterResolver:
+    """Class getting the values of SSM parameters in batches, and caching them
+    """
+
+    def __init__(self, ssm_client, with_decryption=True):
+        """Constructor
+
+        :param ssm_client: the SSM client
+        :param with_decryption: (bool) if True, the values of SecureString parameters are decrypted
+        """
+        self.ssm_client = ssm_client
+        self.with_decryption = with_decryption
+        self.cache = {}  # parameter name -> value
+        self.calls = 0  # the number of ssm.get_parameters() calls made
+        self.lock = threading.Lock()
+
+    def get_values(self, names):
+        """Gets the values of parameters, fetching the parameters that aren't cached yet
+
+        :param names: (iterable) the parameter names, optionally with a version or label selector
+            (e.g. '/budgets/actual-webhook-url:2')
+        :return: (dict) the values keyed by parameter name
+        :raises SsmParameterNotFoundException: if some parameters don't exist
+        """
+        names = set(names)
+        with self.lock:
+            missing_names = sorted(names.difference(self.cache))
+            for start in range(0, len(missing_names), GET_PARAMETERS_MAX_NAMES):
+                response = self.ssm_client.get_parameters(
+                    Names=missing_names[start:start + GET_PARAMETERS_MAX_NAMES],
+                    WithDecryption=self.with_decryption)
+                self.calls += 1
+                if response.get('InvalidParameters'):
+                    raise SsmParameterNotFoundException(
+                        f"SSM parameters not found: {', '.join(response['InvalidParameters'])}")
+                # the parameters are named as requested, without their selector if they have one
+                self.cache.update((parameter['Name'] + parameter.get('Selector', ''),
+                                   parameter['Value']) for parameter in response['Parameters'])
+            return {name: self.cache[name] for name in names}
+
+    def resolve(self, value):
+        """Resolves a value that may reference a parameter
+
+        :param value: the value, e.g. 'ssm:/budgets/actual-webhook-url'
+        :return: the value of the parameter if the value references one, the value otherwise
+        """
+        name = get_reference_name(value)
+        return value if name is None else self.get_values([name])[name]
+
+
+def resolve_variant_references(variants, resolver, fields):
+    """Replaces the references to SSM parameters of the template variants of many accounts by the
+    values of the parameters. The parameters of all the variants are fetched together, in as few
+    calls as possible.
+
+    :param variants: (iterable) (name, variant) tuples, the variants being dataclass objects, e.g.
+        see aws_budget_alerting.read_variants()
+    :param resolver: the SsmParameterResolver object
+    :param fields: (tuple) the fields of the variants that may reference parameters, e.g.
+        aws_budget_alerting.WEBHOOK_VARIANT_FIELDS
+    :return: (list) the (name, variant) tuples, with the parameter values
+    :raises SsmParameterNotFoundException: if some parameters don't exist
+    """
+    variants = list(variants)
+    values = resolver.get_values(
+        reference_name for _, variant in variants for reference_name in
+        (get_reference_name(getattr(variant, field)) for field in fields)
+        if reference_name is not None)
+    resolved_variants = []
+    for name, variant in variants:
+        references = {field: get_reference_name(getattr(variant, field)) for field in fields}
+        resolved_variants.append((name, replace(variant, **{
+            field: values[reference_name] for field, reference_name in references.items()
+            if reference_name is not None})))
+    return resolved_variants
@@ -0,0 +1,163 @@
+"""Module writing CloudFormation templates to a file incrementally.
+Template.to_yaml() encodes the whole template to a dict, serialises it to JSON, parses the JSON
+back and only then dumps it as YAML, holding several copies of the template in memory. The emitter
+encodes and writes one resource (or parameter, output...) at a time, in the same key order and
+format as Template.to_json() and Template.to_yaml().
+"""
+
+import json
+import yaml
+from cfn_flip.yaml_dumper import CONVERTED_SUFFIXES, FN_PREFIX, TAG_MAP, Dumper, fn_representer
+from troposphere import encode_to_dict
+
+OUTPUT_FORMATS = ('json', 'yaml')
+# template sections containing named entries, written one entry at a time
+ENTRY_SECTIONS = ('Conditions', 'Mappings', 'Metadata', 'Outputs', 'Parameters', 'Resources')
+JSON_INDENT = 4
+
+
+def _get_sections(template):
+    """Gets the sections of a template, in the order they are written
+
+    :param template: the troposphere Template object
+    :return: (list) (section name, section content) tuples
+    """
+    sections = {
+        'AWSTemplateFormatVersion': template.version,
+        'Conditions': template.conditions,
+        'Description': template.description,
+        'Mappings': template.mappings,
+        'Metadata': template.metadata,
+        'Outputs': template.outputs,
+        'Parameters': template.parameters,
+        'Transform': template.transform,
+    }
+    sections = {name: content for name, content in sections.items() if content}
+    # the resources section is required, even if empty
+    sections['Resources'] = template.resources
+    return sorted(sections.items())
+
+
+def _represent_mapping(dumper, value):
+    """Represents a dict as the cfn-flip dumper represents its ODict objects, with the intrinsic
+    functions in their short form (e.g. !Ref)
+
+    :param dumper: the YAML dumper
+    :param value: (dict) the mapping
+    :return: the YAML node
+    """
+    if len(value) == 1:
+        key = next(iter(value))
+        if key in CONVERTED_SUFFIXES:
+            return fn_representer(dumper, key, value[key])
+        if key.startswith(FN_PREFIX):
+            return fn_representer(dumper, key[len(FN_PREFIX):], value[key])
+    return dumper.represent_mapping(TAG_MAP, value, flow_style=False)
+
+
+class _EntryDumper(Dumper):  # pylint: disable=too-many-ancestors
+    """cfn-flip YAML dumper working on plain dicts. The ODict objects used by Template.to_yaml()
+    reference themselves, so each dumped entry would leave garbage behind until a full garbage
+    collection.
+    """
+
+
+_EntryDumper.add_representer(dict, _represent_mapping)
+
+
+def _dump_yaml(data):
+    """Dumps data as YAML, as Template.to_yaml() does
+
+    :param data: (dict) the data, with its keys sorted
+    :return: (str) the YAML document
+    """
+    return yaml.dump(data, Dumper=_EntryDumper, default_flow_style=False, allow_unicode=True)
+
+
+def _load_entry(value):
+    """Encodes a template entry the way Template.to_yaml() does, going through JSON
+
+    :param value: the entry (a troposphere object, dict, list or scalar)
+    :return: the encoded entry, with the keys sorted
+    """
+    return json.loads(json.dumps(encode_to_dict(value), sort_keys=True))
+
+
+def _emit_yaml(template, stream):
+    """Writes a template as YAML
+
+    :param template: the troposphere Template object
+    :param stream: the text stream to write to
+    :return: None
+    """
+    for section, content in _get_sections(template):
+        if section not in ENTRY_SECTIONS or not content:
+            stream.write(_dump_yaml({section: _load_entry(content)}))
+            continue
+        stream.write(f"{section}:\n")
+        for title in sorted(content):
+            # dumped within its section, so that it is indented and wrapped as in the template
+            entry_yaml = _dump_yaml({section: {title: _load_entry(content[title])}})
+            stream.write(entry_yaml[entry_yaml.index('\n') + 1:])
+
+
+def _dump_json(value, indent):
+    """Dumps data as JSON, as Template.to_json() does
+
+    :param value: the data
+    :param indent: (int) the indentation of the lines following the first line
+    :return: (str) the JSON text
+    """
+    return json.dumps(encode_to_dict(value), indent=JSON_INDENT, sort_keys=True,
+                      separators=(',', ': ')).replace('\n', '\n' + ' ' * indent)
+
+
+def _emit_json(template, stream):
+    """Writes a template as JSON
+
+    :param template: the troposphere Template object
+    :param stream: the text stream to write to
+    :return: None
+    """
+    section_separator = '{\n'
+    for section, content in _get_sections(template):
+        stream.write(f"{section_separator}{' ' * JSON_INDENT}{json.dumps(section)}: ")
+        section_separator = ',\n'
+        if section not in ENTRY_SECTIONS or not content:
+            stream.write(_dump_json(content, JSON_INDENT))
+            continue
+        entry_separator = '{\n'
+        for title in sorted(content):
+            stream.write(f"{entry_separator}{' ' * JSON_INDENT * 2}{json.dumps(title)}: "
+                         f"{_dump_json(content[title], JSON_INDENT * 2)}")
+            entry_separator = ',\n'
+        stream.write(f"\n{' ' * JSON_INDENT}}}")
+    stream.write('\n}')
+
+
+def emit_template(template, stream, output_format='yaml'):
+    """Writes a template to a text stream, one entry at a time
+
+    :param template: the troposphere Template object
+    :param stream: the text stream to write to (e.g. a file open for writing)
+    :param output_format: (str) 'json' or 'yaml'
+    :return: None
+    """
+    if output_format == 'json':
+        _emit_json(template, stream)
+    elif output_format == 'yaml':
+        _emit_yaml(template, stream)
+    else:
+        raise ValueError(f"output format should be one of {OUTPUT_FORMATS} (got {output_format})")
+
+
+def write_template(template, file_name):
+    """Writes a template to a file, as JSON if the file name ends with .json, as YAML otherwise
+
+    :param template: the troposphere Template object
+    :param file_name: (str) the name of the file
+    :return: None
+    """
+    output_format = 'json' if file_name.endswith('.json') else 'yaml'
+    with open(file_name, 'w', encoding='utf-8') as template_file:
+        emit_template(template, template_file, output_format)
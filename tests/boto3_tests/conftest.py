@@ -1,6 +1,9 @@
 """pytest configuration
 Define fixtures used by the the tests
 """
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import socketserver
+import threading
 import pytest
 from botocore.stub import Stubber
 from botocore import session
@@ -8,6 +11,8 @@ from botocore import session
 
 STS_CLIENT = session.get_session().create_client('sts')
 BUDGETS_CLIENT = session.get_session().create_client('budgets')
+CE_CLIENT = session.get_session().create_client('ce')
+SSM_CLIENT = session.get_session().create_client('ssm', region_name='us-east-1')
 
 
 @pytest.fixture(autouse=True)
@@ -30,3 +35,106 @@ def budgets_stub():
     with Stubber(BUDGETS_CLIENT) as stubber:
         yield stubber
         stubber.assert_no_pending_responses()
+
+
+@pytest.fixture(autouse=True)
+def ce_stub():
+    """creates a botcore stub for the AWS Cost Explorer service
+
+    :return: yields a Stubber for the AWS Cost Explorer service
+    """
+    with Stubber(CE_CLIENT) as stubber:
+        yield stubber
+        stubber.assert_no_pending_responses()
+
+
+@pytest.fixture(autouse=True)
+def ssm_stub():
+    """creates a botcore stub for the AWS SSM service
+
+    :return: yields a Stubber for the AWS SSM service
+    """
+    with Stubber(SSM_CLIENT) as stubber:
+        yield stubber
+        stubber.assert_no_pending_responses()
+
+
+class WebhookRequestHandler(BaseHTTPRequestHandler):
+    """Request handler standing in for a Slack webhook, recording the requests it receives
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """Records the request and replies 'ok'
+        """
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.requests.append((self.client_address, self.path, body.decode('utf-8')))
+        self.send_response(200)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'ok')
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        """Silences the request logging
+        """
+
+
+@pytest.fixture
+def webhook_server():
+    """starts a local HTTP server standing in for a Slack webhook
+
+    :return: yields the server, whose 'requests' attribute lists the (client address, path, body)
+        of the requests received
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', 0), WebhookRequestHandler)
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+class SmtpRequestHandler(socketserver.StreamRequestHandler):
+    """Request handler standing in for an SMTP server, recording the messages it receives
+    """
+
+    def reply(self, line):
+        """Sends a reply line to the client
+        """
+        self.wfile.write(line.encode('ascii') + b'\r\n')
+
+    def handle(self):
+        """Handles an SMTP session
+        """
+        self.reply('220 localhost ESMTP')
+        while True:
+            line = self.rfile.readline().decode('utf-8').strip()
+            command = line[:4].upper()
+            if not line or command == 'QUIT':
+                self.reply('221 bye')
+                return
+            if command == 'DATA':
+                self.reply('354 end data with <CR><LF>.<CR><LF>')
+                data = []
+                for data_line in iter(self.rfile.readline, b'.\r\n'):
+                    data.append(data_line.decode('utf-8'))
+                self.server.messages.append((self.client_address, ''.join(data)))
+            self.reply('250 ok')
+
+
+@pytest.fixture
+def smtp_server():
+    """starts a local SMTP server
+
+    :return: yields the server, whose 'messages' attribute lists the (client address, message) of
+        the messages received
+    """
+    server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), SmtpRequestHandler)
+    server.daemon_threads = True
+    server.messages = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
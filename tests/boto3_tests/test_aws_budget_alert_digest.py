@@ -0,0 +1,212 @@
+"""Tests for the AWS Budgets alert digest
+"""
+import json
+from botocore import session
+from botocore.stub import Stubber
+from parser_tests.test_aws_budget_notification_parser import get_test_event
+from aws_budget_alert_digest import VISIBILITY_TIMEOUT_SECONDS, AlertDigest, WebhookClient, \
+    WebhookException, run_digest
+
+QUEUE_URL = 'https://sqs.eu-west-1.amazonaws.com/123456789012/budget-alerts'
+
+
+def get_test_message(account_id='123456', alert_type='ACTUAL'):
+    """Returns an AWS Budgets notification message
+
+    :param account_id: (str) the AWS account ID the notification is for
+    :param alert_type: (str) 'ACTUAL' or 'FORECASTED'
+    :return: the message
+    """
+    return get_test_event()['Records'][0]['Sns']['Message'] \
+        .replace('AWS Account 123456', f'AWS Account {account_id}') \
+        .replace('ACTUAL', alert_type)
+
+
+def test_alertdigest_deduplicates_within_window():
+    """ Tests that AlertDigest merges notifications for the same account, budget and alert type and
+    is only due at the end of the window
+
+    :return: None
+    """
+    now = [0.0]
+    digest = AlertDigest(window_seconds=60, clock=lambda: now[0])
+    assert digest.remaining_seconds() is None
+
+    digest.add(get_test_message())
+    now[0] = 30
+    digest.add(get_test_message())
+    digest.add(get_test_message(alert_type='FORECASTED'))
+    digest.add(get_test_message(account_id='210987'))
+    assert not digest.is_due()
+    now[0] = 60
+    assert digest.is_due()
+
+    lines = digest.get_message()['text'].split('\n')
+    assert lines[0] == '<!here> AWS Budgets alerts (3)'
+    assert lines[1] == 'AWS Account 123456 - Monthly Budget - ACTUAL: $981.52 > $981.00 ' \
+                       '(budget $981.00) (x2)'
+    assert lines[2].startswith('AWS Account 123456 - Monthly Budget - FORECASTED')
+    assert lines[3].startswith('AWS Account 210987 - Monthly Budget - ACTUAL')
+    digest.clear()
+    assert digest.get_message() is None
+    assert digest.remaining_seconds() is None
+
+
+def test_run_digest_posts_batch_over_one_connection(webhook_server):
+    """ Tests that run_digest posts one message per window to the webhook, reusing the connection,
+    and deletes the SQS messages once posted
+
+    :param webhook_server: the fixture providing a local HTTP server standing in for the webhook
+    :return: None
+    """
+    sqs_client = session.get_session().create_client('sqs', region_name='eu-west-1')
+    digest = AlertDigest(window_seconds=0, clock=lambda: 0.0)
+    webhook_client = WebhookClient(
+        f'http://127.0.0.1:{webhook_server.server_port}/services/T000/B000')
+
+    with Stubber(sqs_client) as sqs_stub:
+        for account_id in ('123456', '210987'):
+            sqs_stub.add_response('receive_message', {'Messages': [
+                {'MessageId': f'{account_id}-1',
+                 'Body': json.dumps({'Message': get_test_message(account_id)}),
+                 'ReceiptHandle': f'handle-{account_id}-1'},
+                {'MessageId': f'{account_id}-2', 'Body': get_test_message(account_id),
+                 'ReceiptHandle': f'handle-{account_id}-2'},
+            ]})
+            sqs_stub.add_response('delete_message_batch', {'Successful': [], 'Failed': []}, {
+                'QueueUrl': QUEUE_URL,
+                'Entries': [{'Id': '0', 'ReceiptHandle': f'handle-{account_id}-1'},
+                            {'Id': '1', 'ReceiptHandle': f'handle-{account_id}-2'}],
+            })
+        receive_count = []
+        run_digest(sqs_client, QUEUE_URL, digest, webhook_client,
+                   stop=lambda: receive_count.append(1) or len(receive_count) > 2)
+        sqs_stub.assert_no_pending_responses()
+    webhook_client.close()
+
+    assert len(webhook_server.requests) == 2
+    assert webhook_server.requests[0][0] == webhook_server.requests[1][0]
+    assert webhook_server.requests[0][1] == '/services/T000/B000'
+    text = json.loads(webhook_server.requests[0][2])['text']
+    assert text.startswith('<!here> AWS Budgets alerts (1)\nAWS Account 123456')
+    assert '(x2)' in text
+
+
+class RecordingWebhookClient:  # pylint: disable=too-few-public-methods
+    """Webhook client recording the messages posted
+    """
+
+    def __init__(self):
+        self.messages = []
+
+    def post(self, message):
+        """Records the message
+        """
+        self.messages.append(message)
+
+
+class FlakyWebhookClient(RecordingWebhookClient):  # pylint: disable=too-few-public-methods
+    """Webhook client failing to post the first message
+    """
+
+    def post(self, message):
+        """Records the message, failing the first time
+        """
+        super().post(message)
+        if len(self.messages) == 1:
+            raise WebhookException('webhook returned 500: internal error')
+
+
+def test_run_digest_keeps_digest_when_post_fails():
+    """ Tests that a digest that could not be posted is kept, with the notifications received
+    meanwhile, and that its SQS messages are only deleted once it has been posted
+
+    :return: None
+    """
+    sqs_client = session.get_session().create_client('sqs', region_name='eu-west-1')
+    digest = AlertDigest(window_seconds=0, clock=lambda: 0.0)
+    webhook_client = FlakyWebhookClient()
+
+    with Stubber(sqs_client) as sqs_stub:
+        for account_id in ('123456', '210987'):
+            sqs_stub.add_response('receive_message', {'Messages': [
+                {'MessageId': account_id, 'Body': get_test_message(account_id),
+                 'ReceiptHandle': f'handle-{account_id}'},
+            ]})
+        sqs_stub.add_response('delete_message_batch', {'Successful': [], 'Failed': []}, {
+            'QueueUrl': QUEUE_URL,
+            'Entries': [{'Id': '0', 'ReceiptHandle': 'handle-123456'},
+                        {'Id': '1', 'ReceiptHandle': 'handle-210987'}],
+        })
+        receive_count = []
+        run_digest(sqs_client, QUEUE_URL, digest, webhook_client,
+                   stop=lambda: receive_count.append(1) or len(receive_count) > 2)
+        sqs_stub.assert_no_pending_responses()
+
+    assert len(webhook_client.messages) == 2
+    assert webhook_client.messages[1]['text'].startswith('<!here> AWS Budgets alerts (2)\n')
+    assert digest.get_message() is None
+
+
+def test_run_digest_extends_visibility_and_deduplicates():
+    """ Tests that the visibility of the messages buffered for a long window is extended, and that a
+    message delivered again is only counted once, and deleted with its latest receipt handle
+
+    :return: None
+    """
+    sqs_client = session.get_session().create_client('sqs', region_name='eu-west-1')
+    now = [0.0]
+    digest = AlertDigest(window_seconds=70, clock=lambda: now[0])
+    webhook_client = RecordingWebhookClient()
+
+    with Stubber(sqs_client) as sqs_stub:
+        sqs_stub.add_response('receive_message', {'Messages': [
+            {'MessageId': 'message-1', 'Body': get_test_message(), 'ReceiptHandle': 'handle-1'},
+        ]}, {'QueueUrl': QUEUE_URL, 'MaxNumberOfMessages': 10, 'WaitTimeSeconds': 20,
+             'VisibilityTimeout': VISIBILITY_TIMEOUT_SECONDS})
+        # 40 seconds later, the visibility of message-1 is extended, then message-1 is delivered
+        # again as if it had expired
+        sqs_stub.add_response('change_message_visibility_batch', {
+            'Successful': [{'Id': '0'}], 'Failed': [],
+        }, {
+            'QueueUrl': QUEUE_URL,
+            'Entries': [{'Id': '0', 'ReceiptHandle': 'handle-1',
+                         'VisibilityTimeout': VISIBILITY_TIMEOUT_SECONDS}],
+        })
+        sqs_stub.add_response('receive_message', {'Messages': [
+            {'MessageId': 'message-1', 'Body': get_test_message(), 'ReceiptHandle': 'handle-1b'},
+            {'MessageId': 'message-2', 'Body': get_test_message(account_id='210987'),
+             'ReceiptHandle': 'handle-2'},
+        ]})
+        # 40 seconds later, the visibility is extended with the latest receipt handles, a failure
+        # only being logged
+        sqs_stub.add_response('change_message_visibility_batch', {
+            'Successful': [{'Id': '0'}],
+            'Failed': [{'Id': '1', 'SenderFault': True, 'Code': 'ReceiptHandleIsInvalid'}],
+        }, {
+            'QueueUrl': QUEUE_URL,
+            'Entries': [{'Id': '0', 'ReceiptHandle': 'handle-1b',
+                         'VisibilityTimeout': VISIBILITY_TIMEOUT_SECONDS},
+                        {'Id': '1', 'ReceiptHandle': 'handle-2',
+                         'VisibilityTimeout': VISIBILITY_TIMEOUT_SECONDS}],
+        })
+        sqs_stub.add_response('receive_message', {'Messages': []})
+        sqs_stub.add_response('delete_message_batch', {'Successful': [], 'Failed': []}, {
+            'QueueUrl': QUEUE_URL,
+            'Entries': [{'Id': '0', 'ReceiptHandle': 'handle-1b'},
+                        {'Id': '1', 'ReceiptHandle': 'handle-2'}],
+        })
+
+        def stop():
+            """Advances the clock by 40 seconds per loop, stopping after 3 loops
+            """
+            now[0] += 40
+            return now[0] >= 120
+
+        now[0] = -40
+        run_digest(sqs_client, QUEUE_URL, digest, webhook_client, stop=stop)
+        sqs_stub.assert_no_pending_responses()
+
+    assert len(webhook_client.messages) == 1
+    assert webhook_client.messages[0]['text'].startswith('<!here> AWS Budgets alerts (2)\n')
+    assert '(x2)' not in webhook_client.messages[0]['text']
@@ -0,0 +1,77 @@
+"""Tests for the SpendAnomalyDetector class
+"""
+from aws_budget_anomaly_detector import SpendAnomalyDetector, get_daily_spend
+from .conftest import CE_CLIENT
+
+
+def get_cost_and_usage_response(days, next_page_token=None):
+    """Returns a mocked response object for the get_cost_and_usage call
+
+    :param days: (dict) the spend per day, as a dict of {(account_id, service): amount}
+    :param next_page_token: (str) the token of the next page, if any
+    :return: the response object
+    """
+    response = {
+        'ResultsByTime': [{
+            'TimePeriod': {'Start': day, 'End': day},
+            'Groups': [{
+                'Keys': [account_id, service],
+                'Metrics': {'UnblendedCost': {'Amount': str(amount), 'Unit': 'USD'}},
+            } for (account_id, service), amount in amounts.items()],
+            'Estimated': False,
+        } for day, amounts in days.items()],
+    }
+    if next_page_token:
+        response['NextPageToken'] = next_page_token
+    return response
+
+
+def test_spendanomalydetector_process_flags_spike():
+    """ Tests that SpendAnomalyDetector flags a sudden spike in one series only
+
+    :return: None
+    """
+    detector = SpendAnomalyDetector()
+    records = []
+    for day in range(1, 15):
+        records.append((f'2019-05-{day:02}', '123456789012', 'Amazon EC2', 100.0 + day % 3))
+        records.append((f'2019-05-{day:02}', '123456789012', 'AWS Lambda', 5.0 + day % 2))
+    records.append(('2019-05-15', '123456789012', 'Amazon EC2', 1000.0))
+    records.append(('2019-05-15', '123456789012', 'AWS Lambda', 6.0))
+
+    anomalies = list(detector.process(records))
+
+    assert len(anomalies) == 1
+    assert anomalies[0].day == '2019-05-15'
+    assert anomalies[0].service == 'Amazon EC2'
+    assert anomalies[0].severity > 4
+    assert len(detector.series) == 2
+
+
+def test_spendanomalydetector_process_ignores_short_history():
+    """ Tests that SpendAnomalyDetector does not flag series without enough history
+
+    :return: None
+    """
+    detector = SpendAnomalyDetector(min_periods=7)
+    records = [(f'2019-05-{day:02}', '123456789012', 'Amazon EC2', 10.0) for day in range(1, 4)]
+    records.append(('2019-05-04', '123456789012', 'Amazon EC2', 1000.0))
+
+    assert not list(detector.process(records))
+
+
+def test_get_daily_spend_paginates(ce_stub):
+    """ Tests that get_daily_spend follows the Cost Explorer pagination
+
+    :param ce_stub: (Stubber) the fixture providing a stub for the AWS Cost Explorer service
+    :return: None
+    """
+    ce_stub.add_response('get_cost_and_usage', get_cost_and_usage_response(
+        {'2019-05-01': {('123456789012', 'Amazon EC2'): 10}}, next_page_token='page-2'))
+    ce_stub.add_response('get_cost_and_usage', get_cost_and_usage_response(
+        {'2019-05-01': {('123456789012', 'AWS Lambda'): 1.5}}))
+
+    assert list(get_daily_spend(CE_CLIENT, '2019-05-01', '2019-05-02')) == [
+        ('2019-05-01', '123456789012', 'Amazon EC2', 10.0),
+        ('2019-05-01', '123456789012', 'AWS Lambda', 1.5),
+    ]
@@ -1,8 +1,10 @@
 """Tests for the AwsBudgetThresholdchecker class
 """
+from datetime import datetime, timezone
 import pytest
 from botocore.exceptions import ClientError
-from aws_budget_check_params import AwsBudgetThresholdchecker
+from aws_budget_check_params import AwsBudgetThresholdchecker, Budget, InvalidPercentageException, \
+    evaluate_budgets, get_threshold_findings
 from .conftest import BUDGETS_CLIENT, STS_CLIENT
 
 
@@ -187,3 +189,84 @@ def test_awsbudgetthresholdchecker_checkthresholdtrigger_high_thresholds(sts_stu
         actual_threshold_percentage=100,
         forecasted_threshold_percentage=110,
     ) is True
+
+
+def test_get_threshold_findings_period_aware():
+    """ Tests that a batch of budgets of different time units is evaluated over the current period
+    of each budget, and that budgets without a forecast are checked against their projected spend
+
+    :return: None
+    """
+    now = datetime(2019, 5, 16, 12, tzinfo=timezone.utc)
+    may_6 = datetime(2019, 5, 6, tzinfo=timezone.utc).timestamp()
+    may_26 = datetime(2019, 5, 26, tzinfo=timezone.utc).timestamp()
+    budgets = [
+        Budget(limit_amount=10, calculated_actual_spend=6, calculated_forecasted_spend=None,
+               time_unit='DAILY'),
+        Budget(limit_amount=100, calculated_actual_spend=40, calculated_forecasted_spend=90,
+               time_unit='MONTHLY', period_start=1556668800.0, period_end=3706473600.0),
+        Budget(limit_amount=3000, calculated_actual_spend=1000, calculated_forecasted_spend=None,
+               time_unit='QUARTERLY'),
+        Budget(limit_amount=365, calculated_actual_spend=100, calculated_forecasted_spend=None,
+               time_unit='ANNUALLY'),
+        Budget(limit_amount=200, calculated_actual_spend=105, calculated_forecasted_spend=None,
+               time_unit='CUSTOM', period_start=may_6, period_end=may_26),
+        Budget(limit_amount=210, calculated_actual_spend=10, calculated_forecasted_spend=None,
+               time_unit='MONTHLY', period_start=datetime(2019, 5, 11, tzinfo=timezone.utc)
+               .timestamp()),
+    ]
+
+    evaluation = evaluate_budgets(budgets, now)
+    assert evaluation.elapsed_fraction == pytest.approx([0.5, 0.5, 0.5, 135.5 / 365, 0.525,
+                                                         5.5 / 21])
+    assert evaluation.expected_spend == pytest.approx([5, 50, 1500, 135.5, 105, 55])
+    assert evaluation.forecasted_spend == pytest.approx([12, 90, 2000, 100 * 365 / 135.5, 200,
+                                                         10 * 21 / 5.5])
+
+    findings = get_threshold_findings([str(index) for index in range(6)],
+                                      [f'budget-{index}' for index in range(6)], budgets,
+                                      [50, 50, 50, 50, 50, 50], [100, 100, 100, 100, 99, 100], now)
+    assert [(finding.budget_name, finding.notification_type) for finding in findings] == [
+        ('budget-0', 'ACTUAL'), ('budget-4', 'ACTUAL'), ('budget-0', 'FORECASTED'),
+        ('budget-4', 'FORECASTED'),
+    ]
+    assert findings[2].calculated_spend == pytest.approx(12)
+
+
+def test_get_threshold_findings_pace():
+    """ Tests that the budgets whose actual spend is ahead of their limit prorated over the elapsed
+    fraction of their period are found, whatever their time unit
+
+    :return: None
+    """
+    now = datetime(2019, 5, 16, 12, tzinfo=timezone.utc)
+    budgets = [
+        Budget(limit_amount=100, calculated_actual_spend=60, calculated_forecasted_spend=90,
+               time_unit='MONTHLY'),
+        Budget(limit_amount=3000, calculated_actual_spend=1000, calculated_forecasted_spend=None,
+               time_unit='QUARTERLY'),
+        Budget(limit_amount=365, calculated_actual_spend=150, calculated_forecasted_spend=None,
+               time_unit='ANNUALLY'),
+        Budget(limit_amount=200, calculated_actual_spend=110, calculated_forecasted_spend=None,
+               time_unit='CUSTOM', period_start=datetime(2019, 5, 6, tzinfo=timezone.utc)
+               .timestamp(), period_end=datetime(2019, 5, 26, tzinfo=timezone.utc).timestamp()),
+    ]
+
+    assert evaluate_budgets(budgets, now).expected_spend == pytest.approx([50, 1500, 135.5, 105])
+
+    findings = get_threshold_findings(['0', '1', '2', '3'], ['monthly', 'quarterly', 'annually',
+                                                             'custom'], budgets,
+                                      [100] * 4, [150] * 4, now, pace_percentages=[110] * 4)
+    assert [(finding.budget_name, finding.notification_type) for finding in findings] == [
+        ('monthly', 'PACE'), ('annually', 'PACE'),
+    ]
+    assert findings[1].threshold_trigger == pytest.approx(149.05)
+    assert findings[1].calculated_spend == 150
+    assert findings[0].message.startswith("calculated actual spend (60.0) > prorated budget pace (")
+    assert findings[0].message.endswith(") for budget 'monthly' in account 0")
+    assert not get_threshold_findings(['0', '1', '2', '3'], ['monthly', 'quarterly', 'annually',
+                                                             'custom'], budgets,
+                                      [100] * 4, [150] * 4, now)
+    with pytest.raises(InvalidPercentageException):
+        get_threshold_findings(['0'], ['monthly'], budgets[:1], [100], [150], now,
+                               pace_percentages=[0])
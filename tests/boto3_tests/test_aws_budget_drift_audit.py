@@ -0,0 +1,71 @@
+"""Tests for the drift audit of the alerting stacks
+"""
+import io
+import json
+from aws_budget_drift_audit import DriftAuditor, get_budget_setting, run_audit
+from aws_budget_fake_services import FakeAwsServer, generate_fleet
+from aws_budget_fleet_scan import FleetScanner
+
+MANAGEMENT_CREDENTIALS = {'aws_access_key_id': 'MANAGEMENT', 'aws_secret_access_key': 'fake'}
+
+
+def test_get_budget_setting():
+    """ Tests that the budget amount and the thresholds of a budget resource are recognised, the
+    type of a threshold coming from the expected properties
+
+    :return: None
+    """
+    expected_properties = {'NotificationsWithSubscribers': [
+        {'Notification': {'NotificationType': 'ACTUAL'}},
+        {'Notification': {'NotificationType': 'FORECASTED'}},
+    ]}
+    assert get_budget_setting('/Budget/BudgetLimit/Amount', expected_properties) == \
+        'budget amount'
+    assert get_budget_setting('/NotificationsWithSubscribers/1/Notification/Threshold',
+                              expected_properties) == 'forecasted threshold'
+    assert get_budget_setting('/NotificationsWithSubscribers/2/Notification/Threshold',
+                              expected_properties) == 'threshold'
+    assert get_budget_setting('/Budget/TimeUnit', expected_properties) is None
+
+
+def test_audit_drifted_and_missing_stacks():
+    """ Tests that the audit reports the budget amounts and thresholds changed outside of the
+    stacks, polls the detections together, and reports the accounts without a stack as not audited
+
+    :return: None
+    """
+    fleet = generate_fleet(12, seed=3)
+    account_ids = sorted(fleet)
+    fleet[account_ids[2]].budgets['Monthly Budget'].limit_amount += 500
+    fleet[account_ids[5]].budgets['Monthly Budget'].thresholds['FORECASTED'] = 120.0
+    del fleet[account_ids[7]].stacks['budget-alerts']
+    with FakeAwsServer(fleet, seed=3) as server:
+        server.drift_detection_seconds = 0.05
+        auditor = DriftAuditor(FleetScanner(server.url, **MANAGEMENT_CREDENTIALS),
+                               poll_interval=0.02, max_poll_interval=0.04)
+        report_file = io.StringIO()
+        report = run_audit(auditor, account_ids, report_file)
+
+        assert report.accounts == 11
+        assert sorted(report.drifted_account_ids) == [account_ids[2], account_ids[5]]
+        assert report.budget_drifts == 2
+        assert sorted((account_id, property_drift.budget_setting)
+                      for account_id, property_drift in report.property_drifts) == \
+            sorted([(account_ids[2], 'budget amount'), (account_ids[5], 'forecasted threshold')])
+        assert report.failed_account_ids == [account_ids[7]]
+        assert report.exit_status == 2
+        # the detections are polled together, rather than account by account
+        assert server.stats['DescribeStackDriftDetectionStatus']['calls'] < 11 * 4
+        assert server.stats['DescribeStackResourceDrifts']['calls'] == 2
+
+    records = {record['account_id']: record for record in
+               map(json.loads, report_file.getvalue().splitlines())}
+    assert len(records) == 12
+    assert records[account_ids[0]]['drift_status'] == 'IN_SYNC'
+    amount_drift, = records[account_ids[2]]['property_drifts']
+    assert amount_drift['budget_setting'] == 'budget amount'
+    assert float(amount_drift['actual_value']) == float(amount_drift['expected_value']) + 500
+    threshold_drift, = records[account_ids[5]]['property_drifts']
+    assert (threshold_drift['budget_setting'], threshold_drift['expected_value'],
+            threshold_drift['actual_value']) == ('forecasted threshold', '100', '120')
+    assert 'does not exist' in records[account_ids[7]]['error']
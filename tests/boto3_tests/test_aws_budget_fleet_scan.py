@@ -0,0 +1,76 @@
+"""Tests for the sharded fleet scan
+"""
+from aws_budget_fake_services import FakeAwsServer, generate_fleet
+from aws_budget_fleet_scan import FleetScanner, get_shard_index, merge_checkpoints, scan_shard
+
+MANAGEMENT_CREDENTIALS = {'aws_access_key_id': 'MANAGEMENT', 'aws_secret_access_key': 'fake'}
+
+
+def get_expected_findings(fleet):
+    """Returns the findings expected for every budget of a fleet
+
+    :param fleet: (dict) the FakeAccount objects keyed by account ID
+    :return: (set) (account ID, budget name, notification type) tuples
+    """
+    findings = set()
+    for account in fleet.values():
+        for budget in account.budgets.values():
+            spends = {'ACTUAL': budget.actual_spend, 'FORECASTED': budget.forecasted_spend}
+            for notification_type, threshold in budget.thresholds.items():
+                if threshold / 100 * budget.limit_amount < spends[notification_type]:
+                    findings.add((account.account_id, budget.name, notification_type))
+    return findings
+
+
+def test_shards_split_fleet_and_merge(tmp_path):
+    """ Tests that the shards check every budget of every account exactly once, and that the
+    merged report has the findings of all the shards
+
+    :param tmp_path: the fixture providing a temporary directory
+    :return: None
+    """
+    fleet = generate_fleet(30, budgets_per_account=2, seed=2)
+    checkpoints = [str(tmp_path / f'shard-{index}.jsonl') for index in range(1, 4)]
+    with FakeAwsServer(fleet, error_rate=0.05, seed=2) as server:
+        scanner = FleetScanner(server.url, **MANAGEMENT_CREDENTIALS)
+        shard_accounts = [scan_shard(scanner, (index, 3), checkpoint, concurrency=4)[0]
+                          for index, checkpoint in enumerate(checkpoints, 1)]
+
+    assert sum(shard_accounts) == 30
+    assert all(shard_accounts)
+    assert server.stats['DescribeBudgets']['errors'] + 30 == \
+        server.stats['DescribeBudgets']['calls']
+    report = merge_checkpoints(checkpoints)
+    assert report.accounts == 30
+    assert report.complete
+    assert {(finding.account_id, finding.budget_name, finding.notification_type)
+            for finding in report.findings} == get_expected_findings(fleet)
+    assert report.exit_status == (1 if report.findings else 0)
+    assert get_shard_index('100000000001', 3) == get_shard_index('100000000001', 3)
+
+
+def test_shard_resumes_from_checkpoint(tmp_path):
+    """ Tests that a shard restarted after a crash only checks the accounts it didn't finish, and
+    that a merge without every shard completed is reported as incomplete
+
+    :param tmp_path: the fixture providing a temporary directory
+    :return: None
+    """
+    fleet = generate_fleet(20, seed=3)
+    checkpoint = tmp_path / 'shard-1.jsonl'
+    with FakeAwsServer(fleet) as server:
+        scanner = FleetScanner(server.url, **MANAGEMENT_CREDENTIALS)
+        accounts, checked, failed_account_ids = scan_shard(scanner, (1, 2), str(checkpoint))
+        assert (checked, failed_account_ids) == (accounts, [])
+        # crash after the fourth account, in the middle of the fifth record
+        lines = checkpoint.read_text().splitlines(keepends=True)
+        checkpoint.write_text(''.join(lines[:5]) + lines[5][:10])
+        calls = server.stats['DescribeBudgets']['calls']
+
+        assert scan_shard(scanner, (1, 2), str(checkpoint)) == (accounts, accounts - 4, [])
+        assert server.stats['DescribeBudgets']['calls'] - calls == accounts - 4
+
+    report = merge_checkpoints([str(checkpoint)])
+    assert report.accounts == accounts
+    assert report.missing_shards == [2]
+    assert report.exit_status == 2
@@ -0,0 +1,78 @@
+"""Tests for the load test harness and the local stand-in for the AWS APIs
+"""
+import pytest
+from botocore.exceptions import ClientError
+from aws_budget_fake_services import MANAGEMENT_ACCOUNT_ID, FakeAwsServer, generate_fleet
+from aws_budget_load_harness import FleetChecker, run_load_test
+
+
+def get_expected_findings(fleet, actual_threshold_percentage, forecasted_threshold_percentage):
+    """Returns the number of findings expected for the 'Monthly Budget' of a fleet
+
+    :param fleet: (dict) the FakeAccount objects keyed by account ID
+    :param actual_threshold_percentage: (float) the actual threshold percentage
+    :param forecasted_threshold_percentage: (float) the forecasted threshold percentage
+    :return: (int) the number of findings
+    """
+    findings = 0
+    for account in fleet.values():
+        budget = account.budgets['Monthly Budget']
+        findings += actual_threshold_percentage / 100 * budget.limit_amount < budget.actual_spend
+        findings += forecasted_threshold_percentage / 100 * budget.limit_amount < \
+            budget.forecasted_spend
+    return findings
+
+
+def test_load_test_with_throttling_and_errors():
+    """ Tests that every account of the fleet is checked concurrently, despite the injected
+    throttling and errors being retried
+
+    :return: None
+    """
+    fleet = generate_fleet(40, budgets_per_account=2, seed=1)
+    with FakeAwsServer(fleet, latency=0.005, error_rate=0.05, throttle_rate=0.1, seed=1) as server:
+        report = run_load_test(FleetChecker(server.url, 'Monthly Budget', 80, 100), concurrency=8)
+
+    assert report.accounts == 40
+    assert report.failures == 0
+    assert report.findings == get_expected_findings(fleet, 80, 100)
+    assert report.throughput > 0
+    assert report.latency_p50 <= report.latency_p90 <= report.latency_p99
+    assert server.stats['ListAccounts']['calls'] >= 2
+    assert sum(action_stats['throttled'] for action_stats in server.stats.values()) > 0
+    assert sum(action_stats['errors'] for action_stats in server.stats.values()) > 0
+
+
+def test_fake_services_errors():
+    """ Tests that the stand-in returns the errors of the real APIs, and throttles the calls above
+    the rate limit
+
+    :return: None
+    """
+    fleet = generate_fleet(2)
+    with FakeAwsServer(fleet, rate_limit=1) as server:
+        fleet_checker = FleetChecker(server.url, 'Monthly Budget', 80, 100)
+        sts_client = fleet_checker.create_client('sts')
+        with pytest.raises(ClientError) as error_info:
+            sts_client.assume_role(RoleArn='arn:aws:iam::999999999999:role/Role',
+                                   RoleSessionName='test')
+        assert error_info.value.response['Error']['Code'] == 'AccessDenied'
+
+        credentials = sts_client.assume_role(RoleArn='arn:aws:iam::100000000001:role/Role',
+                                             RoleSessionName='test')['Credentials']
+        budgets_client = fleet_checker.create_client(
+            'budgets', aws_access_key_id=credentials['AccessKeyId'],
+            aws_secret_access_key=credentials['SecretAccessKey'],
+            aws_session_token=credentials['SessionToken'])
+        with pytest.raises(ClientError) as error_info:
+            budgets_client.describe_budget(AccountId='100000000001', BudgetName='Other Budget')
+        assert error_info.value.response['Error']['Code'] == 'NotFoundException'
+        # the management account is not part of the fleet, so it has no budget
+        with pytest.raises(ClientError) as error_info:
+            fleet_checker.create_client('budgets').describe_budget(
+                AccountId=MANAGEMENT_ACCOUNT_ID, BudgetName='Monthly Budget')
+        assert error_info.value.response['Error']['Code'] == 'NotFoundException'
+        with pytest.raises(ClientError) as error_info:
+            budgets_client.describe_budget(AccountId='100000000000', BudgetName='Monthly Budget')
+        assert error_info.value.response['Error']['Code'] == 'AccessDeniedException'
+    assert server.stats['DescribeBudget']['throttled'] > 0
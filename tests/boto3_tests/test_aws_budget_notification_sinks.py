@@ -0,0 +1,152 @@
+"""Tests for the notification sinks
+"""
+import asyncio
+import json
+import smtplib
+import time
+import pytest
+from aws_budget_check_params import ThresholdFinding
+from aws_budget_notification_sinks import EmailSink, Sink, WebhookSink, dispatch, get_sinks
+
+
+class SlowSink(Sink):
+    """Sink that never delivers in time
+    """
+
+    async def deliver(self, findings):
+        await asyncio.sleep(10)
+
+
+def get_findings(count):
+    """Returns findings for the tests
+
+    :param count: (int) the number of findings
+    :return: (list) the ThresholdFinding objects
+    """
+    return [ThresholdFinding(account_id='123456789012', budget_name=f'budget-{index}',
+                             notification_type='ACTUAL', threshold_trigger=100,
+                             calculated_spend=110) for index in range(count)]
+
+
+def test_dispatch_to_sinks_concurrently(webhook_server, smtp_server):
+    """ Tests that dispatch delivers findings in batches to every sink, and that a slow sink doesn't
+    prevent the others from delivering
+
+    :param webhook_server: the fixture providing a local HTTP server standing in for the webhook
+    :param smtp_server: the fixture providing a local SMTP server
+    :return: None
+    """
+    sinks = get_sinks([
+        {'type': 'webhook', 'name': 'slack', 'batch_size': 2, 'expected_body': 'ok',
+         'url': f'http://127.0.0.1:{webhook_server.server_port}/slack'},
+        {'type': 'webhook', 'name': 'tickets', 'payload_format': 'json',
+         'url': f'http://127.0.0.1:{webhook_server.server_port}/tickets'},
+        {'type': 'email', 'name': 'email', 'host': '127.0.0.1',
+         'port': smtp_server.server_address[1], 'sender': 'alerts@example.com',
+         'recipients': ['team@example.com']},
+    ])
+    assert isinstance(sinks[0], WebhookSink)
+    assert isinstance(sinks[2], EmailSink)
+    sinks.append(SlowSink('slow', timeout=0.2, max_retries=1, retry_delay=0.1))
+
+    start = time.monotonic()
+    assert dispatch(get_findings(3), sinks) == {
+        'slack': (3, 0),
+        'tickets': (3, 0),
+        'email': (3, 0),
+        'slow': (0, 3),
+    }
+    assert time.monotonic() - start < 2
+
+    slack_requests = [request for request in webhook_server.requests if request[1] == '/slack']
+    assert len(slack_requests) == 2
+    assert slack_requests[0][0] == slack_requests[1][0]
+    assert json.loads(slack_requests[0][2])['text'].startswith(
+        "<!here> actual threshold trigger (100) < calculated actual spend (110) for budget "
+        "'budget-0' in account 123456789012\n")
+    tickets_requests = [request for request in webhook_server.requests if request[1] == '/tickets']
+    assert [finding['budget_name'] for finding in json.loads(tickets_requests[0][2])['findings']] \
+        == ['budget-0', 'budget-1', 'budget-2']
+    assert len(smtp_server.messages) == 1
+    assert 'Subject: AWS Budgets: 3 finding(s)' in smtp_server.messages[0][1]
+
+
+def test_sink_is_abstract():
+    """ Tests that a sink must implement deliver()
+
+    :return: None
+    """
+    with pytest.raises(TypeError):
+        Sink('abstract')  # pylint: disable=abstract-class-instantiated
+
+
+def test_dispatch_retries_and_waits_when_queue_full(webhook_server):
+    """ Tests that findings are queued as room is made in a full queue rather than dropped, and that
+    failed deliveries are retried a bounded number of times
+
+    :param webhook_server: the fixture providing a local HTTP server standing in for the webhook
+    :return: None
+    """
+    sinks = [
+        WebhookSink('bounded', f'http://127.0.0.1:{webhook_server.server_port}/bounded',
+                    queue_size=2),
+        WebhookSink('wrong-body', f'http://127.0.0.1:{webhook_server.server_port}/wrong-body',
+                    expected_body='accepted', max_retries=2, retry_delay=0.01),
+    ]
+
+    assert dispatch(get_findings(5), sinks) == {
+        'bounded': (5, 0),
+        'wrong-body': (0, 5),
+    }
+    assert len([request for request in webhook_server.requests
+                if request[1] == '/wrong-body']) == 3
+
+
+def test_email_sink_retries_over_another_connection(monkeypatch):
+    """ Tests that the retry of an email delivery that timed out while its worker thread is still
+    sending uses a connection of its own
+
+    :param monkeypatch: the pytest monkeypatch fixture
+    :return: None
+    """
+    connections = []
+
+    class SlowSmtp:
+        """SMTP connection taking longer than the delivery timeout to send the first message
+        """
+
+        def __init__(self, host, port, timeout):
+            self.address = (host, port, timeout)
+            self.messages = []
+            self.closed = False
+            connections.append(self)
+
+        def noop(self):
+            """Checks the connection
+            """
+
+        def send_message(self, message):
+            """Records the message, slowly the first time
+            """
+            if len(connections) == 1:
+                time.sleep(0.5)
+            self.messages.append(message)
+
+        def close(self):
+            """Closes the connection
+            """
+            self.closed = True
+
+        def quit(self):
+            """Closes the connection
+            """
+            self.close()
+
+    monkeypatch.setattr(smtplib, 'SMTP', SlowSmtp)
+    sink = EmailSink('email', '127.0.0.1', 'alerts@example.com', ['team@example.com'],
+                     timeout=0.1, max_retries=1, retry_delay=0.01)
+
+    assert dispatch(get_findings(1), [sink]) == {'email': (1, 0)}
+    assert len(connections) == 2
+    assert len(connections[1].messages) == 1
+    assert connections[1].closed
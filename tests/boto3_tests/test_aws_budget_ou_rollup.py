@@ -0,0 +1,74 @@
+"""Tests for the rollup of the budgets to the organizational units
+"""
+import numpy
+from aws_budget_check_params import Budget
+from aws_budget_fake_services import FakeAwsServer, generate_fleet, generate_organizational_units
+from aws_budget_fleet_scan import FleetScanner
+from aws_budget_ou_rollup import OrganizationTree, get_rollup_findings, load_tree, rollup_budgets
+
+MANAGEMENT_CREDENTIALS = {'aws_access_key_id': 'MANAGEMENT', 'aws_secret_access_key': 'fake'}
+TREE = OrganizationTree(
+    [('r-1', 'Root', None), ('ou-a', 'A', 'r-1'), ('ou-b', 'B', 'r-1'), ('ou-a1', 'A1', 'ou-a')],
+    {'1': 'ou-a1', '2': 'ou-a', '3': 'ou-b', '4': 'r-1'})
+
+
+def test_rollup_to_every_ancestor():
+    """ Tests that the values of every account are added to every unit above it, and that the
+    accounts missing from the values are ignored
+
+    :return: None
+    """
+    assert TREE.unit_paths == ['Root', 'Root/A', 'Root/B', 'Root/A/A1']
+    totals, counts = TREE.rollup(['4', '1', '3'], [[1, 10], [2, 20], [4, 40]])
+    assert totals.tolist() == [[7, 70], [2, 20], [4, 40], [2, 20]]
+    assert counts.tolist() == [3, 1, 1, 1]
+
+
+def test_rollup_findings_on_units():
+    """ Tests that the thresholds of the units are checked along with those of the accounts, a
+    unit being over its threshold while none of its accounts is
+
+    :return: None
+    """
+    account_ids = ['1', '2', '3']
+    budgets = [Budget(limit_amount=100.0, calculated_actual_spend=70.0,
+                      calculated_forecasted_spend=90.0),
+               Budget(limit_amount=100.0, calculated_actual_spend=75.0,
+                      calculated_forecasted_spend=95.0),
+               Budget(limit_amount=1000.0, calculated_actual_spend=10.0,
+                      calculated_forecasted_spend=20.0)]
+    unit_budgets = rollup_budgets(TREE, account_ids, budgets)
+    assert [(unit.path, unit.accounts, unit.limit_amount, unit.actual_spend)
+            for unit in unit_budgets] == [('Root', 3, 1200.0, 155.0), ('Root/A', 2, 200.0, 145.0),
+                                          ('Root/B', 1, 1000.0, 10.0),
+                                          ('Root/A/A1', 1, 100.0, 70.0)]
+    findings = get_rollup_findings(account_ids, budgets, unit_budgets, 72, 100)
+    assert [(finding.account_id, finding.budget_name, finding.notification_type)
+            for finding in findings] == [('2', 'Monthly Budget', 'ACTUAL'),
+                                         ('ou-a', 'Root/A', 'ACTUAL')]
+
+
+def test_load_tree_from_organizations_and_cache(tmp_path):
+    """ Tests that the tree is built from the organizational units of the organisation, and read
+    from its cache file afterwards
+
+    :return: None
+    """
+    fleet = generate_fleet(30, seed=2)
+    units = generate_organizational_units(fleet, depth=2, fanout=3, seed=2)
+    cache_file_name = str(tmp_path / 'tree.json')
+    with FakeAwsServer(fleet, seed=2) as server:
+        server.organizational_units = units
+        client = FleetScanner(server.url, **MANAGEMENT_CREDENTIALS).create_client('organizations')
+        tree = load_tree(client, cache_file_name)
+        cached_tree = load_tree(client, cache_file_name)
+        assert server.stats['ListRoots']['calls'] == 1
+
+    assert tree.accounts == {account_id: account.parent_id
+                             for account_id, account in fleet.items()}
+    assert len(tree.unit_ids) == 1 + 3 + 9
+    assert cached_tree.unit_paths == tree.unit_paths
+    assert cached_tree.accounts == tree.accounts
+    # every account is counted once in the root
+    _, counts = cached_tree.rollup(sorted(fleet), numpy.ones(len(fleet)))
+    assert counts[0] == len(fleet)
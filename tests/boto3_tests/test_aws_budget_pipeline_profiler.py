@@ -0,0 +1,97 @@
+"""Tests for the profiling of the release pipeline
+"""
+import sys
+import pytest
+from aws_budget_alerting import AlertingTemplateVariant
+from aws_budget_fake_services import FakeAwsServer, generate_fleet
+from aws_budget_pipeline_profiler import CsmListener, Phase, PhaseProfile, PipelineProfiler, \
+    compare_to_baseline, get_pipeline_phases, summarize, to_chrome_trace
+
+# a phase calling the fake STS API twice with boto3
+API_CALLS_SCRIPT = """
+import boto3
+client = boto3.client('sts', region_name='us-east-1', endpoint_url=sys.argv[1],
+                      aws_access_key_id='MANAGEMENT', aws_secret_access_key='fake')
+client.get_caller_identity()
+client.get_caller_identity()
+"""
+
+
+def test_get_pipeline_phases():
+    """ Tests that the build phases run once and the check and deploy phases once per account,
+    with the values of the account written in full
+
+    :return: None
+    """
+    phases = get_pipeline_phases({
+        '222222222222': AlertingTemplateVariant(monthly_budget=123456.78, actual_threshold=80,
+                                                forecasted_threshold=100.5,
+                                                actual_webhook_url='https://hook'),
+        '111111111111': AlertingTemplateVariant(monthly_budget=1234567, actual_threshold=70,
+                                                forecasted_threshold=90, message_prefix='dev'),
+    }, 'bucket', profile_format='budgets-{account_id}', python='python3')
+    assert [(phase.name, phase.account_id) for phase in phases] == [
+        ('template', None), ('sam build', None), ('sam package', None),
+        ('threshold check', '111111111111'), ('deploy', '111111111111'),
+        ('threshold check', '222222222222'), ('deploy', '222222222222')]
+    assert phases[4].command == ['./deploy.sh', '1234567', '70', '90', 'dev']
+    assert phases[5].command[-2:] == ['80', '100.5']
+    assert phases[6].command[1] == '123456.78'
+    assert phases[6].env == {'TEMPLATE_FILE': 'packaged.yaml',
+                             'AWS_PROFILE': 'budgets-222222222222',
+                             'ACTUAL_COST_WEBHOOK_URL': 'https://hook'}
+
+
+def test_profile_pipeline(tmp_path):
+    """ Tests that the API calls of every phase are counted, that the pipeline stops at the first
+    failing phase, and that the phases are traced on the track of their account
+
+    :return: None
+    """
+    phases = [
+        Phase(name='template', command=[sys.executable, '-c', 'print("Resources: {}")'],
+              output_file='template.yaml'),
+        Phase(name='threshold check', account_id='111111111111',
+              command=[sys.executable, '-c', 'import sys' + API_CALLS_SCRIPT]),
+        Phase(name='deploy', account_id='111111111111',
+              command=[sys.executable, '-c', 'import sys; sys.exit(3)']),
+        Phase(name='deploy', account_id='222222222222', command=[sys.executable, '-c', '']),
+    ]
+    with FakeAwsServer(generate_fleet(1)) as server, CsmListener() as csm_listener:
+        phases[1].command.append(server.url)
+        profiles = PipelineProfiler(csm_listener, str(tmp_path)).run(phases)
+
+    assert (tmp_path / 'template.yaml').read_text() == 'Resources: {}\n'
+    assert [(profile.name, profile.returncode, profile.api_calls) for profile in profiles] == \
+        [('template', 0, 0), ('threshold check', 0, 2), ('deploy', 3, 0)]
+    assert profiles[1].api_call_counts == {'STS.GetCallerIdentity': 2}
+    assert all(profile.wall_seconds > 0 and profile.cpu_seconds > 0 for profile in profiles)
+    trace = to_chrome_trace(profiles)
+    phase_events = [event for event in trace['traceEvents'] if event['ph'] == 'X']
+    assert [(event['name'], event['tid']) for event in phase_events] == \
+        [('template', 0), ('threshold check', 1), ('deploy', 1)]
+    assert phase_events[1]['ts'] >= phase_events[0]['ts'] + phase_events[0]['dur']
+
+
+def test_compare_to_baseline():
+    """ Tests that the phases of the same name are summed, and that a phase slower than the
+    baseline beyond the tolerance is a regression
+
+    :return: None
+    """
+    def profile(name, wall_seconds, bytes_sent=0):
+        return PhaseProfile(name=name, account_id=None, start=0.0, wall_seconds=wall_seconds,
+                            cpu_seconds=1.0, bytes_sent=bytes_sent, api_calls=2)
+
+    baseline = summarize([profile('sam build', 10.0), profile('deploy', 20.0),
+                          profile('deploy', 20.0)])
+    summary = summarize([profile('sam build', 11.0), profile('deploy', 30.0),
+                         profile('deploy', 30.0, None), profile('sam package', 5.0)])
+    assert summary['deploy'] == {'wall_seconds': 60.0, 'cpu_seconds': 2.0, 'bytes_sent': None,
+                                 'api_calls': 4, 'runs': 2}
+    comparisons = compare_to_baseline(summary, baseline, tolerance=20.0)
+    assert [(comparison.name, comparison.regression) for comparison in comparisons] == \
+        [('sam build', False), ('deploy', True), ('sam package', False)]
+    assert comparisons[0].wall_change == pytest.approx(10.0)
+    assert comparisons[1].wall_change == pytest.approx(50.0)
+    assert comparisons[2].wall_change is None
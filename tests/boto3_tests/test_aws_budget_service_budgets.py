@@ -0,0 +1,55 @@
+"""Tests for the per-service budgets
+"""
+from aws_budget_alerting import build_alerting_template
+from aws_budget_service_budgets import CostMatrix, ServiceBudget, derive_service_budgets
+
+
+def test_derive_service_budgets():
+    """ Tests that the top cost drivers of every account get a budget sized from a percentile of
+    their monthly spend, and that minor services don't
+
+    :return: None
+    """
+    cost_matrix = CostMatrix()
+    for month, ec2_amount in (('2019-04', 100), ('2019-05', 200), ('2019-06', 300)):
+        cost_matrix.add(f'{month}-01', '123456789012', 'Amazon Elastic Compute Cloud - Compute',
+                        ec2_amount / 2)
+        cost_matrix.add(f'{month}-15', '123456789012', 'Amazon Elastic Compute Cloud - Compute',
+                        ec2_amount / 2)
+        cost_matrix.add(f'{month}-01', '123456789012', 'Amazon Simple Storage Service', 50)
+        cost_matrix.add(f'{month}-01', '123456789012', 'AWS Key Management Service', 1)
+        cost_matrix.add(f'{month}-01', '210987654321', 'AWS Lambda', 20)
+    cost_matrix.add('2019-06-01', '210987654321', 'Amazon Simple Storage Service', 35)
+
+    assert derive_service_budgets(cost_matrix, top_n=2, percentile=50, headroom=0.1) == [
+        ServiceBudget(account_id='123456789012', service='Amazon Elastic Compute Cloud - Compute',
+                      limit_amount=220, share=600 / 753),
+        ServiceBudget(account_id='123456789012', service='Amazon Simple Storage Service',
+                      limit_amount=60, share=150 / 753),
+        ServiceBudget(account_id='210987654321', service='AWS Lambda', limit_amount=30,
+                      share=60 / 95),
+    ]
+    assert derive_service_budgets(CostMatrix()) == []
+
+
+def test_alerting_template_with_service_budgets():
+    """ Tests that the service budgets are added to the alerting template, with a cost filter on
+    their service and the notifications of the account-wide budget
+
+    :return: None
+    """
+    resources = build_alerting_template(service_budgets=[
+        ServiceBudget(account_id='123456789012', service='Amazon Simple Storage Service',
+                      limit_amount=60, share=0.2),
+    ]).to_dict()['Resources']
+
+    service_budget = resources['AmazonSimpleStorageServiceBudget']['Properties']
+    assert service_budget['Budget'] == {
+        'BudgetLimit': {'Amount': 60.0, 'Unit': 'USD'},
+        'BudgetName': 'Monthly Budget - Amazon Simple Storage Service',
+        'BudgetType': 'COST',
+        'CostFilters': {'Service': ['Amazon Simple Storage Service']},
+        'TimeUnit': 'MONTHLY',
+    }
+    assert service_budget['NotificationsWithSubscribers'] == \
+        resources['Budget']['Properties']['NotificationsWithSubscribers']
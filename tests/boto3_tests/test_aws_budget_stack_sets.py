@@ -0,0 +1,105 @@
+"""Tests for the stack set rollout
+"""
+import sys
+import pytest
+from aws_budget_alerting import AlertingTemplateVariant
+from aws_budget_fake_services import FakeAwsServer, generate_fleet
+from aws_budget_fleet_scan import FleetScanner
+from aws_budget_stack_sets import SPOKE_OVERRIDE_PARAMETERS, RolloutPreferences, StackSetRollout, \
+    group_accounts, main
+
+MANAGEMENT_CREDENTIALS = {'aws_access_key_id': 'MANAGEMENT', 'aws_secret_access_key': 'fake'}
+TEMPLATE_BODY = '{"Resources": {}}'
+
+
+def test_group_accounts():
+    """ Tests that the accounts sharing the same parameter overrides are grouped together
+
+    :return: None
+    """
+    groups = group_accounts({
+        '3': AlertingTemplateVariant(monthly_budget=100, actual_threshold=80),
+        '1': AlertingTemplateVariant(monthly_budget=100, actual_threshold=80),
+        '2': AlertingTemplateVariant(monthly_budget=250, message_prefix='dev'),
+        '4': AlertingTemplateVariant(),
+    })
+    assert groups == {
+        (('ActualThreshold', '80'), ('MonthlyBudget', '100')): ['1', '3'],
+        (('MessagePrefix', 'dev'), ('MonthlyBudget', '250')): ['2'],
+        (): ['4'],
+    }
+    # the webhook URLs are overridden per account, but not in the member accounts of a hub
+    webhook_variant = AlertingTemplateVariant(actual_webhook_url='https://hook')
+    assert group_accounts({'5': webhook_variant}) == {
+        (('ActualCostWebHookUrl', 'https://hook'),): ['5']}
+    assert group_accounts({'5': webhook_variant}, SPOKE_OVERRIDE_PARAMETERS) == {(): ['5']}
+
+
+def test_roll_out_with_overrides_and_failure_tolerance():
+    """ Tests that a rollout creates the stack set and its instances with the overrides of every
+    account group, that the operation of a group stops once its failures exceed the tolerance, and
+    that rolling out again updates the existing instances
+
+    :return: None
+    """
+    fleet = generate_fleet(13, seed=5)
+    account_ids = sorted(fleet)
+    manifest = {account_id: AlertingTemplateVariant(monthly_budget=100 if index < 8 else 200)
+                for index, account_id in enumerate(account_ids)}
+    with FakeAwsServer(fleet, seed=5) as server:
+        server.stack_instance_seconds = 0.02
+        # the first account of the second group fails, with no failure tolerance
+        server.failing_stack_instances = {account_ids[8]}
+        client = FleetScanner(server.url, **MANAGEMENT_CREDENTIALS).create_client('cloudformation')
+        rollout = StackSetRollout(client, 'budget-alerts', RolloutPreferences(
+            max_concurrent_percentage=25, poll_interval=0.01, max_poll_interval=0.05))
+        report = rollout.roll_out(TEMPLATE_BODY, {'ActualCostWebHookUrl': 'https://hook'},
+                                  group_accounts(manifest))
+
+        assert len(report.operations) == 2
+        assert sorted(report.operations.values()) == ['FAILED', 'SUCCEEDED']
+        assert report.exit_status == 1
+        instances = {instance.account_id: instance for instance in report.instances}
+        assert [instances[account_id].status for account_id in account_ids[:8]] == \
+            ['SUCCEEDED'] * 8
+        # the second group is deployed one account at a time: the failure cancels the others. The
+        # API versions without detailed statuses report them as OUTDATED, with the same reasons
+        assert [instances[account_id].status in ('FAILED', 'CANCELLED', 'OUTDATED')
+                for account_id in account_ids[8:]] == [True] * 5
+        assert [instances[account_id].reason for account_id in account_ids[8:]] == \
+            ['FAILED'] + ['CANCELLED'] * 4
+        stack_set = server.stack_sets['budget-alerts']
+        assert stack_set.parameters == {'ActualCostWebHookUrl': 'https://hook'}
+        assert stack_set.instances[(account_ids[0], 'us-east-1')].parameter_overrides == \
+            {'MonthlyBudget': '100'}
+        assert stack_set.instances[(account_ids[12], 'us-east-1')].parameter_overrides == \
+            {'MonthlyBudget': '200'}
+
+        server.failing_stack_instances = set()
+        report = rollout.roll_out(TEMPLATE_BODY, {'ActualCostWebHookUrl': 'https://hook'},
+                                  group_accounts(manifest))
+        assert list(report.operations.values()) == ['SUCCEEDED'] * 2
+        assert report.exit_status == 0
+        assert len(report.instances) == 13
+        assert 'UpdateStackSet' not in server.stats
+        assert server.stats['UpdateStackInstances']['calls'] == 2
+
+
+@pytest.mark.parametrize('arguments', [
+    [],
+    ['--template', 'alerting'],
+    ['--inline-code', 'lambda-src/inline.js', '--packaged-template', 'packaged.yaml'],
+    ['--template', 'alerting-spoke', '--packaged-template', 'packaged.yaml'],
+])
+def test_main_requires_deployable_alerting_code(monkeypatch, arguments):
+    """ Tests that the alerting template is only rolled out with its code inline or packaged, as
+    the code of the generated template is a local directory
+
+    :param monkeypatch: the pytest monkeypatch fixture
+    :param arguments: (list) the command line arguments
+    :return: None
+    """
+    monkeypatch.setattr(sys, 'argv', ['aws_budget_stack_sets.py'] + arguments)
+    with pytest.raises(SystemExit) as exit_info:
+        main()
+    assert exit_info.value.code == 2
@@ -0,0 +1,57 @@
+"""Tests for the threshold simulation
+"""
+from aws_budget_threshold_simulator import SpendHistory, simulate_thresholds
+
+
+def add_month(history, account_id, month, daily_amount, days=30):
+    """Adds a month of constant daily spend to a spend history
+
+    :param history: (SpendHistory) the history to add the spend to
+    :param account_id: (str) the AWS account ID
+    :param month: (str) the month (YYYY-MM)
+    :param daily_amount: (float) the spend for each day of the month
+    :param days: (int) the number of days in the month
+    :return: None
+    """
+    for day in range(1, days + 1):
+        history.add(f'{month}-{day:02}', account_id, daily_amount)
+
+
+def test_simulate_thresholds_warns_before_overspend():
+    """ Tests that simulate_thresholds recommends thresholds that alert before an overspend
+    without raising alerts in normal months
+
+    :return: None
+    """
+    history = SpendHistory({'123456789012': 300})
+    add_month(history, '123456789012', '2019-04', 8)
+    add_month(history, '123456789012', '2019-06', 8)
+    add_month(history, '123456789012', '2019-09', 20)
+
+    recommendations = simulate_thresholds(history, [50, 100, 150], [90, 120, 200])
+
+    assert len(recommendations) == 1
+    recommendation = recommendations[0]
+    assert recommendation.account_id == '123456789012'
+    assert recommendation.months == 3
+    assert recommendation.false_alarms == 0
+    assert recommendation.missed_overspends == 0
+    assert recommendation.forecasted_threshold == 120
+    assert recommendation.mean_lead_days == 15
+    assert recommendation.actual_threshold == 150
+
+
+def test_simulate_thresholds_quiet_account():
+    """ Tests that simulate_thresholds recommends the highest thresholds for an account that never
+    exceeds its budget, and ignores accounts without a budget
+
+    :return: None
+    """
+    history = SpendHistory({'123456789012': 1000})
+    add_month(history, '123456789012', '2019-04', 10)
+    add_month(history, '210987654321', '2019-04', 10)
+
+    recommendations = simulate_thresholds(history, [50, 100], [90, 120])
+
+    assert [(rec.account_id, rec.actual_threshold, rec.forecasted_threshold)
+            for rec in recommendations] == [('123456789012', 100, 120)]
@@ -0,0 +1,66 @@
+"""Tests for the bulk threshold updater
+"""
+from aws_budget_fake_services import FakeAwsServer, generate_fleet
+from aws_budget_fleet_scan import FleetScanner, merge_checkpoints, scan_shard
+from aws_budget_threshold_updater import RateLimiter, ThresholdPolicy, ThresholdUpdater, \
+    update_fleet
+
+MANAGEMENT_CREDENTIALS = {'aws_access_key_id': 'MANAGEMENT', 'aws_secret_access_key': 'fake'}
+
+
+def test_policy_thresholds():
+    """ Tests the thresholds computed by the policies
+
+    :return: None
+    """
+    policy = ThresholdPolicy({'ACTUAL': 90})
+    assert policy.get_threshold('ACTUAL', 80, 120) == 90
+    assert policy.get_threshold('FORECASTED', 100, 120) == 100
+    policy = ThresholdPolicy({'ACTUAL': 90}, minimum_viable=True, margin=5)
+    assert policy.get_threshold('ACTUAL', 80, 50) == 90
+    assert policy.get_threshold('ACTUAL', 80, 101.2) == 107
+    assert policy.get_threshold('FORECASTED', 110, 109) == 110
+
+
+def test_update_fleet_dry_run_apply_and_rerun(tmp_path):
+    """ Tests that the thresholds too low to trigger an alert are raised above the spend, with the
+    parameters of the alerting stacks, after a dry run changing nothing, and that running the
+    update again changes nothing either
+
+    :param tmp_path: the fixture providing a temporary directory
+    :return: None
+    """
+    fleet = generate_fleet(12, budgets_per_account=2, seed=4)
+    with FakeAwsServer(fleet, throttle_rate=0.05, seed=4) as server:
+        scanner = FleetScanner(server.url, **MANAGEMENT_CREDENTIALS)
+        updater = ThresholdUpdater(scanner, ThresholdPolicy(minimum_viable=True),
+                                   RateLimiter(200))
+        account_ids = sorted(fleet)
+
+        planned = update_fleet(updater, account_ids, dry_run=True)
+        assert 'UpdateNotification' not in server.stats
+        assert 'UpdateStack' not in server.stats
+        threshold_updates = [update for account_update in planned
+                             for update in account_update.threshold_updates]
+        assert threshold_updates
+        assert all(update.new_threshold > update.old_threshold for update in threshold_updates)
+
+        applied = update_fleet(updater, account_ids)
+        assert [account_update.error for account_update in applied] == [None] * 12
+        assert applied == planned
+        assert server.stats['UpdateStack']['calls'] - server.stats['UpdateStack']['throttled'] \
+            == sum(1 for account_update in applied if account_update.stack_updates) > 0
+        for account_update in applied:
+            stack = fleet[account_update.account_id].stacks['budget-alerts']
+            budget = fleet[account_update.account_id].budgets['Monthly Budget']
+            assert float(stack.parameters['ActualThreshold']) == budget.thresholds['ACTUAL']
+            assert float(stack.parameters['ForecastedThreshold']) == \
+                budget.thresholds['FORECASTED']
+
+        checkpoint = str(tmp_path / 'shard-1.jsonl')
+        scan_shard(scanner, (1, 1), checkpoint)
+        assert not merge_checkpoints([checkpoint]).findings
+        rerun = update_fleet(updater, account_ids)
+        assert all(not account_update.threshold_updates and not account_update.stack_updates
+                   for account_update in rerun)
+        assert sum(account_update.unchanged for account_update in rerun) == 12 * 2 * 2
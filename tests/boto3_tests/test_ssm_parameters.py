@@ -0,0 +1,56 @@
+"""Tests for the SSM parameter resolution
+"""
+import pytest
+from aws_budget_alerting import WEBHOOK_VARIANT_FIELDS, AlertingTemplateVariant
+from ssm_parameters import SsmParameterNotFoundException, SsmParameterResolver, \
+    resolve_variant_references
+from .conftest import SSM_CLIENT
+
+
+def _get_parameters_response(names):
+    """Gets the response of ssm.get_parameters() for existing parameters
+
+    :param names: (list) the parameter names
+    :return: (dict) the response
+    """
+    return {'Parameters': [{'Name': name, 'Type': 'SecureString', 'Value': f"https://{name}"}
+                           for name in names]}
+
+
+def test_resolve_variant_references(ssm_stub):
+    """ Tests that the webhook URLs referenced by the variants of many accounts are fetched 10 at a
+    time, each once, and that the other values are left alone
+
+    :param ssm_stub: the Stubber for the SSM client
+    :return: None
+    """
+    names = [f"/budgets/webhook-{index:02}" for index in range(12)]
+    for batch in (names[:10], names[10:]):
+        ssm_stub.add_response('get_parameters', _get_parameters_response(batch),
+                              {'Names': batch, 'WithDecryption': True})
+    variants = [(f"account-{index}", AlertingTemplateVariant(
+        actual_webhook_url='ssm:' + names[index % 12],
+        forecasted_webhook_url='ssm:' + names[(index + 1) % 12] if index % 2 else 'https://plain'))
+                for index in range(30)]
+    resolver = SsmParameterResolver(SSM_CLIENT)
+
+    resolved = resolve_variant_references(variants, resolver, WEBHOOK_VARIANT_FIELDS)
+    assert resolver.calls == 2
+    assert resolved[0] == ('account-0', AlertingTemplateVariant(
+        actual_webhook_url='https:///budgets/webhook-00', forecasted_webhook_url='https://plain'))
+    assert resolved[13][1].forecasted_webhook_url == 'https:///budgets/webhook-02'
+    # cached: no more calls
+    assert resolver.resolve('ssm:' + names[3]) == 'https:///budgets/webhook-03'
+    assert resolver.resolve('https://plain') == 'https://plain'
+
+
+def test_resolve_missing_parameter(ssm_stub):
+    """ Tests that a reference to a parameter that doesn't exist is reported
+
+    :param ssm_stub: the Stubber for the SSM client
+    :return: None
+    """
+    ssm_stub.add_response('get_parameters', {'Parameters': [], 'InvalidParameters': ['/missing']},
+                          {'Names': ['/missing'], 'WithDecryption': True})
+    with pytest.raises(SsmParameterNotFoundException, match='/missing'):
+        SsmParameterResolver(SSM_CLIENT).resolve('ssm:/missing')
@@ -1,10 +1,10 @@
 'use strict'
 const os = require('os')
+const https = require('https')
+const EventEmitter = require('events')
 const Bluebird = require('../lambda-src/node_modules/bluebird')
 const expect = require('../lambda-src/node_modules/chai').expect
 
-const myLambda = require('../lambda-src/index')
-
 const request = require('../lambda-src/node_modules/request-promise-native')
 
 const sinon = require('../lambda-src/node_modules/sinon')
@@ -13,14 +13,58 @@ const WEBHOOK_URL = 'http://localhost/test'
 const MESSAGE_PREFIX = 'Account: MyAccount'
 const eventMessage = require('./aws_budgtets_test_message.json')
 
-describe('aws-budget-alert-lambda', function () {
+// index.js posts with request-promise-native, and inline.js, its copy without any dependency, with
+// the https module: both run the same cases, their posts being stubbed. stubPost() takes a function
+// returning the response body of a { url, body, json } post, and returns a function getting the
+// posts sent
+const handlers = [
+  {
+    name: 'index.js',
+    lambda: require('../lambda-src/index'),
+    stubPost: (respond) => {
+      const rpStub = sinon.stub(request, 'post') // mock rp.post() calls
+      const toPost = (options) => ({ url: options.url, body: options.body, json: options.json === true })
+      // calls to rp.post() return a promise that will resolve to the response body
+      rpStub.callsFake((options) => Bluebird.resolve(respond(toPost(options))))
+      return () => rpStub.getCalls().map((call) => toPost(call.args[0]))
+    }
+  },
+  {
+    name: 'inline.js',
+    lambda: require('../lambda-src/inline'),
+    stubPost: (respond) => {
+      const posts = []
+      // mock https.request() calls, the response being emitted once the request body is sent
+      sinon.stub(https, 'request').callsFake((options, callback) => {
+        const clientRequest = new EventEmitter()
+        clientRequest.end = (body) => {
+          const post = {
+            url: options.href,
+            body: JSON.parse(body),
+            json: options.headers['Content-Type'] === 'application/json'
+          }
+          posts.push(post)
+          const response = new EventEmitter()
+          response.setEncoding = () => {}
+          process.nextTick(() => {
+            callback(response)
+            response.emit('data', respond(post))
+            response.emit('end')
+          })
+        }
+        return clientRequest
+      })
+      return () => posts
+    }
+  }
+]
+
+handlers.forEach(({ name, lambda, stubPost }) => describe(`aws-budget-alert-lambda (${name})`, function () {
   it(`should throw error when WEBHOOK_URL environment variable not defined: `, function (done) {
-    const rpStub = sinon.stub(request, 'post') // mock rp.post() calls
+    stubPost(() => 'ok')
 
-    // calls to rp.post() return a promise that will resolve to an object
-    rpStub.returns(Bluebird.resolve('ok'))
     try {
-      myLambda.handler(eventMessage, { /* context */ }, (error, result) => {
+      lambda.handler(eventMessage, { /* context */ }, (error, result) => {
         expect(error).to.equals(null)
         done(error)
       })
@@ -34,17 +78,14 @@ describe('aws-budget-alert-lambda', function () {
   })
 
   it(`should send event message to WEBHOOK_URL when WEBHOOK_URL environment variable defined and no error: `, function (done) {
-    const rpStub = sinon.stub(request, 'post') // mock rp.post() calls
-
-    // calls to rp.post() return a promise that will resolve to an object
-    rpStub.returns(Bluebird.resolve('ok'))
+    const getPosts = stubPost(() => 'ok')
 
     process.env.WEBHOOK_URL = WEBHOOK_URL
 
-    myLambda.handler(eventMessage, { /* context */ }, (err, result) => {
+    lambda.handler(eventMessage, { /* context */ }, (err, result) => {
       try {
         expect(err).to.equals(null)
-        verifyRequestSentToWebhook(rpStub, '')
+        verifyRequestSentToWebhook(getPosts(), '')
 
         done()
       } catch (error) {
@@ -54,18 +95,15 @@ describe('aws-budget-alert-lambda', function () {
   })
 
   it(`should send event message to WEBHOOK_URL when WEBHOOK_URL and MESSAGE_PREFIX environment variables defined and no error: `, function (done) {
-    const rpStub = sinon.stub(request, 'post') // mock rp.post() calls
-
-    // calls to rp.post() return a promise that will resolve to an object
-    rpStub.returns(Bluebird.resolve('ok'))
+    const getPosts = stubPost(() => 'ok')
 
     process.env.WEBHOOK_URL = WEBHOOK_URL
     process.env.MESSAGE_PREFIX = MESSAGE_PREFIX
 
-    myLambda.handler(eventMessage, { /* context */ }, (err, result) => {
+    lambda.handler(eventMessage, { /* context */ }, (err, result) => {
       try {
         expect(err).to.equals(null)
-        verifyRequestSentToWebhook(rpStub, MESSAGE_PREFIX)
+        verifyRequestSentToWebhook(getPosts(), MESSAGE_PREFIX)
 
         done()
       } catch (error) {
@@ -75,19 +113,75 @@ describe('aws-budget-alert-lambda', function () {
   })
 
   it(`should throw error when request to WEBHOOK_URL returns error: `, function (done) {
-    const rpStub = sinon.stub(request, 'post') // mock rp.post() calls
-
     const expectedErrorMessage = 'Error from WEBHOOK'
-    // calls to rp.post() return a promise that will resolve to an object
-    rpStub.returns(Bluebird.resolve(expectedErrorMessage))
-    // sandbox.stub(process.env, 'WEBHOOK_URL').value(test-webhook-url)
+    const getPosts = stubPost(() => expectedErrorMessage)
     process.env.WEBHOOK_URL = WEBHOOK_URL
 
-    myLambda.handler(eventMessage, { /* context */ }, (error, result) => {
+    lambda.handler(eventMessage, { /* context */ }, (error, result) => {
       try {
         expect(error).to.not.equals(null)
         expect(error.message).to.equals(expectedErrorMessage)
-        verifyRequestSentToWebhook(rpStub, '')
+        verifyRequestSentToWebhook(getPosts(), '')
+        done()
+      } catch (error) {
+        done(error)
+      }
+    })
+  })
+
+  it(`should send event message to the webhook of the topic when WEBHOOK_URL_<topic name> and MESSAGE_PREFIX_<topic name> environment variables defined: `, function (done) {
+    const getPosts = stubPost(() => 'ok')
+
+    // the topic of the test event is arn:aws:sns:eu-west-1:12345:MyTopic
+    process.env.WEBHOOK_URL_MyTopic = WEBHOOK_URL
+    process.env.MESSAGE_PREFIX_MyTopic = MESSAGE_PREFIX
+    process.env.WEBHOOK_URL_OtherTopic = 'http://localhost/other'
+
+    lambda.handler(eventMessage, { /* context */ }, (err, result) => {
+      try {
+        expect(err).to.equals(null)
+        verifyRequestSentToWebhook(getPosts(), MESSAGE_PREFIX)
+
+        done()
+      } catch (error) {
+        done(error)
+      }
+    })
+  })
+
+  it(`should post the messages of a batch from an SQS queue once per webhook URL, and report those that could not be posted: `, function (done) {
+    // the messages of the default webhook are posted, the webhook of OtherTopic rejects them
+    const getPosts = stubPost((post) => post.url === WEBHOOK_URL ? 'ok' : 'rate_limited')
+
+    process.env.WEBHOOK_URL = WEBHOOK_URL
+    process.env.WEBHOOK_URL_OtherTopic = 'http://localhost/other'
+
+    const otherNotification = Object.assign({}, eventMessage.Records[0].Sns, {
+      TopicArn: 'arn:aws:sns:eu-west-1:12345:OtherTopic'
+    })
+    const queueEvent = {
+      Records: [
+        ['message-1', eventMessage.Records[0].Sns],
+        ['message-2', otherNotification],
+        ['message-3', eventMessage.Records[0].Sns]
+      ].map(([messageId, notification]) => ({
+        messageId: messageId,
+        eventSource: 'aws:sqs',
+        body: JSON.stringify(notification)
+      }))
+    }
+    lambda.handler(queueEvent, { /* context */ }, (err, result) => {
+      try {
+        expect(err).to.equals(null)
+        expect(result).to.deep.equals({ batchItemFailures: [{ itemIdentifier: 'message-2' }] })
+        const posts = getPosts()
+        expect(posts.length).to.equals(2)
+        expect(posts[0].url).to.equals(WEBHOOK_URL)
+        expect(posts[0].body.text).to.equals('<!here> ' +
+          eventMessage.Records[0].Sns.Message + os.EOL + os.EOL +
+          eventMessage.Records[0].Sns.Message + os.EOL + os.EOL +
+          'Please set the alert thresholds to higher values if you want to be notified of overspend again this month')
+
         done()
       } catch (error) {
         done(error)
@@ -98,18 +192,21 @@ describe('aws-budget-alert-lambda', function () {
   afterEach(() => {
     delete process.env.WEBHOOK_URL
     delete process.env.MESSAGE_PREFIX
+    delete process.env.WEBHOOK_URL_MyTopic
+    delete process.env.MESSAGE_PREFIX_MyTopic
+    delete process.env.WEBHOOK_URL_OtherTopic
     sinon.restore()
   })
-})
+}))
 
-function verifyRequestSentToWebhook (rpStub, messagePrefix) {
-  const requestArg = rpStub.getCall(0).args[0]
+function verifyRequestSentToWebhook (posts, messagePrefix) {
+  const post = posts[0]
   const expectedBody = '<!here> ' +
                          messagePrefix + (messagePrefix ? os.EOL : '') +
                          eventMessage.Records[0].Sns.Message +
                          os.EOL + os.EOL +
                          'Please set the alert thresholds to higher values if you want to be notified of overspend again this month'
-  expect(requestArg.url).to.equals(WEBHOOK_URL)
-  expect(requestArg.body.text).to.equals(expectedBody)
-  expect(requestArg.json).to.equals(true)
+  expect(post.url).to.equals(WEBHOOK_URL)
+  expect(post.body.text).to.equals(expectedBody)
+  expect(post.json).to.equals(true)
 }
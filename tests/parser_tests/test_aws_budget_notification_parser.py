@@ -0,0 +1,94 @@
+"""Tests for the AWS Budgets notification parser
+"""
+import gzip
+import json
+import os
+import pytest
+from aws_budget_notification_parser import (BudgetNotification, InvalidNotificationException,
+                                            aggregate_notifications, parse_notification,
+                                            read_archive)
+
+TEST_MESSAGE_FILE = os.path.join(os.path.dirname(__file__), '..', 'aws_budgtets_test_message.json')
+
+
+def get_test_event():
+    """Returns the test Lambda event containing an AWS Budgets notification
+
+    :return: the event as a dict
+    """
+    with open(TEST_MESSAGE_FILE, encoding='utf-8') as message_file:
+        return json.load(message_file)
+
+
+def test_parse_notification():
+    """ Tests that parse_notification extracts the information from an AWS Budgets notification
+
+    :return: None
+    """
+    message = get_test_event()['Records'][0]['Sns']['Message']
+
+    assert parse_notification(message) == BudgetNotification(
+        date='2019-05-15',
+        account_id='123456',
+        budget_name='Monthly Budget',
+        alert_type='ACTUAL',
+        budgeted_amount=981.0,
+        threshold=981.0,
+        amount=981.52,
+    )
+
+
+def test_parse_notification_invalid_message():
+    """ Tests that parse_notification throws an exception if the message is not an AWS Budgets
+    notification
+
+    :return: None
+    """
+    with pytest.raises(InvalidNotificationException):
+        parse_notification('Hello world')
+
+
+def test_read_archive_aggregate_notifications(tmpdir):
+    """ Tests that a gzip archive of SNS events is parsed and aggregated per account
+
+    :param tmpdir: the pytest fixture providing a temporary directory
+    :return: None
+    """
+    event = get_test_event()
+    forecasted_event = json.loads(json.dumps(event).replace('ACTUAL', 'FORECASTED')
+                                  .replace('May 15, 2019', 'June 2, 2019'))
+    archive_name = str(tmpdir.join('archive.jsonl.gz'))
+    with gzip.open(archive_name, 'wt', encoding='utf-8') as archive:
+        archive.write(json.dumps(event) + '\n')
+        archive.write(json.dumps(event['Records'][0]) + '\n')
+        archive.write(json.dumps({'Message': 'not a budget notification'}) + '\n')
+        archive.write(json.dumps(forecasted_event['Records'][0]['Sns']) + '\n')
+
+    statistics = aggregate_notifications(read_archive(archive_name))
+
+    assert list(statistics) == ['123456']
+    account_statistics = statistics['123456']
+    assert account_statistics.alert_counts == {'ACTUAL': 2, 'FORECASTED': 1}
+    assert account_statistics.months == {'2019-05', '2019-06'}
+    assert account_statistics.alerts_per_month == 1.5
+    assert account_statistics.first_date == '2019-05-15'
+    assert account_statistics.last_date == '2019-06-02'
+
+
+def test_read_archive_skips_invalid_lines(tmpdir, caplog):
+    """ Tests that a truncated line of an archive is skipped with a warning
+
+    :param tmpdir: the pytest fixture providing a temporary directory
+    :param caplog: the pytest fixture capturing the log records
+    :return: None
+    """
+    line = json.dumps(get_test_event())
+    archive_name = str(tmpdir.join('archive.jsonl'))
+    with open(archive_name, 'w', encoding='utf-8') as archive:
+        archive.write(line[:-10] + '\n')
+        archive.write(line + '\n')
+
+    notifications = list(read_archive(archive_name))
+
+    assert [notification.account_id for notification in notifications] == ['123456']
+    assert 'warning: ignoring line 1 of' in caplog.text
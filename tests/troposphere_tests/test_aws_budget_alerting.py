@@ -1,12 +1,28 @@
 """Test the CloudFormation template generated to manage the AWS Budgets resources
 """
-from aws_budget_alerting import get_alerting_cf_template
+import os
+import sys
+import pytest
+from troposphere import Ref
+from aws_budget_alerting import (AlertBatching, AlertingTemplate, AlertingTemplateSkeleton,
+                                 AlertingTemplateVariant, AlertRoute, InlineCodeTooLargeException,
+                                 InvalidBatchingException, InvalidPerformanceProfileException,
+                                 LAMBDA_INLINE_CODE_MAX_SIZE, LambdaMetaData,
+                                 LambdaPerformanceProfile, build_alerting_template,
+                                 build_hub_template,
+                                 build_spoke_template, get_alerting_cf_template,
+                                 get_lambda_code_properties, get_performance_profile, main,
+                                 read_variants)
+
+INLINE_HANDLER_FILE = os.path.join(os.path.dirname(__file__), '..', '..', 'lambda-src',
+                                   'inline.js')
 
 EXPECTED_ALERTING_TEMPLATE = '''AWSTemplateFormatVersion: '2010-09-09'
 Description: Stack alerting forecasted and actual AWS budget overspend to Slack
 Parameters:
   ActualCostWebHookUrl:
     Description: webhook for posting messages to the actual AWS cost Slack channel
+    NoEcho: true
     Type: String
   ActualThreshold:
     Description: Threshold (percentage) compared to the actual cost that should trigger
@@ -14,6 +30,7 @@ Parameters:
     Type: Number
   ForecastedCostWebHookUrl:
     Description: webhook for posting messages to the forecasted AWS cost Slack channel
+    NoEcho: true
     Type: String
   ForecastedThreshold:
     Description: Threshold (percentage) compared to the forecasted cost that should
@@ -141,3 +158,304 @@ def test_alerting_cf_template():
     :return: None
     """
     assert EXPECTED_ALERTING_TEMPLATE == get_alerting_cf_template()
+
+
+def test_alerting_cf_template_single_router():
+    """Test that the single router mode subscribes one Lambda function to every topic, with a
+    webhook URL and message prefix per topic
+
+    :return: None
+    """
+    template = AlertingTemplate()
+    topics = template.add_topics_and_router_lambda(
+        routes=[
+            AlertRoute(topic_name='ActualBudgetAlert', webhook_url=Ref('ActualCostWebHookUrl'),
+                       message_prefix=Ref('MessagePrefix')),
+            AlertRoute(topic_name='ServiceBudgetAlert', webhook_url=Ref('ServiceWebHookUrl'),
+                       message_prefix=Ref('ServicePrefix')),
+        ],
+        name='BudgetAlertSlackNotification',
+        description='Posts a message to the budget alert Slack channel of the topic',
+    )
+    resources = template.to_dict()['Resources']
+
+    assert sorted(topics) == ['ActualBudgetAlert', 'ServiceBudgetAlert']
+    assert sorted(resources) == ['ActualBudgetAlertTopic', 'BudgetAlertSlackNotificationLambda',
+                                 'ServiceBudgetAlertTopic']
+    function_properties = resources['BudgetAlertSlackNotificationLambda']['Properties']
+    assert function_properties['Environment']['Variables'] == {
+        'WEBHOOK_URL_ActualBudgetAlert': {'Ref': 'ActualCostWebHookUrl'},
+        'MESSAGE_PREFIX_ActualBudgetAlert': {'Ref': 'MessagePrefix'},
+        'WEBHOOK_URL_ServiceBudgetAlert': {'Ref': 'ServiceWebHookUrl'},
+        'MESSAGE_PREFIX_ServiceBudgetAlert': {'Ref': 'ServicePrefix'},
+    }
+    assert function_properties['Events'] == {
+        'SNSActualBudgetAlert': {'Type': 'SNS',
+                                 'Properties': {'Topic': {'Ref': 'ActualBudgetAlertTopic'}}},
+        'SNSServiceBudgetAlert': {'Type': 'SNS',
+                                  'Properties': {'Topic': {'Ref': 'ServiceBudgetAlertTopic'}}},
+    }
+
+    single_router_template = get_alerting_cf_template(single_router=True)
+    assert single_router_template.count('Type: AWS::Serverless::Function') == 1
+    assert 'WEBHOOK_URL_ForecastedBudgetAlert: !Ref \'ForecastedCostWebHookUrl\'' in \
+        single_router_template
+
+
+def test_alerting_cf_template_performance_profile():
+    """Test the properties of a Lambda function rendered with the low-latency performance profile
+
+    :return: None
+    """
+    template = AlertingTemplate()
+    template.add_topic_and_lambda(
+        topic_name='ActualBudgetAlert',
+        lambda_meta_data=LambdaMetaData(description='Posts a message',
+                                        name='ActualCostSlackNotification',
+                                        webhook_url=Ref('ActualCostWebHookUrl'),
+                                        message_prefix=Ref('MessagePrefix'),
+                                        performance_profile='low-latency'))
+    function_properties = \
+        template.to_dict()['Resources']['ActualCostSlackNotificationLambda']['Properties']
+
+    assert {key: value for key, value in function_properties.items()
+            if key not in ('Description', 'Environment', 'Events', 'FunctionName')} == {
+                'Architectures': ['arm64'],
+                'AutoPublishAlias': 'live',
+                'CodeUri': 'lambda-src/',
+                'Handler': 'index.handler',
+                'MemorySize': 512,
+                'ProvisionedConcurrencyConfig': {'ProvisionedConcurrentExecutions': 2},
+                'ReservedConcurrentExecutions': 20,
+                'Runtime': 'nodejs18.x',
+                'Timeout': 10,
+            }
+    assert get_alerting_cf_template(performance_profile='default') == EXPECTED_ALERTING_TEMPLATE
+
+
+@pytest.mark.parametrize('profile', [
+    LambdaPerformanceProfile(memory_size=100),
+    LambdaPerformanceProfile(timeout=901),
+    LambdaPerformanceProfile(architecture='arm'),
+    LambdaPerformanceProfile(runtime='python3.7'),
+    LambdaPerformanceProfile(architecture='arm64', runtime='nodejs8.10'),
+    LambdaPerformanceProfile(reserved_concurrency=0),
+    LambdaPerformanceProfile(reserved_concurrency=2, provisioned_concurrency=5),
+])
+def test_performance_profile_validation(profile):
+    """Test that invalid combinations of performance settings are rejected
+
+    :param profile: (LambdaPerformanceProfile) an invalid profile
+    :return: None
+    """
+    with pytest.raises(InvalidPerformanceProfileException):
+        profile.validate()
+
+
+def test_performance_profiles_valid():
+    """Test that the predefined performance profiles are valid and that unknown profiles are
+    rejected
+
+    :return: None
+    """
+    for name in ('default', 'minimal', 'burst', 'low-latency'):
+        get_performance_profile(name)
+    with pytest.raises(InvalidPerformanceProfileException):
+        get_performance_profile('turbo')
+
+
+def test_alerting_cf_template_inline_code(tmpdir):
+    """Test that a small handler is defined inline in the Lambda functions, that the handler
+    without dependencies fits inline, and that a handler too large to be defined inline is rejected
+
+    :param tmpdir: the pytest fixture providing a temporary directory
+    :return: None
+    """
+    small_handler = tmpdir.join('small.js')
+    small_handler.write("exports.handler = (event, context, cb) => cb(null)\n")
+    large_handler = tmpdir.join('large.js')
+    large_handler.write('//' + 'x' * LAMBDA_INLINE_CODE_MAX_SIZE + '\n')
+
+    inline_template = AlertingTemplate(inline_code_file=str(small_handler))
+    inline_template.add_topics_and_router_lambda(routes=[], name='Router', description='Router')
+    function_properties = inline_template.to_dict()['Resources']['RouterLambda']['Properties']
+    assert function_properties['InlineCode'] == small_handler.read()
+    assert 'CodeUri' not in function_properties
+
+    assert 'InlineCode' in get_lambda_code_properties(INLINE_HANDLER_FILE)
+    with pytest.raises(InlineCodeTooLargeException):
+        get_alerting_cf_template(inline_code_file=str(large_handler))
+
+
+def test_inline_handler_size():
+    """Test that the handler without dependencies stays small enough to be defined inline
+
+    :return: None
+    """
+    assert os.path.getsize(INLINE_HANDLER_FILE) <= LAMBDA_INLINE_CODE_MAX_SIZE
+
+
+def test_alerting_cf_template_batching():
+    """Test that in batching mode, the notifications of every topic are buffered in an SQS queue
+    with a dead-letter queue, which the Lambda function polls in batches
+
+    :return: None
+    """
+    template = AlertingTemplate(batching=AlertBatching(batch_size=100, maximum_batching_window=60,
+                                                       max_receive_count=3))
+    template.add_topics_and_router_lambda(
+        routes=[AlertRoute(topic_name='ActualBudgetAlert', webhook_url=Ref('ActualCostWebHookUrl'),
+                           message_prefix=Ref('MessagePrefix'))],
+        name='BudgetAlertSlackNotification',
+        description='Posts a message to the budget alert Slack channel of the topic',
+        performance_profile='burst',
+    )
+    resources = template.to_dict()['Resources']
+
+    assert sorted(resources) == [
+        'ActualBudgetAlertDeadLetterQueue', 'ActualBudgetAlertQueue',
+        'ActualBudgetAlertQueuePolicy', 'ActualBudgetAlertSubscription', 'ActualBudgetAlertTopic',
+        'BudgetAlertSlackNotificationLambda']
+    queue_properties = resources['ActualBudgetAlertQueue']['Properties']
+    # 6 times the 30s timeout of the burst profile, plus the batching window
+    assert queue_properties['VisibilityTimeout'] == 240
+    assert queue_properties['RedrivePolicy'] == {
+        'deadLetterTargetArn': {'Fn::GetAtt': ['ActualBudgetAlertDeadLetterQueue', 'Arn']},
+        'maxReceiveCount': 3}
+    assert resources['ActualBudgetAlertSubscription']['Properties'] == {
+        'Endpoint': {'Fn::GetAtt': ['ActualBudgetAlertQueue', 'Arn']},
+        'Protocol': 'sqs',
+        'TopicArn': {'Ref': 'ActualBudgetAlertTopic'}}
+    assert resources['BudgetAlertSlackNotificationLambda']['Properties']['Events'] == {
+        'SQSActualBudgetAlert': {'Type': 'SQS', 'Properties': {
+            'Queue': {'Fn::GetAtt': ['ActualBudgetAlertQueue', 'Arn']},
+            'BatchSize': 100,
+            'MaximumBatchingWindowInSeconds': 60,
+            'FunctionResponseTypes': ['ReportBatchItemFailures']}}}
+
+    batching_resources = build_alerting_template(batching=AlertBatching()).to_dict()['Resources']
+    assert sum(resource['Type'] == 'AWS::SQS::Queue' for resource in
+               batching_resources.values()) == 4
+    assert [sorted(batching_resources[name]['Properties']['Events']) for name in
+            ('ActualCostSlackNotificationLambda', 'ForecastedCostSlackNotificationLambda')] == \
+        [['SQS'], ['SQS']]
+    with pytest.raises(InvalidBatchingException):
+        AlertingTemplate(batching=AlertBatching(batch_size=100, maximum_batching_window=0))
+
+
+def test_hub_and_spoke_templates():
+    """Test that the hub template holds the only topics and Lambda functions, restricted to the
+    budgets of the member accounts, and that the spoke template only holds the budget, alerting to
+    the topics of the hub
+
+    :return: None
+    """
+    hub = build_hub_template(single_router=True).to_dict()
+    assert sorted(hub['Resources']) == [
+        'ActualBudgetAlertTopic', 'ActualBudgetAlertTopicPolicy',
+        'BudgetAlertSlackNotificationLambda', 'ForecastedBudgetAlertTopic',
+        'ForecastedBudgetAlertTopicPolicy']
+    statement = hub['Resources']['ActualBudgetAlertTopicPolicy']['Properties'][
+        'PolicyDocument']['Statement'][0]
+    assert statement['Principal'] == {'Service': 'budgets.amazonaws.com'}
+    assert statement['Condition'] == {
+        'StringEquals': {'aws:SourceAccount': {'Ref': 'MemberAccountIds'}}}
+    assert hub['Parameters']['MemberAccountIds']['Type'] == 'CommaDelimitedList'
+    assert sorted(hub['Outputs']) == ['ActualBudgetAlertTopicArn', 'ForecastedBudgetAlertTopicArn']
+
+    spoke = build_spoke_template(AlertingTemplateVariant(budget_name='Team budget',
+                                                         monthly_budget=500)).to_dict()
+    assert sorted(spoke['Resources']) == ['Budget']
+    assert 'Transform' not in spoke
+    assert sorted(spoke['Parameters']) == ['ActualThreshold', 'ForecastedThreshold',
+                                           'HubAccountId', 'MonthlyBudget']
+    budget_properties = spoke['Resources']['Budget']['Properties']
+    assert budget_properties['Budget']['BudgetName'] == 'Team budget'
+    assert [notification['Subscribers'][0]['Address'] for notification in
+            budget_properties['NotificationsWithSubscribers']] == [
+                {'Fn::Sub': 'arn:${AWS::Partition}:sns:${AWS::Region}:${HubAccountId}:'
+                            'ActualBudgetAlert'},
+                {'Fn::Sub': 'arn:${AWS::Partition}:sns:${AWS::Region}:${HubAccountId}:'
+                            'ForecastedBudgetAlert'}]
+    assert 'Condition' not in get_alerting_cf_template()
+
+
+@pytest.mark.parametrize('single_router', [False, True])
+def test_alerting_template_skeleton(single_router):
+    """Test that the templates rendered from the skeleton are identical to the templates generated
+    from scratch, including values that have to be quoted or wrapped
+
+    :param single_router: (bool) whether the template has a single Lambda function
+    :return: None
+    """
+    skeleton = AlertingTemplateSkeleton(single_router=single_router)
+    for variant in (
+            AlertingTemplateVariant(),
+            AlertingTemplateVariant(budget_name='Team: data', monthly_budget=1200,
+                                    actual_threshold=80, forecasted_threshold=100.5,
+                                    message_prefix="it's prod",
+                                    actual_webhook_url='https://hooks.slack.com/services/T0/B0/x'),
+            AlertingTemplateVariant(budget_name='b' * 150, monthly_budget=1.5e9,
+                                    forecasted_threshold=0, message_prefix='a ' * 60),
+            AlertingTemplateVariant(budget_name='123', message_prefix=None),
+    ):
+        assert skeleton.render(variant) == \
+            get_alerting_cf_template(single_router=single_router, variant=variant)
+    assert skeleton.render(AlertingTemplateVariant()) == get_alerting_cf_template(
+        single_router=single_router)
+    # the webhook URLs are secrets, passed as parameter overrides at deploy time
+    assert 'hooks.slack.com' not in skeleton.render(AlertingTemplateVariant(
+        actual_webhook_url='https://hooks.slack.com/services/T0/B0/x'))
+
+
+def test_alerting_template_skeleton_many_variants():
+    """Test that the skeleton renders the templates of many accounts identically to the templates
+    generated from scratch
+
+    :return: None
+    """
+    variants = [AlertingTemplateVariant(budget_name=f'Budget {index}', monthly_budget=index * 100,
+                                        actual_threshold=80, forecasted_threshold=100,
+                                        message_prefix=f'account-{index}')
+                for index in range(20)]
+
+    skeleton = AlertingTemplateSkeleton()
+    assert [skeleton.render(variant) for variant in variants] == \
+        [get_alerting_cf_template(variant=variant) for variant in variants]
+
+
+def test_read_variants(tmpdir):
+    """Test that the numbers of the variants file are read as ints when they are integral
+
+    :param tmpdir: the pytest fixture providing a temporary directory
+    :return: None
+    """
+    variants_file = tmpdir.join('accounts.csv')
+    variants_file.write('name,monthly_budget,actual_threshold,forecasted_threshold\n'
+                        'dev,1e3,80,100.5\n'
+                        'prod,2.5e3,90.0,\n')
+    assert list(read_variants(str(variants_file))) == [
+        ('dev', AlertingTemplateVariant(monthly_budget=1000, actual_threshold=80,
+                                        forecasted_threshold=100.5)),
+        ('prod', AlertingTemplateVariant(monthly_budget=2500, actual_threshold=90)),
+    ]
+
+
+def test_main_variants_hub_options(monkeypatch, tmpdir):
+    """Test that the hub templates of the --variants accounts are built with the Lambda options
+
+    :param monkeypatch: the pytest monkeypatch fixture
+    :param tmpdir: the pytest fixture providing a temporary directory
+    :return: None
+    """
+    variants_file = tmpdir.join('accounts.csv')
+    variants_file.write('name,message_prefix\nhub,Hub account\n')
+    monkeypatch.setattr(sys, 'argv', [
+        'aws_budget_alerting.py', '--variants', str(variants_file), '--output-dir', str(tmpdir),
+        '--topology', 'hub', '--single-router', '--performance-profile', 'minimal',
+        '--inline-code', INLINE_HANDLER_FILE])
+    main()
+
+    assert tmpdir.join('hub.yaml').read() == build_hub_template(
+        single_router=True, performance_profile='minimal', inline_code_file=INLINE_HANDLER_FILE,
+        variant=AlertingTemplateVariant(message_prefix='Hub account')).to_yaml()
@@ -0,0 +1,18 @@
+"""Test the benchmark of the generation of the alerting templates of many accounts
+"""
+from aws_budget_template_benchmark import benchmark_templates, get_variants
+
+
+def test_benchmark_templates():
+    """Test that the templates of every variant are generated by both methods and timed, without
+    checking the timings, which depend on the machine
+
+    :return: None
+    """
+    variants = get_variants(3)
+    assert len({variant.message_prefix for variant in variants}) == 3
+
+    benchmark = benchmark_templates(variants)
+    assert benchmark.variant_count == 3
+    assert benchmark.full_seconds > 0 and benchmark.skeleton_seconds > 0
+    assert benchmark.message.startswith('3 templates: ')
@@ -0,0 +1,45 @@
+"""Test the bulk build mode of the CloudFormation templates
+"""
+import pytest
+from troposphere import Template, Ref, sns, awslambda
+from aws_budget_alerting import build_alerting_template
+from aws_budget_alerting_management_role import AlertingCreationRoleTemplate
+from bulk_build import TemplateValidationException, build_template
+from lambda_bucket import build_cf_template
+
+
+@pytest.mark.parametrize('build', [build_alerting_template, AlertingCreationRoleTemplate,
+                                   build_cf_template])
+def test_bulk_build_same_template(build):
+    """Test that the templates built in bulk mode are identical to the templates built with
+    troposphere validating every property, and that the time taken by each phase is measured
+
+    :param build: the function building the template
+    :return: None
+    """
+    template_yaml, timer = build_template(build, bulk=True)
+    assert template_yaml == build_template(build)[0]
+    assert list(timer.timings) == ['build', 'validate', 'serialize']
+
+
+def test_bulk_build_reports_all_errors():
+    """Test that the validation pass reports every invalid object of a template built in bulk mode,
+    and that troposphere checks properties again once the template is built
+
+    :return: None
+    """
+    def build():
+        template = Template()
+        topic = template.add_resource(sns.Topic('Topic', TopicName=42))
+        template.add_resource(awslambda.Function('Function', MemorySize=100, Role=Ref(topic)))
+        return template
+
+    with pytest.raises(TemplateValidationException) as exception_info:
+        build_template(build, bulk=True)
+    errors = exception_info.value.errors
+    assert len(errors) == 2
+    assert errors[0].startswith('Resources.Topic (Topic): TopicName is')
+    assert errors[1].startswith('Resources.Function (Function): MemorySize')
+
+    with pytest.raises(TypeError):
+        sns.Topic('Topic', TopicName=42)
@@ -0,0 +1,90 @@
+"""Test the streaming emitter of the CloudFormation templates
+"""
+import io
+import json
+import tracemalloc
+import pytest
+from cfn_tools import load_yaml
+from aws_budget_alerting import (AlertBatching, AlertingTemplate, AlertingTemplateVariant,
+                                 LambdaMetaData, LAMBDA_PERFORMANCE_PROFILES,
+                                 build_alerting_template, build_hub_template, build_spoke_template)
+from aws_budget_alerting_management_role import AlertingCreationRoleTemplate
+from aws_budget_service_budgets import ServiceBudget
+from lambda_bucket import build_cf_template
+from template_emitter import emit_template
+
+SERVICE_BUDGETS = [
+    ServiceBudget(account_id='123456789012', service='Amazon Elastic Compute Cloud - Compute',
+                  limit_amount=1250.5, share=0.6),
+    ServiceBudget(account_id='123456789012', service='AWS Lambda', limit_amount=40, share=0.1),
+]
+
+TEMPLATE_BUILDS = [
+    build_alerting_template,
+    lambda: build_alerting_template(single_router=True),
+    lambda: build_alerting_template(variant=AlertingTemplateVariant(
+        budget_name='b' * 250, monthly_budget=1200, actual_threshold=80,
+        forecasted_threshold=100.5, message_prefix='0123')),
+    lambda: build_alerting_template(batching=AlertBatching(batch_size=100)),
+    lambda: build_alerting_template(service_budgets=SERVICE_BUDGETS),
+    build_hub_template,
+    lambda: build_hub_template(single_router=True, batching=AlertBatching(),
+                               variant=AlertingTemplateVariant(message_prefix='hub')),
+    build_spoke_template,
+    lambda: build_spoke_template(variant=AlertingTemplateVariant(monthly_budget=500),
+                                 service_budgets=SERVICE_BUDGETS),
+    AlertingCreationRoleTemplate,
+    build_cf_template,
+] + [lambda profile=profile: build_alerting_template(performance_profile=profile)
+     for profile in LAMBDA_PERFORMANCE_PROFILES]
+
+
+class NullStream:  # pylint: disable=too-few-public-methods
+    """Stream discarding what is written to it
+    """
+
+    def write(self, text):
+        """Discards text
+
+        :param text: (str) the text
+        :return: None
+        """
+
+
+@pytest.mark.parametrize('build', TEMPLATE_BUILDS)
+def test_emitter_conformance(build):
+    """Test that the emitted templates are the same as the templates serialised by troposphere
+
+    :param build: the function building the template
+    :return: None
+    """
+    template = build()
+    yaml_stream = io.StringIO()
+    emit_template(template, yaml_stream, 'yaml')
+    assert load_yaml(yaml_stream.getvalue()) == load_yaml(template.to_yaml())
+    assert yaml_stream.getvalue() == template.to_yaml()
+
+    json_stream = io.StringIO()
+    emit_template(template, json_stream, 'json')
+    assert json.loads(json_stream.getvalue()) == json.loads(template.to_json())
+    assert json_stream.getvalue() == template.to_json()
+
+
+def test_emitter_memory():
+    """Test that the memory used to emit a template doesn't grow with the number of resources
+
+    :return: None
+    """
+    peaks = []
+    for count in (10, 60):
+        template = AlertingTemplate()
+        for index in range(count):
+            template.add_topic_policy(template.add_topic_and_lambda(
+                f'Topic{index}', LambdaMetaData(description='alerts', name=f'Function{index}',
+                                                webhook_url='url', message_prefix='prefix')))
+        emit_template(template, NullStream())
+        tracemalloc.start()
+        emit_template(template, NullStream())
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    assert peaks[1] < peaks[0] * 1.5